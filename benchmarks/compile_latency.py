@@ -0,0 +1,396 @@
+"""
+Measure how long it takes to get from a Python function to a callable
+native entry point, separately from how long the kernel takes to run.
+
+Kernels are collected from the scripts in benchmarks/ (by intercepting their
+calls to compare_perf) and from the tests in test/algorithms/ (by intercepting
+expect and jit calls). Every repetition starts from cold caches and doesn't
+use the on-disk module cache, so each timing covers the full path:
+
+  translate (ast_conversion) -> type inference -> optimization phases ->
+  value specialization -> C code generation -> native build
+
+The native build uses a single compile-and-link command, precompiled headers
+and cached helper objects unless --separate-build is given, which goes back to
+compiling an object, linking it and parsing every header for each module.
+
+Usage:
+  python compile_latency.py [--backend c|openmp] [--repeat N] [--json FILE] 
+                            [--separate-build] [pattern ...]
+"""
+
+import argparse
+import glob
+import imp
+import json
+import os
+import re
+import sys
+import time
+import types
+
+import numpy as np
+
+from parakeet import config, testing_helpers
+from parakeet.c_backend import config as c_config, PyModuleCompiler, fn_compiler
+from parakeet.c_backend.prepare_args import prepare_args
+from parakeet.frontend import ast_conversion, decorators, run_function
+from parakeet.ndtypes import closure_type
+from parakeet.openmp_backend import MulticoreCompiler
+from parakeet.transforms import pipeline, Phase
+from parakeet.value_specialization import specialize as value_specialize
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+algorithms_dir = os.path.join(benchmarks_dir, "..", "test", "algorithms")
+
+###########################################
+#
+#  Collecting kernels
+#
+###########################################
+
+class Kernel(object):
+  def __init__(self, source, fn, args):
+    self.source = source
+    self.fn = fn
+    self.args = args
+
+  @property
+  def arg_types(self):
+    return tuple(run_function._typeof(arg) for arg in self.args)
+
+  @property
+  def name(self):
+    return "%s:%s(%s)" % (self.source, self.fn.__name__,
+                          ", ".join(str(t) for t in self.arg_types))
+
+  def key(self):
+    return self.fn, self.arg_types
+
+def _is_python_fn(fn):
+  return isinstance(fn, types.FunctionType)
+
+def _unwrap(fn):
+  while isinstance(fn, decorators.jit):
+    fn = fn.f
+  return fn
+
+def _load_module(path, prefix):
+  name = prefix + re.sub(r"\W", "_", os.path.basename(path)[:-3])
+  return imp.load_source(name, path)
+
+def collect_benchmark_kernels(found, pattern = None):
+  """
+  Load every benchmark script which uses compare_perf, but with a stand-in
+  compare_perf module that just records the function and its arguments
+  """
+  recorder = types.ModuleType("compare_perf")
+  def compare_perf(fn, args, *ignored_args, **ignored_kwargs):
+    found.append(Kernel(source, _unwrap(fn), list(args)))
+  recorder.compare_perf = compare_perf
+
+  old_compare_perf = sys.modules.get("compare_perf")
+  sys.modules["compare_perf"] = recorder
+  sys.path.insert(0, benchmarks_dir)
+  try:
+    for path in sorted(glob.glob(os.path.join(benchmarks_dir, "*.py"))):
+      source = os.path.basename(path)[:-3]
+      if pattern and not re.search(pattern, source):
+        continue
+      with open(path) as f:
+        if "compare_perf(" not in f.read() or source == "compare_perf":
+          continue
+      try:
+        _load_module(path, "_compile_latency_benchmark_")
+      except:
+        print "Skipping benchmark %s: %s" % (source, sys.exc_info()[1])
+  finally:
+    sys.path.remove(benchmarks_dir)
+    if old_compare_perf is None:
+      del sys.modules["compare_perf"]
+    else:
+      sys.modules["compare_perf"] = old_compare_perf
+
+def collect_test_kernels(found, pattern = None):
+  """
+  Run the algorithm tests with expect and jit replaced by functions
+  which record the kernel and its arguments and then fall back on Python
+  """
+  old_expect = testing_helpers.expect
+  old_jit_call = decorators.jit.__call__
+
+  def expect(fn, args, expected, *ignored_args, **ignored_kwargs):
+    if _is_python_fn(_unwrap(fn)):
+      found.append(Kernel(source, _unwrap(fn), list(args)))
+
+  def jit_call(self, *args, **kwargs):
+    kwargs.pop('_backend', None)
+    if not kwargs:
+      found.append(Kernel(source, self.f, list(args)))
+    return self.f(*args, **kwargs)
+
+  testing_helpers.expect = expect
+  decorators.jit.__call__ = jit_call
+  try:
+    for path in sorted(glob.glob(os.path.join(algorithms_dir, "test_*.py"))):
+      source = os.path.basename(path)[:-3]
+      if pattern and not re.search(pattern, source):
+        continue
+      try:
+        module = _load_module(path, "_compile_latency_test_")
+      except:
+        print "Skipping test %s: %s" % (source, sys.exc_info()[1])
+        continue
+      for name in sorted(dir(module)):
+        test_fn = getattr(module, name)
+        if name.startswith("test_") and _is_python_fn(test_fn):
+          try:
+            test_fn()
+          except:
+            # the recorded kernels are still useful even if
+            # running the rest of the test in Python didn't work out
+            pass
+  finally:
+    testing_helpers.expect = old_expect
+    decorators.jit.__call__ = old_jit_call
+
+def collect_kernels(pattern = None):
+  found = []
+  collect_benchmark_kernels(found, pattern)
+  collect_test_kernels(found, pattern)
+  seen = set([])
+  unique = []
+  for kernel in found:
+    key = kernel.key()
+    if key not in seen:
+      seen.add(key)
+      unique.append(kernel)
+  return unique
+
+###########################################
+#
+#  Disabling caches
+#
+###########################################
+
+def all_phases():
+  result = set([])
+  def add(p):
+    if isinstance(p, Phase) and p not in result:
+      result.add(p)
+      for child in list(p.transforms) + list(p.depends_on) + list(p.cleanup):
+        add(child)
+  for value in vars(pipeline).itervalues():
+    add(value)
+  return result
+
+def _module(name):
+  # several analysis modules are shadowed in their package
+  # by a function of the same name, so look them up directly
+  __import__(name)
+  return sys.modules[name]
+
+def reset_caches():
+  """
+  Throw away every piece of cached IR, specialization and compiled code
+  so that the next compilation starts from scratch
+  """
+  ast_conversion._known_python_functions.clear()
+  for closure_t in closure_type._closure_type_cache.itervalues():
+    closure_t.specializations.clear()
+  _module("parakeet.type_inference.type_inference")._invoke_type_cache.clear()
+  for p in all_phases():
+    p.cache.clear()
+  _module("parakeet.value_specialization.value_specialization")._cache.clear()
+  _module("parakeet.value_specialization.find_constant_values")._cache.clear()
+  _module("parakeet.analysis.escape_analysis")._cache.clear()
+  shape_inference = _module("parakeet.shape_inference.shape_inference")
+  shape_inference._shape_env_cache.clear()
+  shape_inference._shape_cache.clear()
+  fn_compiler.FnCompiler._flat_compile_cache.clear()
+  PyModuleCompiler._entry_compile_cache.clear()
+
+###########################################
+#
+#  Timing
+#
+###########################################
+
+class PhaseTimer(object):
+  """
+  While active, record the exclusive time spent in each optimization phase
+  (time spent in nested phases is only attributed to the nested phase)
+  """
+  def __init__(self):
+    self.timings = {}
+    self.stack = []
+
+  def __enter__(self):
+    self.original_apply = Phase.apply
+    timer = self
+    def timed_apply(p, fn, run_dependencies = True):
+      timer.stack.append(0.0)
+      start = time.time()
+      try:
+        return timer.original_apply(p, fn, run_dependencies)
+      finally:
+        elapsed = time.time() - start
+        nested = timer.stack.pop()
+        key = "phase:" + str(p)
+        timer.timings[key] = timer.timings.get(key, 0.0) + elapsed - nested
+        if timer.stack:
+          timer.stack[-1] += elapsed
+    Phase.apply = timed_apply
+    return self
+
+  def __exit__(self, *exc_info):
+    Phase.apply = self.original_apply
+    return False
+
+class Stopwatch(object):
+  def __init__(self, timings):
+    self.timings = timings
+
+  def __call__(self, stage, fn, *args, **kwargs):
+    start = time.time()
+    result = fn(*args, **kwargs)
+    self.timings[stage] = self.timings.get(stage, 0.0) + time.time() - start
+    return result
+
+def compile_once(kernel, backend):
+  """
+  Compile the kernel from scratch, returning a dictionary of elapsed times
+  for each stage along with the size of the generated C module source
+  """
+  reset_caches()
+  timings = {}
+  stopwatch = Stopwatch(timings)
+  untyped = stopwatch("translate", ast_conversion.translate_function_value, kernel.fn)
+  typed_fn, linear_args = \
+    stopwatch("type_inference", run_function.specialize, untyped, kernel.args)
+  args = prepare_args(linear_args, typed_fn.input_types)
+  with PhaseTimer() as phase_timer:
+    if backend == 'openmp':
+      fn = pipeline.lower_to_adverbs.apply(typed_fn)
+    else:
+      fn = pipeline.lower_to_loops.apply(typed_fn)
+  timings.update(phase_timer.timings)
+  if config.value_specialization:
+    fn = stopwatch("value_specialization", value_specialize, fn, args)
+  compiler = MulticoreCompiler() if backend == 'openmp' else PyModuleCompiler()
+  name, sig, src = stopwatch("codegen", compiler.visit_fn, fn)
+  compiled = stopwatch("native_build", compiler.compile_module, name, sig, src)
+  return timings, len(compiled.src), len(compiled.src.splitlines())
+
+def median(values):
+  return float(np.median(values)) if len(values) > 0 else 0.0
+
+def measure(kernel, backend, repeat):
+  runs = []
+  src_bytes = src_lines = None
+  for _ in xrange(repeat):
+    timings, src_bytes, src_lines = compile_once(kernel, backend)
+    runs.append(timings)
+  stages = set([])
+  for timings in runs:
+    stages.update(timings.keys())
+  medians = dict((stage, median([timings.get(stage, 0.0) for timings in runs]))
+                 for stage in stages)
+  total = median([sum(timings.values()) for timings in runs])
+  return {'kernel' : kernel.name,
+          'total' : total,
+          'stages' : medians,
+          'src_bytes' : src_bytes,
+          'src_lines' : src_lines}
+
+###########################################
+#
+#  Reporting
+#
+###########################################
+
+def stage_group(stage):
+  if stage.startswith("phase:"):
+    return "optimize"
+  return stage
+
+def print_report(results):
+  print
+  print "%-60s %10s %12s %10s" % ("Kernel", "Total (ms)", "C src (KB)", "C lines")
+  for r in results:
+    print "%-60s %10.1f %12.1f %10d" % \
+      (r['kernel'][:60], r['total'] * 1000, r['src_bytes'] / 1024.0, r['src_lines'])
+
+  totals = [r['total'] for r in results]
+  print
+  print "Median compile latency: %0.1fms (min = %0.1fms, max = %0.1fms)" % \
+    (median(totals) * 1000, min(totals) * 1000, max(totals) * 1000)
+  print "Median C source size: %0.1fKB" % (median([r['src_bytes'] for r in results]) / 1024.0)
+
+  stage_totals = {}
+  for r in results:
+    for stage, t in r['stages'].iteritems():
+      stage_totals[stage] = stage_totals.get(stage, 0.0) + t
+  grand_total = sum(stage_totals.values())
+
+  print
+  print "Per-stage breakdown (sum of per-kernel medians):"
+  groups = {}
+  for stage, t in stage_totals.iteritems():
+    group = stage_group(stage)
+    groups[group] = groups.get(group, 0.0) + t
+  for group, t in sorted(groups.items(), key = lambda (_, t): -t):
+    print "  %-48s %10.1fms %6.1f%%" % (group, t * 1000, 100.0 * t / grand_total)
+
+  print
+  print "Optimization phases (exclusive time):"
+  phase_items = [(stage, t) for (stage, t) in stage_totals.iteritems()
+                 if stage.startswith("phase:")]
+  for stage, t in sorted(phase_items, key = lambda (_, t): -t):
+    print "  %-48s %10.1fms %6.1f%%" % (stage[len("phase:"):][:48], t * 1000,
+                                         100.0 * t / grand_total)
+
+def main(argv):
+  parser = argparse.ArgumentParser(description = "Measure cold compile latency of Parakeet kernels")
+  parser.add_argument("patterns", nargs = "*",
+                      help = "only include benchmark scripts or tests whose names match")
+  parser.add_argument("--backend", default = "c", choices = ("c", "openmp"))
+  parser.add_argument("--repeat", type = int, default = 3)
+  parser.add_argument("--json", default = None, help = "also write results to this file")
+  parser.add_argument("--separate-build", action = "store_true", 
+                      help = "compile and link separately without precompiled headers or helper objects")
+  options = parser.parse_args(argv)
+  if options.separate_build:
+    c_config.single_command_build = False
+    c_config.precompiled_headers = False
+    c_config.helper_objects = False
+
+  pattern = "|".join(options.patterns) if options.patterns else None
+  kernels = collect_kernels(pattern)
+  print "Collected %d kernels" % len(kernels)
+
+  old_cache_dir = c_config.cache_dir
+  c_config.cache_dir = None
+  results = []
+  try:
+    for kernel in kernels:
+      try:
+        result = measure(kernel, options.backend, options.repeat)
+      except:
+        print "Failed to compile %s: %s" % (kernel.name, sys.exc_info()[1])
+        continue
+      print "%-60s %8.1fms" % (kernel.name[:60], result['total'] * 1000)
+      results.append(result)
+  finally:
+    c_config.cache_dir = old_cache_dir
+
+  if results:
+    print_report(results)
+  if options.json:
+    with open(options.json, "w") as f:
+      json.dump({'backend' : options.backend,
+                 'repeat' : options.repeat,
+                 'results' : results}, f, indent = 2)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,94 @@
+"""
+Measure the cost of running the optimization pipeline (lower_to_loops) over
+the benchmark kernels: how long it takes and how much memory the syntax
+trees it produces hold on to.
+
+Kernels are collected the same way as in compile_latency.py and every
+repetition starts from cold caches. Memory is reported as the number and
+total size (including per-instance __dict__s) of the syntax nodes which
+lowering created and kept alive (mostly in the caches of each phase), along
+with the peak resident set size of this process.
+
+Usage:
+  python lowering_overhead.py [--repeat N] [pattern ...]
+"""
+
+import argparse
+import gc
+import resource
+import sys
+import time
+
+import numpy as np
+
+from parakeet.frontend import ast_conversion, run_function
+from parakeet.syntax import Expr, Stmt
+from parakeet.transforms import pipeline
+
+from compile_latency import collect_kernels, reset_caches
+
+def syntax_memory():
+  """
+  Count every live syntax node along with the bytes used by it
+  """
+  count = 0
+  nbytes = 0
+  for obj in gc.get_objects():
+    if isinstance(obj, (Expr, Stmt)):
+      count += 1
+      nbytes += sys.getsizeof(obj)
+      d = getattr(obj, '__dict__', None)
+      if d is not None:
+        nbytes += sys.getsizeof(d)
+  return count, nbytes
+
+def lower_once(kernel):
+  reset_caches()
+  gc.collect()
+  untyped = ast_conversion.translate_function_value(kernel.fn)
+  typed_fn, _ = run_function.specialize(untyped, kernel.args)
+  gc.collect()
+  count_before, nbytes_before = syntax_memory()
+  start = time.time()
+  pipeline.lower_to_loops.apply(typed_fn)
+  elapsed = time.time() - start
+  gc.collect()
+  count, nbytes = syntax_memory()
+  return elapsed, count - count_before, nbytes - nbytes_before
+
+def main(argv):
+  parser = argparse.ArgumentParser(description = "Measure time and memory of lower_to_loops")
+  parser.add_argument("patterns", nargs = "*",
+                      help = "only include benchmark scripts or tests whose names match")
+  parser.add_argument("--repeat", type = int, default = 3)
+  options = parser.parse_args(argv)
+
+  pattern = "|".join(options.patterns) if options.patterns else None
+  kernels = collect_kernels(pattern)
+  print "Collected %d kernels" % len(kernels)
+  print
+  print "%-60s %10s %10s %12s" % ("Kernel", "Time (ms)", "Nodes", "Nodes (KB)")
+  times = []
+  total_nodes = 0
+  total_bytes = 0
+  for kernel in kernels:
+    try:
+      runs = [lower_once(kernel) for _ in xrange(options.repeat)]
+    except:
+      print "Failed to lower %s: %s" % (kernel.name, sys.exc_info()[1])
+      continue
+    t = float(np.median([elapsed for (elapsed, _, _) in runs]))
+    _, count, nbytes = runs[-1]
+    times.append(t)
+    total_nodes += count
+    total_bytes += nbytes
+    print "%-60s %10.1f %10d %12.1f" % (kernel.name[:60], t * 1000, count, nbytes / 1024.0)
+  if times:
+    print
+    print "Total lowering time: %0.1fms (median per kernel = %0.1fms)" % \
+      (sum(times) * 1000, np.median(times) * 1000)
+    print "Total live syntax: %d nodes, %0.1fKB" % (total_nodes, total_bytes / 1024.0)
+    print "Peak RSS: %0.1fMB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
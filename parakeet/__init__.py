@@ -8,7 +8,7 @@ __license__ = package_info.__license__
 __version__ = package_info.__version__
 __website__ = package_info.__website__
 
-from system_info import openmp_available
+from system_info import openmp_available, llvmlite_available
 from ndtypes import * 
 
 from analysis import SyntaxVisitor, verify
@@ -25,4 +25,10 @@ from prims import *
 from frontend import jit, macro, run_python_fn, run_untyped_fn, run_typed_fn
 from frontend import typed_repr, specialize, find_broken_transform
 
+from c_backend import allocation_policy, path_counts
+from lazy_arrays import lazy, force, LazyArray
+from retention import memory_footprint, print_memory_footprint, release_intermediate_ir
+from openmp_backend import (set_num_threads, get_num_threads, 
+                            set_schedule, get_schedule, thread_pool)
+
 
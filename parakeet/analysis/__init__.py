@@ -7,6 +7,7 @@ from contains import (contains_adverbs, contains_calls, contains_functions,
                       contains_loops, contains_slices, contains_structs, 
                       contains_array_operators)
  
+from cost_estimate import estimate_cost
 from escape_analysis import may_alias, may_escape, escape_analysis 
 
 from find_local_arrays import FindLocalArrays
@@ -19,6 +20,7 @@ from use_analysis import find_live_vars, use_count
 from usedef import StmtPath, UseDefAnalysis
 from value_range_analysis import ValueRangeAnalyis
 from verify import verify 
+from written_args import written_args, WrittenArgs
 
 
 
@@ -0,0 +1,159 @@
+from .. import prims
+from .. ndtypes import FnT, ClosureT
+from ..retention import register_ir_cache
+from .. syntax import Const, Closure, TypedFn
+from .. syntax.helpers import get_fn
+from syntax_visitor import SyntaxVisitor
+
+# assumed trip count of loops and nested adverbs whose bounds aren't constants
+unknown_trip_count = 100
+
+# relative cost of primitives which are much slower than an add or compare
+_expensive_prims = {
+  prims.divide : 4,
+  prims.remainder : 4,
+  prims.fmod : 4,
+  prims.sqrt : 8,
+  prims.power : 20,
+}
+
+def prim_cost(p):
+  if p in _expensive_prims:
+    return _expensive_prims[p]
+  elif isinstance(p, prims.Float):
+    # exp, log, trigonometric functions, etc..
+    return 20
+  else:
+    return 1
+
+def trip_count(expr):
+  """
+  Number of iterations described by a loop bound or an adverb's shape, using
+  the unknown_trip_count guess for every dimension that isn't a constant
+  """
+  if expr is None:
+    return 1
+  elif expr.__class__ is Const:
+    return max(expr.value, 0)
+  elif hasattr(expr, 'elts'):
+    total = 1
+    for elt in expr.elts:
+      total *= trip_count(elt)
+    return total
+  else:
+    return unknown_trip_count
+
+class CostEstimate(SyntaxVisitor):
+  """
+  Very rough static estimate of the work done by one call to a function,
+  counted in units of simple scalar operations. Used to decide whether a
+  parallel loop has enough work in its body to be worth forking threads for.
+  """
+
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.cost = 0
+
+  def fn_cost(self, fn_expr):
+    if isinstance(fn_expr, (Closure, TypedFn)) or isinstance(fn_expr.type, (FnT, ClosureT)):
+      return estimate_cost(get_fn(fn_expr))
+    return 1
+
+  def visit_PrimCall(self, expr):
+    self.cost += prim_cost(expr.prim)
+    SyntaxVisitor.visit_PrimCall(self, expr)
+
+  def visit_Index(self, expr):
+    self.cost += 1
+    SyntaxVisitor.visit_Index(self, expr)
+
+  def visit_Alloc(self, expr):
+    self.cost += 10
+    SyntaxVisitor.visit_Alloc(self, expr)
+
+  def visit_AllocArray(self, expr):
+    self.cost += 10 + trip_count(expr.shape)
+    SyntaxVisitor.visit_AllocArray(self, expr)
+
+  def visit_Call(self, expr):
+    self.cost += self.fn_cost(expr.fn)
+    for arg in expr.args:
+      self.visit_expr(arg)
+
+  def visit_TypedFn(self, expr):
+    pass
+
+  def visit_Closure(self, expr):
+    self.visit_expr_list(expr.args)
+
+  def visit_adverb(self, expr, fns, shape):
+    n = trip_count(shape) if shape is not None else unknown_trip_count
+    self.cost += n * sum(self.fn_cost(fn) for fn in fns if fn is not None)
+
+  def visit_Map(self, expr):
+    self.visit_adverb(expr, [expr.fn], None)
+
+  def visit_OuterMap(self, expr):
+    self.visit_adverb(expr, [expr.fn], None)
+
+  def visit_Reduce(self, expr):
+    self.visit_adverb(expr, [expr.fn, expr.combine], None)
+
+  def visit_Scan(self, expr):
+    self.visit_adverb(expr, [expr.fn, expr.combine], None)
+
+  def visit_IndexMap(self, expr):
+    self.visit_adverb(expr, [expr.fn], expr.shape)
+
+  def visit_IndexReduce(self, expr):
+    self.visit_adverb(expr, [expr.fn, expr.combine], expr.shape)
+
+  def visit_IndexScan(self, expr):
+    self.visit_adverb(expr, [expr.fn, expr.combine], expr.shape)
+
+  def visit_ParFor(self, stmt):
+    self.visit_adverb(stmt, [stmt.fn], stmt.bounds)
+
+  def visit_block_cost(self, stmts):
+    old_cost = self.cost
+    self.cost = 0
+    self.visit_block(stmts)
+    block_cost = self.cost
+    self.cost = old_cost
+    return block_cost
+
+  def visit_If(self, stmt):
+    self.visit_expr(stmt.cond)
+    self.cost += max(self.visit_block_cost(stmt.true),
+                     self.visit_block_cost(stmt.false))
+    self.visit_merge_if(stmt.merge)
+
+  def visit_While(self, stmt):
+    self.visit_expr(stmt.cond)
+    self.cost += unknown_trip_count * self.visit_block_cost(stmt.body)
+
+  def visit_ForLoop(self, stmt):
+    start, stop = stmt.start, stmt.stop
+    if start.__class__ is Const and stop.__class__ is Const and \
+       stmt.step.__class__ is Const and stmt.step.value != 0:
+      n = max((stop.value - start.value) // stmt.step.value, 0)
+    else:
+      n = unknown_trip_count
+    self.cost += n * max(self.visit_block_cost(stmt.body), 1)
+
+  def visit_fn(self, fn):
+    self.visit_block(fn.body)
+    return max(self.cost, 1)
+
+_cache = {}
+register_ir_cache(__name__)
+
+def estimate_cost(fn):
+  key = fn.cache_key
+  if key in _cache:
+    return _cache[key]
+  # guard against recursion through calls
+  _cache[key] = unknown_trip_count
+  result = CostEstimate().visit_fn(fn)
+  _cache[key] = result
+  return result
@@ -1,5 +1,7 @@
 
 from .. import config
+from ..retention import register_ir_cache
+from ..settings_caches import register_settings_cache
 from .. ndtypes import ScalarT, ArrayT, PtrT, TupleT, ClosureT, FnT, SliceT, NoneT
 from .. syntax import Var, Attribute, Tuple 
 from syntax_visitor import SyntaxVisitor
@@ -246,6 +248,9 @@ class EscapeAnalysis(SyntaxVisitor):
       self.update_return(name, combined_set)
 
 _cache = {}
+register_ir_cache(__name__)
+register_settings_cache(__name__)
+
 def escape_analysis(fundef, fresh_alloc_args = set([])):
   key = fundef.cache_key, frozenset(fresh_alloc_args)
   if key in _cache:
@@ -49,7 +49,7 @@ class FindLocalArrays(SyntaxVisitor):
           right_stmt = self.local_arrays[right_name]
           if left_stmt == right_stmt:
             self.local_arrays[new_name] = left_stmt 
-            if left.name in self.array_to_alloc_name:
+            if left.name in self.array_to_alloc:
               self.array_to_alloc[new_name] = \
                   self.array_to_alloc[left.name]
         elif left.type.__class__ is PtrT and \
@@ -5,6 +5,38 @@ from .. syntax import (Expr, Assign, ExprStmt, ForLoop, If, Return, While, Comme
                        AllocArray, ArrayView, Cast, Slice, TupleProj, TypeValue,  
                        Map, Reduce, Scan, OuterMap, IndexMap, IndexReduce, IndexScan )
 
+# maps each visitor class to a dictionary from syntax classes 
+# to the unbound function which visits them 
+_expr_dispatch = {}
+_stmt_dispatch = {}
+
+def lookup_method(visitor_class, name):
+  method = getattr(visitor_class, name, None)
+  return getattr(method, 'im_func', method)
+
+def expr_method(visitor_class, expr_class):
+  table = _expr_dispatch.get(visitor_class)
+  if table is None:
+    table = _expr_dispatch[visitor_class] = {}
+  fn = table.get(expr_class)
+  if fn is None:
+    fn = lookup_method(visitor_class, "visit_" + expr_class.__name__)
+    if fn is None:
+      fn = lookup_method(visitor_class, "visit_generic_expr")
+    table[expr_class] = fn
+  return fn
+
+def stmt_method(visitor_class, stmt_class):
+  table = _stmt_dispatch.get(visitor_class)
+  if table is None:
+    table = _stmt_dispatch[visitor_class] = {}
+  fn = table.get(stmt_class)
+  if fn is None:
+    fn = lookup_method(visitor_class, "visit_" + stmt_class.__name__)
+    assert fn is not None, "Unsupported statement %s" % (stmt_class,)
+    table[stmt_class] = fn
+  return fn
+
 class SyntaxVisitor(object):
   """
   Traverse the statement structure of a syntax block, optionally collecting
@@ -172,42 +204,6 @@ class SyntaxVisitor(object):
     for v in expr.children():
       self.visit_expr(v)
 
-  _expr_method_names = {
-    Var : 'visit_Var', 
-    Const : 'visit_Const', 
-    PrimCall : 'visit_PrimCall', 
-    Attribute : 'visit_Attribute', 
-    Index : 'visit_Index', 
-    Tuple : 'visit_Tuple', 
-    TupleProj : 'visit_TupleProj', 
-    Slice : 'visit_Slice', 
-    Struct : 'visit_Struct', 
-    AllocArray : 'visit_AllocArray', 
-    ArrayView : 'visit_ArrayView', 
-    Array : 'visit_Array',
-    Range : 'visit_Range',
-    Ravel : 'visit_Ravel',   
-    Transpose : 'visit_Transpose', 
-    Shape : 'visit_Shape', 
-    Strides : 'visit_Strides', 
-    Alloc : 'visit_Alloc', 
-    Cast : 'visit_Cast', 
-    Call : 'visit_Call', 
-    Select : 'visit_Select', 
-    Map : 'visit_Map',
-    OuterMap : 'visit_OuterMap',
-    IndexMap : 'visit_IndexMap', 
-    Reduce : 'visit_Reduce',
-    IndexReduce : 'visit_IndexReduce',
-    Scan : 'visit_Scan', 
-    IndexScan : 'visit_IndexScan',
-    Closure : 'visit_Closure', 
-    ClosureElt : 'visit_ClosureElt', 
-    UntypedFn : 'visit_UntypedFn',  
-    TypedFn : 'visit_TypedFn', 
-    TypeValue : 'visit_TypeValue', 
-  }
-  
   def visit_expr(self, expr):   
     c = expr.__class__
     if c is Var:  
@@ -223,21 +219,8 @@ class SyntaxVisitor(object):
     elif c is Index: 
       return self.visit_Index(expr)
     
-    # try looking up the method in fast-path dictionary
-    method_name = self._expr_method_names.get(c)
-    if not method_name:
-      # ...otherwise, just construct a new string following the visit_Expr pattern 
-      method_name = "visit_" + c.__name__
-    
-    # if we found a method, call it 
-    if method_name:
-      method = getattr(self, method_name)
-      
-    if method:
-      return method(expr)
-
-    for child in expr.children():
-      self.visit_expr(child)
+    # otherwise look up visit_<ExprClass> in this visitor's dispatch table 
+    return expr_method(self.__class__, c)(self, expr)
       
   def visit_expr_list(self, exprs):
     return [self.visit_expr(expr) for expr in exprs]
@@ -324,23 +307,12 @@ class SyntaxVisitor(object):
     self.visit_expr(expr.fn)
     self.visit_expr(expr.bounds)
   
-  _stmt_method_names = {
-    Assign : 'visit_Assign', 
-    Return : 'visit_Return', 
-    While : 'visit_While', 
-    ForLoop : 'visit_ForLoop', 
-    If : 'visit_If', 
-    ExprStmt : 'visit_ExprStmt', 
-    ParFor : 'visit_ParFor', 
-    Comment : 'visit_Comment',                    
-  }
-  
   def visit_stmt(self, stmt):
     c = stmt.__class__
     if c is Assign: 
       self.visit_Assign(stmt)
     else:
-      getattr(self, self._stmt_method_names[c])(stmt)
+      stmt_method(self.__class__, c)(self, stmt)
     
 
   def visit_fn(self, fn):
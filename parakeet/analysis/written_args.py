@@ -0,0 +1,100 @@
+from ..retention import register_ir_cache
+from ..ndtypes import ArrayT, TupleT, PtrT
+from ..syntax import TypedFn, Var, Tuple, Adverb
+from ..syntax.helpers import get_fn, get_closure_args
+from collect_vars import collect_var_names
+from syntax_visitor import SyntaxVisitor
+
+def may_alias(t):
+  return isinstance(t, (ArrayT, PtrT, TupleT))
+
+class WrittenArgs(SyntaxVisitor):
+  """
+  Which arguments of a function might have their elements overwritten,
+  either by the function itself or by functions it calls (including the
+  bodies of parallel loops and adverbs). Values derived from an argument
+  (views, pointers to its data) are conservatively assumed to alias it.
+  """
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.aliases = {}
+    self.written = set([])
+
+  def alias(self, name, expr):
+    self.aliases.setdefault(name, set([])).update(collect_var_names(expr))
+
+  def mark_written(self, expr):
+    self.written.update(collect_var_names(expr))
+
+  def visit_Assign(self, stmt):
+    if stmt.lhs.__class__ is Var:
+      if may_alias(stmt.lhs.type):
+        self.alias(stmt.lhs.name, stmt.rhs)
+    elif stmt.lhs.__class__ is Tuple:
+      for elt in stmt.lhs.elts:
+        if elt.__class__ is Var and may_alias(elt.type):
+          self.alias(elt.name, stmt.rhs)
+    else:
+      self.mark_written(stmt.lhs)
+    self.visit_expr(stmt.rhs)
+
+  def visit_merge(self, phi_nodes):
+    for (name, (left, right)) in phi_nodes.iteritems():
+      self.alias(name, left)
+      self.alias(name, right)
+
+  def visit_merge_loop_start(self, phi_nodes):
+    self.visit_merge(phi_nodes)
+
+  def visit_call(self, fn_expr, args):
+    fn = get_fn(fn_expr)
+    if not isinstance(fn, TypedFn):
+      return
+    actuals = tuple(get_closure_args(fn_expr)) + tuple(args)
+    written = written_args(fn)
+    for (name, actual) in zip(fn.arg_names, actuals):
+      if name in written:
+        self.mark_written(actual)
+
+  def visit_Call(self, expr):
+    self.visit_call(expr.fn, expr.args)
+
+  def visit_ParFor(self, stmt):
+    # the indices can't be written, so only the closure arguments matter
+    self.visit_call(stmt.fn, ())
+
+  def visit_generic_expr(self, expr):
+    if isinstance(expr, Adverb):
+      for field in ('fn', 'combine', 'emit'):
+        fn_expr = getattr(expr, field, None)
+        if fn_expr is not None:
+          self.visit_call(fn_expr, ())
+    SyntaxVisitor.visit_generic_expr(self, expr)
+
+  def resolve(self, names):
+    """
+    Every variable the given ones might alias
+    """
+    result = set([])
+    todo = list(names)
+    while todo:
+      name = todo.pop()
+      if name not in result:
+        result.add(name)
+        todo.extend(self.aliases.get(name, ()))
+    return result
+
+  def visit_fn(self, fn):
+    self.visit_block(fn.body)
+    return self.resolve(self.written).intersection(fn.arg_names)
+
+_cache = {}
+def written_args(fn):
+  key = fn.cache_key
+  if key not in _cache:
+    # recursive calls see no writes until the analysis finishes
+    _cache[key] = set([])
+    _cache[key] = WrittenArgs().visit_fn(fn)
+  return _cache[key]
+
+register_ir_cache(__name__)
@@ -88,7 +88,7 @@ class ArithBuilder(CoreBuilder):
     if is_one(y):
       return self.pick_const(x, y, 0)
     elif x.__class__ is Const and y.__class__ is Const:
-      return self.pick_const(x, y, np.fmod(x,y))
+      return self.pick_const(x, y, np.fmod(x.value, y.value))
     else:
       return self.prim(prims.fmod, [x,y], name)
       
@@ -179,7 +179,7 @@ class ArithBuilder(CoreBuilder):
     cond = self.gte(x, y)
     expr = Select(cond, x, y, type = x.type)
     if name is None: return expr 
-    else: self.assign_name(expr, name)
+    else: return self.assign_name(expr, name)
     
   def or_(self, x, y, name = None):
     if x.__class__ is Const and x.value:
@@ -1,3 +1,5 @@
+from allocation import allocation_policy
 from fn_compiler import FnCompiler
+from multiversion import path_counts
 from pymodule_compiler import PyModuleCompiler
 from run_function import run 
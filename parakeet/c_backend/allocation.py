@@ -0,0 +1,106 @@
+import threading
+
+from .. import config as root_config
+import config
+
+class _ScopeStack(threading.local):
+  def __init__(self):
+    self.scopes = []
+
+_local = _ScopeStack()
+
+class allocation_policy(object):
+  """
+  Scope which overrides how generated code allocates new arrays,
+  any setting left as None is taken from c_backend.config:
+
+    with parakeet.allocation_policy(alignment = 4096, huge_pages = True):
+      f(x)
+
+  Can also be passed to a single call as f(x, _alloc = allocation_policy(...))
+  """
+  def __init__(self, alignment = None, huge_pages = None, first_touch = None):
+    assert alignment is None or (alignment >= 0 and (alignment & (alignment - 1)) == 0), \
+      "Alignment must be zero or a power of two, got %s" % (alignment,)
+    self.alignment = alignment
+    self.huge_pages = huge_pages
+    self.first_touch = first_touch
+
+  def __enter__(self):
+    _local.scopes.append(self)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    popped = _local.scopes.pop()
+    assert popped is self, "allocation_policy scopes exited out of order"
+    return False
+
+def _lookup(attr, default):
+  for scope in reversed(_local.scopes):
+    value = getattr(scope, attr)
+    if value is not None:
+      return value
+  return default
+
+def current_allocation():
+  """
+  Settings used to generate allocation code right now, also
+  serves as part of the cache key of compiled functions
+  """
+  alignment = _lookup('alignment', config.array_alignment)
+  huge_pages = _lookup('huge_pages', config.huge_pages)
+  first_touch = _lookup('first_touch', config.first_touch)
+  return (alignment,
+          config.huge_page_min_bytes if huge_pages else None,
+          config.first_touch_min_bytes if first_touch else None,
+          config.stack_array_max_bytes if root_config.opt_stack_allocation else None)
+
+# alignment used for arrays which get huge pages
+huge_page_bytes = 2 ** 21
+
+alloc_fn_name = "parakeet_alloc"
+alloc_fn_sig = "static void* %s(int64_t nbytes)" % alloc_fn_name
+
+def alloc_fn_source(alignment, huge_page_min_bytes):
+  """
+  C source of the function generated code calls to allocate array data
+  """
+  return "%s {\n  %s\n}" % (alloc_fn_sig, alloc_fn_body(alignment, huge_page_min_bytes))
+
+def alloc_helper(alignment, huge_page_min_bytes):
+  """
+  Name, signature and source of a stand-alone version of the allocation 
+  function, which can be compiled once into an object shared by all modules
+  """
+  name = "%s_%d_%d" % (alloc_fn_name, alignment, huge_page_min_bytes or 0)
+  sig = "void* %s(int64_t nbytes)" % name
+  headers = "\n".join("#include <%s>" % header 
+                      for header in ["stdint.h", "stdlib.h", "sys/mman.h"])
+  src = "%s\n\n__attribute__((visibility(\"hidden\"))) %s {\n  %s\n}\n" % \
+    (headers, sig, alloc_fn_body(alignment, huge_page_min_bytes))
+  return name, sig, src
+
+def alloc_fn_body(alignment, huge_page_min_bytes):
+  if alignment == 0 and huge_page_min_bytes is None:
+    body = "return malloc(nbytes);"
+  else:
+    alignment = max(alignment, 16)
+    if huge_page_min_bytes is None:
+      huge_pages = ""
+    else:
+      huge_pages = """
+  if (nbytes >= %(huge_page_min_bytes)dLL) { alignment = %(huge_page_bytes)d; }""" % \
+        dict(huge_page_min_bytes = huge_page_min_bytes,
+             huge_page_bytes = huge_page_bytes)
+    body = """
+  void* ptr = NULL;
+  size_t alignment = %(alignment)d;%(huge_pages)s
+  if (posix_memalign(&ptr, alignment, (size_t) nbytes) != 0) { return NULL; }""" % locals()
+    if huge_page_min_bytes is not None:
+      body += """
+  #ifdef MADV_HUGEPAGE
+  if (nbytes >= %dLL) { madvise(ptr, (size_t) nbytes, MADV_HUGEPAGE); }
+  #endif""" % huge_page_min_bytes
+    body += """
+  return ptr;"""
+  return body.strip()
@@ -1,8 +1,19 @@
+import hashlib
+
 from .. import names 
 from ..ndtypes import BoolT, IntT 
 import type_mappings 
 from reserved_names import is_reserved
 
+def canonical_name(prefix, content):
+  """
+  C name which only depends on the given prefix and on the source of whatever 
+  it names, rather than on counters which depend on everything compiled so far, 
+  so identical specializations compile to identical modules in every process 
+  (and hit the same entry of the on-disk module cache)
+  """
+  prefix = names.original(prefix).replace(".", "_")
+  return "%s_%s" % (prefix, hashlib.sha1(content).hexdigest()[:10])
 
 class BaseCompiler(object):
   
@@ -12,6 +23,7 @@ class BaseCompiler(object):
     self.name_mappings = {}
     self.extra_link_flags = extra_link_flags if extra_link_flags else []
     self.extra_compile_flags = extra_compile_flags if extra_compile_flags else []
+    self.extra_headers = []
     
   def add_compile_flag(self, flag):
     if flag not in self.extra_compile_flags:
@@ -20,6 +32,10 @@ class BaseCompiler(object):
   def add_link_flag(self, flag):
     if flag not in self.extra_link_flags:
       self.extra_link_flags.append(flag)
+  
+  def add_header(self, header):
+    if header not in self.extra_headers:
+      self.extra_headers.append(header)
         
   
   def visit_expr(self, expr):
@@ -1,9 +1,11 @@
+import atexit
 import collections
 import hashlib
 import imp
 import os
+import shutil
 
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 
 from .. import config as root_config 
 import config 
@@ -13,7 +15,7 @@ from system_info import (python_lib_dir,
                          get_source_extension, object_extension, shared_extension,  
                          get_compiler, 
                          include_dirs)
-from flags import get_compiler_flags, get_linker_flags
+from flags import get_compiler_flags, get_linker_flags, get_opt_flags
 from shell_command import CommandFailed, run_cmd 
 
 CompiledPyFn = collections.namedtuple(
@@ -40,6 +42,9 @@ CompiledObject = collections.namedtuple(
 
   
 c_headers = ["stdint.h",  "math.h",  "signal.h"]
+if not windows:
+  # for madvise when allocating arrays with huge pages 
+  c_headers.append("sys/mman.h")
 core_python_headers = ["Python.h"]
 numpy_headers = ['numpy/arrayobject.h', 'numpy/arrayscalars.h']
 
@@ -50,20 +55,33 @@ python_headers = core_python_headers + numpy_headers
 global_preprocessor_defs = ["#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION"]
 
 
-def create_module_source(raw_src, fn_name, 
-                            extra_headers = [], 
-                            declarations = [], 
-                            extra_function_sources = [], 
-                            print_source = None):
-    # when compiling with NVCC, other headers get implicitly included 
-  # and cause warnings since Python redefines this constant
+def module_prologue(extra_headers = []):
+  """
+  Preprocessor definitions and includes which start every generated module 
+  """
   src_lines = list(global_preprocessor_defs) 
+  # when compiling with NVCC, other headers get implicitly included 
+  # and cause warnings since Python redefines this constant
   if config.undef_posix_c_source:
     src_lines.append("#undef _XOPEN_SOURCE")
     src_lines.append("#undef _POSIX_C_SOURCE")
   
   for header in extra_headers + c_headers:
     src_lines.append("#include <%s>" % header)
+  return "\n".join(src_lines)
+
+def create_module_source(raw_src, fn_name, 
+                            extra_headers = [], 
+                            declarations = [], 
+                            extra_function_sources = [], 
+                            extra_methods = [], 
+                            print_source = None, 
+                            prologue_header = None):
+  if prologue_header is None:
+    src_lines = [module_prologue(extra_headers)]
+  else:
+    # the prologue got written to a (precompiled) header 
+    src_lines = ['#include "%s"' % prologue_header]
   
   for decl in declarations:
     decl = decl.strip()
@@ -74,12 +92,15 @@ def create_module_source(raw_src, fn_name,
   src_lines.extend(extra_function_sources)
   
   src_lines.append(raw_src)
+  # besides the entry function, the module can export other functions 
+  # which take a tuple of arguments 
+  method_entries = "".join("""
+      {"%(name)s",  %(name)s, METH_VARARGS,
+       "%(name)s"},
+""" % dict(name = name) for name in [fn_name] + list(extra_methods))
   module_init = """
     \n\n
-    static PyMethodDef %(fn_name)sMethods[] = {
-      {"%(fn_name)s",  %(fn_name)s, METH_VARARGS,
-       "%(fn_name)s"},
-
+    static PyMethodDef %(fn_name)sMethods[] = {%(method_entries)s
       {NULL, NULL, 0, NULL}        /* Sentinel */
     };
   
@@ -180,6 +201,143 @@ def link_module(
     env["LD_LIBRARY_PATH"] = python_lib_dir
   run_cmd(linker_cmd, env = env, label = "Linking")
 
+def compile_and_link(
+      compiler, src_filename, shared_name, 
+      extra_objects = [], 
+      extra_compile_flags = [], 
+      extra_link_flags = []):
+  """
+  Build a shared library straight from its source with one compiler command
+  """
+  if isinstance(compiler, (list,tuple)):
+    cmd = list(compiler)
+  else:
+    cmd = [compiler]
+  cmd += get_compiler_flags(extra_compile_flags)
+  cmd += [src_filename, '-o', shared_name]
+  cmd += get_linker_flags(extra_link_flags)
+  cmd += list(extra_objects)
+  
+  env = os.environ.copy()
+  if not windows:
+    env["LD_LIBRARY_PATH"] = python_lib_dir
+  run_cmd(cmd, env = env, label = "Compile and link")
+
+def compile_and_link_separately(
+      compiler, src_filename, fn_name, src_extension, 
+      extra_objects = [], 
+      extra_compile_flags = [], 
+      extra_link_flags = [], 
+      print_commands = None, 
+      compiler_flag_prefix = None, 
+      linker_flag_prefix = None):
+  """
+  Build a shared library by compiling its source to an object and then 
+  linking that, for compilers whose flags need a prefix 
+  """
+  compiled_object = compile_object(src_filename,
+                                   fn_name = fn_name,
+                                   src_extension = src_extension,
+                                   extra_objects = extra_objects,
+                                   extra_compile_flags = extra_compile_flags,
+                                   print_commands = print_commands,
+                                   compiler = compiler,
+                                   compiler_flag_prefix = compiler_flag_prefix)
+
+  object_name = compiled_object.object_filename
+  shared_name = src_filename.replace(src_extension, shared_extension)
+  link_module(compiler, object_name, shared_name,
+              extra_objects = extra_objects,
+              extra_link_flags = extra_link_flags,
+              linker_flag_prefix = linker_flag_prefix)
+
+  if config.delete_temp_files:
+    os.remove(object_name)
+  return shared_name
+
+_build_dir = []
+def build_dir():
+  """
+  Where to keep precompiled headers and helper objects: a subdirectory 
+  of the module cache or, if modules aren't cached, a temporary directory 
+  which lasts as long as this process  
+  """
+  if config.cache_dir:
+    path = os.path.join(config.cache_dir, "build")
+  else:
+    if not _build_dir:
+      _build_dir.append(mkdtemp(prefix = "parakeet_build_"))
+      atexit.register(shutil.rmtree, _build_dir[0], True)
+    path = _build_dir[0]
+  if not os.path.exists(path):
+    os.makedirs(path)
+  return path
+
+def _write_if_missing(filename, src):
+  if not os.path.exists(filename):
+    # write to a temporary name first so other processes never see half a file 
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+      f.write(src)
+    os.rename(tmp_filename, filename)
+
+def _cmd_prefix(compiler):
+  if isinstance(compiler, (list, tuple)):
+    return list(compiler)
+  return [compiler]
+
+def prologue_header(prologue, compiler, extra_compile_flags = []):
+  """
+  Write the prologue of a module to a header (named after its contents and
+  the compiler and flags which will use it) and return the header's path
+  """
+  compiler_flags = get_compiler_flags(extra_compile_flags)
+  digest = hashlib.sha1(prologue + " ".join(_cmd_prefix(compiler) + compiler_flags)).hexdigest()[:16]
+  header_name = os.path.join(build_dir(), "parakeet_prologue_%s.h" % digest)
+  _write_if_missing(header_name, prologue + "\n")
+  return header_name
+
+# headers which failed to precompile, don't keep trying 
+_failed_headers = set([])
+
+def precompile_header(header_name, compiler, extra_compile_flags = []):
+  """
+  Precompile the header with the same compiler and flags as the modules which
+  include it, the compiler falls back on the plain header if this fails
+  """
+  pch_name = header_name + ".gch"
+  if header_name in _failed_headers or os.path.exists(pch_name):
+    return
+  tmp_pch_name = "%s.%d.tmp" % (pch_name, os.getpid())
+  cmd = _cmd_prefix(compiler) + get_compiler_flags(extra_compile_flags)
+  cmd += ['-x', 'c-header' if config.pure_c else 'c++-header', header_name, '-o', tmp_pch_name]
+  try:
+    run_cmd(cmd, label = "Precompile header")
+  except CommandFailed:
+    _failed_headers.add(header_name)
+    return
+  os.rename(tmp_pch_name, pch_name)
+
+def helper_object(name, src, compiler = None):
+  """
+  Compile the source of helper functions which many modules share into
+  an object file (once for each distinct source and set of flags) 
+  and return its path 
+  """
+  if compiler is None: compiler = get_compiler()
+  compiler_flags = get_compiler_flags()
+  cmd_prefix = _cmd_prefix(compiler)
+  digest = hashlib.sha1(src + " ".join(cmd_prefix + compiler_flags)).hexdigest()[:16]
+  object_name = os.path.join(build_dir(), "%s_%s%s" % (name, digest, object_extension))
+  if not os.path.exists(object_name):
+    src_filename = os.path.join(build_dir(), "%s_%s%s" % (name, digest, get_source_extension()))
+    _write_if_missing(src_filename, src)
+    tmp_object_name = "%s.%d.tmp" % (object_name, os.getpid())
+    run_cmd(cmd_prefix + compiler_flags + ['-c', src_filename, '-o', tmp_object_name], 
+            label = "Compile helper")
+    os.rename(tmp_object_name, object_name)
+  return object_name
+
 def compile_with_distutils(extension_name, 
                               src_filename,
                               extra_objects = [], 
@@ -241,6 +399,7 @@ def compile_module_from_source(
       extra_objects = [],
       extra_compile_flags = [], 
       extra_link_flags = [], 
+      extra_methods = [], 
       print_source = None, 
       print_commands = None, 
       compiler = None, 
@@ -250,15 +409,39 @@ def compile_module_from_source(
   if print_source is None: print_source = root_config.print_generated_code 
   if print_commands is None: print_commands = config.print_commands
   if src_extension is None: src_extension = get_source_extension()
+  if compiler is None: compiler = get_compiler()
+  
+  # nvcc and friends which need their flags prefixed get built 
+  # the old way, compiling and then linking  
+  single_command = config.single_command_build and compiler_is_gnu(compiler) and \
+    compiler_flag_prefix is None and linker_flag_prefix is None 
   
+  if single_command and config.precompiled_headers:
+    header_name = prologue_header(module_prologue(python_headers + extra_headers), 
+                                  compiler, extra_compile_flags)
+    # the header's directory gets added to the include path, leaving
+    # the location of the build directory out of the source  
+    build_flags = list(extra_compile_flags) + ['-I%s' % os.path.dirname(header_name)]
+    include_name = os.path.basename(header_name)
+  else:
+    header_name = None 
+    build_flags = extra_compile_flags 
+    include_name = None
+     
   full_src = create_module_source(partial_src, fn_name, 
                                  extra_headers = python_headers + extra_headers, 
                                  declarations = declarations,  
                                  extra_function_sources = extra_function_sources, 
-                                 print_source = print_source)
+                                 extra_methods = extra_methods, 
+                                 print_source = print_source, 
+                                 prologue_header = include_name)
 
 
-  digest = hashlib.sha224(full_src).hexdigest()
+  # the same source built with different flags (e.g. optimization level)
+  # has to end up in a different cached module 
+  flags_str = " ".join(get_opt_flags() + list(extra_compile_flags) + list(extra_link_flags))
+  if config.debug: flags_str += " debug"
+  digest = hashlib.sha224(full_src + flags_str).hexdigest()
   
   if config.cache_dir:
     cached_name = os.path.join(config.cache_dir, fn_name + "_" + digest + shared_extension)
@@ -276,27 +459,24 @@ def compile_module_from_source(
                                   src_extension = src_extension)
     src_filename = src_file.name
 
-    if compiler is None: compiler = get_compiler()
-
     try:
-      compiled_object = compile_object(src_filename,
-                                       fn_name = fn_name,
-                                       src_extension = src_extension,
-                                       extra_objects = extra_objects,
-                                       extra_compile_flags = extra_compile_flags,
-                                       print_commands = print_commands,
-                                       compiler = compiler,
-                                       compiler_flag_prefix = compiler_flag_prefix)
-
-      object_name = compiled_object.object_filename
-      shared_name = src_filename.replace(src_extension, shared_extension)
-      link_module(compiler, object_name, shared_name,
-                  extra_objects = extra_objects,
-                  extra_link_flags = extra_link_flags,
-                  linker_flag_prefix = linker_flag_prefix)
-
-      if config.delete_temp_files:
-        os.remove(object_name)
+      if single_command:
+        if header_name is not None:
+          precompile_header(header_name, compiler, extra_compile_flags)
+        shared_name = src_filename.replace(src_extension, shared_extension)
+        compile_and_link(compiler, src_filename, shared_name, 
+                         extra_objects = extra_objects, 
+                         extra_compile_flags = build_flags, 
+                         extra_link_flags = extra_link_flags)
+      else: 
+        shared_name = compile_and_link_separately(
+          compiler, src_filename, fn_name, src_extension, 
+          extra_objects = extra_objects, 
+          extra_compile_flags = extra_compile_flags, 
+          extra_link_flags = extra_link_flags, 
+          print_commands = print_commands, 
+          compiler_flag_prefix = compiler_flag_prefix, 
+          linker_flag_prefix = linker_flag_prefix)
     except CommandFailed:
       # if normal compilation fails, try distutils instead
       if not compiler_is_gnu(compiler):
@@ -307,7 +487,7 @@ def compile_module_from_source(
       shared_name = compile_with_distutils(fn_name + "_" + digest,
                                            src_filename,
                                            extra_objects,
-                                           extra_compile_flags,
+                                           build_flags,
                                            extra_link_flags,
                                            print_commands)
 
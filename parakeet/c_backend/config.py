@@ -4,9 +4,48 @@
 fast_math = True 
 sse2 = True 
 opt_level = '-O2'
+# with parakeet.config.tiered_compilation, the level for the first 
+# quickly compiled version of each function and for recompiling hot ones
+tier0_opt_level = '-O0'
+tier1_opt_level = '-O3'
 # overload the default compiler path  
 compiler_path = None
 
+##########################
+#     Build Speed        #
+##########################
+# with gcc (or g++), build each module with one command 
+# rather than compiling an object and then linking it 
+single_command_build = True
+# precompile the Python and NumPy headers which every module includes, 
+# only used along with single_command_build 
+precompiled_headers = True
+# compile helper functions which many modules share (e.g. allocating 
+# aligned arrays) once into object files which get linked into each module 
+helper_objects = True
+
+##########################
+#   Array Allocation     #
+##########################
+# alignment in bytes of arrays allocated by generated code, 
+# 64 covers a cache line and AVX-512 vectors, 0 means use plain malloc
+array_alignment = 64
+
+# advise the kernel to back large arrays with transparent huge pages (Linux only)
+huge_pages = False 
+huge_page_min_bytes = 2 ** 21
+
+# OpenMP only: touch the pages of large new arrays from all threads, 
+# partitioned like a schedule(static) loop over their elements, 
+# so each page lands on the NUMA node of the thread which will fill it 
+first_touch = True
+first_touch_min_bytes = 2 ** 20
+
+# when parakeet.config.opt_stack_allocation is on, arrays whose size is known 
+# at compile time and which never escape the function allocating them 
+# get declared as local C arrays if they're no bigger than this
+stack_array_max_bytes = 1024
+
 ##########################
 # Insert Debugging Code  #
 ##########################
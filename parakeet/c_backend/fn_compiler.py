@@ -2,13 +2,19 @@ from collections import namedtuple
 import numpy as np 
 
 from .. import names, prims  
+from ..settings_caches import register_settings_cache
 from ..ndtypes import (IntT, FloatT, TupleT, FnT, Type, BoolT, NoneT, Float32, Float64, Bool, 
                        ClosureT, ScalarT, PtrT, NoneType, ArrayT, SliceT, TypeValueT)    
 from ..syntax import (Const, Var,  PrimCall, Attribute, TupleProj, Tuple, ArrayView,
-                      Expr, Closure, TypedFn)
+                      Expr, Closure, TypedFn, Alloc)
 # from ..syntax.helpers import get_types   
+import config 
 import type_mappings
-from base_compiler import BaseCompiler
+from allocation import alloc_fn_name, alloc_fn_sig, alloc_fn_source, alloc_helper, current_allocation
+from base_compiler import BaseCompiler, canonical_name
+from compile_util import helper_object
+from stack_allocation import stack_allocations
+from system_info import windows 
 
 
 CompiledFlatFn = namedtuple("CompiledFlatFn", 
@@ -49,6 +55,12 @@ class FnCompiler(BaseCompiler):
     # if so, expect some of the methods like visit_Return to be overloaded 
     # to return PyObjects
     self.module_entry = module_entry
+    
+    # variables whose allocations live in local C arrays, 
+    # mapped to their number of elements, and the declarations 
+    # of those arrays which go at the top of the function body 
+    self.stack_arrays = {}
+    self.stack_array_decls = []
      
   def add_decl(self, decl):
     if decl not in self.declarations:
@@ -105,8 +117,6 @@ class FnCompiler(BaseCompiler):
         self.declarations.append(decl)
       return typename 
     
-    typename = names.fresh(struct_name).replace(".", "")
-    
     field_decls = []
     for t, field_name in zip(field_types, field_names):
       if field_name in field_repeats:
@@ -114,7 +124,9 @@ class FnCompiler(BaseCompiler):
       else:
         field_decl = "  %s %s;" % (t, field_name)
       field_decls.append(field_decl)
-    decl = "typedef struct %s {\n%s\n} %s;" % (typename, "\n".join(field_decls), typename)
+    fields_str = "\n".join(field_decls)
+    typename = canonical_name(struct_name, fields_str)
+    decl = "typedef struct %s {\n%s\n} %s;" % (typename, fields_str, typename)
     
     _struct_type_names[key] = typename
     _struct_type_decls[typename] = decl
@@ -162,10 +174,60 @@ class FnCompiler(BaseCompiler):
     nelts = self.fresh_var("npy_intp", "nelts", self.visit_expr(expr.count))
     bytes_per_elt = elt_t.nbytes
     nbytes = self.mul(nelts, bytes_per_elt)#"%s * %d" % (nelts, bytes_per_elt)
-    raw_ptr = "(%s) malloc(%s)" % (type_mappings.to_ctype(expr.type), nbytes)
+    raw_ptr = "(%s) %s" % (type_mappings.to_ctype(expr.type), self.alloc_bytes(nbytes))
     struct_type = self.to_ctype(expr.type)
     return self.fresh_var(struct_type, "new_ptr", "{%s, NULL}" % raw_ptr)
     
+  def alloc_bytes(self, nbytes):
+    """
+    C expression which allocates the given number of bytes
+    according to the current allocation policy
+    """
+    alignment, huge_page_min_bytes = current_allocation()[:2]
+    if alignment == 0 and huge_page_min_bytes is None:
+      return "malloc(%s)" % nbytes 
+    if self.uses_helper_objects():
+      name, sig, src = alloc_helper(alignment, huge_page_min_bytes)
+      self.add_decl(sig)
+      self.extra_objects.add(helper_object(name, src))
+      return "%s(%s)" % (name, nbytes)
+    if alloc_fn_sig not in self.extra_function_signatures:
+      self.extra_function_signatures.append(alloc_fn_sig)
+      self.extra_functions[alloc_fn_sig] = alloc_fn_source(alignment, huge_page_min_bytes)
+    return "%s(%s)" % (alloc_fn_name, nbytes)
+  
+  def uses_helper_objects(self):
+    # compilers like nvcc whose flags need a prefix don't get helper objects
+    return config.helper_objects and not windows and \
+      getattr(self, 'compiler_cmd', None) is None and \
+      getattr(self, 'compiler_flag_prefix', None) is None
+  
+  def find_stack_arrays(self, fn):
+    self.stack_array_decls = []
+    max_bytes = current_allocation()[3]
+    if max_bytes is None:
+      self.stack_arrays = {}
+    else:
+      self.stack_arrays = stack_allocations(fn, max_bytes)
+  
+  def with_stack_array_decls(self, body_str):
+    if len(self.stack_array_decls) == 0:
+      return body_str
+    return "\n".join(self.stack_array_decls) + "\n" + body_str
+  
+  def stack_alloc(self, expr, nelts):
+    """
+    Use a local C array declared at the top of the function 
+    as the data of an allocation which doesn't outlive the function
+    """
+    elt_t = expr.elt_type if expr.__class__ is Alloc else expr.type.elt_type 
+    storage = self.fresh_name("stack_data")
+    self.stack_array_decls.append("%s %s[%d];" % (self.to_ctype(elt_t), storage, nelts))
+    if expr.__class__ is Alloc:
+      return self.fresh_var(self.to_ctype(expr.type), "new_ptr", "{%s, NULL}" % storage)
+    else:
+      return self.alloc_array(expr.type, expr.shape, storage = storage)
+    
   def visit_Const(self, expr):
     t = expr.type 
     c = t.__class__ 
@@ -356,7 +418,10 @@ class FnCompiler(BaseCompiler):
     return expr.__class__ in (Var, Const, PrimCall, Attribute, TupleProj, Tuple, ArrayView)
   
   def visit_Assign(self, stmt):
-    rhs = self.visit_expr(stmt.rhs)
+    if stmt.lhs.__class__ is Var and stmt.lhs.name in self.stack_arrays:
+      rhs = self.stack_alloc(stmt.rhs, self.stack_arrays[stmt.lhs.name])
+    else:
+      rhs = self.visit_expr(stmt.rhs)
 
     if stmt.lhs.__class__ is Var:
       lhs = self.visit_expr(stmt.lhs)
@@ -382,11 +447,18 @@ class FnCompiler(BaseCompiler):
     else: 
       self.append("%s %s = %s;" % (t, c_name, init_value))
   
+  def sorted_merge(self, merge):
+    """
+    Phi nodes in an order which doesn't depend on the version 
+    numbers of their names (and hence on what else got compiled)
+    """
+    return sorted(merge.iteritems(), key = lambda (name, _): names.sort_key(name))
+  
   def declare_merge_vars(self, merge):
     """ 
     Declare but don't initialize
     """
-    for (name, (left, _)) in merge.iteritems():
+    for (name, (left, _)) in self.sorted_merge(merge):
       self.declare(name, left.type)
       
   def visit_merge_left(self, merge, fresh_vars = True):
@@ -395,8 +467,8 @@ class FnCompiler(BaseCompiler):
       return ""
     
     self.push()
-    self.comment("Merge Phi Nodes (left side) " + str(merge))
-    for (name, (left, _)) in merge.iteritems():
+    self.comment("Merge Phi Nodes (left side)")
+    for (name, (left, _)) in self.sorted_merge(merge):
       c_left = self.visit_expr(left)
       if fresh_vars:
         self.declare(name, left.type, c_left)
@@ -411,9 +483,9 @@ class FnCompiler(BaseCompiler):
     if len(merge) == 0:
       return ""
     self.push()
-    self.comment("Merge Phi Nodes (right side) " + str(merge))
+    self.comment("Merge Phi Nodes (right side)")
     
-    for (name, (_, right)) in merge.iteritems():
+    for (name, (_, right)) in self.sorted_merge(merge):
       c_right = self.visit_expr(right)
      
       self.append("%s = %s;"  % (self.name(name), c_right))
@@ -589,7 +661,6 @@ class FnCompiler(BaseCompiler):
     if attributes is None:
       attributes = []
     
-    c_fn_name = names.refresh(fn.name).replace(".", "_")
     arg_types = [self.to_ctype(t) for t in fn.input_types]
     arg_names = [self.name(old_arg) for old_arg in fn.arg_names]
 
@@ -618,11 +689,13 @@ class FnCompiler(BaseCompiler):
       self.return_by_ref = False 
     args_str = ", ".join("%s %s" % (t, name) for (t,name) in zip(arg_types,arg_names))
     
-    body_str = self.visit_block(fn.body) 
+    self.find_stack_arrays(fn)
+    body_str = self.with_stack_array_decls(self.visit_block(fn.body))
     
     if inline:
       attributes = attributes + ["static inline"]
     attr_str = " ".join(attributes)
+    c_fn_name = canonical_name(fn.name, "%s %s(%s) {%s}" % (attr_str, return_type, args_str, body_str))
     sig = "%s %s(%s)" % (return_type, c_fn_name, args_str)
     src = "%s %s {\n\n%s}" % (attr_str, sig, body_str) 
     return c_fn_name, sig, src
@@ -634,7 +707,7 @@ class FnCompiler(BaseCompiler):
     we can use this cache key to track the class of the compiler or other
     relevant meta-data
     """ 
-    return self.__class__ 
+    return self.__class__, current_allocation() 
   
   _flat_compile_cache = {}
   def compile_flat_source(self, parakeet_fn, attributes = [], inline = True):
@@ -663,3 +736,5 @@ class FnCompiler(BaseCompiler):
       declarations = self.declarations)
     self._flat_compile_cache[key] = result
     return result
+
+register_settings_cache(FnCompiler, '_flat_compile_cache')
@@ -0,0 +1,47 @@
+from .. import config, names
+from ..transforms.narrow_indices import narrow_indices
+from ..value_specialization import specialize_contiguous
+
+# map from a description of each compiled function to the functions 
+# of its modules which return how often each of their versions ran, 
+# there can be several if it gets compiled with different settings  
+_path_counters = {}
+
+def compile_multiversion(compiler, fn):
+  """
+  Compile a function into a module with both a generic version and one for 
+  contiguous arrays (plus a copy of that one with 32-bit indices for small 
+  arrays), or just the generic version if it has no array arguments, 
+  and return the module's entry function
+  """
+  contiguous_fn = specialize_contiguous(fn)
+  if contiguous_fn is fn:
+    return compiler.compile_entry(fn).c_fn
+  narrow_fn = None
+  if config.opt_narrow_indices:
+    narrow_fn = narrow_indices(contiguous_fn)
+    if narrow_fn is contiguous_fn:
+      narrow_fn = None
+  compiled_fn = compiler.compile_multiversion_entry(fn, contiguous_fn, narrow_fn)
+  label = "%s(%s) with %s" % (names.original(fn.name), 
+                              ", ".join(str(t) for t in fn.input_types), 
+                              compiler.__class__.__name__)
+  counter = getattr(compiled_fn.module, compiled_fn.fn_name + "_path_counts")
+  counters = _path_counters.setdefault(label, [])
+  if counter not in counters:
+    counters.append(counter)
+  return compiled_fn.c_fn
+
+def path_counts():
+  """
+  How many times the contiguous and strided versions of each 
+  multiversioned function have been called, calls to the contiguous 
+  version with 32-bit indices are also counted as 'narrow_index' 
+  """
+  result = {}
+  for (label, counters) in _path_counters.iteritems():
+    counts = [counter() for counter in counters]
+    result[label] = {'contiguous' : int(sum(c + n for (c, _, n) in counts)), 
+                     'strided' : int(sum(s for (_, s, _) in counts)), 
+                     'narrow_index' : int(sum(n for (_, _, n) in counts))}
+  return result
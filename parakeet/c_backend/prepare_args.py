@@ -30,8 +30,9 @@ def prepare_arg(arg, t):
       return prepare_closure_args(arg)
     else:
       from ..frontend import ast_conversion
-      untyped = ast_conversion.translate_function_value(arg)
-      return prepare_closure_args(untyped)
+      closure_args = ast_conversion.closure_values(arg)
+      closure_arg_types = [type_conv.typeof(v) for v in closure_args]
+      return prepare_args(closure_args, closure_arg_types)
   assert False, "Can't call compiled C code with argument %s (Python type = %s, Parakeet type = %s)" % \
     (arg, type(arg), t)
   
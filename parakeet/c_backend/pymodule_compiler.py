@@ -1,5 +1,6 @@
 from ..analysis import use_count
 from ..syntax import Tuple,  Expr
+from ..transforms.narrow_indices import max_elements
  
 from ..ndtypes import (
   TupleT,  ArrayT,  NoneT, elt_type, ScalarT, FloatT, BoolT,  
@@ -10,6 +11,7 @@ import type_mappings
 from fn_compiler import FnCompiler
 from compile_util import compile_module_from_source
 from .. import config as root_config 
+from ..settings_caches import register_settings_cache
 import config 
 
 def attr_from_kwargs(obj, kwargs, attr, value = None):
@@ -481,7 +483,11 @@ class PyModuleCompiler(FnCompiler):
    
     
   
-  def alloc_array(self, array_t, shape_expr):
+  def alloc_array(self, array_t, shape_expr, storage = None):
+    """
+    Fill in the fields of a new array, allocating its data 
+    unless we're given the name of a local C array to use instead
+    """
     if isinstance(shape_expr.type, ScalarT):
       dim = self.visit_expr(shape_expr)
       nelts = dim 
@@ -496,7 +502,10 @@ class PyModuleCompiler(FnCompiler):
     typename = self.to_ctype(array_t)
     result = self.fresh_var(typename, "new_array")
     raw_ptr_t = self.to_ctype(array_t.elt_type) + "*"
-    self.setfield(result, "data.raw_ptr", "(%s) malloc(%s * %s)" % (raw_ptr_t, nelts, bytes_per_elt) )
+    nbytes = "%s * %s" % (nelts, bytes_per_elt)
+    if storage is None:
+      storage = self.alloc_bytes(nbytes)
+    self.setfield(result, "data.raw_ptr", "(%s) %s" % (raw_ptr_t, storage))
     self.setfield(result, "data.base", "(PyObject*) NULL")
     self.setfield(result, "offset", "0")
     self.setfield(result, "size", nelts)
@@ -695,6 +704,10 @@ class PyModuleCompiler(FnCompiler):
     
     dummy = self.fresh_name("dummy")
     args = self.fresh_name("args")
+    # derived compilers can look for extra arguments past the function's own 
+    # in their enter_module_body hook 
+    self.entry_args_var = args
+    self.n_entry_args = len(fn.arg_names)
     
     if config.debug: 
       self.newline()
@@ -703,12 +716,11 @@ class PyModuleCompiler(FnCompiler):
     for i, argname in enumerate(fn.arg_names):
       assert argname in uses, "Couldn't find arg %s in use-counts" % argname
       if uses[argname] <= 1:
-        self.comment("Skipping unused argument %s" % argname)
+        self.comment("Skipping unused argument #%d" % (i+1))
         continue
-      self.comment("Unpacking argument %s"  % argname)
       c_name = self.name(argname)
       t = fn.type_env[argname]
-      self.comment("Getting arg #%d: %s : %s => %s" % (i+1, argname,  t, c_name) )
+      self.comment("Getting arg #%d: %s : %s" % (i+1, c_name,  t) )
       self.append("PyObject* %s = PyTuple_GetItem(%s, %d);" % (c_name, args, i))
       
       self.check_type(c_name, t)
@@ -719,15 +731,17 @@ class PyModuleCompiler(FnCompiler):
       
       if isinstance(t, (TupleT, NoneT, PtrT, ClosureT, ScalarT, ArrayT, SliceT)):
         #new_name = self.name(argname, overwrite = True)
-        self.comment("Unboxing %s : %s" % (argname, t))
+        self.comment("Unboxing %s : %s" % (c_name, t))
         var = self.unbox(c_name, t, target = argname)
 
         self.name_mappings[argname] = var
       
 
+    self.find_stack_arrays(fn)
     self.enter_module_body()
     c_body = self.visit_block(fn.body, push=False)
     self.exit_module_body()
+    c_body = self.with_stack_array_decls(c_body)
     c_body = self.indent(c_body )
     c_args = "PyObject* %s, PyObject* %s" % (dummy, args) #", ".join("PyObject* %s" % self.name(n) for n in fn.arg_names)
     c_sig = "PyObject* %(c_fn_name)s (%(c_args)s)" % locals() 
@@ -736,33 +750,141 @@ class PyModuleCompiler(FnCompiler):
   
   _entry_compile_cache = {} 
   def compile_entry(self, parakeet_fn):  
-    # we include the compiler's class as part of the key
+    # we include the compiler's cache key (which contains its class) as part of the key
     # since this function might get reused by descendant backends like OpenMP and CUDA
-    key = parakeet_fn.cache_key, self.__class__ 
+    key = parakeet_fn.cache_key, self.cache_key 
     compiled_fn = self._entry_compile_cache.get(key)
     if compiled_fn: return compiled_fn 
     
     name, sig, src = self.visit_fn(parakeet_fn)
+    compiled_fn = self.compile_module(name, sig, src)
+    self._entry_compile_cache[key]  = compiled_fn
+    return compiled_fn
+
+  _multiversion_compile_cache = {}
+  def compile_multiversion_entry(self, generic_fn, contiguous_fn, narrow_fn = None):
+    """
+    Build a single module whose entry function checks whether the innermost 
+    stride of every array argument is one element and then calls either 
+    contiguous_fn, compiled assuming that it is, or the fully generic version. 
+    If given, narrow_fn (a version of contiguous_fn with 32-bit indices) gets 
+    called instead of contiguous_fn when no array argument has more than 
+    max_elements elements or spans more than that many elements of memory. 
+    The module also exports <entry name>_path_counts() which returns how many 
+    times each version has run. 
+    """
+    key = generic_fn.cache_key, contiguous_fn.cache_key, \
+      narrow_fn.cache_key if narrow_fn is not None else None, self.cache_key 
+    compiled_fn = self._multiversion_compile_cache.get(key)
+    if compiled_fn: return compiled_fn 
+    
+    generic_name, _, generic_src = self.visit_fn(generic_fn)
+    # the versions share variable names but they're local to each C function 
+    self.name_mappings = {}
+    contiguous_name, _, contiguous_src = self.visit_fn(contiguous_fn)
+    
+    checks = []
+    array_args = []
+    for (i, t) in enumerate(generic_fn.input_types):
+      if isinstance(t, ArrayT) and t.rank > 0:
+        arg = "PyTuple_GET_ITEM(args, %d)" % i
+        array_args.append(arg)
+        checks.append("PyArray_STRIDES((PyArrayObject*) %s)[%d] == %d" % 
+                      (arg, t.rank - 1, t.elt_type.dtype.itemsize))
+    name = self.fresh_name(generic_fn.name)
+    counts = "%s_counts" % name 
+    counts_fn = "%s_path_counts" % name 
+    sig = "PyObject* %s (PyObject* dummy, PyObject* args)" % name 
     
-    if config.print_function_source: 
+    if narrow_fn is not None:
+      self.name_mappings = {}
+      narrow_name, _, narrow_src = self.visit_fn(narrow_fn)
+      small = "%s_small_array" % name 
+      narrow_src += """
+      static int %(small)s(PyObject* obj) {
+        PyArrayObject* array = (PyArrayObject*) obj;
+        long long itemsize = PyArray_ITEMSIZE(array);
+        long long extent = 1;
+        int i;
+        if (PyArray_SIZE(array) > %(limit)dLL) { return 0; }
+        for (i = 0; i < PyArray_NDIM(array); ++i) {
+          long long dim = PyArray_DIM(array, i);
+          long long stride = PyArray_STRIDE(array, i) / itemsize;
+          if (stride < 0) { stride = -stride; }
+          if (dim > %(limit)dLL || stride > %(limit)dLL) { return 0; }
+          if (dim > 0) { extent += (dim - 1) * stride; }
+          if (extent > %(limit)dLL) { return 0; }
+        }
+        return 1;
+      }
+      """ % dict(small = small, limit = max_elements)
+      narrow_call = """
+        if (%(check)s) {
+          %(counts)s[2] += 1;
+          return %(narrow_name)s(dummy, args);
+        }""" % dict(check = " && ".join("%s(%s)" % (small, arg) for arg in array_args), 
+                   counts = counts, narrow_name = narrow_name)
+    else:
+      narrow_src = ""
+      narrow_call = ""
+    src = """
+    %(generic_src)s
+    
+    %(contiguous_src)s
+    
+    %(narrow_src)s
+    
+    static long long %(counts)s[3] = {0, 0, 0};
+    
+    static PyObject* %(counts_fn)s(PyObject* dummy, PyObject* args) {
+      return Py_BuildValue("(LLL)", %(counts)s[0], %(counts)s[1], %(counts)s[2]);
+    }
+    
+    %(sig)s {
+      if (%(check)s) {%(narrow_call)s
+        %(counts)s[0] += 1;
+        return %(contiguous_name)s(dummy, args);
+      } else {
+        %(counts)s[1] += 1;
+        return %(generic_name)s(dummy, args);
+      }
+    }
+    """ % dict(generic_src = generic_src, contiguous_src = contiguous_src, 
+                narrow_src = narrow_src, narrow_call = narrow_call,
+                counts = counts, counts_fn = counts_fn, sig = sig, 
+                check = " && ".join(checks) if checks else "1", 
+                contiguous_name = contiguous_name, generic_name = generic_name)
+    compiled_fn = self.compile_module(name, sig, src, extra_methods = [counts_fn])
+    self._multiversion_compile_cache[key] = compiled_fn
+    return compiled_fn 
+  
+  def compile_module(self, name, sig, src, extra_methods = []):
+    """
+    Given the source of an entry function generated by visit_fn, combine it
+    with all the helper functions and declarations it depends on and build
+    the result into a Python extension module
+    """
+    if config.print_function_source:
       print "Generated C source for %s: %s" %(name, src)
-    ordered_function_sources = [self.extra_functions[extra_sig] for 
+    ordered_function_sources = [self.extra_functions[extra_sig] for
                                 extra_sig in self.extra_function_signatures]
 
-    compiled_fn = compile_module_from_source(
+    return compile_module_from_source(
       src, 
       fn_name = name,
       fn_signature = sig, 
       src_extension = self.src_extension,
+      extra_headers = self.extra_headers, 
       extra_objects = set(self.extra_objects),
       extra_function_sources = ordered_function_sources, 
       declarations =  self.declarations, 
       extra_compile_flags = self.extra_compile_flags, 
       extra_link_flags = self.extra_link_flags, 
+      extra_methods = extra_methods, 
       print_source = root_config.print_generated_code, 
       compiler = self.compiler_cmd, 
       compiler_flag_prefix = self.compiler_flag_prefix, 
       linker_flag_prefix = self.linker_flag_prefix)
-    self._entry_compile_cache[key]  = compiled_fn
-    return compiled_fn
 
+register_settings_cache(PyModuleCompiler, '_entry_compile_cache')
+register_settings_cache(PyModuleCompiler, '_multiversion_compile_cache')
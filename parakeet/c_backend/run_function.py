@@ -1,25 +1,68 @@
 from prepare_args import prepare_args
+from .. import config
+from ..retention import release_after_compile, snapshot_ir_caches
+from ..settings_caches import register_backend_caches
+from ..tiering import compile_lock
 from ..transforms.pipeline  import lower_to_loops
-from ..value_specialization import specialize
-from ..config import value_specialization
-from pymodule_compiler import PyModuleCompiler 
-
+from ..value_specialization import specialization_values, specialize_abstract_values
+from pymodule_compiler import PyModuleCompiler
+from allocation import current_allocation
+from multiversion import compile_multiversion
 
+def multiversioned():
+  return config.value_specialization and config.multiversioning and \
+    not config.small_shape_specialization
 
 _cache = {}
-def run(fn, args):
+
+# compiled functions keyed by the typed function they were compiled from,
+# so that later calls skip lowering (whose results may have been released)
+_entry_cache = {}
+register_backend_caches('c', __name__)
+
+def entry_key(fn, args):
+  """
+  Key of the code compiled for the typed function and these arguments,
+  along with the arguments to call it with
+  """
   args = prepare_args(args, fn.input_types)
+  multiversion = multiversioned()
+  if config.value_specialization and not multiversion:
+    abstract_values = specialization_values(fn, args)
+  else:
+    abstract_values = None
+  return (fn.cache_key, abstract_values, multiversion, current_allocation()), args
 
-  fn = lower_to_loops(fn)
-  
-  if value_specialization: 
-    fn = specialize(fn, args)
-
-  key = fn.cache_key
-  if key in _cache:
-    return _cache[key](*args)
-  compiled_fn = PyModuleCompiler().compile_entry(fn)
-  c_fn = compiled_fn.c_fn 
-  _cache[key] = c_fn 
-  return c_fn(*args)
-  
\ No newline at end of file
+def compiled_entry(fn, args):
+  """
+  Compiled code for the typed function along with the arguments to call it with
+  """
+  compiled_key, args = entry_key(fn, args)
+  if compiled_key in _entry_cache:
+    return _entry_cache[compiled_key], args
+  # lowering reads the compiler's settings and caches, which the compiler
+  # of a hot function on another thread might be changing
+  with compile_lock:
+    snapshot = snapshot_ir_caches()
+    _, abstract_values, multiversion, _ = compiled_key
+
+    lowered = lower_to_loops(fn)
+    if abstract_values is not None:
+      lowered = specialize_abstract_values(lowered, abstract_values)
+
+    key = lowered.cache_key, multiversion, current_allocation()
+    if key in _cache:
+      c_fn = _cache[key]
+    else:
+      if multiversion:
+        c_fn = compile_multiversion(PyModuleCompiler(), lowered)
+      else:
+        c_fn = PyModuleCompiler().compile_entry(lowered).c_fn
+      _cache[key] = c_fn
+    _entry_cache[compiled_key] = c_fn
+    release_after_compile(fn, snapshot)
+    return c_fn, args
+
+def run(fn, args):
+  c_fn, c_args = compiled_entry(fn, args)
+  return c_fn(*c_args)
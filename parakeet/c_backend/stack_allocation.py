@@ -0,0 +1,89 @@
+from .. import shape_inference
+from ..analysis.escape_analysis import EscapeAnalysis
+from ..analysis.syntax_visitor import SyntaxVisitor
+from ..retention import register_ir_cache
+from ..syntax import Alloc, AllocArray, Const, Var
+
+class FindAllocations(SyntaxVisitor):
+  """
+  Collect every variable which gets assigned a fresh allocation
+  along with the names of all the variables merged at the top of loops
+  """
+  def __init__(self):
+    self.allocs = {}
+    self.loop_vars = set([])
+
+  def visit_Assign(self, stmt):
+    if stmt.lhs.__class__ is Var and stmt.rhs.__class__ in (Alloc, AllocArray):
+      self.allocs[stmt.lhs.name] = stmt.rhs
+    SyntaxVisitor.visit_Assign(self, stmt)
+
+  def visit_merge_loop_start(self, phi_nodes):
+    self.loop_vars.update(phi_nodes.iterkeys())
+
+class LocalEscapeAnalysis(EscapeAnalysis):
+  """
+  The body of a ParFor can write into the arrays of its closure but has 
+  nowhere to keep them once the loop is done, so unlike other calls passing 
+  an array to a ParFor doesn't let it outlive the current function 
+  """
+  def visit_ParFor(self, stmt):
+    self.visit_expr(stmt.bounds)
+
+def const_nelts(name, rhs, fn):
+  """
+  Number of elements in an allocation if it's known at compile time, otherwise None
+  """
+  if rhs.__class__ is Alloc:
+    if rhs.count.__class__ is Const:
+      return rhs.count.value
+    count = shape_inference.shape_env(fn).get(rhs.count.name) \
+            if rhs.count.__class__ is Var else None
+    if count.__class__ is shape_inference.Const:
+      return count.value
+    return None
+  shape = shape_inference.shape_env(fn).get(name)
+  if shape.__class__ is not shape_inference.Shape:
+    return None
+  nelts = 1
+  for d in shape.dims:
+    if d.__class__ is not shape_inference.Const:
+      return None
+    nelts *= d.value
+  return nelts
+
+_cache = {}
+register_ir_cache(__name__)
+
+def stack_allocations(fn, max_bytes):
+  """
+  Map from names of variables in the given function to the number of elements
+  of the allocations they're assigned, for every allocation which can live
+  on the stack of the generated C function instead of the heap: its size is
+  known at compile time and no bigger than max_bytes, it never escapes or
+  gets returned, and it never flows around a loop (since the storage of an
+  allocation inside a loop gets reused by every iteration)
+  """
+  key = fn.cache_key, max_bytes
+  if key in _cache:
+    return _cache[key]
+  finder = FindAllocations()
+  finder.visit_fn(fn)
+  result = {}
+  if finder.allocs:
+    escape_info = LocalEscapeAnalysis()
+    escape_info.visit_fn(fn)
+    for (name, rhs) in finder.allocs.iteritems():
+      if name in escape_info.may_escape or name in escape_info.may_return:
+        continue
+      aliases = escape_info.may_alias.get(name, set([name]))
+      if any(alias in finder.loop_vars for alias in aliases):
+        continue
+      nelts = const_nelts(name, rhs, fn)
+      if nelts is None or nelts <= 0:
+        continue
+      elt_t = rhs.elt_type if rhs.__class__ is Alloc else rhs.type.elt_type
+      if nelts * elt_t.nbytes <= max_bytes:
+        result[name] = nelts
+  _cache[key] = result
+  return result
@@ -5,7 +5,9 @@
 #  'auto'  : use either 'c' or 'openmp' depending on availability of OpenMP
 #  'c': sequential, use gcc or clang to compile
 #  'openmp': multi-threaded execution for array operations, requires gcc 4.4+
-#  'llvm': deprecated
+#  'llvm': in-process JIT through llvmlite, no C compiler needed
+#  'multiprocess': splits the outermost parallel loop across worker processes
+#  'numpy': runs array operations as whole-array NumPy calls, nothing to compile
 #  'interp': interpreter, will be dreadfully slow
 #  'cuda': experimental GPU support
 #
@@ -21,7 +23,12 @@ backend = 'openmp' if openmp_available else 'c'
 opt_inline = True
 
 opt_fusion = True
+# merge independent loops over the same indices into one traversal
+opt_horizontal_fusion = True
 opt_combine_nested_maps = True
+# order the indices of multidimensional parallel loops so 
+# the innermost one touches consecutive array elements 
+opt_loop_interchange = True
 
 opt_specialize_fn_args = True 
 
@@ -40,15 +47,17 @@ opt_shape_elim = True
 #
 #   with 
 #     a = b[i:j]  
-# TODO: fix it, currently breaks rule30
-opt_copy_elimination = False
+# unless the code computing a might read b's data 
+opt_copy_elimination = True
 
 # may dramatically increase compile time
 opt_loop_unrolling = False
+# how many copies of a loop body to make when unrolling 
+loop_unrolling_factor = 4
 
-# suspiciously complex optimizations may introduce bugs 
-# TODO: comb through carefully 
-opt_scalar_replacement = False
+# keep array elements which a loop repeatedly reads and writes
+# in registers, unless another array might share their data
+opt_scalar_replacement = True
 
 # experimental!
 opt_simplify_array_operators = False
@@ -59,6 +68,46 @@ opt_verify = False
 # recompile functions for distinct patterns of unit strides and 0 or 1 input values 
 value_specialization = True 
 
+# instead of compiling a new module for each pattern of strides, give every module 
+# a generic version and one for arrays with contiguous rows, picked at runtime 
+# (ignored when small_shape_specialization is on)
+multiversioning = True
+
+# with multiversioning, also compile a copy of the contiguous version with 32-bit 
+# loop counters and array offsets, which runs when no array argument has more 
+# than 2**30 elements (value ranges decide which integers can be narrowed) 
+opt_narrow_indices = True
+
+# also treat array dimensions no bigger than small_shape_max_dim as constants, 
+# fully unrolling the loops over them, and compile at most small_shape_max_variants 
+# such versions of each function before falling back on the generic one  
+small_shape_specialization = False
+small_shape_max_dim = 16
+small_shape_max_variants = 8
+
+# compile specializations which were tuned by calling fn.autotune(...) 
+# with the winning settings saved in the compiler's cache directory 
+use_autotuned_settings = True
+
+# once a specialization has been compiled to native code, throw away the versions 
+# of it made by each optimization phase along with all the analyses of them, 
+# later calls get dispatched straight to the compiled code
+release_intermediate_ir = True
+
+# compile each new specialization quickly (no optimizations, tier0_opt_level) 
+# and only recompile it with every optimization, tier1_opt_level and loop 
+# unrolling once it's been called tier_up_calls times or has run for 
+# tier_up_seconds in total, switching to the optimized code once it's ready
+tiered_compilation = False
+tier_up_calls = 100
+tier_up_seconds = 0.5
+# recompile hot functions on a background thread instead of in the call 
+# which made them hot, earlier calls keep running the unoptimized code  
+tier_up_in_background = True
+# run the unoptimized code with the 'c' backend, or skip compiling it
+# altogether with the 'numpy' interpreter or the 'interp'reter
+tier0_backend = 'c'
+
 
 
 #####################################
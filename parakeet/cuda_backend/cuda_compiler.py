@@ -44,6 +44,7 @@ class CudaCompiler(MulticoreCompiler):
     return self.__class__, self.depth > 0, max(self.gpu_depth, 2) 
   
   def enter_module_body(self):
+    MulticoreCompiler.enter_module_body(self)
     self.append('cudaSetDevice(%d);' % device_info.device_id(self.device))
   
   def build_kernel(self, clos, bounds, write_only = None):
@@ -1,4 +1,4 @@
-from ast_conversion import translate_function_value, translate_function_ast
+from ast_conversion import translate_function_value, translate_function_ast, closure_values
 from closure_specializations import print_specializations
 from decorators import jit, macro, staged_macro, typed_macro, axis_macro
 from diagnose import find_broken_transform
@@ -26,6 +26,7 @@ from ..syntax import (Expr,
 from ..syntax.helpers import (none, true, false, one_i64, zero_i64, zero_i24,  
                               is_python_constant, const)
 from ..syntax.wrappers import build_untyped_prim_fn, build_untyped_expr_fn, build_untyped_cast_fn
+from ..tiering import compile_lock
 
 
  
@@ -921,7 +922,14 @@ def translate_function_ast(name, args, body,
   Helper to launch translation of a python function's AST, and then construct
   an untyped parakeet function from the arguments, refs, and translated body.
   """
-  
+  # translation creates fresh names, which mustn't collide with 
+  # those of a function being compiled on another thread
+  with compile_lock:
+    return _translate_function_ast(name, args, body, globals_dict, 
+                                   closure_vars, closure_cells, parent, filename)
+
+def _translate_function_ast(name, args, body, globals_dict, 
+                              closure_vars, closure_cells, parent, filename):
   assert len(closure_vars) == len(closure_cells)
   closure_cell_dict = dict(zip(closure_vars, closure_cells))
   
@@ -994,8 +1002,18 @@ def translate_function_source(source,
   elif isinstance(syntax_tree, ast.Expression):
     syntax_tree = syntax_tree.body
   
-  assert isinstance(syntax_tree, ast.FunctionDef), \
-      "Unexpected Python syntax node: %s" % ast.dump(syntax_tree)
+  if not isinstance(syntax_tree, ast.FunctionDef):
+    # the source of a lambda is the whole statement it appears in 
+    lambdas = [node for node in ast.walk(syntax_tree) if isinstance(node, ast.Lambda)]
+    assert len(lambdas) == 1, \
+        "Unexpected Python syntax node: %s" % ast.dump(syntax_tree)
+    return translate_function_ast("lambda", 
+                                  lambdas[0].args, 
+                                  [ast.Return(lambdas[0].body)], 
+                                  globals_dict, 
+                                  closure_vars, 
+                                  closure_cells, 
+                                  filename = filename)
   return translate_function_ast(syntax_tree.name, 
                                 syntax_tree.args, 
                                 syntax_tree.body, 
@@ -1008,6 +1026,29 @@ def translate_function_source(source,
 # untyped representation
 _known_python_functions = {}
 
+# code object of a user-defined function mapped to the globals and defaults 
+# it was translated with, along with its untyped representation. 
+# Lambdas and nested functions get re-created each time the enclosing 
+# Python code runs but the new function values all share a code object, 
+# so they can reuse the translation (and every specialization of it) 
+# as long as their closure cell values get passed in as arguments.  
+_known_code_objects = {}
+
+def _code_object_translation(fn):
+  if not isinstance(fn, types.FunctionType):
+    return None
+  entry = _known_code_objects.get(fn.func_code)
+  if entry is None:
+    return None
+  globals_dict, defaults, fundef = entry
+  if globals_dict is not fn.func_globals:
+    return None 
+  new_defaults = fn.func_defaults or ()
+  if len(defaults) != len(new_defaults) or \
+     any(d is not new_d for (d, new_d) in zip(defaults, new_defaults)):
+    return None
+  return fundef 
+
 # keep track of which functions are being translated at this moment 
 # to check for recursive calls 
 _currently_processing = set([])
@@ -1070,11 +1111,10 @@ def _translate_function_value(fn):
   
     _currently_processing.remove(fn)              
     _known_python_functions[fn] = fundef
+    if isinstance(fn, types.FunctionType) and fn.func_code not in _known_code_objects:
+      _known_code_objects[fn.func_code] = (globals_dict, fn.func_defaults or (), fundef) 
   return fundef 
 
-import threading 
-_lock = threading.RLock()
-
 def translate_function_value(fn):
   if fn in _known_python_functions:
     return _known_python_functions[fn]
@@ -1086,7 +1126,8 @@ def translate_function_value(fn):
   # short-circuit logic for turning dtypes and Python types into 
   # functions for casting from any value to those types 
   elif isinstance(fn, (np.dtype, int, long, float, bool)): 
-    fundef = build_untyped_cast_fn(fn)
+    with compile_lock:
+      fundef = build_untyped_cast_fn(fn)
       
   else:
     
@@ -1109,9 +1150,41 @@ def translate_function_value(fn):
     # check again if, after unwrapping the function a bunch, it isn't in the cache 
     if fn in _known_python_functions:
       return _known_python_functions[fn]
+    
+    # a re-created lambda or nested function shares the translation of 
+    # an earlier function value with the same code, don't hold onto it 
+    # by adding it to the cache above 
+    fundef = _code_object_translation(fn)
+    if fundef is not None:
+      return fundef 
   
-    with _lock:
+    with compile_lock:
       fundef = _translate_function_value(fn)
            
   _known_python_functions[fn] = fundef 
-  return fundef 
+  return fundef
+
+def closure_values(fn):
+  """
+  Values of the Python variables which a function refers to from outside 
+  its own scope, in the order of its untyped representation's python_refs. 
+  Since function values created from the same code object share their 
+  untyped representation, closure cells get read from this particular 
+  function value rather than the one which was originally translated. 
+  """
+  untyped = translate_function_value(fn)
+  while isinstance(fn, jit):
+    fn = fn.f 
+  if not untyped.python_refs or \
+     not isinstance(fn, types.FunctionType) or \
+     not fn.func_closure or \
+     _code_object_translation(fn) is not untyped:
+    return untyped.python_nonlocals()
+  cells = dict(zip(fn.func_code.co_freevars, fn.func_closure))
+  values = []
+  for ref in untyped.python_refs:
+    if isinstance(ref, ClosureCellRef):
+      values.append(cells[ref.name].cell_contents)
+    else:
+      values.append(ref.deref())
+  return values 
@@ -0,0 +1,244 @@
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+
+from .. import config
+from ..c_backend import config as c_config
+from ..openmp_backend import config as openmp_config
+from ..settings_caches import settings_caches, tunable_backends
+from ..tiering import compile_lock
+
+class Knob(object):
+  """
+  A global setting which changes the generated code without changing its result
+  (up to floating point reassociation for fast_math)
+  """
+  def __init__(self, name, config_module, choices, backends = None, depends_on = None):
+    self.name = name
+    self.config_module = config_module
+    self.choices = choices
+    self.backends = backends
+    # only worth trying if this other knob is turned on
+    self.depends_on = depends_on
+
+  def get(self):
+    return getattr(self.config_module, self.name)
+
+  def set(self, value):
+    setattr(self.config_module, self.name, value)
+
+  def applies_to(self, backend, settings):
+    if self.backends is not None and backend not in self.backends:
+      return False
+    return self.depends_on is None or settings.get(self.depends_on)
+
+knobs = [
+  Knob('opt_loop_unrolling', config, [False, True]),
+  Knob('loop_unrolling_factor', config, [2, 4, 8], depends_on = 'opt_loop_unrolling'),
+  Knob('opt_scalar_replacement', config, [False, True]),
+  # only the C backends specialize on argument values 
+  Knob('small_shape_specialization', config, [False, True], backends = ['c', 'openmp']),
+  Knob('opt_level', c_config, ['-O1', '-O2', '-O3'], backends = ['c', 'openmp']),
+  Knob('fast_math', c_config, [True, False], backends = ['c', 'openmp']),
+  Knob('collapse_nested_loops', openmp_config, [True, False], backends = ['openmp']),
+  Knob('runtime_schedule', openmp_config, ['static', 'dynamic', 'guided'], backends = ['openmp']),
+]
+_knobs_by_name = dict((knob.name, knob) for knob in knobs)
+
+def current_settings(backend):
+  return dict((knob.name, knob.get()) for knob in knobs
+              if knob.backends is None or backend in knob.backends)
+
+# for each scope key, the caches used under it keyed by the id and 
+# attribute of the object which holds them 
+_cache_namespaces = {}
+
+class config_scope(object):
+  """
+  Compile and run with the given (config module, attribute, value) overrides, 
+  using copies of every registered settings cache which are only shared 
+  with other scopes under the same key. Since the overrides and caches are 
+  module globals, the scope holds compile_lock so that no other thread 
+  compiles while they're swapped in.
+  """
+  def __init__(self, overrides, key):
+    self.overrides = overrides
+    self.key = key
+
+  def __enter__(self):
+    compile_lock.acquire()
+    self.caches = _cache_namespaces.setdefault(self.key, {})
+    self.old_values = []
+    for (config_module, name, value) in self.overrides:
+      self.old_values.append((config_module, name, getattr(config_module, name)))
+      setattr(config_module, name, value)
+    self.old_caches = []
+    for (obj, attr) in settings_caches():
+      self.old_caches.append((obj, attr, getattr(obj, attr)))
+      setattr(obj, attr, self.caches.setdefault((id(obj), attr), {}))
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    swapped = set((id(obj), attr) for (obj, attr, _) in self.old_caches)
+    for (obj, attr) in settings_caches():
+      # caches registered by modules first imported inside the scope 
+      # were filled with this scope's settings 
+      if (id(obj), attr) not in swapped:
+        self.caches[(id(obj), attr)] = getattr(obj, attr)
+        setattr(obj, attr, {})
+    for (obj, attr, cache) in self.old_caches:
+      setattr(obj, attr, cache)
+    for (config_module, name, value) in reversed(self.old_values):
+      setattr(config_module, name, value)
+    compile_lock.release()
+    return False
+
+class settings_scope(config_scope):
+  """
+  Compile and run with the given settings, using caches
+  which aren't shared with any other group of settings
+  """
+  def __init__(self, settings):
+    overrides = [(_knobs_by_name[name].config_module, name, value) 
+                 for (name, value) in settings.iteritems()]
+    config_scope.__init__(self, overrides, tuple(sorted(settings.items())))
+    self.settings = settings
+
+_function_ids = {}
+def function_id(python_fn):
+  """
+  Name for a Python function which stays the same across processes
+  as long as the function's source doesn't change
+  """
+  if python_fn in _function_ids:
+    return _function_ids[python_fn]
+  try:
+    src = inspect.getsource(python_fn)
+  except (IOError, TypeError):
+    src = python_fn.func_code.co_code
+  digest = hashlib.sha1(src).hexdigest()[:12]
+  result = "%s.%s:%s" % (python_fn.__module__, python_fn.__name__, digest)
+  _function_ids[python_fn] = result
+  return result
+
+def specialization_key(python_fn, input_types, backend):
+  return "%s(%s)@%s" % (function_id(python_fn), ", ".join(str(t) for t in input_types), backend)
+
+autotune_filename = "autotune.json"
+
+def autotune_path():
+  if not c_config.cache_dir:
+    return None
+  return os.path.join(c_config.cache_dir, autotune_filename)
+
+_saved_settings = []
+def saved_settings():
+  """
+  Winners of previous autotuning runs, read from the cache directory the first time
+  """
+  if not _saved_settings:
+    path = autotune_path()
+    saved = {}
+    if path is not None and os.path.exists(path):
+      try:
+        with open(path) as f:
+          saved = json.load(f)
+      except (IOError, ValueError):
+        saved = {}
+    _saved_settings.append(saved)
+  return _saved_settings[0]
+
+def save_settings(key, settings):
+  saved = saved_settings()
+  saved[key] = settings
+  path = autotune_path()
+  if path is None:
+    return
+  if not os.path.exists(c_config.cache_dir):
+    os.makedirs(c_config.cache_dir)
+  with open(path, 'w') as f:
+    json.dump(saved, f, indent = 2, sort_keys = True)
+
+def tuned_settings(python_fn, input_types, backend):
+  # tiered compilation picks the settings of each tier itself
+  if not config.use_autotuned_settings or config.tiered_compilation:
+    return None
+  saved = saved_settings()
+  if not saved:
+    return None
+  settings = saved.get(specialization_key(python_fn, input_types, backend))
+  if settings is None:
+    return None
+  # JSON turns the settings' strings into unicode
+  return dict((str(k), str(v) if isinstance(v, unicode) else v)
+              for (k, v) in settings.iteritems() if k in _knobs_by_name)
+
+def same_result(x, y):
+  if isinstance(x, tuple):
+    return isinstance(y, tuple) and len(x) == len(y) and \
+      all(same_result(xi, yi) for (xi, yi) in zip(x, y))
+  x = np.asarray(x)
+  y = np.asarray(y)
+  if x.shape != y.shape:
+    return False
+  if x.dtype.kind == 'f' or y.dtype.kind == 'f':
+    return np.allclose(x, y, rtol = 1e-4, atol = 1e-6, equal_nan = True)
+  return np.all(x == y)
+
+def time_variant(run, settings, min_time = 0.05, min_repeat = 3):
+  """
+  Compile once and then return the best time and the result of the given function
+  """
+  with settings_scope(settings):
+    result = run()
+    best = None
+    total = 0.0
+    count = 0
+    while count < min_repeat or total < min_time:
+      start = time.time()
+      run()
+      elapsed = time.time() - start
+      total += elapsed
+      count += 1
+      if best is None or elapsed < best:
+        best = elapsed
+  return best, result
+
+def autotune(python_fn, typed_fn, run, backend, budget_seconds = 30.0, save = True):
+  """
+  Greedily try each knob's alternatives on top of the best settings found so far,
+  keep any change which makes the specialization faster without changing its result,
+  and stop trying new variants once the time budget is used up
+  """
+  start = time.time()
+  best_settings = current_settings(backend)
+  best_time, expected = time_variant(run, best_settings)
+  # checked after the first run, which imports the backend (and so 
+  # registers its caches) if nothing else has yet 
+  assert backend in tunable_backends(), \
+    "Can't autotune backend %s, its compiled code isn't kept apart for each variant" % backend
+  for knob in knobs:
+    if not knob.applies_to(backend, best_settings):
+      continue
+    for choice in knob.choices:
+      if time.time() - start > budget_seconds:
+        break
+      if choice == best_settings[knob.name]:
+        continue
+      candidate = dict(best_settings)
+      candidate[knob.name] = choice
+      try:
+        t, result = time_variant(run, candidate)
+      except Exception:
+        # some settings are still experimental, skip them if they break this function
+        continue
+      if t < best_time and same_result(result, expected):
+        best_time = t
+        best_settings = candidate
+  if save:
+    save_settings(specialization_key(python_fn, typed_fn.input_types, backend), best_settings)
+  return best_settings
@@ -1,30 +1,92 @@
+import contextlib 
 
-from .. import names 
+from .. import config, names 
+from .. lazy_arrays import deferred_call, force, is_lazy 
+from .. tiering import compile_lock
   
 from .. syntax import (Expr, Var, Const, Return, UntypedFn, FormalArgs, DelayUntilTyped,  
                        const, is_python_constant)
 
+from autotune import autotune as autotune_specialization, settings_scope, tuned_settings
 from run_function import run_untyped_fn, run_typed_fn, specialize 
 
+def pop_call_scope(kwargs):
+  """
+  Remove the per-call '_threads', '_schedule' and '_alloc' keywords and, 
+  if any were given, return a scope which applies them  
+  """
+  num_threads = kwargs.pop('_threads', None)
+  schedule = kwargs.pop('_schedule', None)
+  alloc = kwargs.pop('_alloc', None)
+  if num_threads is None and schedule is None:
+    return alloc 
+  from ..openmp_backend import thread_pool 
+  pool = thread_pool(num_threads = num_threads, schedule = schedule)
+  if alloc is None:
+    return pool 
+  return contextlib.nested(alloc, pool)
+
+def run_in_scope(scope, typed_fn, linear_args, backend_name):
+  if scope is None:
+    return run_typed_fn(typed_fn, linear_args, backend_name)
+  with scope:
+    return run_typed_fn(typed_fn, linear_args, backend_name)
+
 class jit(object):
   def __init__(self, f):
     self.f = f
     self.fn = f
     self.untyped = None 
 
+  def specialize(self, args, kwargs):
+    if self.untyped is None:
+      import ast_conversion 
+      self.untyped = ast_conversion.translate_function_value(self.fn)
+    if self.untyped.python_refs:
+      # closure cells are read from the Python function since 
+      # its untyped representation may be shared with other closures
+      return specialize(self.fn, args, kwargs)
+    return specialize(self.untyped, args, kwargs)
+    
   def __call__(self, *args, **kwargs):
     if '_backend' in kwargs:
       backend_name = kwargs['_backend']
       del kwargs['_backend']
     else:
       backend_name = None
+    scope = pop_call_scope(kwargs)
     
-    if self.untyped is None:
-      import ast_conversion 
-      self.untyped = ast_conversion.translate_function_value(self.fn)
+    if is_lazy(args, kwargs):
+      # record calls on deferred values so they get compiled together with 
+      # the rest of the expression, unless we were told how to run this one 
+      if backend_name is None and scope is None:
+        return deferred_call(self, args, kwargs)
+      args = tuple(force(arg, backend_name) for arg in args)
+      kwargs = dict((k, force(v, backend_name)) for (k, v) in kwargs.iteritems())
     
-    typed_fn, linear_args = specialize(self.untyped, args, kwargs)
-    return run_typed_fn(typed_fn, linear_args, backend_name)
+    typed_fn, linear_args = self.specialize(args, kwargs)
+    settings = tuned_settings(self.fn, typed_fn.input_types, backend_name or config.backend)
+    if settings is None:
+      return run_in_scope(scope, typed_fn, linear_args, backend_name)
+    with settings_scope(settings):
+      return run_in_scope(scope, typed_fn, linear_args, backend_name)
+
+  def autotune(self, *args, **kwargs):
+    """
+    Compile several variants of the specialization for these arguments, 
+    time them and remember the fastest settings for later calls 
+    (and later processes, unless called with save = False). 
+    Returns the winning settings. 
+    """
+    budget_seconds = kwargs.pop('budget_seconds', 30.0)
+    save = kwargs.pop('save', True)
+    backend_name = kwargs.pop('_backend', None) or config.backend
+    typed_fn, linear_args = self.specialize(args, kwargs)
+    def run():
+      return run_typed_fn(typed_fn, linear_args, backend_name)
+    return autotune_specialization(self.fn, typed_fn, run, backend_name, 
+                                   budget_seconds = budget_seconds, 
+                                   save = save)
 
 
 class macro(object):
@@ -123,6 +185,7 @@ class macro(object):
       del kwargs['_backend']
     else:
       backend_name = None
+    scope = pop_call_scope(kwargs)
 
     n_pos = len(args)
     keywords = kwargs.keys()
@@ -132,10 +195,15 @@ class macro(object):
                                if k not in self.static_names)
 
      
-    untyped = self._create_wrapper(n_pos, static_pairs, dynamic_keywords)
+    # building the wrapper creates fresh names 
+    with compile_lock:
+      untyped = self._create_wrapper(n_pos, static_pairs, dynamic_keywords)
 
     dynamic_kwargs = dict( (k, kwargs[k]) for k in dynamic_keywords)
-    return run_untyped_fn(untyped, args, dynamic_kwargs, backend = backend_name)
+    if scope is None:
+      return run_untyped_fn(untyped, args, dynamic_kwargs, backend = backend_name)
+    with scope:
+      return run_untyped_fn(untyped, args, dynamic_kwargs, backend = backend_name)
     
 
   def transform(self, args, kwargs = {}):
@@ -2,6 +2,7 @@
 from .. import config, type_inference 
 from ..ndtypes import type_conv, Type, typeof  
 from ..syntax import UntypedFn, ActualArgs
+from ..tiering import compile_lock
 from ..transforms import pipeline
 
 from .. import c_backend
@@ -25,9 +26,7 @@ def prepare_args(fn, args, kwargs):
   values and their types
   """
   #assert not isinstance(fn, TypedFn), "[prepare_args] Only works for untyped functions"
-  if not isinstance(fn, UntypedFn):
-    fn = ast_conversion.translate_function_value(fn)   
-  nonlocals = tuple(fn.python_nonlocals())
+  nonlocals = tuple(ast_conversion.closure_values(fn))
   arg_values = ActualArgs(nonlocals + tuple(args), kwargs)
   arg_types = arg_values.transform(_typeof)
   return arg_values, arg_types
@@ -42,10 +41,13 @@ def specialize(untyped, args, kwargs = {}, optimize = False):
   arguments in a linear order. 
   """
 
+  # keep the Python function around to read its closure cells, 
+  # its untyped representation may be shared with other function values 
+  python_fn = untyped 
   if not isinstance(untyped, UntypedFn):
     untyped = ast_conversion.translate_function_value(untyped)
        
-  arg_values, arg_types = prepare_args(untyped, args, kwargs)
+  arg_values, arg_types = prepare_args(python_fn, args, kwargs)
   
   # convert the awkward mix of positional, named, and starargs 
   # into a positional sequence of arguments
@@ -53,12 +55,14 @@ def specialize(untyped, args, kwargs = {}, optimize = False):
   
   # propagate types through function representation and all
   # other functions it calls
-   
+  # (translation and type inference take compile_lock unless they find 
+  # their result cached, so calls of compiled code don't wait for it)
   typed_fn = type_inference.specialize(untyped, arg_types)
   if optimize: 
     from .. transforms.pipeline import normalize 
     # apply high level optimizations 
-    typed_fn = normalize.apply(typed_fn)
+    with compile_lock:
+      typed_fn = normalize.apply(typed_fn)
   return typed_fn, linear_args 
 
    
@@ -73,6 +77,10 @@ def run_typed_fn(fn, args, backend = None):
   if backend is None:
     backend = config.backend
   
+  if config.tiered_compilation and backend in ('c', 'openmp'):
+    from .. import tiering 
+    return tiering.run(fn, args, backend)
+  
   if backend == 'c':
     return c_backend.run(fn, args)
    
@@ -85,25 +93,22 @@ def run_typed_fn(fn, args, backend = None):
     return cuda_backend.run(fn, args)
   
   elif backend == 'llvm':
-    from ..llvm_backend.llvm_context import global_context
-    from ..llvm_backend import generic_value_to_python 
-    from ..llvm_backend import ctypes_to_generic_value, compile_fn 
-    lowered_fn = pipeline.lowering.apply(fn)
-    llvm_fn = compile_fn(lowered_fn).llvm_fn
-
-    ctypes_inputs = [t.from_python(v) 
-                   for (v,t) 
-                   in zip(args, expected_types)]
-    gv_inputs = [ctypes_to_generic_value(cv, t) 
-                 for (cv,t) 
-                 in zip(ctypes_inputs, expected_types)]
-    exec_engine = global_context.exec_engine
-    gv_return = exec_engine.run_function(llvm_fn, gv_inputs)
-    return generic_value_to_python(gv_return, fn.return_type)
+    # only selectively import llvm_backend since it requires llvmlite
+    from .. import llvm_backend
+    return llvm_backend.run(fn, args)
+
+  elif backend == 'multiprocess':
+    from .. import multiprocess_backend
+    return multiprocess_backend.run(fn, args)
+
+  elif backend == 'numpy':
+    from .. import numpy_interp
+    return numpy_interp.run(fn, args)
 
   elif backend == "interp":
     from .. import interp 
-    fn = pipeline.loopify(fn)
+    with compile_lock:
+      fn = pipeline.loopify(fn)
     return interp.eval_fn(fn, args)
   
   else:
@@ -130,7 +135,8 @@ def run_python_fn(fn, args, kwargs = None, backend = None):
   """
   Given a python function, run it in Parakeet on the supplied args
   """
-  # translate from the Python AST to Parakeet's untyped format
-  untyped = ast_conversion.translate_function_value(fn)
-  return run_untyped_fn(untyped, args, kwargs, backend)
+  if kwargs is None:
+    kwargs = {}
+  typed_fn, linear_args = specialize(fn, args, kwargs)
+  return run_typed_fn(typed_fn, linear_args, backend)
   
@@ -61,7 +61,7 @@ register(prims.class_list, ClosureT, typeof_prim)
 def typeof_fn(f):
   import ast_conversion
   untyped_fn = ast_conversion.translate_function_value(f)
-  closure_args = untyped_fn.python_nonlocals()
+  closure_args = ast_conversion.closure_values(f)
   closure_arg_types = map(typeof, closure_args)
   return make_closure_type(untyped_fn, closure_arg_types)
 
@@ -411,7 +411,7 @@ def eval_fn(fn, actuals):
     # they have to be translated into Parakeet functions
     if isinstance(result, types.FunctionType):
       fundef = ast_conversion.translate_function_value(result)
-      return ClosureVal(fundef, fundef.python_nonlocals())
+      return ClosureVal(fundef, ast_conversion.closure_values(result))
     else:
       return result
 
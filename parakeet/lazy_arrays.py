@@ -0,0 +1,380 @@
+"""
+Deferred array expressions: wrapping an array with lazy(x) gives a value
+whose arithmetic, ufuncs, reductions, indexing and calls to @jit functions
+get recorded instead of computed. Forcing it (force(y), y.force() or
+handing it to NumPy) translates the whole expression graph into a single
+untyped function and runs it, so fusion and the elimination of temporaries
+work across what would otherwise have been separate calls, each returning
+a fully materialized array.
+
+The untyped function for a graph is cached by the graph's structure
+(its operations, with the leaf values standing in as arguments), so
+rebuilding the same expression on new arrays of the same types reuses
+the compiled code.
+"""
+
+import ast
+import numpy as np
+
+# static parts of a node (operators, functions, axes) are baked into the
+# generated function, everything else becomes one of its arguments
+_binop_nodes = {
+  '+' : ast.Add, '-' : ast.Sub, '*' : ast.Mult, '/' : ast.Div,
+  '//' : ast.FloorDiv, '%' : ast.Mod, '**' : ast.Pow,
+}
+_compare_nodes = {
+  '<' : ast.Lt, '<=' : ast.LtE, '>' : ast.Gt, '>=' : ast.GtE,
+  '==' : ast.Eq, '!=' : ast.NotEq,
+}
+_unaryop_nodes = {'-' : ast.USub, '+' : ast.UAdd}
+
+class LazyArray(object):
+  """
+  A node of an expression graph: either a concrete value (op is 'value')
+  or an operation on other nodes and plain values which hasn't run yet.
+  Once forced, a node keeps its value and drops the graph behind it.
+  """
+  def __init__(self, op, params = (), args = ()):
+    self.op = op
+    self.params = params
+    self.args = tuple(args)
+    self.value = None
+
+  def force(self, backend = None):
+    if self.op != 'value':
+      self.value = evaluate(self, backend)
+      self.op = 'value'
+      self.params = ()
+      self.args = ()
+    return self.value
+
+  def __array__(self, dtype = None):
+    return np.asarray(self.force(), dtype = dtype)
+
+  def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+    from mappings import function_mappings
+    if method == '__call__' and len(kwargs) == 0 and ufunc in function_mappings:
+      return deferred_call(ufunc, inputs)
+    inputs = tuple(force(x) for x in inputs)
+    return getattr(ufunc, method)(*inputs, **kwargs)
+
+  def __repr__(self):
+    if self.op == 'value':
+      return "lazy(%r)" % (self.value,)
+    return "LazyArray(%s, %s)" % (self.op, self.params[0])
+
+  def binop(self, op, other):
+    return LazyArray('binop', (op,), (self, other))
+
+  def rbinop(self, op, other):
+    return LazyArray('binop', (op,), (other, self))
+
+  def __add__(self, other): return self.binop('+', other)
+  def __radd__(self, other): return self.rbinop('+', other)
+  def __sub__(self, other): return self.binop('-', other)
+  def __rsub__(self, other): return self.rbinop('-', other)
+  def __mul__(self, other): return self.binop('*', other)
+  def __rmul__(self, other): return self.rbinop('*', other)
+  def __div__(self, other): return self.binop('/', other)
+  def __rdiv__(self, other): return self.rbinop('/', other)
+  def __truediv__(self, other): return self.binop('/', other)
+  def __rtruediv__(self, other): return self.rbinop('/', other)
+  def __floordiv__(self, other): return self.binop('//', other)
+  def __rfloordiv__(self, other): return self.rbinop('//', other)
+  def __mod__(self, other): return self.binop('%', other)
+  def __rmod__(self, other): return self.rbinop('%', other)
+  def __pow__(self, other): return self.binop('**', other)
+  def __rpow__(self, other): return self.rbinop('**', other)
+
+  def __lt__(self, other): return LazyArray('compare', ('<',), (self, other))
+  def __le__(self, other): return LazyArray('compare', ('<=',), (self, other))
+  def __gt__(self, other): return LazyArray('compare', ('>',), (self, other))
+  def __ge__(self, other): return LazyArray('compare', ('>=',), (self, other))
+  def __eq__(self, other): return LazyArray('compare', ('==',), (self, other))
+  def __ne__(self, other): return LazyArray('compare', ('!=',), (self, other))
+  # nodes are still looked up by identity 
+  __hash__ = object.__hash__
+
+  def __neg__(self): return LazyArray('unaryop', ('-',), (self,))
+  def __pos__(self): return LazyArray('unaryop', ('+',), (self,))
+  def __abs__(self): return deferred_call(abs, (self,))
+
+  def __getitem__(self, index):
+    operands = []
+    template = index_template(index, operands)
+    return LazyArray('index', (template,), [self] + operands)
+
+  def reduction(self, name, axis, dtype, out):
+    from mappings import function_mappings, method_mappings
+    if dtype is not None or out is not None:
+      return getattr(np, name)(self.force(), axis = axis, dtype = dtype, out = out)
+    fn = method_mappings[name] if name in method_mappings else function_mappings[getattr(np, name)]
+    return deferred_call(fn, (self,), static_kwargs = {'axis' : axis})
+
+  def sum(self, axis = None, dtype = None, out = None, **kwargs):
+    return self.reduction('sum', axis, dtype, out)
+
+  def prod(self, axis = None, dtype = None, out = None, **kwargs):
+    return self.reduction('prod', axis, dtype, out)
+
+  def mean(self, axis = None, dtype = None, out = None, **kwargs):
+    return self.reduction('mean', axis, dtype, out)
+
+  def min(self, axis = None, out = None, **kwargs):
+    return self.reduction('min', axis, None, out)
+
+  def max(self, axis = None, out = None, **kwargs):
+    return self.reduction('max', axis, None, out)
+
+  def all(self, axis = None, out = None, **kwargs):
+    return self.reduction('all', axis, None, out)
+
+  def any(self, axis = None, out = None, **kwargs):
+    return self.reduction('any', axis, None, out)
+
+  @property
+  def T(self):
+    from mappings import property_mappings
+    return deferred_call(property_mappings['T'], (self,))
+
+  # questions about the result's layout can't be answered without computing it
+  @property
+  def shape(self):
+    return np.shape(self.force())
+
+  @property
+  def ndim(self):
+    return np.ndim(self.force())
+
+  @property
+  def dtype(self):
+    return np.asarray(self.force()).dtype
+
+  def __len__(self):
+    return len(self.force())
+
+  # comparisons are recorded like everything else, so their truth value
+  # has to come from NumPy (which refuses it for more than one element)
+  def __nonzero__(self):
+    return bool(np.asarray(self.force()))
+
+def lazy(value):
+  """
+  Start recording operations on the given array (or scalar)
+  """
+  if isinstance(value, LazyArray):
+    return value
+  node = LazyArray('value')
+  node.value = value
+  return node
+
+def force(value, backend = None):
+  """
+  Compute a deferred value, anything else is returned as it is
+  """
+  if isinstance(value, LazyArray):
+    return value.force(backend)
+  return value
+
+def is_lazy(args, kwargs = {}):
+  for arg in args:
+    if isinstance(arg, LazyArray):
+      return True
+  for arg in kwargs.itervalues():
+    if isinstance(arg, LazyArray):
+      return True
+  return False
+
+def deferred_call(fn, args, kwargs = {}, static_kwargs = {}):
+  """
+  Record a call to a Python or Parakeet function (or one which mappings.py
+  translates), static_kwargs get passed to it as constants
+  """
+  kwarg_names = tuple(sorted(kwargs.keys()))
+  static_items = tuple(sorted(static_kwargs.items()))
+  return LazyArray('call', (fn, len(args), kwarg_names, static_items),
+                   tuple(args) + tuple(kwargs[name] for name in kwarg_names))
+
+def is_static_index(value):
+  return value is None or (isinstance(value, (int, long, np.integer)) and \
+                           not isinstance(value, (bool, np.bool_)))
+
+def index_template(index, operands):
+  """
+  Structure of an indexing expression: integer indices and slice bounds
+  are kept as constants (so that negative ones get resolved against the
+  array's shape), anything else is replaced by its position among the
+  operands
+  """
+  if isinstance(index, tuple):
+    return ('tuple',) + tuple(index_template(elt, operands) for elt in index)
+  elif isinstance(index, slice):
+    parts = []
+    for part in (index.start, index.stop, index.step):
+      if is_static_index(part):
+        parts.append(('const', None if part is None else int(part)))
+      else:
+        operands.append(part)
+        parts.append(('arg', len(operands)))
+    return ('slice',) + tuple(parts)
+  elif index is Ellipsis:
+    return ('ellipsis',)
+  elif is_static_index(index) and index is not None:
+    return ('const', int(index))
+  else:
+    operands.append(index)
+    return ('arg', len(operands))
+
+def literal(value):
+  if value is None or isinstance(value, bool):
+    return ast.Name(id = repr(value), ctx = ast.Load())
+  elif isinstance(value, (int, long, float)):
+    return ast.Num(n = value)
+  assert isinstance(value, tuple), "Unsupported static argument %s" % (value,)
+  return ast.Tuple(elts = [literal(elt) for elt in value], ctx = ast.Load())
+
+class GraphTranslation(object):
+  """
+  Turn an expression graph into the body of a Python function, whose
+  arguments are the concrete values at its leaves, along with a
+  description of the graph's structure that doesn't depend on those values
+  """
+  def __init__(self):
+    self.inputs = []
+    self.input_names = {}
+    self.node_names = {}
+    self.globals = {'np' : np}
+    self.fn_names = {}
+    self.stmts = []
+    self.structure = []
+
+  def operand(self, value):
+    """
+    Returns the Python AST for an operand along with its part of the structure
+    """
+    if isinstance(value, LazyArray):
+      if value.op != 'value':
+        return self.node(value)
+      value = value.value
+    if value is None:
+      return literal(None), None
+    if id(value) not in self.input_names:
+      self.input_names[id(value)] = "arg%d" % len(self.inputs)
+      self.inputs.append(value)
+    name = self.input_names[id(value)]
+    return ast.Name(id = name, ctx = ast.Load()), name
+
+  def fn_name(self, fn):
+    if fn not in self.fn_names:
+      name = "fn%d" % len(self.fn_names)
+      self.fn_names[fn] = name
+      self.globals[name] = fn
+    return ast.Name(id = self.fn_names[fn], ctx = ast.Load())
+
+  def fn_identity(self, fn):
+    """
+    Name of a function's untyped representation, which function values
+    created from the same code share, so that the structure (and with it
+    the graph cache) doesn't keep freshly created lambdas and closures alive
+    """
+    from frontend.ast_conversion import translate_function_value
+    return translate_function_value(fn).name
+
+  def index_part(self, part, exprs):
+    kind, value = part
+    if kind == 'const':
+      return None if value is None else literal(value)
+    return exprs[value]
+
+  def index(self, template, exprs):
+    kind = template[0]
+    if kind == 'tuple':
+      elts = [self.index(elt, exprs) for elt in template[1:]]
+      if all(isinstance(elt, ast.Index) for elt in elts):
+        return ast.Index(value = ast.Tuple(elts = [elt.value for elt in elts], ctx = ast.Load()))
+      return ast.ExtSlice(dims = elts)
+    elif kind == 'slice':
+      parts = [self.index_part(part, exprs) for part in template[1:]]
+      return ast.Slice(lower = parts[0], upper = parts[1], step = parts[2])
+    elif kind == 'ellipsis':
+      return ast.Ellipsis()
+    return ast.Index(value = self.index_part(template, exprs))
+
+  def node(self, root):
+    """
+    Translate every node the given one depends on before the node itself,
+    with an explicit stack since a graph can be a long chain of operations
+    """
+    stack = [(root, False)]
+    while len(stack) > 0:
+      node, ready = stack.pop()
+      if id(node) in self.node_names:
+        continue
+      if ready:
+        self.translate_node(node)
+        continue
+      stack.append((node, True))
+      for arg in reversed(node.args):
+        if isinstance(arg, LazyArray) and arg.op != 'value':
+          stack.append((arg, False))
+    name = self.node_names[id(root)]
+    return ast.Name(id = name, ctx = ast.Load()), name
+
+  def translate_node(self, node):
+    operands = [self.operand(arg) for arg in node.args]
+    exprs = [expr for (expr, _) in operands]
+    op = node.op
+    if op == 'binop':
+      expr = ast.BinOp(left = exprs[0], op = _binop_nodes[node.params[0]](), right = exprs[1])
+      params = node.params
+    elif op == 'compare':
+      expr = ast.Compare(left = exprs[0], ops = [_compare_nodes[node.params[0]]()],
+                         comparators = [exprs[1]])
+      params = node.params
+    elif op == 'unaryop':
+      expr = ast.UnaryOp(op = _unaryop_nodes[node.params[0]](), operand = exprs[0])
+      params = node.params
+    elif op == 'index':
+      expr = ast.Subscript(value = exprs[0], slice = self.index(node.params[0], exprs),
+                           ctx = ast.Load())
+      params = node.params
+    else:
+      assert op == 'call', "Unknown lazy operation %s" % op
+      fn, n_args, kwarg_names, static_items = node.params
+      keywords = [ast.keyword(arg = name, value = expr)
+                  for (name, expr) in zip(kwarg_names, exprs[n_args:])]
+      keywords.extend(ast.keyword(arg = name, value = literal(value))
+                      for (name, value) in static_items)
+      fn_name = self.fn_name(fn)
+      expr = ast.Call(func = fn_name, args = exprs[:n_args], keywords = keywords,
+                      starargs = None, kwargs = None)
+      params = (fn_name.id, self.fn_identity(fn), n_args, kwarg_names, static_items)
+    name = "t%d" % len(self.stmts)
+    self.stmts.append(ast.Assign(targets = [ast.Name(id = name, ctx = ast.Store())],
+                                 value = expr))
+    self.structure.append((op, params, tuple(ref for (_, ref) in operands)))
+    self.node_names[id(node)] = name
+
+  def function_ast(self, result):
+    args = ast.arguments(args = [ast.Name(id = self.input_names[id(value)], ctx = ast.Param())
+                                 for value in self.inputs],
+                         vararg = None, kwarg = None, defaults = [])
+    fn_def = ast.FunctionDef(name = "lazy_expr", args = args,
+                             body = self.stmts + [ast.Return(value = result)],
+                             decorator_list = [])
+    return ast.fix_missing_locations(fn_def)
+
+# untyped functions for each graph structure, specializing them for
+# the types of their arguments and compiling those are cached as usual
+_graph_cache = {}
+
+def evaluate(node, backend = None):
+  from frontend import ast_conversion, run_untyped_fn
+  translation = GraphTranslation()
+  result, _ = translation.node(node)
+  key = tuple(translation.structure)
+  if key not in _graph_cache:
+    fn_def = translation.function_ast(result)
+    _graph_cache[key] = ast_conversion.translate_function_ast(fn_def.name, fn_def.args,
+                                                              fn_def.body, translation.globals)
+  return run_untyped_fn(_graph_cache[key], translation.inputs, backend = backend)
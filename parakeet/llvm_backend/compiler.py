@@ -1,595 +1,751 @@
+import llvmlite.ir as ir
 
-import llvm.core as llc 
-from llvm.core import Builder, ATTR_NO_CAPTURE #, Module 
-from llvm.core import Type as lltype
+from .. import names, prims
+from ..analysis import estimate_cost
+from ..ndtypes import (combine_type_list, ScalarT, FloatT, SignedT, BoolT, NoneT, TupleT, ArrayT, PtrT,
+                       Int64, Float32, Float64)
+from ..syntax import Const, Var, Tuple, Index, Attribute
+from ..syntax.helpers import get_fn, get_closure_args
 
-from .. import config, prims, syntax 
-from .. analysis import may_escape
-from .. ndtypes import BoolT, FloatT, SignedT, UnsignedT, ScalarT, NoneT, Float64
-from .. ndtypes import Int32, Int64, PtrT, Bool 
-from .. syntax import Var, Struct, Index, TypedFn, Attribute 
-
-import llvm_config 
-import llvm_context
+import llvm_config
 import llvm_convert
-import llvm_types
 import llvm_prims
-from llvm_helpers import const, int32, zero 
-from llvm_types import llvm_value_type, llvm_ref_type
-from parakeet.llvm_backend.llvm_convert import to_bit, from_bit
-
+import llvm_types
+from llvm_helpers import const, int64, zero, one, undef, make_struct, make_array
+from llvm_types import (llvm_value_type, field_pos, empty_struct_t, void_t,
+                        int64_t, ptr_int8_t, is_float)
+
+# signature of the functions which run a range of a parallel loop's
+# outermost iterations: worker(environment, start, stop)
+worker_fn_t = ir.FunctionType(void_t, [ptr_int8_t, int64_t, int64_t])
+
+class ModuleCompiler(object):
+  """
+  Collects an entry point and every function it calls
+  (along with the workers of parallel loops) into one LLVM module
+  """
+  def __init__(self, name, triple = None, data_layout = None, parallel = False):
+    self.module = ir.Module(name = name)
+    if triple is not None:
+      self.module.triple = triple
+    if data_layout is not None:
+      self.module.data_layout = data_layout
+    self.parallel = parallel
+    # compiled functions keyed by the typed function, its input types
+    # (specializations of one function can share a name) and whether
+    # they run inside a parallel loop
+    self.functions = {}
+    self.name_versions = {}
+
+  def fresh_name(self, prefix):
+    """
+    Names of generated functions always end with a dot and a number,
+    so they can't clash with C functions such as the math library's cos
+    """
+    prefix = names.original(prefix).replace(".", "_")
+    version = self.name_versions.get(prefix, 0) + 1
+    self.name_versions[prefix] = version
+    return "%s.%d" % (prefix, version)
+
+  def declare(self, name, return_t, arg_types):
+    existing = self.module.globals.get(name)
+    if existing is not None:
+      return existing
+    return ir.Function(self.module, ir.FunctionType(return_t, arg_types), name)
+
+  def get_function(self, fn, sequential):
+    """
+    LLVM function for a typed function, functions which aren't sequential
+    (only possible outside of parallel loops) run their own ParFor loops
+    in parallel and take the parallel settings as two extra arguments
+    """
+    sequential = sequential or not self.parallel
+    key = fn.cache_key, fn.input_types, sequential
+    if key in self.functions:
+      return self.functions[key]
+    compiler = FnCompiler(self, fn, sequential)
+    # register before compiling the body, in case it's recursive
+    self.functions[key] = compiler.llvm_fn
+    compiler.compile_body()
+    return compiler.llvm_fn
+
+class FunctionBuilder(object):
+  """
+  State and helpers shared by everything which emits the body of an LLVM
+  function: compiled Parakeet functions, parallel loop workers and the
+  entry points called from Python
+  """
+  def __init__(self, parent, name, return_t, arg_types, sequential = True,
+               linkage = 'internal'):
+    self.parent = parent
+    self.module = parent.module
+    self.sequential = sequential
+    self.llvm_fn = ir.Function(self.module, ir.FunctionType(return_t, arg_types), name)
+    if linkage is not None:
+      self.llvm_fn.linkage = linkage
+    # stack slots all go in the entry block, where
+    # mem2reg can turn them into SSA values
+    entry_block = self.llvm_fn.append_basic_block("entry")
+    body_block = self.llvm_fn.append_basic_block("body")
+    self.alloca_builder = ir.IRBuilder(entry_block)
+    self.alloca_builder.position_before(self.alloca_builder.branch(body_block))
+    self.builder = ir.IRBuilder(body_block)
+
+  def alloca(self, llvm_t, name = ""):
+    return self.alloca_builder.alloca(llvm_t, name = name)
 
-_escape_analysis_cache = {}
-class Compiler(object):
-  def __init__(self, fundef, llvm_cxt = llvm_context.global_context):
-    self.parakeet_fundef = fundef
-    if config.opt_stack_allocation:
-      self.may_escape = may_escape(fundef)
-    else:
-      self.may_escape = None
-    self.llvm_context = llvm_cxt
-    self.vars = {}
-    self.initialized = set([])
-    # Initializes the variables dictionary and returns a builder object
-    llvm_input_types = map(llvm_ref_type, fundef.input_types)
-    llvm_output_type = llvm_ref_type(fundef.return_type)
-    llvm_fn_t = lltype.function(llvm_output_type, llvm_input_types)
+  def new_block(self, name):
+    return self.llvm_fn.append_basic_block(name)
 
-    self.llvm_fn = self.llvm_context.module.add_function(llvm_fn_t, fundef.name)
+  def declare(self, name, return_t, arg_types):
+    return self.parent.declare(name, return_t, arg_types)
 
-    for arg in self.llvm_fn.args:
-      if not llvm_types.is_scalar(arg.type):
-        arg.add_attribute(ATTR_NO_CAPTURE)
+  def malloc(self, nbytes):
+    malloc = self.declare("malloc", ptr_int8_t, [int64_t])
+    return self.builder.call(malloc, [nbytes], name = "raw_data")
 
-    self.llvm_fn.does_not_throw = True
+  def to_int64(self, value, t):
+    return llvm_convert.convert(value, t, Int64, self.builder)
 
-    self.entry_block, self.entry_builder = self.new_block("entry")
-    self._init_vars(self.parakeet_fundef, self.entry_builder)
+  def product(self, values):
+    result = int64(1)
+    for v in values:
+      result = self.builder.mul(result, v)
+    return result
 
-  def new_block(self, name):
-    bb = self.llvm_fn.append_basic_block(name)
-    builder = Builder.new(bb)
-    return bb, builder
+  def cmp(self, prim, t, x, y, name = "cmp"):
+    op = llvm_prims.comparison_ops[prim]
+    if isinstance(t, FloatT):
+      if prim == prims.not_equal:
+        # like C, NaN is unequal to everything
+        return self.builder.fcmp_unordered(op, x, y, name = name)
+      return self.builder.fcmp_ordered(op, x, y, name = name)
+    elif isinstance(t, SignedT):
+      return self.builder.icmp_signed(op, x, y, name = name)
+    else:
+      return self.builder.icmp_unsigned(op, x, y, name = name)
 
-  def _init_vars(self, fundef, builder):
+  def build_loops(self, bounds, body, prefix = "idx"):
     """
-    Create a mapping from variable names to stack locations, these will later be
-    converted to SSA variables by the mem2reg pass.
+    Nest of loops counting from zero to each of the bounds,
+    calls body(indices) to fill the innermost loop
     """
-    n_expected = len(fundef.arg_names)
-    n_compiled = len(self.llvm_fn.args)
-    assert n_compiled == n_expected, \
-        "Expected %d args (%s) but compiled code had %d args (%s)" % \
-        (n_expected, fundef.arg_names, n_compiled, self.llvm_fn.args)
-
-    for (name, t) in fundef.type_env.iteritems():
-      if not name.startswith("$"):
-        llvm_t = llvm_ref_type(t)
-        stack_val = builder.alloca(llvm_t, name)
-        self.vars[name] = stack_val
-
-    for llvm_arg, name in zip(self.llvm_fn.args, fundef.arg_names):
-      self.initialized.add(name)
-      llvm_arg.name = name
-      if name in self.vars:
-        builder.store(llvm_arg, self.vars[name])
-
-  def attribute_lookup(self, struct, name, builder):
+    counters = [self.alloca(int64_t, "%s%d" % (prefix, i)) for i in xrange(len(bounds))]
+    self._build_loops(counters, bounds, [], body)
+
+  def _build_loops(self, counters, bounds, indices, body):
+    if len(counters) == 0:
+      body(indices)
+      return
+    counter, bound = counters[0], bounds[0]
+    header = self.new_block("loop_header")
+    loop_body = self.new_block("loop_body")
+    after = self.new_block("after_loop")
+    self.builder.store(int64(0), counter)
+    self.builder.branch(header)
+    self.builder.position_at_end(header)
+    i = self.builder.load(counter)
+    self.builder.cbranch(self.builder.icmp_signed("<", i, bound), loop_body, after)
+    self.builder.position_at_end(loop_body)
+    self._build_loops(counters[1:], bounds[1:], indices + [i], body)
+    self.builder.store(self.builder.add(self.builder.load(counter), int64(1)), counter)
+    self.builder.branch(header)
+    self.builder.position_at_end(after)
+
+  def call_with_indices(self, fn, closure_args, indices):
     """
-    Helper for getting the address of an attribute lookup, used both when
-    setting and getting attributes
+    Call the function of a parallel loop or reduction on the indices of the
+    current iteration, passed as a tuple if that's what the function expects
     """
-    llvm_struct = self.compile_expr(struct, builder)
-    struct_t = struct.type
-    field_pos = struct_t.field_pos(name)
-    field_type = struct_t.field_type(name)
-    indices = [int32(0), int32(field_pos)]
-    ptr_name = "%s_ptr" % name
-    ptr = builder.gep(llvm_struct, indices, ptr_name)
-    return ptr, field_type
-
-  def compile_Var(self, expr, builder):
-    name = expr.name
-    assert name in self.initialized, "%s uninitialized" % name
-    ref = self.vars[expr.name]
-    val = builder.load(ref, expr.name + "_val")
-    return val
-
-  def compile_Const(self, expr, builder):
-    t = expr.type
-
-    if isinstance(t, NoneT):
-      return const(0, Int64)
+    callee = self.parent.get_function(fn, sequential = True)
+    index_types = fn.input_types[len(closure_args):]
+    last_t = index_types[-1]
+    if isinstance(last_t, TupleT):
+      elts = [llvm_convert.convert(idx, Int64, elt_t, self.builder)
+              for (idx, elt_t) in zip(indices, last_t.elt_types)]
+      index_args = [make_struct(self.builder, llvm_value_type(last_t), elts)]
     else:
-      assert isinstance(expr.type, ScalarT), \
-          "Expected scalar constant but got %s" % expr.type
+      index_args = [llvm_convert.convert(idx, Int64, t, self.builder)
+                    for (idx, t) in zip(indices, index_types)]
+    return self.builder.call(callee, list(closure_args) + index_args)
+
+  def finish(self, return_void):
+    if not self.builder.block.is_terminated:
+      if return_void:
+        self.builder.ret_void()
+      else:
+        self.builder.unreachable()
+
+class WorkerCompiler(FunctionBuilder):
+  """
+  Outlines the body of a parallel loop into a function which runs a range of
+  its outermost iterations. The closure arguments of the loop's function and
+  the bounds of its inner dimensions get passed through an environment struct.
+  """
+  def __init__(self, parent, fn, closure_types, n_dims):
+    self.env_t = ir.LiteralStructType(list(closure_types) + [int64_t] * (n_dims - 1))
+    name = parent.fresh_name("parfor_worker_" + names.original(fn.name))
+    FunctionBuilder.__init__(self, parent, name, void_t, [ptr_int8_t, int64_t, int64_t])
+    env_arg, start, stop = self.llvm_fn.args
+    env_ptr = self.builder.bitcast(env_arg, ir.PointerType(self.env_t))
+    env = self.builder.load(env_ptr, name = "env")
+    closure_args = [self.builder.extract_value(env, i) for i in xrange(len(closure_types))]
+    inner_bounds = [self.builder.extract_value(env, len(closure_types) + i)
+                    for i in xrange(n_dims - 1)]
+    counter = self.alloca(int64_t, "outer_idx")
+    header = self.new_block("loop_header")
+    body = self.new_block("loop_body")
+    after = self.new_block("after_loop")
+    self.builder.store(start, counter)
+    self.builder.branch(header)
+    self.builder.position_at_end(header)
+    i = self.builder.load(counter)
+    self.builder.cbranch(self.builder.icmp_signed("<", i, stop), body, after)
+    self.builder.position_at_end(body)
+    def loop_body(inner_indices):
+      self.call_with_indices(fn, closure_args, [i] + inner_indices)
+    self.build_loops(inner_bounds, loop_body)
+    self.builder.store(self.builder.add(self.builder.load(counter), int64(1)), counter)
+    self.builder.branch(header)
+    self.builder.position_at_end(after)
+    self.builder.ret_void()
+
+class FnCompiler(FunctionBuilder):
+  """
+  Translate a lowered Parakeet function into an LLVM function. Variables live
+  in stack slots, which LLVM's mem2reg pass turns back into SSA values, and
+  arrays, tuples and pointers are first-class structs laid out like the ones
+  used by the C backend.
+  """
+  def __init__(self, parent, fn, sequential = True):
+    self.fn = fn
+    self.return_void = isinstance(fn.return_type, NoneT)
+    arg_types = [llvm_value_type(t) for t in fn.input_types]
+    if not sequential:
+      # number of threads and minimum estimated work of a parallel loop
+      arg_types = arg_types + [int64_t, int64_t]
+    return_t = void_t if self.return_void else llvm_value_type(fn.return_type)
+    FunctionBuilder.__init__(self, parent, parent.fresh_name(fn.name),
+                             return_t, arg_types, sequential = sequential)
+    self.vars = {}
+    params = self.llvm_fn.args
+    for (name, param) in zip(fn.arg_names, params):
+      param.name = names.original(name).replace(".", "_")
+      self.builder.store(param, self.var_ref(name))
+    if not sequential:
+      self.num_threads, self.parallel_threshold = params[-2:]
+
+  def compile_body(self):
+    self.visit_block(self.fn.body)
+    self.finish(self.return_void)
+
+  def var_ref(self, name):
+    if name not in self.vars:
+      llvm_t = llvm_value_type(self.fn.type_env[name])
+      self.vars[name] = self.alloca(llvm_t, names.original(name).replace(".", "_"))
+    return self.vars[name]
+
+  def coerce(self, value, old_t, new_t):
+    if old_t != new_t and isinstance(old_t, ScalarT) and isinstance(new_t, ScalarT):
+      return llvm_convert.convert(value, old_t, new_t, self.builder)
+    return value
+
+  #############################################
+  #
+  #  Expressions
+  #
+  #############################################
+
+  def visit_expr(self, expr):
+    method_name = "visit_" + expr.__class__.__name__
+    assert hasattr(self, method_name), "Unsupported expression %s" % expr.__class__.__name__
+    return getattr(self, method_name)(expr)
+
+  def visit_expr_list(self, exprs):
+    return [self.visit_expr(e) for e in exprs]
+
+  def visit_Var(self, expr):
+    return self.builder.load(self.var_ref(expr.name))
+
+  def visit_Const(self, expr):
     return const(expr.value, expr.type)
 
-  def compile_Cast(self, expr, builder):
-    llvm_value = self.compile_expr(expr.value, builder)
-    return llvm_convert.convert(llvm_value, expr.value.type, expr.type, builder)
+  def visit_TypedFn(self, expr):
+    # functions are called directly, as values they carry no data
+    return undef(empty_struct_t)
 
-  def compile_Struct(self, expr, builder, local = False):
-    struct_t = expr.type
-    llvm_struct_t = llvm_value_type(struct_t)
-    name = expr.type.node_type()
-    if local:
-      struct_ptr = builder.alloca(llvm_struct_t, name + "_local_ptr")
-    else:
-      struct_ptr = builder.malloc(llvm_struct_t, name + "_ptr")
-
-    for (i, elt) in enumerate(expr.args):
-      field_name, field_type = struct_t._fields_[i]
-      assert elt.type == field_type, \
-          "Mismatch between expected type %s and given %s for field '%s' " % \
-          (field_type, elt.type, field_name)
-      elt_ptr = builder.gep(struct_ptr, [int32(0), int32(i)], "field%d_ptr" % i)
-      llvm_elt = self.compile_expr(elt, builder)
-      builder.store(llvm_elt, elt_ptr)
-
-    return struct_ptr
-
-  def compile_Alloc(self, expr, builder):
-    elt_t = expr.elt_type
-    llvm_elt_t = llvm_types.llvm_value_type(elt_t)
-    n_elts = self.compile_expr(expr.count, builder)
-    return builder.malloc_array(llvm_elt_t, n_elts, "data_ptr")
-
-  def compile_Index(self, expr, builder):
-    llvm_arr = self.compile_expr(expr.value, builder)
-    llvm_index = self.compile_expr(expr.index, builder)
-    pointer = builder.gep(llvm_arr, [llvm_index], "elt_pointer")
-    elt = builder.load(pointer, "elt", align = 16) #, invariant = True)
-    return elt
-  
-  def compile_Select(self, expr, builder):
-    cond = self.compile_expr(expr.cond, builder)
-    cond = llvm_convert.to_bit(cond, builder)
-    trueval = self.compile_expr(expr.true_value, builder)
-    falseval = self.compile_expr(expr.false_value, builder)
-    result =  builder.select(cond, trueval, falseval, "select_result")
-    return result 
-  
-  def compile_Attribute(self, expr, builder):
-    field_ptr, _ = \
-        self.attribute_lookup(expr.value, expr.name, builder)
-    field_value = builder.load(field_ptr, "%s_value" % expr.name)
-    return field_value
-
-  def compile_TypedFn(self, expr, builder):
-    (target_fn, _, _) = compile_fn(expr)
-    return target_fn
-
-  def compile_Call(self, expr, builder):
-    assert expr.fn.__class__ is TypedFn
-    typed_fundef = expr.fn
-    (target_fn, _, _) = compile_fn(typed_fundef)
-    arg_types = syntax.get_types(expr.args)
-    llvm_args = [self.compile_expr(arg, builder) for arg in expr.args]
-    assert len(arg_types) == len(llvm_args)
-    return builder.call(target_fn, llvm_args, 'call_result')
-
-  def cmp(self, prim, t, llvm_x, llvm_y, builder, result_name = None):
-    if result_name is None:
-      result_name = prim.name + "_result"
+  def visit_UntypedFn(self, expr):
+    return undef(empty_struct_t)
 
-    if isinstance(t, FloatT):
-      cmp_op = llvm_prims.float_comparisons[prim]
-      return builder.fcmp(cmp_op, llvm_x, llvm_y, result_name)
-    elif isinstance(t, SignedT):
-      cmp_op = llvm_prims.signed_int_comparisons[prim]
-      return builder.icmp(cmp_op, llvm_x, llvm_y, result_name)
-    else:
-      assert isinstance(t, (BoolT, UnsignedT)), "Unexpected type for comparison %s: %s" % (prim, t)
-      cmp_op = llvm_prims.unsigned_int_comparisons[prim]
-      return builder.icmp(cmp_op, llvm_x, llvm_y, result_name)
-
-  
-  def lt(self, t, llvm_x, llvm_y, builder, result_name = None ):
-    return self.cmp(prims.less, t, llvm_x, llvm_y, builder, result_name)
-  
-  def lte(self, t, llvm_x, llvm_y, builder, result_name = None ):
-    return self.cmp(prims.less_equal, t, llvm_x, llvm_y, builder, result_name)
-  
-  def neq(self, t, llvm_x, llvm_y, builder, result_name = None):
-    return self.cmp(prims.not_equal, t, llvm_x, llvm_y, builder, result_name)
-  
-  def sub(self, t, x, y, builder, result_name = "sub"):
-    if isinstance(t, FloatT):
-      return builder.fsub(x, y, result_name)
-    else:
-      return builder.sub(x, y, result_name)
-    
-  
-  def add(self, t, x, y, builder, result_name = "add"):
-    if isinstance(t, FloatT):
-      return builder.fadd(x, y, result_name)
-    else:
-      return builder.add(x, y, result_name)
-  
-  
-  def mul(self, t, x, y, builder, result_name = "mul"):
-    if isinstance(t, FloatT):
-      return builder.fmul(x, y, result_name)
+  def visit_NumCores(self, expr):
+    if self.sequential:
+      return int64(1)
+    return self.num_threads
+
+  def visit_Cast(self, expr):
+    value = self.visit_expr(expr.value)
+    return llvm_convert.convert(value, expr.value.type, expr.type, self.builder)
+
+  def visit_Select(self, expr):
+    cond = llvm_convert.to_bit(self.visit_expr(expr.cond), self.builder)
+    true_value = self.visit_expr(expr.true_value)
+    false_value = self.visit_expr(expr.false_value)
+    return self.builder.select(cond, true_value, false_value)
+
+  def tuple_elts(self, expr):
+    """
+    List of (LLVM value, Parakeet type) for the elements of a tuple
+    expression, a scalar counts as a tuple of one element
+    """
+    if expr.__class__ is Tuple:
+      return [(self.visit_expr(elt), elt.type) for elt in expr.elts]
+    elif isinstance(expr.type, TupleT):
+      tup = self.visit_expr(expr)
+      return [(self.builder.extract_value(tup, i), t)
+              for (i, t) in enumerate(expr.type.elt_types)]
     else:
-      return builder.mul(x, y, result_name)
-  
-    
-  def neg(self, x, builder):
-    if isinstance(x.type, llc.IntegerType):
-      return builder.neg(x, "neg")
+      return [(self.visit_expr(expr), expr.type)]
+
+  def int64_elts(self, expr):
+    return [self.to_int64(v, t) for (v, t) in self.tuple_elts(expr)]
+
+  def visit_Tuple(self, expr):
+    elts = self.visit_expr_list(expr.elts)
+    return make_struct(self.builder, llvm_value_type(expr.type), elts)
+
+  def visit_Closure(self, expr):
+    args = self.visit_expr_list(expr.args)
+    return make_struct(self.builder, llvm_value_type(expr.type), args)
+
+  def visit_TupleProj(self, expr):
+    return self.builder.extract_value(self.visit_expr(expr.tuple), expr.index)
+
+  def visit_ClosureElt(self, expr):
+    return self.builder.extract_value(self.visit_expr(expr.closure), expr.index)
+
+  def visit_Slice(self, expr):
+    values = [self.visit_expr(expr.start), self.visit_expr(expr.stop), self.visit_expr(expr.step)]
+    return make_struct(self.builder, llvm_value_type(expr.type), values)
+
+  def visit_Attribute(self, expr):
+    value = self.visit_expr(expr.value)
+    t = expr.value.type
+    pos = field_pos(t, expr.name)
+    field = self.builder.extract_value(value, pos)
+    if isinstance(t, ArrayT) and expr.name in ('shape', 'strides'):
+      # stored as arrays of int64 but used as tuples
+      elts = [llvm_convert.convert(self.builder.extract_value(field, i), Int64, elt_t, self.builder)
+              for (i, elt_t) in enumerate(expr.type.elt_types)]
+      return make_struct(self.builder, llvm_value_type(expr.type), elts)
+    return field
+
+  def index_ptr(self, expr):
+    """
+    Address of the element an Index expression refers to
+    """
+    base = self.visit_expr(expr.value)
+    indices = self.int64_elts(expr.index)
+    base_t = expr.value.type
+    if isinstance(base_t, PtrT):
+      assert len(indices) == 1, \
+        "Can't index into pointer using %d indices (%s)" % (len(indices), expr.index)
+      raw_ptr = self.builder.extract_value(base, 0)
+      offset = indices[0]
     else:
-      return builder.fsub(zero(x.type), x, "neg") 
-    
-  def prim(self, prim, t, llvm_args, builder, result_name = None):
-    if result_name is None:
-      result_name = prim.name + "_result"
-
-    if isinstance(prim, prims.Cmp):
-      bit = self.cmp(prim, t, llvm_args[0], llvm_args[1], builder)
-      return llvm_convert.to_bool(bit,builder)
-    
-    elif prim == prims.maximum:
-      x, y = llvm_args
-      bit = self.cmp(prims.greater_equal, t, x, y, builder)
-      return builder.select(bit, x, y)
-    
-    elif prim == prims.minimum:
-      x,y = llvm_args
-      bit = self.cmp(prims.less_equal, t, x, y, builder)
-      return builder.select(bit, x, y)
-    
-    elif prim == prims.negative:
-      if t == Bool: 
-        bit = llvm_convert.to_bit(llvm_args[0], builder)
-        negated = builder.not_(bit)
-        return llvm_convert.to_bool(negated, builder)
-      return self.neg(llvm_args[0], builder)
-    
-    # python's remainder is weird in that it preserve's the sign of 
-    # the second argument, whereas LLVM's srem/frem operators preserve
-    # the sign of the first 
-    elif prim == prims.mod:
-      x,y = llvm_args 
-      if isinstance(t, (UnsignedT, BoolT)):
-        return builder.urem(llvm_args[0], llvm_args[1], "modulo")
-      elif isinstance(t, SignedT): 
-        rem = builder.srem(x,y, "modulo")
+      assert isinstance(base_t, ArrayT), "Can't index into %s : %s" % (expr.value, base_t)
+      raw_ptr = self.builder.extract_value(self.builder.extract_value(base, 0), 0)
+      offset = self.builder.extract_value(base, 3)
+      strides = self.builder.extract_value(base, 2)
+      for (i, idx) in enumerate(indices):
+        stride = self.builder.extract_value(strides, i)
+        offset = self.builder.add(offset, self.builder.mul(idx, stride))
+    return self.builder.gep(raw_ptr, [offset], name = "elt_ptr")
+
+  def visit_Index(self, expr):
+    return self.builder.load(self.index_ptr(expr), name = "elt")
+
+  def visit_ArrayView(self, expr):
+    data = self.visit_expr(expr.data)
+    shape = make_array(self.builder, self.int64_elts(expr.shape), int64_t)
+    strides = make_array(self.builder, self.int64_elts(expr.strides), int64_t)
+    offset = self.to_int64(self.visit_expr(expr.offset), expr.offset.type)
+    size = self.to_int64(self.visit_expr(expr.size), expr.size.type)
+    return make_struct(self.builder, llvm_value_type(expr.type),
+                       [data, shape, strides, offset, size])
+
+  def alloc_data(self, elt_t, nelts):
+    nbytes = self.builder.mul(nelts, int64(elt_t.dtype.itemsize))
+    raw = self.malloc(nbytes)
+    ptr = self.builder.bitcast(raw, ir.PointerType(llvm_value_type(elt_t)))
+    return make_struct(self.builder, llvm_types.ptr_struct_type(elt_t),
+                       [ptr, ir.Constant(ptr_int8_t, None)])
+
+  def visit_Alloc(self, expr):
+    nelts = self.to_int64(self.visit_expr(expr.count), expr.count.type)
+    return self.alloc_data(expr.elt_type, nelts)
+
+  def alloc_array(self, array_t, shape_expr):
+    shape_elts = self.int64_elts(shape_expr)
+    nelts = self.product(shape_elts)
+    data = self.alloc_data(array_t.elt_type, nelts)
+    # C-order layout
+    strides_elts = [self.product(shape_elts[(i+1):]) for i in xrange(len(shape_elts))]
+    return make_struct(self.builder, llvm_value_type(array_t),
+                       [data,
+                        make_array(self.builder, shape_elts, int64_t),
+                        make_array(self.builder, strides_elts, int64_t),
+                        int64(0),
+                        nelts])
+
+  def visit_AllocArray(self, expr):
+    return self.alloc_array(expr.type, expr.shape)
+
+  def callee(self, fn_expr):
+    """
+    Typed function of a function or closure expression along with
+    the LLVM values of its closure arguments
+    """
+    fn = get_fn(fn_expr)
+    closure_args = self.visit_expr_list(get_closure_args(fn_expr))
+    return fn, closure_args
+
+  def visit_Call(self, expr):
+    fn, closure_args = self.callee(expr.fn)
+    callee = self.parent.get_function(fn, self.sequential)
+    args = closure_args + self.visit_expr_list(expr.args)
+    if not self.sequential and self.parent.parallel:
+      args = args + [self.num_threads, self.parallel_threshold]
+    result = self.builder.call(callee, args)
+    if isinstance(fn.return_type, NoneT):
+      return const(None, fn.return_type)
+    return result
+
+  def visit_PrimCall(self, expr):
+    args = self.visit_expr_list(expr.args)
+    # arguments usually have uniform types after type specialization,
+    # otherwise upcast them the way a C compiler would
+    arg_types = [arg.type for arg in expr.args]
+    t = combine_type_list(arg_types)
+    args = [self.coerce(arg, arg_t, t) for (arg, arg_t) in zip(args, arg_types)]
+    result = self.prim(expr.prim, t, args, expr.type)
+    if result.type != llvm_value_type(expr.type):
+      result = self.coerce(result, t, expr.type)
+    return result
+
+  def float_call(self, prim, t, args, result_t):
+    """
+    Call the math library's version of a primitive, converting
+    any integer arguments to doubles the way a C compiler would
+    """
+    float_t = t if isinstance(t, FloatT) else Float64
+    args = [llvm_convert.convert(arg, t, float_t, self.builder) for arg in args]
+    fn = llvm_prims.get_float_op(self.module, prim, float_t, len(args))
+    result = self.builder.call(fn, args)
+    return llvm_convert.convert(result, float_t, result_t, self.builder)
+
+  def python_remainder(self, t, x, y):
+    """
+    Python's remainder preserves the sign of the second argument, whereas
+    LLVM's srem preserves the sign of the first
+    """
+    rem = self.builder.srem(x, y, name = "rem")
+    llvm_zero = zero(x.type)
+    y_is_negative = self.builder.icmp_signed("<", y, llvm_zero)
+    rem_is_negative = self.builder.icmp_signed("<", rem, llvm_zero)
+    y_nonzero = self.builder.icmp_signed("!=", y, llvm_zero)
+    rem_nonzero = self.builder.icmp_signed("!=", rem, llvm_zero)
+    neither_zero = self.builder.and_(y_nonzero, rem_nonzero)
+    diff_signs = self.builder.xor(y_is_negative, rem_is_negative)
+    should_flip = self.builder.and_(neither_zero, diff_signs)
+    flipped_rem = self.builder.add(y, rem, name = "flipped_rem")
+    return self.builder.select(should_flip, flipped_rem, rem)
+
+  def prim(self, p, t, args, result_t):
+    b = self.builder
+    if isinstance(p, prims.Cmp):
+      x, y = args
+      return llvm_convert.to_bool(self.cmp(p, t, x, y), b)
+
+    elif p == prims.maximum:
+      x, y = args
+      return b.select(self.cmp(prims.greater, t, x, y), x, y)
+
+    elif p == prims.minimum:
+      x, y = args
+      return b.select(self.cmp(prims.less, t, x, y), x, y)
+
+    elif p == prims.negative:
+      x = args[0]
+      if isinstance(t, BoolT):
+        return b.sub(one(x.type), x)
+      elif isinstance(t, FloatT):
+        return b.fsub(ir.Constant(x.type, -0.0), x)
       else:
-        assert isinstance(t, FloatT)
-        rem = builder.frem(llvm_args[0], llvm_args[1], "modulo")
-
-      y_is_negative = self.lt(t, y, zero(y.type), builder, "second_arg_negative")
-      rem_is_negative = self.lt(t, rem, zero(rem.type), builder, "rem_is_negative")
-      y_nonzero = self.neq(t, y, zero(y.type), builder, "second_arg_nonzero")
-      rem_nonzero = self.neq(t, rem, zero(x.type), builder, "rem_nonzero")
-      neither_zero = builder.and_(y_nonzero, rem_nonzero, "neither_zero")
-      diff_signs = builder.xor(y_is_negative, rem_is_negative, "different_signs")
-      should_flip = builder.and_(neither_zero, diff_signs, "should_flip") 
-      flipped_rem = self.add(t, y, rem, builder, "flipped_rem")
-      return builder.select(should_flip, flipped_rem, rem)
-
-    elif prim == prims.power:
-      x,y = llvm_args
-       
+        return b.neg(x)
+
+    elif p == prims.abs:
+      x = args[0]
       if isinstance(t, FloatT):
-        new_t = t 
+        negated = b.fsub(ir.Constant(x.type, -0.0), x)
       else:
-        new_t = Float64
-      x = llvm_convert.convert(x, t, new_t, builder)
-      y = llvm_convert.convert(y, t, new_t, builder)
-      llvm_op = llvm_prims.get_float_op(prim, new_t)
-      result = builder.call(llvm_op, [x,y])
-      return llvm_convert.convert(result, new_t, t, builder)
-        
-    elif isinstance(prim, prims.Arith) or isinstance(prim, prims.Bitwise):
+        negated = b.neg(x)
+      return b.select(self.cmp(prims.greater_equal, t, x, zero(x.type)), x, negated)
+
+    elif p == prims.logical_and:
+      x, y = args
+      return llvm_convert.to_bool(b.and_(llvm_convert.to_bit(x, b), llvm_convert.to_bit(y, b)), b)
+
+    elif p == prims.logical_or:
+      x, y = args
+      return llvm_convert.to_bool(b.or_(llvm_convert.to_bit(x, b), llvm_convert.to_bit(y, b)), b)
+
+    elif p == prims.logical_not:
+      return llvm_convert.to_bool(b.not_(llvm_convert.to_bit(args[0], b)), b)
+
+    elif p == prims.bitwise_not:
+      return b.not_(args[0])
+
+    elif p == prims.remainder and isinstance(t, SignedT):
+      return self.python_remainder(t, args[0], args[1])
+
+    elif p == prims.remainder and isinstance(t, FloatT):
+      # same as C's fmod
+      return b.frem(args[0], args[1])
+
+    elif p == prims.power:
+      return self.float_call(p, t, args, result_t)
+
+    elif isinstance(p, (prims.Arith, prims.Bitwise)):
       if isinstance(t, FloatT):
-        instr = llvm_prims.float_binops[prim]
+        instr = llvm_prims.float_binops[p]
       elif isinstance(t, SignedT):
-        instr = llvm_prims.signed_binops[prim]
-      elif isinstance(t, UnsignedT):
-        instr = llvm_prims.unsigned_binops[prim]
+        instr = llvm_prims.signed_binops[p]
       else:
-        assert isinstance(t, BoolT)
-        instr = llvm_prims.bool_binops[prim]
-      op = getattr(builder, instr)
-      return op(name = result_name, *llvm_args)
-
-    elif isinstance(prim, prims.Logical):
-      if prim == prims.logical_and:
-        result = builder.and_(name = result_name, 
-                            lhs = to_bit(llvm_args[0], builder), 
-                            rhs = to_bit(llvm_args[1], builder))
-        return from_bit(result, t, builder)
-      elif prim == prims.logical_not:
-        result = builder.not_(to_bit(llvm_args[0], builder), name = result_name)
-        return from_bit(result, t, builder)
-      else:
-        assert prim == prims.logical_or
-        result = builder.or_(lhs = to_bit(llvm_args[0], builder), 
-                           rhs = to_bit(llvm_args[1], builder), name = result_name)
-        return from_bit(result, t, builder)
-      
-    elif prim == prims.abs:
-      x = llvm_args[0]
-      bit = self.cmp(prims.greater_equal, t,  x, zero(x.type), builder, "gt_zero")
-      neg_value = self.neg(x, builder)
-      return builder.select(bit, x, neg_value)
-    elif isinstance(prim, prims.Float): 
-      llvm_op = llvm_prims.get_float_op(prim, t)
-      return builder.call(llvm_op, llvm_args)
-    
-    else:
-      assert False, "UNSUPPORTED PRIMITIVE: %s" % prim
-
-  def compile_PrimCall(self, expr, builder):
-    args = expr.args
-    # type specialization should have made types of arguments uniform,
-    # so we only need to check the type of the first arg
-    t = args[0].type
-    llvm_args = [self.compile_expr(arg, builder) for arg in args]
-    return self.prim(expr.prim, t, llvm_args, builder)
-
-  def compile_expr(self, expr, builder):
-    method_name = "compile_" + expr.node_type()
-    return getattr(self, method_name)(expr, builder)
-
-  def compile_Assign(self, stmt, builder):
-    rhs_t = stmt.rhs.type
-    # special case for locally allocated structs
-    if self.may_escape is not None and \
-       stmt.lhs.__class__ is Var and \
-       stmt.rhs.__class__ is Struct and \
-       stmt.lhs.name  not in self.may_escape:
-      value = self.compile_Struct(stmt.rhs, builder, local = True)
+        instr = llvm_prims.unsigned_binops[p]
+      return getattr(b, instr)(args[0], args[1])
+
+    elif isinstance(p, (prims.Float, prims.Round)):
+      return self.float_call(p, t, args, result_t)
+
     else:
-      value = self.compile_expr(stmt.rhs, builder)
-    if stmt.lhs.__class__ is Var:
-      name = stmt.lhs.name
-      lhs_t = stmt.lhs.type
-      self.initialized.add(name)
-      ref = self.vars[name]
-    elif stmt.lhs.__class__ is Index:
-      ptr_t = stmt.lhs.value.type
-      assert isinstance(ptr_t, PtrT), \
-          "Expected pointer, got %s" % ptr_t
-      lhs_t = ptr_t.elt_type
-      base_ptr = self.compile_expr(stmt.lhs.value, builder)
-      index = self.compile_expr(stmt.lhs.index, builder)
-      index = llvm_convert.from_signed(index, Int32, builder)
-      ref = builder.gep(base_ptr, [index], "elt_ptr")
+      assert False, "Prim not yet implemented: %s" % p
+
+  #############################################
+  #
+  #  Adverbs left in the IR of parallel code
+  #
+  #############################################
+
+  def visit_IndexReduce(self, expr):
+    """
+    Reductions run sequentially, only ParFor loops get spread across threads
+    """
+    assert expr.init is not None, "Accumulator required but not given"
+    bounds = self.int64_elts(expr.shape)
+    fn, fn_closure_args = self.callee(expr.fn)
+    combine, combine_closure_args = self.callee(expr.combine)
+    combine_fn = self.parent.get_function(combine, sequential = True)
+    acc = self.alloca(llvm_value_type(expr.type), "acc")
+    self.builder.store(self.coerce(self.visit_expr(expr.init), expr.init.type, expr.type), acc)
+    def body(indices):
+      elt = self.call_with_indices(fn, fn_closure_args, indices)
+      combined = self.builder.call(combine_fn,
+                                   combine_closure_args + [self.builder.load(acc), elt])
+      self.builder.store(combined, acc)
+    self.build_loops(bounds, body)
+    return self.builder.load(acc)
+
+  def visit_IndexScan(self, expr):
+    assert isinstance(expr.type, ArrayT), "Expected output of Scan to be an array"
+    assert expr.init is not None, "Accumulator required but not given"
+    bounds = self.int64_elts(expr.shape)
+    fn, fn_closure_args = self.callee(expr.fn)
+    combine, combine_closure_args = self.callee(expr.combine)
+    emit, emit_closure_args = self.callee(expr.emit)
+    combine_fn = self.parent.get_function(combine, sequential = True)
+    emit_fn = self.parent.get_function(emit, sequential = True)
+    result = self.alloc_array(expr.type, expr.shape)
+    raw_ptr = self.builder.extract_value(self.builder.extract_value(result, 0), 0)
+    strides = self.builder.extract_value(result, 2)
+    acc = self.alloca(llvm_value_type(expr.init.type), "acc")
+    self.builder.store(self.visit_expr(expr.init), acc)
+    def body(indices):
+      elt = self.call_with_indices(fn, fn_closure_args, indices)
+      combined = self.builder.call(combine_fn,
+                                   combine_closure_args + [self.builder.load(acc), elt])
+      self.builder.store(combined, acc)
+      offset = int64(0)
+      for (i, idx) in enumerate(indices):
+        stride = self.builder.extract_value(strides, i)
+        offset = self.builder.add(offset, self.builder.mul(idx, stride))
+      emitted = self.builder.call(emit_fn, emit_closure_args + [combined])
+      self.builder.store(emitted, self.builder.gep(raw_ptr, [offset]))
+    self.build_loops(bounds, body)
+    return result
+
+  #############################################
+  #
+  #  Statements
+  #
+  #############################################
+
+  def visit_block(self, stmts):
+    for stmt in stmts:
+      if self.builder.block.is_terminated:
+        # anything after a return is dead
+        return
+      method_name = "visit_" + stmt.__class__.__name__
+      assert hasattr(self, method_name), \
+        "Statement %s not supported by %s" % (stmt.__class__.__name__, self.__class__.__name__)
+      getattr(self, method_name)(stmt)
+
+  def visit_Assign(self, stmt):
+    lhs = stmt.lhs
+    value = self.coerce(self.visit_expr(stmt.rhs), stmt.rhs.type, lhs.type)
+    if lhs.__class__ is Var:
+      self.builder.store(value, self.var_ref(lhs.name))
+    elif lhs.__class__ is Tuple:
+      for (i, elt) in enumerate(lhs.elts):
+        assert elt.__class__ is Var, "Expected LHS variable, got %s" % elt
+        self.builder.store(self.builder.extract_value(value, i), self.var_ref(elt.name))
+    elif lhs.__class__ is Index:
+      self.builder.store(value, self.index_ptr(lhs))
     else:
-      assert stmt.lhs.__class__ is Attribute, \
-          "Unexpected LHS: %s" % stmt.lhs
-      struct = stmt.lhs.value
-      ref, lhs_t = self.attribute_lookup(struct, stmt.lhs.name, builder)
-
-    assert lhs_t == rhs_t, \
-        "Type mismatch between LHS %s and RHS %s" % (lhs_t, rhs_t)
-
-    builder.store(value, ref)
-    return builder, False
-
-  def compile_ExprStmt(self, stmt, builder):
-    self.compile_expr(stmt.value, builder)
-    return builder, False
-
-  def compile_Return(self, stmt, builder):
-    ret_val = self.compile_expr(stmt.value, builder)
-    builder.ret(ret_val)
-    return builder, True
-
-  def compile_merge_left(self, phi_nodes, builder):
-    for name, (left, _) in phi_nodes.iteritems():
-      ref = self.vars[name]
-      self.initialized.add(name)
-      value = self.compile_expr(left, builder)
-      builder.store(value, ref)
-
-  def compile_merge_right(self, phi_nodes, builder):
-    for name, (_, right) in phi_nodes.iteritems():
-      ref = self.vars[name]
-      self.initialized.add(name)
-      value = self.compile_expr(right, builder)
-      builder.store(value, ref)
-
-  def compile_ForLoop(self, stmt, builder):
-    # first compile the starting, boundary, and
-    # increment values for the loop counter
-    start = self.compile_expr(stmt.start, builder)
-    stop = self.compile_expr(stmt.stop, builder)
-    step = self.compile_expr(stmt.step, builder)
-
-    # get the memory slot associated with the loop counter
-    loop_var = self.vars[stmt.var.name]
-
-    builder.store(start, loop_var)
-    self.initialized.add(stmt.var.name)
-
-    # ...and we'll need its Parakeet type later on
-    # for calls to 'cmp' and 'prim'
-    loop_var_t = stmt.var.type
-
-    # any phi-bound variables should be initialized to their
-    # starting values
-    self.compile_merge_left(stmt.merge, builder)
-
-    loop_bb, body_start_builder = self.new_block("loop_body")
-    after_bb, after_builder = self.new_block("after_loop")
-
-    # WARNING: Assuming loop is always increasing,
-    # only enter the loop if we're less than the stopping value
-    enter_cond = self.cmp(prims.less, loop_var_t,  start, stop,
-                          builder, "enter_cond")
-    builder.cbranch(enter_cond, loop_bb, after_bb)
-
-    # TODO: what should we do if the body always ends in a return statement?
-    body_end_builder, body_always_returns = \
-      self.compile_block(stmt.body, body_start_builder)
-
-    counter_at_end = body_end_builder.load(loop_var)
-    # increment the loop counter
-    incr = self.prim(prims.add, loop_var_t,
-                     [counter_at_end, step],
-                     body_end_builder,  "incr_loop_var")
-    body_end_builder.store(incr, loop_var)
-    self.compile_merge_right(stmt.merge, body_end_builder)
-
-    exit_cond = self.cmp(prims.less, loop_var_t, incr, stop,
-                         body_end_builder, "exit_cond")
-    body_end_builder.cbranch(exit_cond, loop_bb, after_bb)
-    # WARNING: what if the loop doesn't run? Should
-    # we still be returning 'body_always_returns'?
-    return after_builder, body_always_returns
-
-  def compile_While(self, stmt, builder):
-    # current flow ----> loop --------> exit--> after
-    #    |                       skip------------|
-    #    |----------------------/
-
-    self.compile_merge_left(stmt.merge, builder)
-    loop_bb, body_start_builder = self.new_block("loop_body")
-
-    after_bb, after_builder = self.new_block("after_loop")
-    enter_cond = self.compile_expr(stmt.cond, builder)
-    enter_cond = llvm_convert.to_bit(enter_cond, builder)
-    builder.cbranch(enter_cond, loop_bb, after_bb)
-
-    body_end_builder, body_always_returns = \
-        self.compile_block(stmt.body, body_start_builder)
-    if not body_always_returns:
-      exit_bb, exit_builder = self.new_block("loop_exit")
-      self.compile_merge_right(stmt.merge, body_end_builder)
-      repeat_cond = self.compile_expr(stmt.cond, body_end_builder)
-      repeat_cond = llvm_convert.to_bit(repeat_cond, body_end_builder)
-      body_end_builder.cbranch(repeat_cond, loop_bb, exit_bb)
-      exit_builder.branch(after_bb)
-
-    return after_builder, False
-
-  def compile_If(self, stmt, builder):
-    cond = self.compile_expr(stmt.cond, builder)
-    cond = llvm_convert.to_bit(cond, builder)
-
-    if len(stmt.true) == 0 and len(stmt.false) == 0:
-      # if nothing happens in the loop bodies, just
-      # emit select instructions
-      for (name, (true_expr, false_expr)) in stmt.merge.iteritems():
-        ref = self.vars[name]
-        self.initialized.add(name)
-        true_val = self.compile_expr(true_expr, builder)
-        false_val = self.compile_expr(false_expr, builder)
-        select_val = builder.select(cond, true_val, false_val)
-        builder.store(select_val, ref)
-      return builder, False
+      assert lhs.__class__ is Attribute and lhs.value.__class__ is Var, \
+        "Unexpected LHS: %s" % lhs
+      ref = self.var_ref(lhs.value.name)
+      pos = field_pos(lhs.value.type, lhs.name)
+      self.builder.store(self.builder.insert_value(self.builder.load(ref), value, pos), ref)
+
+  def visit_ExprStmt(self, stmt):
+    self.visit_expr(stmt.value)
+
+  def visit_Comment(self, stmt):
+    pass
+
+  def visit_Return(self, stmt):
+    if self.return_void:
+      self.builder.ret_void()
     else:
-      # compile the two possible branches as distinct basic blocks
-      # and then wire together the control flow with branches
-      true_bb, true_builder = self.new_block("if_true")
-      after_true, true_always_returns = \
-        self.compile_block(stmt.true, true_builder)
-
-      false_bb, false_builder = self.new_block("if_false")
-      after_false, false_always_returns = \
-          self.compile_block(stmt.false, false_builder)
-
-      builder.cbranch(cond, true_bb, false_bb)
-
-      # compile phi nodes as assignments and then branch
-      # to the continuation block
-      self.compile_merge_left(stmt.merge, after_true)
-      self.compile_merge_right(stmt.merge, after_false)
-
-      # if both branches return then there is no point
-      # making a new block for more code
-      # did both branches end in a return?
-      both_always_return = true_always_returns and false_always_returns
-      if both_always_return:
-        return None, True
-      after_bb, after_builder = self.new_block("if_after")
-      if not true_always_returns:
-        after_true.branch(after_bb)
-      if not false_always_returns:
-        after_false.branch(after_bb)
-      return after_builder, False
-
-  def compile_Comment(self, stmt, builder):
-    return builder, False
-
-  def compile_stmt(self, stmt, builder):
+      value = self.visit_expr(stmt.value)
+      self.builder.ret(self.coerce(value, stmt.value.type, self.fn.return_type))
+
+  def sorted_merge(self, merge):
+    return sorted(merge.iteritems(), key = lambda (name, _): names.sort_key(name))
+
+  def visit_merge(self, merge, side):
     """
-    Translate an SSA statement into LLVM. Every translation function returns a
-    builder pointing to the end of the current basic block and a boolean
-    indicating whether every branch of control flow in that statement ends in a
-    return. The latter is needed to avoid creating empty basic blocks, which
-    were causing some mysterious crashes inside LLVM.
+    Assign the left or right values of phi nodes to their variables,
+    all values get computed before any of them is assigned
     """
-    method_name = "compile_" + stmt.node_type()
-    return getattr(self, method_name)(stmt, builder)
+    values = [(name, self.visit_expr(exprs[side])) for (name, exprs) in self.sorted_merge(merge)]
+    for (name, value) in values:
+      self.builder.store(value, self.var_ref(name))
+
+  def visit_If(self, stmt):
+    cond = llvm_convert.to_bit(self.visit_expr(stmt.cond), self.builder)
+    true_block = self.new_block("if_true")
+    false_block = self.new_block("if_false")
+    after = self.new_block("if_after")
+    self.builder.cbranch(cond, true_block, false_block)
+    for (block, body, side) in [(true_block, stmt.true, 0), (false_block, stmt.false, 1)]:
+      self.builder.position_at_end(block)
+      self.visit_block(body)
+      if not self.builder.block.is_terminated:
+        self.visit_merge(stmt.merge, side)
+        self.builder.branch(after)
+    self.builder.position_at_end(after)
+
+  def visit_While(self, stmt):
+    self.visit_merge(stmt.merge, 0)
+    header = self.new_block("while_header")
+    body = self.new_block("while_body")
+    after = self.new_block("after_while")
+    self.builder.branch(header)
+    self.builder.position_at_end(header)
+    cond = llvm_convert.to_bit(self.visit_expr(stmt.cond), self.builder)
+    self.builder.cbranch(cond, body, after)
+    self.builder.position_at_end(body)
+    self.visit_block(stmt.body)
+    if not self.builder.block.is_terminated:
+      self.visit_merge(stmt.merge, 1)
+      self.builder.branch(header)
+    self.builder.position_at_end(after)
+
+  def visit_ForLoop(self, stmt):
+    t = stmt.var.type
+    start = self.coerce(self.visit_expr(stmt.start), stmt.start.type, t)
+    stop = self.coerce(self.visit_expr(stmt.stop), stmt.stop.type, t)
+    step = self.coerce(self.visit_expr(stmt.step), stmt.step.type, t)
+    ref = self.var_ref(stmt.var.name)
+    self.builder.store(start, ref)
+    self.visit_merge(stmt.merge, 0)
+    header = self.new_block("for_header")
+    body = self.new_block("for_body")
+    after = self.new_block("after_for")
+    self.builder.branch(header)
+    self.builder.position_at_end(header)
+    i = self.builder.load(ref)
+    if stmt.step.__class__ is Const:
+      if stmt.step.value >= 0:
+        cond = self.cmp(prims.less, t, i, stop)
+      else:
+        cond = self.cmp(prims.greater, t, i, stop)
+    else:
+      step_positive = self.cmp(prims.greater_equal, t, step, zero(step.type))
+      cond = self.builder.select(step_positive,
+                                 self.cmp(prims.less, t, i, stop),
+                                 self.cmp(prims.greater, t, i, stop))
+    self.builder.cbranch(cond, body, after)
+    self.builder.position_at_end(body)
+    self.visit_block(stmt.body)
+    if not self.builder.block.is_terminated:
+      self.visit_merge(stmt.merge, 1)
+      i = self.builder.load(ref)
+      if is_float(i.type):
+        next_i = self.builder.fadd(i, step)
+      else:
+        next_i = self.builder.add(i, step)
+      self.builder.store(next_i, ref)
+      self.builder.branch(header)
+    self.builder.position_at_end(after)
+
+  def visit_ParFor(self, stmt):
+    bounds = self.int64_elts(stmt.bounds)
+    fn, closure_args = self.callee(stmt.fn)
+    if self.sequential:
+      self.build_loops(bounds, lambda indices: self.call_with_indices(fn, closure_args, indices))
+    else:
+      self.parallel_loop(fn, closure_args, bounds)
 
-  def compile_block(self, stmts, builder):
-    for stmt in stmts:
-      builder, always_returns = self.compile_stmt(stmt, builder)
-      if always_returns:
-        return builder, always_returns
-    return builder, False
-
-  def compile_body(self, body):
-    return self.compile_block(body, builder = self.entry_builder)
-  
-  
-import os
-from collections import namedtuple   
-CompiledFn = namedtuple('CompiledFn', ('llvm_fn', 'llvm_exec_engine', 'parakeet_fn')) 
-
-compiled_functions = {}
-def compile_fn(fundef):
-  key = fundef.cache_key 
-  if key in compiled_functions:
-    return compiled_functions[key]
-  
-  if config.print_lowered_function:
-    print
-    print "=== Lowered function ==="
-    print
-    print repr(fundef)
-    print
-
-  compiler = Compiler(fundef)
-  compiler.compile_body(fundef.body)
-  if llvm_config.print_unoptimized_llvm:
-    print "=== LLVM before optimizations =="
-    print
-    print compiler.llvm_context.module
-    print
-  compiler.llvm_context.run_passes(compiler.llvm_fn)
-
-  if config.print_generated_code:
-    print "=== LLVM after optimizations =="
-    print
-    print compiler.llvm_context.module
-    print
-
-  if llvm_config.print_x86:
-    print "=== Generated assembly =="
-    print
-    start_printing = False
-    w,r = os.popen2("llc")
-    w.write(str(compiler.llvm_context.module))
-    w.close()
-    assembly_str = r.read()
-    r.close()
-    for l in assembly_str.split('\n'):
-      if l.strip().startswith('.globl'):
-        if start_printing:
-          break
-        elif fundef.name in l:
-          start_printing = True
-      if start_printing:
-        print l
-
-  result = CompiledFn(compiler.llvm_fn,
-                      compiler.llvm_context.exec_engine, 
-                      fundef)
-  compiled_functions[key] = result
-  return result
+  def parallel_loop(self, fn, closure_args, bounds):
+    """
+    Run the outermost dimension of the loop on the thread pool, unless only
+    one thread was asked for or the loop's estimated work (its trip count
+    times the cost of its body) is below the threshold
+    """
+    worker = WorkerCompiler(self.parent, fn, [arg.type for arg in closure_args], len(bounds))
+    env = self.alloca(worker.env_t, "parfor_env")
+    self.builder.store(make_struct(self.builder, worker.env_t, closure_args + bounds[1:]), env)
+    env_arg = self.builder.bitcast(env, ptr_int8_t)
+    n = bounds[0]
+    work = self.builder.mul(self.product(bounds), int64(max(1, estimate_cost(fn))))
+    b = self.builder
+    worth_it = b.and_(b.and_(b.icmp_signed(">", self.num_threads, int64(1)),
+                             b.icmp_signed(">", n, int64(1))),
+                      b.icmp_signed(">=", work, self.parallel_threshold))
+    parallel = self.new_block("parallel_loop")
+    sequential = self.new_block("sequential_loop")
+    after = self.new_block("after_parallel_loop")
+    b.cbranch(worth_it, parallel, sequential)
+    b.position_at_end(parallel)
+    parallel_for = self.declare("parakeet_parallel_for", void_t,
+                                [ir.PointerType(worker_fn_t), ptr_int8_t,
+                                 int64_t, int64_t, int64_t])
+    b.call(parallel_for, [worker.llvm_fn, env_arg, n, self.num_threads,
+                          int64(llvm_config.chunks_per_thread)])
+    b.branch(after)
+    b.position_at_end(sequential)
+    b.call(worker.llvm_fn, [env_arg, int64(0), n])
+    b.branch(after)
+    b.position_at_end(after)
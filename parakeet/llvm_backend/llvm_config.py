@@ -1,17 +1,31 @@
 
-
 ######################################
 #        OPTIMIZER OPTIONS           #
 ######################################
 
-# run LLVM optimization passes
-llvm_optimize = True
+# optimization level of LLVM's standard pass pipeline (0-3)
+opt_level = 3
 
-# number of times to run optimizations
-llvm_num_passes = 4
+# generate code for the host's CPU (and its vector extensions)
+# rather than a generic target
+native_cpu = True
 
 # run verifier over generated LLVM code?
-llvm_verify = True
+llvm_verify = False
+
+
+######################################
+#         PARALLEL LOOPS             #
+######################################
+
+# compile the adverb-level IR and run its outermost ParFor loops
+# on a pool of native threads, otherwise compile the fully
+# sequential loops produced by lower_to_loops
+parallel = True
+
+# split the iterations of a parallel loop into this many chunks
+# per thread, threads grab the next chunk when they finish one
+chunks_per_thread = 4
 
 
 ######################################
@@ -21,9 +35,5 @@ llvm_verify = True
 # print generated assembly of compiled functions
 print_x86 = False
 
-# show LLVM bytecode before optimization passes
+# show LLVM IR before optimization passes
 print_unoptimized_llvm = False
-
-# show LLVM bytecode after optimizations
-# print_optimized_llvm = False 
-
@@ -1,110 +1,130 @@
+import ctypes
 
-import llvm.core as core
-import llvm.ee as ee
-import llvm.passes as passes
+import numpy as np
+import llvmlite.binding as llvm
 
-import llvm_config 
+from .. import config
+import llvm_config
+import thread_pool
 
-class LLVM_Context:
-  """Combine a module, exec engine, and pass manager into a single object"""
+llvm.initialize()
+llvm.initialize_native_target()
+llvm.initialize_native_asmprinter()
 
-  _verify_passes = [
-    'preverify',
-    'domtree',
-    'verify'
-  ]
+# positions of the NumPy C-API functions we call in its table of function
+# pointers, NumPy only ever appends to this table so they don't change
+# between versions (see __multiarray_api.h)
+numpy_api_slots = {
+  'PyArray_Type' : 2,
+  'PyArray_New' : 93,
+  'PyArray_Scalar' : 60,
+  'PyArray_SetBaseObject' : 282,
+}
 
-  _opt_passes = [
-    'mem2reg',
-    'targetlibinfo',
-    'no-aa',
-    'basicaa',
-    'memdep',
-    'tbaa',
-    'instcombine',
-    'simplifycfg',
-    'basiccg',
-    'memdep',
-    'scalarrepl-ssa',
-    'sroa',
-    'domtree',
-    'early-cse',
-    'simplify-libcalls',
-    'lazy-value-info',
-    'correlated-propagation',
-    'simplifycfg',
-    'instcombine',
-    'reassociate',
-    'domtree',
-    'mem2reg',
-    'scev-aa',
-    'loops',
-    'loop-simplify',
-    'lcssa',
-    'loop-rotate',
-    'licm',
-    'lcssa',
-    'loop-unswitch',
-    'instcombine',
-    'scalar-evolution',
-    'loop-simplify',
-    'lcssa',
-    'indvars',
-    'loop-idiom',
-    'loop-deletion',
-    #'loop-vectorize',
-     'loop-unroll',
-    #'bb-vectorize',
-    'memdep',
-    'gvn',
-    'memdep',
-    'sccp',
-    'dse',
-    'adce',
-    'correlated-propagation',
-    'jump-threading',
-    'simplifycfg',
-    'instcombine',
-    'licm',
-  ]
+def numpy_api_table():
+  api = np.core.multiarray._ARRAY_API
+  if type(api).__name__ == 'PyCapsule':
+    get_pointer = ctypes.pythonapi.PyCapsule_GetPointer
+    get_pointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+    get_pointer.restype = ctypes.c_void_p
+    return get_pointer(api, None)
+  else:
+    get_pointer = ctypes.pythonapi.PyCObject_AsVoidPtr
+    get_pointer.argtypes = [ctypes.py_object]
+    get_pointer.restype = ctypes.c_void_p
+    return get_pointer(api)
 
-  def __init__(self, module_name, 
-               optimize = llvm_config.llvm_optimize,
-               verify = llvm_config.llvm_verify):
-    self.module = core.Module.new(module_name)
-    self.engine_builder = ee.EngineBuilder.new(self.module)
-    self.engine_builder.force_jit()
-    opt_level = 3 if optimize else 0
-    if optimize:
-      self.engine_builder.opt(opt_level)
+def register_numpy_api():
+  """
+  The NumPy C-API is only reachable through its table of function pointers,
+  so give its entries names which JIT compiled code can link against
+  (the Python C-API and libc are found among the symbols of this process)
+  """
+  table = numpy_api_table()
+  pointer_size = ctypes.sizeof(ctypes.c_void_p)
+  for (name, slot) in numpy_api_slots.iteritems():
+    address = ctypes.c_void_p.from_address(table + slot * pointer_size).value
+    llvm.add_symbol(name, address)
+
+class LLVM_Context(object):
+  """
+  A single in-process JIT engine, every compiled module gets added to it and
+  lives as long as the process. The first module is the runtime of the
+  native thread pool which parallel loops call into.
+  """
+  def __init__(self):
+    target = llvm.Target.from_default_triple()
+    if llvm_config.native_cpu:
+      self.target_machine = target.create_target_machine(
+        cpu = llvm.get_host_cpu_name(),
+        features = llvm.get_host_cpu_features().flatten(),
+        opt = llvm_config.opt_level)
     else:
-      self.engine_builder.opt(opt_level)
-    self.exec_engine = self.engine_builder.create()
-    tm = ee.TargetMachine.new(opt = opt_level, cm=ee.CM_JITDEFAULT)
-    self.tm = tm 
-    _, fpm = passes.build_pass_managers(tm, 
-                                     opt = opt_level,
-                                     loop_vectorize = (opt_level > 0), 
-                                     mod = self.module, 
-                                     vectorize = (opt_level > 0), 
-                                     )
-    self.pass_manager = fpm 
-    # self.fpm = fpm 
-    for p in self._verify_passes:
-      self.pass_manager.add(p)
-    if optimize:
-      for p in (self._opt_passes + self._verify_passes):
-        self.pass_manager.add(p)
+      self.target_machine = target.create_target_machine(opt = llvm_config.opt_level)
+    register_numpy_api()
+    runtime = llvm.parse_assembly(thread_pool.runtime_source)
+    self.exec_engine = llvm.create_mcjit_compiler(runtime, self.target_machine)
+    self.exec_engine.finalize_object()
+    pool_init = ctypes.CFUNCTYPE(None)(self.exec_engine.get_function_address("parakeet_pool_init"))
+    pool_init()
+    self.pool_size = ctypes.CFUNCTYPE(ctypes.c_int64)(
+      self.exec_engine.get_function_address("parakeet_pool_size"))
+
+  @property
+  def triple(self):
+    return self.target_machine.triple
+
+  @property
+  def data_layout(self):
+    return str(self.target_machine.target_data)
+
+  def optimize(self, module):
+    pmb = llvm.create_pass_manager_builder()
+    pmb.opt_level = llvm_config.opt_level
+    pmb.loop_vectorize = llvm_config.opt_level > 1
+    pmb.slp_vectorize = llvm_config.opt_level > 1
+    if llvm_config.opt_level > 1:
+      pmb.inlining_threshold = 275
+    pm = llvm.create_module_pass_manager()
+    self.target_machine.add_analysis_passes(pm)
+    pmb.populate(pm)
+    pm.run(module)
+
+  def add_module(self, ir_module):
+    """
+    Optimize, compile and link the module, returns its compiled version
+    """
+    if llvm_config.print_unoptimized_llvm:
+      print "=== LLVM before optimizations =="
+      print
+      print ir_module
+      print
+    module = llvm.parse_assembly(str(ir_module))
+    if llvm_config.llvm_verify:
+      module.verify()
+    if llvm_config.opt_level > 0:
+      self.optimize(module)
+    if config.print_generated_code:
+      print "=== LLVM after optimizations =="
+      print
+      print module
+      print
+    if llvm_config.print_x86:
+      print "=== Generated assembly =="
+      print
+      print self.target_machine.emit_assembly(module)
+    self.exec_engine.add_module(module)
+    self.exec_engine.finalize_object()
+    return module
+
+  def function_address(self, name):
+    return self.exec_engine.get_function_address(name)
 
-  def run_passes(self, llvm_fn, n_iters = llvm_config.llvm_num_passes):
-    for _ in xrange(n_iters):
-      self.pass_manager.run(llvm_fn)
-    #passmanagers = passes.build_pass_managers(
-    #        tm= self.tm , opt=3, inline_threshold=1000,
-    #        loop_vectorize=True, vectorize=True, fpm=False)
-    #for optname in self._opt_passes:
-    #  passmanagers.pm.add(optname)
-    #passmanagers.pm.add('loop-vectorize')
-    #passmanagers.pm.run(self.module)
-      
-global_context = LLVM_Context("module")
+_contexts = []
+def global_context():
+  """
+  The JIT engine gets created the first time something is compiled
+  """
+  if not _contexts:
+    _contexts.append(LLVM_Context())
+  return _contexts[0]
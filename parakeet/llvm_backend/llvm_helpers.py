@@ -1,15 +1,17 @@
-import llvm.core as llcore
- 
-from .. ndtypes  import ScalarT, FloatT, Int32, Int64
-from llvm_types import llvm_value_type
- 
+import llvmlite.ir as ir
+
+from .. ndtypes import ScalarT, FloatT, NoneT, Int32, Int64
+from llvm_types import llvm_value_type, is_float
+
 def const(python_scalar, parakeet_type):
-  assert isinstance(parakeet_type, ScalarT)
+  assert isinstance(parakeet_type, (ScalarT, NoneT))
   llvm_type = llvm_value_type(parakeet_type)
-  if isinstance(parakeet_type, FloatT):
-    return llcore.Constant.real(llvm_type, float(python_scalar))
+  if isinstance(parakeet_type, NoneT):
+    return ir.Constant(llvm_type, 0)
+  elif isinstance(parakeet_type, FloatT):
+    return ir.Constant(llvm_type, float(python_scalar))
   else:
-    return llcore.Constant.int(llvm_type, int(python_scalar))
+    return ir.Constant(llvm_type, int(python_scalar))
 
 def int32(x):
   """Make LLVM constants of type int32"""
@@ -20,22 +22,38 @@ def int64(x):
 
 def zero(llvm_t):
   """
-  Make a zero constant of either int or real type. 
-  Doesn't (yet) work for vector constants! 
+  Make a zero constant of either int or real type.
+  Doesn't (yet) work for vector constants!
   """
-  if isinstance(llvm_t, llcore.IntegerType):
-    return llcore.Constant.int(llvm_t, 0)
+  if is_float(llvm_t):
+    return ir.Constant(llvm_t, 0.0)
   else:
-    return llcore.Constant.real(llvm_t, 0.0)
-  
+    return ir.Constant(llvm_t, 0)
+
 def one(llvm_t):
   """
-  Make a constant 1 of either int or real type. 
+  Make a constant 1 of either int or real type.
   Doesn't (yet) work for vector constants!
   """
-  if isinstance(llvm_t, llcore.IntegerType):
-    return llcore.Constant.int(llvm_t, 1)
+  if is_float(llvm_t):
+    return ir.Constant(llvm_t, 1.0)
   else:
-    return llcore.Constant.real(llvm_t, 1.0)
-  
-  
\ No newline at end of file
+    return ir.Constant(llvm_t, 1)
+
+def undef(llvm_t):
+  return ir.Constant(llvm_t, ir.Undefined)
+
+def make_struct(builder, llvm_t, values):
+  """
+  Build a first-class struct value out of its fields
+  """
+  result = undef(llvm_t)
+  for (i, v) in enumerate(values):
+    result = builder.insert_value(result, v, i)
+  return result
+
+def make_array(builder, values, elt_t):
+  result = undef(ir.ArrayType(elt_t, len(values)))
+  for (i, v) in enumerate(values):
+    result = builder.insert_value(result, v, i)
+  return result
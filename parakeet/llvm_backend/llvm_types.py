@@ -1,105 +1,102 @@
-import ctypes
-import llvm.core as llcore
+import llvmlite.ir as ir
 
-from llvm.core import Type as lltype
+from .. ndtypes import (ScalarT, FloatT, NoneT, PtrT, ArrayT, TupleT, ClosureT, SliceT,
+                        FnT, TypeValueT)
 
-from .. ndtypes import ScalarT, PtrT, NoneT
+void_t = ir.VoidType()
+int1_t = ir.IntType(1)
+int8_t = ir.IntType(8)
+int16_t = ir.IntType(16)
+int32_t = ir.IntType(32)
+int64_t = ir.IntType(64)
 
-void_t = lltype.void()
-int1_t = lltype.int(1)
-int8_t = lltype.int(8)
-int16_t = lltype.int(16)
-int32_t = lltype.int(32)
-int64_t = lltype.int(64)
+float32_t = ir.FloatType()
+float64_t = ir.DoubleType()
 
-float32_t = lltype.float()
-float64_t = lltype.double()
+ptr_int8_t = ir.PointerType(int8_t)
+ptr_int64_t = ir.PointerType(int64_t)
 
-ptr_int8_t = lltype.pointer(int8_t)
-ptr_int32_t = lltype.pointer(int32_t)
-ptr_int64_t = lltype.pointer(int64_t)
+# PyObject* is opaque to the generated code except at the boundary with Python
+pyobj_t = ptr_int8_t
 
-def nbytes(t):
-  if t.kind == llcore.TYPE_FLOAT:
+empty_struct_t = ir.LiteralStructType([])
+
+def nbytes(llvm_t):
+  if llvm_t == float32_t:
     return 4
-  elif t.kind == llcore.TYPE_DOUBLE:
+  elif llvm_t == float64_t:
     return 8
   else:
-    return t.width / 8
-
-def is_scalar(llvm_t):
-  return isinstance(llvm_t, llcore.IntegerType) or \
-         llvm_t in (float32_t, float64_t)
-
-_ctypes_scalars_to_llvm_types = {
-  ctypes.c_bool : int8_t,
-  ctypes.c_uint8 : int8_t,
-  ctypes.c_int8 : int8_t,
-
-  ctypes.c_uint16 : int16_t,
-  ctypes.c_int16 : int16_t,
-
-  ctypes.c_uint32 : int32_t,
-  ctypes.c_int32 : int32_t,
-
-  ctypes.c_uint64 : int64_t,
-  ctypes.c_int64 : int64_t,
-
-  ctypes.c_float : float32_t,
-  ctypes.c_double : float64_t,
-}
-
-PyCPointerType = type(ctypes.POINTER(ctypes.c_int32))
-PyCStructType = type(ctypes.Structure)
+    return llvm_t.width / 8
 
-_struct_cache = {}
-def ctypes_struct_to_lltype(S, name = None):
-  if not name:
-    name = S.__class__.__name__
+def is_float(llvm_t):
+  return llvm_t in (float32_t, float64_t)
 
-  key = tuple(S._fields_)
-
-  if key in _struct_cache:
-    return _struct_cache[key]
-  else:
-    llvm_field_types = [ctypes_to_lltype(field_type)
-                        for (_, field_type) in S._fields_]
-    llvm_struct = lltype.struct(llvm_field_types, name)
-    _struct_cache[key] = llvm_struct
-    return llvm_struct
-
-def ctypes_scalar_to_lltype(ct):
-  assert ct in _ctypes_scalars_to_llvm_types, \
-      "%s isn't a convertible to an LLVM scalar type" % ct
-  return _ctypes_scalars_to_llvm_types[ct]
-
-def ctypes_to_lltype(ctypes_repr, name = None):
-  if type(ctypes_repr) == PyCStructType:
-    return ctypes_struct_to_lltype(ctypes_repr, name)
-  elif type(ctypes_repr) == PyCPointerType:
-    elt_t = ctypes_repr._type_
-    if elt_t == ctypes.c_bool:
-      return lltype.pointer(int8_t)
-    else:
-      return lltype.pointer(ctypes_to_lltype(elt_t))
+def scalar_type(t):
+  if isinstance(t, FloatT):
+    return float32_t if t.nbytes == 4 else float64_t
+  elif isinstance(t, NoneT):
+    return int8_t
   else:
-    return ctypes_scalar_to_lltype(ctypes_repr)
-
+    # booleans are stored as bytes, same as the C backend's int8_t
+    return ir.IntType(t.nbytes * 8)
+
+def ptr_struct_type(elt_t):
+  """
+  Pointers carry the PyObject (if any) which owns their data,
+  so that arrays which are views of their inputs keep them alive
+  """
+  return ir.LiteralStructType([ir.PointerType(llvm_value_type(elt_t)), pyobj_t])
+
+def array_struct_type(elt_t, rank):
+  """
+  Same layout as the C backend's array structs:
+    data, shape, strides (in elements), offset, size
+  """
+  dims_t = ir.ArrayType(int64_t, rank)
+  return ir.LiteralStructType([ptr_struct_type(elt_t), dims_t, dims_t, int64_t, int64_t])
+
+array_field_pos = {'data' : 0, 'shape' : 1, 'strides' : 2, 'offset' : 3, 'size' : 4, 'nelts' : 4}
+slice_field_pos = {'start' : 0, 'stop' : 1, 'step' : 2}
+
+_value_types = {}
 def llvm_value_type(t):
-  return ctypes_to_lltype(t.ctypes_repr, t.node_type())
-
-def llvm_ref_type(t):
-  llvm_value_t = llvm_value_type(t)
-  if isinstance(t, (PtrT, ScalarT, NoneT)):
-    return llvm_value_t
+  if t in _value_types:
+    return _value_types[t]
+  if isinstance(t, (ScalarT, NoneT)):
+    llvm_t = scalar_type(t)
+  elif isinstance(t, PtrT):
+    llvm_t = ptr_struct_type(t.elt_type)
+  elif isinstance(t, ArrayT):
+    llvm_t = array_struct_type(t.elt_type, t.rank)
+  elif isinstance(t, TupleT):
+    llvm_t = ir.LiteralStructType([llvm_value_type(elt_t) for elt_t in t.elt_types])
+  elif isinstance(t, ClosureT):
+    llvm_t = ir.LiteralStructType([llvm_value_type(arg_t) for arg_t in t.arg_types])
+  elif isinstance(t, SliceT):
+    llvm_t = ir.LiteralStructType([llvm_value_type(t.start_type),
+                                   llvm_value_type(t.stop_type),
+                                   llvm_value_type(t.step_type)])
+  elif isinstance(t, (FnT, TypeValueT)):
+    # functions without closure arguments and types carry no data
+    llvm_t = empty_struct_t
   else:
-    return lltype.pointer(llvm_value_t)
-
-# we allocate heap slots for output scalars before entering the
-# function
-def to_llvm_output_type(t):
-  llvm_type = llvm_value_type(t)
-  if isinstance(t, ScalarT):
-    return lltype.pointer(llvm_type)
+    assert False, "Don't know how to make LLVM type for %s" % t
+  _value_types[t] = llvm_t
+  return llvm_t
+
+def field_pos(t, name):
+  """
+  Position of a named field in the struct representing a value of type t
+  """
+  if isinstance(t, ArrayT):
+    assert name in array_field_pos, "Unsupported array attribute %s" % name
+    return array_field_pos[name]
+  elif isinstance(t, SliceT):
+    return slice_field_pos[name]
+  elif isinstance(t, PtrT):
+    assert name == "raw_ptr", "Unsupported pointer attribute %s" % name
+    return 0
   else:
-    return llvm_type
+    assert name.startswith("elt"), "Unsupported attribute %s of %s" % (name, t)
+    return int(name[3:])
@@ -0,0 +1,265 @@
+import ctypes
+
+import llvmlite.ir as ir
+import numpy as np
+
+from ..ndtypes import (ScalarT, IntT, SignedT, FloatT, BoolT, NoneT, ArrayT, TupleT, ClosureT,
+                       SliceT, FnT, TypeValueT, Int64, Float64)
+
+import llvm_convert
+from compiler import FunctionBuilder
+from llvm_helpers import const, int32, int64, undef, make_struct, make_array
+from llvm_types import (llvm_value_type, pyobj_t, int8_t, int32_t, int64_t, ptr_int64_t,
+                        float64_t, empty_struct_t)
+
+# leading fields of PyArrayObject, everything we read comes before its base
+pyarray_struct_t = ir.LiteralStructType([ir.ArrayType(int8_t, object.__basicsize__),
+                                         pyobj_t, int32_t, ptr_int64_t, ptr_int64_t])
+pyarray_ptr_t = ir.PointerType(pyarray_struct_t)
+
+# PySliceObject is a PyObject header followed by start, stop and step
+pyslice_struct_t = ir.LiteralStructType([ir.ArrayType(int8_t, object.__basicsize__),
+                                         pyobj_t, pyobj_t, pyobj_t])
+
+# flags of arrays which wrap data owned by someone else
+NPY_ARRAY_ALIGNED = 0x0100
+NPY_ARRAY_WRITEABLE = 0x0400
+
+class PyEntryCompiler(FunctionBuilder):
+  """
+  Entry point called from Python with the same calling convention as a
+  builtin function's METH_VARARGS implementation:
+    PyObject* entry(PyObject* self, PyObject* args)
+  Unboxes the arguments, calls the compiled function and boxes its result.
+  Parallel entry points take the number of threads and the parallel
+  threshold as two extra trailing arguments.
+  """
+  def __init__(self, parent, fn, compiled_fn, name, parallel = False):
+    FunctionBuilder.__init__(self, parent, name, pyobj_t, [pyobj_t, pyobj_t], linkage = None)
+    self.fn = fn
+    self.compiled_fn = compiled_fn
+    self.parallel = parallel
+    self.args_tuple = self.llvm_fn.args[1]
+
+  def call_api(self, name, return_t, arg_types, args):
+    fn = self.declare(name, return_t, arg_types)
+    return self.builder.call(fn, args)
+
+  def global_object(self, name):
+    """
+    Address of a global PyObject (e.g. Py_None or the type of NumPy arrays)
+    """
+    existing = self.module.globals.get(name)
+    if existing is None:
+      existing = ir.GlobalVariable(self.module, int8_t, name)
+    return existing
+
+  def tuple_item(self, tup, i):
+    return self.call_api("PyTuple_GetItem", pyobj_t, [pyobj_t, int64_t], [tup, int64(i)])
+
+  def incref(self, obj):
+    self.call_api("Py_IncRef", ir.VoidType(), [pyobj_t], [obj])
+
+  def decref(self, obj):
+    self.call_api("Py_DecRef", ir.VoidType(), [pyobj_t], [obj])
+
+  #############################################
+  #
+  #  Python -> LLVM
+  #
+  #############################################
+
+  def unbox_scalar(self, obj, t):
+    if isinstance(t, BoolT):
+      bit = self.call_api("PyObject_IsTrue", int32_t, [pyobj_t], [obj])
+      return llvm_convert.to_bool(bit, self.builder)
+    elif isinstance(t, IntT):
+      if isinstance(t, SignedT):
+        value = self.call_api("PyInt_AsLong", int64_t, [pyobj_t], [obj])
+      else:
+        value = self.call_api("PyInt_AsUnsignedLongMask", int64_t, [pyobj_t], [obj])
+      return llvm_convert.convert(value, Int64, t, self.builder)
+    else:
+      assert isinstance(t, FloatT), "Unexpected scalar type %s" % t
+      value = self.call_api("PyFloat_AsDouble", float64_t, [pyobj_t], [obj])
+      return llvm_convert.convert(value, Float64, t, self.builder)
+
+  def unbox_array(self, obj, t):
+    b = self.builder
+    fields = b.load(b.bitcast(obj, pyarray_ptr_t), name = "array_fields")
+    data = b.extract_value(fields, 1)
+    dims = b.extract_value(fields, 3)
+    byte_strides = b.extract_value(fields, 4)
+    itemsize = int64(t.elt_type.dtype.itemsize)
+    shape = [b.load(b.gep(dims, [int64(i)])) for i in xrange(t.rank)]
+    strides = [b.sdiv(b.load(b.gep(byte_strides, [int64(i)])), itemsize) for i in xrange(t.rank)]
+    ptr = make_struct(b, llvm_value_type(t).elements[0],
+                      [b.bitcast(data, ir.PointerType(llvm_value_type(t.elt_type))), obj])
+    return make_struct(b, llvm_value_type(t),
+                       [ptr,
+                        make_array(b, shape, int64_t),
+                        make_array(b, strides, int64_t),
+                        int64(0),
+                        self.product(shape)])
+
+  def unbox_slice(self, obj, t):
+    b = self.builder
+    fields = b.load(b.bitcast(obj, ir.PointerType(pyslice_struct_t)))
+    values = [self.unbox(b.extract_value(fields, i + 1), elt_t)
+              for (i, elt_t) in enumerate([t.start_type, t.stop_type, t.step_type])]
+    return make_struct(b, llvm_value_type(t), values)
+
+  def unbox_elts(self, obj, elt_types, llvm_t):
+    values = [self.unbox(self.tuple_item(obj, i), elt_t) for (i, elt_t) in enumerate(elt_types)]
+    return make_struct(self.builder, llvm_t, values)
+
+  def unbox(self, obj, t):
+    if isinstance(t, ScalarT):
+      return self.unbox_scalar(obj, t)
+    elif isinstance(t, NoneT):
+      return const(None, t)
+    elif isinstance(t, ArrayT):
+      return self.unbox_array(obj, t)
+    elif isinstance(t, TupleT):
+      return self.unbox_elts(obj, t.elt_types, llvm_value_type(t))
+    elif isinstance(t, ClosureT):
+      # closures get passed as tuples of their arguments
+      return self.unbox_elts(obj, t.arg_types, llvm_value_type(t))
+    elif isinstance(t, SliceT):
+      return self.unbox_slice(obj, t)
+    else:
+      assert isinstance(t, (FnT, TypeValueT)), "Can't unbox %s" % t
+      return undef(empty_struct_t)
+
+  #############################################
+  #
+  #  LLVM -> Python
+  #
+  #############################################
+
+  def box_none(self):
+    none = self.builder.bitcast(self.global_object("_Py_NoneStruct"), pyobj_t)
+    self.incref(none)
+    return none
+
+  def box_scalar(self, value, t):
+    if isinstance(t, BoolT):
+      return self.call_api("PyBool_FromLong", pyobj_t, [int64_t],
+                           [self.builder.zext(value, int64_t)])
+    # the descriptors of builtin dtypes are static, so their address
+    # can be baked into the generated code
+    descr = ir.Constant(int64_t, id(np.dtype(t.dtype))).inttoptr(pyobj_t)
+    slot = self.alloca(value.type, "scalar")
+    self.builder.store(value, slot)
+    return self.call_api("PyArray_Scalar", pyobj_t, [pyobj_t, pyobj_t, pyobj_t],
+                         [self.builder.bitcast(slot, pyobj_t), descr,
+                          ir.Constant(pyobj_t, None)])
+
+  def box_tuple(self, value, elt_types):
+    tup = self.call_api("PyTuple_New", pyobj_t, [int64_t], [int64(len(elt_types))])
+    for (i, elt_t) in enumerate(elt_types):
+      boxed = self.box(self.builder.extract_value(value, i), elt_t)
+      # steals the reference to the element
+      self.call_api("PyTuple_SetItem", int32_t, [pyobj_t, int64_t, pyobj_t],
+                    [tup, int64(i), boxed])
+    return tup
+
+  def box_slice(self, value, t):
+    elts = [self.box(self.builder.extract_value(value, i), elt_t)
+            for (i, elt_t) in enumerate([t.start_type, t.stop_type, t.step_type])]
+    result = self.call_api("PySlice_New", pyobj_t, [pyobj_t] * 3, elts)
+    for elt in elts:
+      self.decref(elt)
+    return result
+
+  def box_array(self, value, t):
+    b = self.builder
+    rank = t.rank
+    itemsize = int64(t.elt_type.dtype.itemsize)
+    shape = b.extract_value(value, 1)
+    strides = b.extract_value(value, 2)
+    dims_t = ir.ArrayType(int64_t, rank)
+    dims = self.alloca(dims_t, "dims")
+    byte_strides = self.alloca(dims_t, "byte_strides")
+    for i in xrange(rank):
+      b.store(b.extract_value(shape, i), b.gep(dims, [int64(0), int64(i)]))
+      b.store(b.mul(b.extract_value(strides, i), itemsize),
+              b.gep(byte_strides, [int64(0), int64(i)]))
+    ptr = b.extract_value(value, 0)
+    elt_ptr = b.gep(b.extract_value(ptr, 0), [b.extract_value(value, 3)])
+    base = b.extract_value(ptr, 1)
+    null = ir.Constant(pyobj_t, None)
+    arg_types = [pyobj_t, int32_t, ptr_int64_t, int32_t, ptr_int64_t, pyobj_t,
+                 int32_t, int32_t, pyobj_t]
+    args = [b.bitcast(self.global_object("PyArray_Type"), pyobj_t),
+            int32(rank),
+            b.bitcast(dims, ptr_int64_t),
+            int32(np.dtype(t.elt_type.dtype).num),
+            b.bitcast(byte_strides, ptr_int64_t),
+            b.bitcast(elt_ptr, pyobj_t),
+            int32(0),
+            int32(NPY_ARRAY_ALIGNED | NPY_ARRAY_WRITEABLE),
+            null]
+    arr = self.call_api("PyArray_New", pyobj_t, arg_types, args)
+    failed = b.icmp_unsigned("==", arr, null)
+    with b.if_then(failed, likely = False):
+      b.ret(null)
+    # if the data is owned by a Python object, the new array keeps it alive
+    has_base = b.icmp_unsigned("!=", base, null)
+    with b.if_then(has_base):
+      self.incref(base)
+      self.call_api("PyArray_SetBaseObject", int32_t, [pyobj_t, pyobj_t], [arr, base])
+    return arr
+
+  def box(self, value, t):
+    if isinstance(t, NoneT):
+      return self.box_none()
+    elif isinstance(t, ScalarT):
+      return self.box_scalar(value, t)
+    elif isinstance(t, TupleT):
+      return self.box_tuple(value, t.elt_types)
+    elif isinstance(t, SliceT):
+      return self.box_slice(value, t)
+    else:
+      assert isinstance(t, ArrayT), "Can't box %s" % t
+      return self.box_array(value, t)
+
+  def compile(self):
+    args = [self.unbox(self.tuple_item(self.args_tuple, i), t)
+            for (i, t) in enumerate(self.fn.input_types)]
+    if self.parallel:
+      n = len(self.fn.input_types)
+      args += [self.unbox_scalar(self.tuple_item(self.args_tuple, n + i), Int64)
+               for i in xrange(2)]
+      # the native threads never touch Python objects, so other Python
+      # threads can run while the parallel loops do
+      state = self.call_api("PyEval_SaveThread", pyobj_t, [], [])
+    result = self.builder.call(self.compiled_fn, args)
+    if self.parallel:
+      self.call_api("PyEval_RestoreThread", ir.VoidType(), [pyobj_t], [state])
+    self.builder.ret(self.box(result, self.fn.return_type))
+
+class PyMethodDef(ctypes.Structure):
+  _fields_ = [('ml_name', ctypes.c_char_p),
+              ('ml_meth', ctypes.c_void_p),
+              ('ml_flags', ctypes.c_int),
+              ('ml_doc', ctypes.c_char_p)]
+
+METH_VARARGS = 0x0001
+
+_new_builtin = ctypes.pythonapi.PyCFunction_NewEx
+_new_builtin.argtypes = [ctypes.POINTER(PyMethodDef), ctypes.py_object, ctypes.py_object]
+_new_builtin.restype = ctypes.py_object
+
+# builtin functions only point at their method definitions,
+# which have to outlive them
+_method_defs = []
+
+def make_builtin(name, address):
+  """
+  Wrap the address of a compiled entry point as a builtin function,
+  so calling it costs no more than calling a function of a C extension
+  """
+  method_def = PyMethodDef(name, address, METH_VARARGS, None)
+  _method_defs.append(method_def)
+  return _new_builtin(ctypes.byref(method_def), None, None)
@@ -0,0 +1,83 @@
+import multiprocessing
+
+from ..c_backend.prepare_args import prepare_args
+from ..openmp_backend.calibration import get_parallel_threshold
+from ..openmp_backend.thread_settings import get_num_threads
+from ..retention import release_after_compile, snapshot_ir_caches
+from ..settings_caches import register_backend_caches
+from ..tiering import compile_lock
+from ..transforms.pipeline import lower_to_adverbs, lower_to_loops
+
+from compiler import ModuleCompiler
+from llvm_context import global_context
+from pyentry_compiler import PyEntryCompiler, make_builtin
+import llvm_config
+
+_cache = {}
+
+# compiled functions keyed by the typed function they were compiled from,
+# so that later calls skip lowering (whose results may have been released)
+_entry_cache = {}
+register_backend_caches('llvm', __name__)
+
+_entry_counter = [0]
+def fresh_entry_name():
+  _entry_counter[0] += 1
+  return "parakeet_entry_%d" % _entry_counter[0]
+
+def compile_entry(fn, parallel):
+  """
+  JIT compile a lowered function along with everything it calls
+  into a builtin function which can be called from Python
+  """
+  context = global_context()
+  name = fresh_entry_name()
+  parent = ModuleCompiler(name, context.triple, context.data_layout, parallel = parallel)
+  compiled_fn = parent.get_function(fn, sequential = not parallel)
+  PyEntryCompiler(parent, fn, compiled_fn, name, parallel = parallel).compile()
+  context.add_module(parent.module)
+  return make_builtin(name, context.function_address(name))
+
+def runtime_args():
+  """
+  Extra trailing arguments of parallel entry points:
+    - number of threads (all cores unless set through parakeet.set_num_threads)
+    - minimum estimated work for a loop to run in parallel
+  """
+  num_threads = get_num_threads()
+  if not num_threads:
+    num_threads = multiprocessing.cpu_count()
+  return (num_threads, get_parallel_threshold())
+
+def compiled_entry(fn, args):
+  """
+  Compiled code for the typed function along with the arguments to call it with
+  """
+  args = prepare_args(args, fn.input_types)
+  parallel = llvm_config.parallel
+  extra_args = runtime_args() if parallel else ()
+  entry_key = fn.cache_key, parallel
+  if entry_key in _entry_cache:
+    return _entry_cache[entry_key], args + extra_args
+  # lowering reads the compiler's settings and caches, which the compiler
+  # of a hot function on another thread might be changing
+  with compile_lock:
+    snapshot = snapshot_ir_caches()
+
+    if parallel:
+      lowered = lower_to_adverbs.apply(fn)
+    else:
+      lowered = lower_to_loops(fn)
+    key = lowered.cache_key, parallel
+    if key in _cache:
+      entry = _cache[key]
+    else:
+      entry = compile_entry(lowered, parallel)
+      _cache[key] = entry
+    _entry_cache[entry_key] = entry
+    release_after_compile(fn, snapshot)
+    return entry, args + extra_args
+
+def run(fn, args):
+  entry, entry_args = compiled_entry(fn, args)
+  return entry(*entry_args)
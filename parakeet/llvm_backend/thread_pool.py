@@ -0,0 +1,222 @@
+"""
+Native thread pool which runs the parallel loops of LLVM-compiled code.
+
+A parallel loop gets outlined into a worker function
+  void worker(i8* env, i64 start, i64 stop)
+which runs the iterations [start, stop) of its outermost dimension. The
+iterations are split into chunks which the calling thread and the pool's
+threads grab from a shared counter until there are none left, so a slow
+thread just ends up running fewer chunks.
+
+The pool is written in LLVM IR against pthreads and gets JIT compiled once
+per process, so (like the rest of the backend) it doesn't need a C compiler.
+The pool's threads are started when a loop first asks for them and then
+sleep on a condition variable between loops. Only one parallel loop runs on
+the pool at a time, nested parallel loops are compiled as sequential loops.
+"""
+
+# pthread_mutex_t and pthread_cond_t are opaque, their storage here is bigger
+# than either of them on every platform we know of (40 and 48 bytes on 64-bit
+# Linux, 64 and 48 bytes on OS X)
+runtime_source = """
+%job = type { void (i8*, i64, i64)*, i8*, i64, i64, i64, i64, i64, i64, i64 }
+; fields of a job:
+;   0: worker function     1: its environment
+;   2: number of iterations       3: iterations per chunk
+;   4: number of chunks           5: next chunk to run
+;   6: number of finished chunks  7: pool threads working on the job
+;   8: maximum number of pool threads which can join the job
+
+@pool_lock = internal global [128 x i8] zeroinitializer, align 16
+@job_lock = internal global [128 x i8] zeroinitializer, align 16
+@work_cond = internal global [128 x i8] zeroinitializer, align 16
+@done_cond = internal global [128 x i8] zeroinitializer, align 16
+@generation = internal global i64 0, align 8
+@current_job = internal global %job* null, align 8
+@n_pool_threads = internal global i64 0, align 8
+
+declare i32 @pthread_mutex_init(i8*, i8*)
+declare i32 @pthread_mutex_lock(i8*)
+declare i32 @pthread_mutex_unlock(i8*)
+declare i32 @pthread_cond_init(i8*, i8*)
+declare i32 @pthread_cond_wait(i8*, i8*)
+declare i32 @pthread_cond_broadcast(i8*)
+declare i32 @pthread_create(i64*, i8*, i8* (i8*)*, i8*)
+
+define void @parakeet_pool_init() {
+entry:
+  %pool_lock = getelementptr [128 x i8], [128 x i8]* @pool_lock, i64 0, i64 0
+  %job_lock = getelementptr [128 x i8], [128 x i8]* @job_lock, i64 0, i64 0
+  %work_cond = getelementptr [128 x i8], [128 x i8]* @work_cond, i64 0, i64 0
+  %done_cond = getelementptr [128 x i8], [128 x i8]* @done_cond, i64 0, i64 0
+  call i32 @pthread_mutex_init(i8* %pool_lock, i8* null)
+  call i32 @pthread_mutex_init(i8* %job_lock, i8* null)
+  call i32 @pthread_cond_init(i8* %work_cond, i8* null)
+  call i32 @pthread_cond_init(i8* %done_cond, i8* null)
+  ret void
+}
+
+define i64 @parakeet_pool_size() {
+entry:
+  %n = load i64, i64* @n_pool_threads
+  ret i64 %n
+}
+
+; grab chunks of the job until there are none left
+define internal void @run_chunks(%job* %job) {
+entry:
+  %fn_ptr = getelementptr %job, %job* %job, i32 0, i32 0
+  %fn = load void (i8*, i64, i64)*, void (i8*, i64, i64)** %fn_ptr
+  %env_ptr = getelementptr %job, %job* %job, i32 0, i32 1
+  %env = load i8*, i8** %env_ptr
+  %n_ptr = getelementptr %job, %job* %job, i32 0, i32 2
+  %n = load i64, i64* %n_ptr
+  %chunk_ptr = getelementptr %job, %job* %job, i32 0, i32 3
+  %chunk = load i64, i64* %chunk_ptr
+  %n_chunks_ptr = getelementptr %job, %job* %job, i32 0, i32 4
+  %n_chunks = load i64, i64* %n_chunks_ptr
+  %next_ptr = getelementptr %job, %job* %job, i32 0, i32 5
+  %finished_ptr = getelementptr %job, %job* %job, i32 0, i32 6
+  br label %loop
+loop:
+  %c = atomicrmw add i64* %next_ptr, i64 1 seq_cst
+  %more = icmp slt i64 %c, %n_chunks
+  br i1 %more, label %body, label %exit
+body:
+  %start = mul i64 %c, %chunk
+  %stop_unclipped = add i64 %start, %chunk
+  %past_end = icmp sgt i64 %stop_unclipped, %n
+  %stop = select i1 %past_end, i64 %n, i64 %stop_unclipped
+  call void %fn(i8* %env, i64 %start, i64 %stop)
+  %ignore = atomicrmw add i64* %finished_ptr, i64 1 seq_cst
+  br label %loop
+exit:
+  ret void
+}
+
+; pool threads start with the generation of jobs which they've already seen
+define internal i8* @pool_thread(i8* %arg) {
+entry:
+  %pool_lock = getelementptr [128 x i8], [128 x i8]* @pool_lock, i64 0, i64 0
+  %work_cond = getelementptr [128 x i8], [128 x i8]* @work_cond, i64 0, i64 0
+  %done_cond = getelementptr [128 x i8], [128 x i8]* @done_cond, i64 0, i64 0
+  %seen = alloca i64
+  %start_generation = ptrtoint i8* %arg to i64
+  store i64 %start_generation, i64* %seen
+  call i32 @pthread_mutex_lock(i8* %pool_lock)
+  br label %wait
+wait:
+  %g = load i64, i64* @generation
+  %s = load i64, i64* %seen
+  %no_new_job = icmp eq i64 %g, %s
+  br i1 %no_new_job, label %sleep, label %wake
+sleep:
+  call i32 @pthread_cond_wait(i8* %work_cond, i8* %pool_lock)
+  br label %wait
+wake:
+  store i64 %g, i64* %seen
+  %job = load %job*, %job** @current_job
+  %no_job = icmp eq %job* %job, null
+  br i1 %no_job, label %wait, label %check_users
+check_users:
+  %users_ptr = getelementptr %job, %job* %job, i32 0, i32 7
+  %users = load i64, i64* %users_ptr
+  %max_users_ptr = getelementptr %job, %job* %job, i32 0, i32 8
+  %max_users = load i64, i64* %max_users_ptr
+  %full = icmp sge i64 %users, %max_users
+  br i1 %full, label %wait, label %join
+join:
+  %users_plus = add i64 %users, 1
+  store i64 %users_plus, i64* %users_ptr
+  call i32 @pthread_mutex_unlock(i8* %pool_lock)
+  call void @run_chunks(%job* %job)
+  call i32 @pthread_mutex_lock(i8* %pool_lock)
+  %users_after = load i64, i64* %users_ptr
+  %users_minus = sub i64 %users_after, 1
+  store i64 %users_minus, i64* %users_ptr
+  call i32 @pthread_cond_broadcast(i8* %done_cond)
+  br label %wait
+}
+
+; run worker(env, start, stop) over [0, n) on the calling thread
+; and up to n_threads - 1 threads of the pool
+define void @parakeet_parallel_for(void (i8*, i64, i64)* %fn, i8* %env, i64 %n,
+                                   i64 %n_threads, i64 %chunks_per_thread) {
+entry:
+  %pool_lock = getelementptr [128 x i8], [128 x i8]* @pool_lock, i64 0, i64 0
+  %job_lock = getelementptr [128 x i8], [128 x i8]* @job_lock, i64 0, i64 0
+  %work_cond = getelementptr [128 x i8], [128 x i8]* @work_cond, i64 0, i64 0
+  %done_cond = getelementptr [128 x i8], [128 x i8]* @done_cond, i64 0, i64 0
+  %job = alloca %job
+  %tid = alloca i64
+  %total_chunks = mul i64 %n_threads, %chunks_per_thread
+  %chunk_rounded = add i64 %n, %total_chunks
+  %chunk_rounded_down = sub i64 %chunk_rounded, 1
+  %chunk_estimate = sdiv i64 %chunk_rounded_down, %total_chunks
+  %chunk_empty = icmp slt i64 %chunk_estimate, 1
+  %chunk = select i1 %chunk_empty, i64 1, i64 %chunk_estimate
+  %n_rounded = add i64 %n, %chunk
+  %n_rounded_down = sub i64 %n_rounded, 1
+  %n_chunks = sdiv i64 %n_rounded_down, %chunk
+  %max_users = sub i64 %n_threads, 1
+  %fn_ptr = getelementptr %job, %job* %job, i32 0, i32 0
+  store void (i8*, i64, i64)* %fn, void (i8*, i64, i64)** %fn_ptr
+  %env_ptr = getelementptr %job, %job* %job, i32 0, i32 1
+  store i8* %env, i8** %env_ptr
+  %n_ptr = getelementptr %job, %job* %job, i32 0, i32 2
+  store i64 %n, i64* %n_ptr
+  %chunk_ptr = getelementptr %job, %job* %job, i32 0, i32 3
+  store i64 %chunk, i64* %chunk_ptr
+  %n_chunks_ptr = getelementptr %job, %job* %job, i32 0, i32 4
+  store i64 %n_chunks, i64* %n_chunks_ptr
+  %next_ptr = getelementptr %job, %job* %job, i32 0, i32 5
+  store i64 0, i64* %next_ptr
+  %finished_ptr = getelementptr %job, %job* %job, i32 0, i32 6
+  store i64 0, i64* %finished_ptr
+  %users_ptr = getelementptr %job, %job* %job, i32 0, i32 7
+  store i64 0, i64* %users_ptr
+  %max_users_ptr = getelementptr %job, %job* %job, i32 0, i32 8
+  store i64 %max_users, i64* %max_users_ptr
+  call i32 @pthread_mutex_lock(i8* %job_lock)
+  call i32 @pthread_mutex_lock(i8* %pool_lock)
+  %g = load i64, i64* @generation
+  %g_arg = inttoptr i64 %g to i8*
+  br label %spawn_check
+spawn_check:
+  %n_pool = load i64, i64* @n_pool_threads
+  %need_more = icmp slt i64 %n_pool, %max_users
+  br i1 %need_more, label %spawn, label %publish
+spawn:
+  %err = call i32 @pthread_create(i64* %tid, i8* null, i8* (i8*)* @pool_thread, i8* %g_arg)
+  %failed = icmp ne i32 %err, 0
+  br i1 %failed, label %publish, label %spawned
+spawned:
+  %n_pool_plus = add i64 %n_pool, 1
+  store i64 %n_pool_plus, i64* @n_pool_threads
+  br label %spawn_check
+publish:
+  %g_next = add i64 %g, 1
+  store i64 %g_next, i64* @generation
+  store %job* %job, %job** @current_job
+  call i32 @pthread_cond_broadcast(i8* %work_cond)
+  call i32 @pthread_mutex_unlock(i8* %pool_lock)
+  call void @run_chunks(%job* %job)
+  call i32 @pthread_mutex_lock(i8* %pool_lock)
+  br label %wait
+wait:
+  %finished = load atomic i64, i64* %finished_ptr seq_cst, align 8
+  %unfinished = icmp slt i64 %finished, %n_chunks
+  %users = load i64, i64* %users_ptr
+  %busy = icmp sgt i64 %users, 0
+  %keep_waiting = or i1 %unfinished, %busy
+  br i1 %keep_waiting, label %sleep, label %done
+sleep:
+  call i32 @pthread_cond_wait(i8* %done_cond, i8* %pool_lock)
+  br label %wait
+done:
+  store %job* null, %job** @current_job
+  call i32 @pthread_mutex_unlock(i8* %pool_lock)
+  call i32 @pthread_mutex_unlock(i8* %job_lock)
+  ret void
+}
+"""
@@ -0,0 +1,3 @@
+from partition import partition
+from run_function import run
+from transport import Transport, PipeTransport, SocketTransport
@@ -0,0 +1,18 @@
+# number of worker processes, None means one per core (the calling
+# process runs a share of the iterations too, so one fewer get started)
+num_processes = None
+
+# how workers get started and reached:
+#   'pipe': processes forked on this machine which map arrays
+#           placed in shared memory
+#   'socket': processes which connect back over TCP and get sent arrays
+#             and compiled modules by value, standing in for other hosts
+# or any object with the interface of transport.Transport
+transport = 'pipe'
+
+# address the 'socket' transport listens on
+socket_host = '127.0.0.1'
+
+# loops with fewer iterations than this per process
+# run entirely in the calling process
+min_iterations_per_process = 1000
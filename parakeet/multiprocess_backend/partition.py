@@ -0,0 +1,268 @@
+"""
+Split a function at its outermost parallel loop so that the loop's
+iterations can be spread across processes.
+
+After indexification the work of a function is mostly in top-level ParFor
+statements (maps writing into arrays allocated just before them) and
+IndexReduce expressions. The first of these gets partitioned when everything
+before it is cheap setup code (shapes, allocations, arithmetic), which then
+gets recomputed by every piece below:
+
+  - shapes(args...) returns the number of iterations and the shape of every
+    array the setup code allocates, so the caller can place them in shared
+    memory
+  - kernel(args..., start, stop, outputs...) runs iterations [start, stop)
+    writing into the given outputs. Reductions instead return their init
+    along with the reduction of the sub-range, which the caller merges with
+    the reduction's combine function
+  - finish(args..., outputs..., [reduction]) runs whatever follows the
+    partitioned statement, it isn't needed when that's just returning a
+    result the caller already has
+"""
+
+from .. import names
+from ..analysis.collect_vars import collect_var_names
+from ..analysis.syntax_visitor import SyntaxVisitor
+from ..analysis.written_args import WrittenArgs
+from ..builder import Builder
+from ..ndtypes import ArrayT, TupleT, PtrT, Int64, NoneType
+from ..syntax import (TypedFn, Var, Assign, Return, Comment, ParFor, AllocArray, IndexReduce,
+                      Adverb, Tuple)
+from ..syntax.helpers import get_fn, get_closure_args, const_int
+from ..transforms.clone_function import CloneFunction
+from ..transforms.pipeline import optimize_indexified_code
+
+from dsltools import NestedBlocks
+
+class Partition(object):
+  """
+  The pieces of a function split at its outermost parallel loop
+  """
+  def __init__(self, fn, shapes, kernel, finish, output_types,
+               combine, written_inputs, result_index):
+    self.fn = fn
+    self.shapes = shapes
+    self.kernel = kernel
+    self.finish = finish
+    self.output_types = output_types
+    # combine function of a partitioned reduction, None for loops
+    self.combine = combine
+    # positions of array arguments which the parallel loop may write
+    self.written_inputs = written_inputs
+    # without a finish function, which output to return
+    # (None means the result of the reduction)
+    self.result_index = result_index
+
+  @property
+  def is_reduction(self):
+    return self.combine is not None
+
+def is_setup(stmt):
+  """
+  Statements cheap enough for every process to repeat
+  """
+  if stmt.__class__ is Comment:
+    return True
+  if stmt.__class__ is not Assign or stmt.lhs.__class__ is not Var:
+    return False
+  return not contains_work(stmt.rhs)
+
+class ContainsWork(SyntaxVisitor):
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.found = False
+
+  def visit_Call(self, expr):
+    self.found = True
+
+  def visit_generic_expr(self, expr):
+    if isinstance(expr, Adverb):
+      self.found = True
+    else:
+      SyntaxVisitor.visit_generic_expr(self, expr)
+
+def contains_work(expr):
+  visitor = ContainsWork()
+  visitor.visit_expr(expr)
+  return visitor.found
+
+def partitioned_stmt(stmt):
+  """
+  The loop or reduction which a statement runs, if it's one we can split
+  """
+  if stmt.__class__ is ParFor:
+    return stmt
+  if stmt.__class__ in (Assign, Return):
+    value = stmt.rhs if stmt.__class__ is Assign else stmt.value
+    if value.__class__ is IndexReduce and value.start_index is None and \
+       value.init is not None and not isinstance(value.shape.type, TupleT) and \
+       value.combine.__class__ is TypedFn and \
+       (stmt.__class__ is Return or stmt.lhs.__class__ is Var):
+      return value
+  return None
+
+def new_fn(name, arg_names, input_types, return_type, template = None):
+  """
+  Empty function along with a builder which appends to its body, the types
+  of the template's local variables are included if its statements get copied
+  """
+  type_env = dict(template.type_env) if template is not None else {}
+  type_env.update(zip(arg_names, input_types))
+  fn = TypedFn(name = name,
+               arg_names = tuple(arg_names),
+               input_types = tuple(input_types),
+               return_type = return_type,
+               body = [],
+               type_env = type_env)
+  blocks = NestedBlocks()
+  blocks.push(fn.body)
+  return fn, Builder(type_env = fn.type_env, blocks = blocks)
+
+def copy_setup(fn, n_setup, builder, output_names):
+  """
+  Clone of the setup statements, with the allocations whose results are
+  placed in shared memory removed (the arrays get passed in instead).
+  Returns the clone of the partitioned statement and everything after it.
+  """
+  body = CloneFunction().apply(fn).body
+  for stmt in body[:n_setup]:
+    if stmt.__class__ is Assign and stmt.lhs.name in output_names:
+      continue
+    builder.append(stmt)
+  return body[n_setup], body[n_setup + 1:]
+
+def offset_loop_body(fn_expr, n_dims):
+  """
+  Wrap a parallel loop's body so that its first index gets shifted by an
+  extra closure argument
+  """
+  body = get_fn(fn_expr)
+  closure_types = [arg.type for arg in get_closure_args(fn_expr)]
+  index_types = list(body.input_types[len(closure_types):])
+  arg_names = [names.fresh("closure_arg") for _ in closure_types] + \
+              [names.fresh("start")] + \
+              [names.fresh("idx") for _ in index_types]
+  wrapper, b = new_fn(names.add_prefix("offset_", body.name), arg_names,
+                      closure_types + [Int64] + index_types, NoneType)
+  args = b.input_vars(wrapper)
+  closure_args = args[:len(closure_types)]
+  start = args[len(closure_types)]
+  indices = args[len(closure_types) + 1:]
+  if len(indices) == n_dims:
+    indices = [b.add(indices[0], start)] + list(indices[1:])
+  else:
+    elts = b.tuple_elts(indices[0])
+    indices = [b.tuple([b.add(elts[0], start)] + list(elts[1:]))]
+  b.call(body, list(closure_args) + list(indices))
+  b.return_none()
+  return wrapper
+
+def bounds_elts(b, bounds):
+  if isinstance(bounds.type, TupleT):
+    return list(b.tuple_elts(bounds))
+  return [bounds]
+
+def partition(fn):
+  """
+  Split the typed function at its outermost parallel loop, or return None
+  if it doesn't have one which can be split
+  """
+  indexified = optimize_indexified_code.apply(fn)
+  body = indexified.body
+  n_setup = 0
+  while n_setup < len(body) and partitioned_stmt(body[n_setup]) is None:
+    if not is_setup(body[n_setup]):
+      return None
+    n_setup += 1
+  if n_setup == len(body):
+    return None
+  target = partitioned_stmt(body[n_setup])
+  stmt = body[n_setup]
+  setup = body[:n_setup]
+
+  outputs = [s.lhs for s in setup if s.__class__ is Assign and s.rhs.__class__ is AllocArray]
+  output_names = [v.name for v in outputs]
+  output_types = [v.type for v in outputs]
+
+  # which inputs might the partitioned statement write?
+  analysis = WrittenArgs()
+  analysis.visit_block(setup)
+  analysis.visit_stmt(stmt)
+  written = analysis.resolve(analysis.written)
+  written_inputs = [i for (i, name) in enumerate(indexified.arg_names)
+                    if name in written and isinstance(indexified.input_types[i], ArrayT)]
+
+  arg_names = list(indexified.arg_names)
+  input_types = list(indexified.input_types)
+
+  # shapes(args...) => (n_iterations, output shapes...)
+  shapes, b = new_fn(names.add_prefix("shapes_", fn.name), arg_names, input_types, NoneType, indexified)
+  target_copy, _ = copy_setup(indexified, n_setup, b, ())
+  if target_copy.__class__ is ParFor:
+    n = bounds_elts(b, target_copy.bounds)[0]
+  else:
+    target_copy = partitioned_stmt(target_copy)
+    n = target_copy.shape
+  shape_values = [n] + [s.rhs.shape for s in CloneFunction().apply(indexified).body[:n_setup]
+                        if s.__class__ is Assign and s.lhs.name in output_names]
+  result = b.tuple(shape_values)
+  shapes.return_type = result.type
+  b.return_(result)
+
+  # kernel(args..., start, stop, outputs...)
+  start_name, stop_name = names.fresh("start"), names.fresh("stop")
+  kernel, b = new_fn(names.add_prefix("partition_", fn.name),
+                     arg_names + [start_name, stop_name] + output_names,
+                     input_types + [Int64, Int64] + output_types, NoneType, indexified)
+  start, stop = Var(start_name, type = Int64), Var(stop_name, type = Int64)
+  target_copy, _ = copy_setup(indexified, n_setup, b, output_names)
+  if target_copy.__class__ is ParFor:
+    elts = bounds_elts(b, target_copy.bounds)
+    count = b.sub(stop, start, "count")
+    new_bounds = b.tuple([count] + elts[1:]) if len(elts) > 1 else count
+    wrapper = offset_loop_body(target_copy.fn, len(elts))
+    closure = b.closure(wrapper, list(get_closure_args(target_copy.fn)) + [start])
+    b.append(ParFor(fn = closure, bounds = new_bounds,
+                    read_only = target_copy.read_only, write_only = target_copy.write_only))
+    b.return_none()
+    combine = None
+  else:
+    reduction = partitioned_stmt(target_copy)
+    # the first element of the sub-range seeds the reduction of the rest,
+    # so the reduction's init only gets used once, by the caller
+    first = b.call(reduction.fn, [start], name = "first")
+    rest_start = b.add(start, const_int(1), "rest_start")
+    rest = IndexReduce(fn = reduction.fn, combine = reduction.combine,
+                       shape = b.sub(stop, rest_start, "rest_count"),
+                       start_index = rest_start,
+                       init = first, type = reduction.type)
+    result = b.tuple([reduction.init, b.assign_name(rest, "partial")])
+    kernel.return_type = result.type
+    b.return_(result)
+    combine = reduction.combine
+
+  # finish(args..., outputs..., [reduction])
+  rest = body[n_setup + 1:]
+  finish = None
+  result_index = None
+  if stmt.__class__ is Return:
+    pass
+  elif len(rest) == 1 and rest[0].__class__ is Return and rest[0].value.__class__ is Var and \
+       (rest[0].value.name in output_names or
+        (combine is not None and rest[0].value.name == stmt.lhs.name)):
+    if rest[0].value.name in output_names:
+      result_index = output_names.index(rest[0].value.name)
+  else:
+    extra_names = output_names[:]
+    extra_types = output_types[:]
+    if combine is not None:
+      extra_names.append(stmt.lhs.name)
+      extra_types.append(stmt.lhs.type)
+    finish, b = new_fn(names.add_prefix("finish_", fn.name), arg_names + extra_names,
+                       input_types + extra_types, indexified.return_type, indexified)
+    _, rest_copy = copy_setup(indexified, n_setup, b, output_names)
+    for s in rest_copy:
+      b.append(s)
+  return Partition(fn = indexified, shapes = shapes, kernel = kernel, finish = finish,
+                   output_types = output_types, combine = combine,
+                   written_inputs = written_inputs, result_index = result_index)
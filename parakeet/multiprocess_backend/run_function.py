@@ -0,0 +1,167 @@
+import multiprocessing
+
+import numpy as np
+
+from .. import c_backend
+from ..c_backend import config as c_config
+from ..c_backend.prepare_args import prepare_args
+from ..c_backend.pymodule_compiler import PyModuleCompiler
+from ..tiering import compile_lock
+from ..transforms.pipeline import lower_to_loops
+
+import config
+import shared_memory
+from partition import partition
+from transport import PipeTransport, SocketTransport
+from worker import Task, get_pool, discard_pool
+
+_partitions = {}
+def get_partition(fn):
+  key = fn.cache_key
+  if key not in _partitions:
+    with compile_lock:
+      _partitions[key] = partition(fn)
+  return _partitions[key]
+
+_compiled = {}
+def compile_piece(fn):
+  """
+  Compiled module for one of the functions a partition is made of, which
+  the workers load from the file it was compiled into
+  """
+  key = fn.cache_key
+  if key not in _compiled:
+    with compile_lock:
+      old_delete = c_config.delete_temp_files
+      # without a cache directory the module file would be deleted once loaded
+      c_config.delete_temp_files = old_delete and c_config.cache_dir is not None
+      try:
+        _compiled[key] = PyModuleCompiler().compile_entry(lower_to_loops(fn))
+      finally:
+        c_config.delete_temp_files = old_delete
+  return _compiled[key]
+
+_transports = {}
+def get_transport():
+  if not isinstance(config.transport, str):
+    return config.transport
+  key = config.transport, config.socket_host
+  if key not in _transports:
+    if config.transport == 'pipe':
+      _transports[key] = PipeTransport()
+    else:
+      assert config.transport == 'socket', "Unknown transport %s" % config.transport
+      _transports[key] = SocketTransport(config.socket_host)
+  return _transports[key]
+
+def get_num_processes():
+  if config.num_processes is None:
+    return multiprocessing.cpu_count()
+  return config.num_processes
+
+def split_range(n, n_chunks):
+  bounds = [(n * i) // n_chunks for i in xrange(n_chunks + 1)]
+  return zip(bounds[:-1], bounds[1:])
+
+class SharedArgs(object):
+  """
+  Arguments copied into shared memory, remembering which
+  names to remove once the workers are done with them
+  """
+  def __init__(self, shared):
+    self.shared = shared
+    self.refs = []
+
+  def empty(self, shape, dtype):
+    if not self.shared:
+      array = np.empty(shape, dtype = dtype)
+      return array, array
+    array, ref = shared_memory.empty(shape, dtype)
+    self.refs.append(ref)
+    return array, ref
+
+  def share(self, value):
+    """
+    The value for this process to use and the one to send to workers
+    """
+    if isinstance(value, np.ndarray) and self.shared:
+      array, ref = shared_memory.copy(value)
+      self.refs.append(ref)
+      return array, ref
+    elif isinstance(value, tuple):
+      pairs = [self.share(v) for v in value]
+      return tuple(p[0] for p in pairs), tuple(p[1] for p in pairs)
+    return value, value
+
+  def release(self):
+    for ref in self.refs:
+      shared_memory.release(ref)
+    self.refs = []
+
+def run(fn, args):
+  plan = get_partition(fn)
+  n_processes = get_num_processes()
+  if plan is None or n_processes < 2:
+    return c_backend.run(fn, args)
+  transport = get_transport()
+  if plan.written_inputs and not transport.shared_memory:
+    # workers without shared memory can't write into our arrays
+    return c_backend.run(fn, args)
+
+  args = prepare_args(args, fn.input_types)
+  shapes = compile_piece(plan.shapes).c_fn(*args)
+  n = shapes[0]
+  n_chunks = min(n_processes, n // max(config.min_iterations_per_process, 1))
+  if n_chunks < 2:
+    return c_backend.run(fn, args)
+
+  kernel = compile_piece(plan.kernel)
+  shared = SharedArgs(transport.shared_memory)
+  pool = get_pool(transport, n_processes - 1)
+  try:
+    local_args, remote_args = zip(*[shared.share(arg) for arg in args])
+    outputs = [shared.empty(shape, t.elt_type.dtype)
+               for (shape, t) in zip(shapes[1:], plan.output_types)]
+    local_outputs = tuple(local for (local, _) in outputs)
+    remote_outputs = tuple(remote for (_, remote) in outputs)
+    chunks = split_range(n, n_chunks)
+    n_args = len(args) + 2
+    # outputs which aren't shared get their rows sent back
+    send_back = () if transport.shared_memory else \
+                tuple(xrange(n_args, n_args + len(remote_outputs)))
+    tasks = [Task(kernel.shared_filename, kernel.fn_name,
+                  tuple(remote_args) + (start, stop) + remote_outputs,
+                  send_back, (start, stop))
+             for (start, stop) in chunks[1:]]
+    pool.submit(tasks)
+    try:
+      start, stop = chunks[0]
+      local_result = kernel.c_fn(*(tuple(local_args) + (start, stop) + local_outputs))
+    finally:
+      replies = pool.results(len(tasks))
+  except:
+    # workers may still be busy or have died, start over next time
+    discard_pool(pool)
+    shared.release()
+    raise
+  shared.release()
+
+  for ((start, stop), (_, rows)) in zip(chunks[1:], replies):
+    for (output, output_rows) in zip(local_outputs, rows):
+      output[start:stop] = output_rows
+  for i in plan.written_inputs:
+    args[i][...] = local_args[i]
+
+  result = None
+  if plan.is_reduction:
+    combine = compile_piece(plan.combine).c_fn
+    init, partial = local_result
+    result = combine(init, partial)
+    for ((_, partial), _) in replies:
+      result = combine(result, partial)
+  if plan.finish is not None:
+    extra = (result,) if plan.is_reduction else ()
+    return compile_piece(plan.finish).c_fn(*(tuple(args) + local_outputs + extra))
+  elif plan.result_index is not None:
+    return local_outputs[plan.result_index]
+  return result
@@ -0,0 +1,78 @@
+"""
+NumPy arrays whose data lives in POSIX shared memory, so that worker
+processes can read and write them without copies. On Linux shm_open just
+creates files in /dev/shm, which is what we do here since Python 2 has no
+binding for it (elsewhere the files go in the temporary directory).
+"""
+
+import itertools
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+_counter = itertools.count()
+
+class SharedArrayRef(object):
+  """
+  Picklable description of a shared array, enough for another
+  process to map the same memory
+  """
+  def __init__(self, name, shape, dtype):
+    self.name = name
+    self.shape = shape
+    self.dtype = dtype
+
+  @property
+  def path(self):
+    return os.path.join(shm_dir, self.name)
+
+  @property
+  def nbytes(self):
+    return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+def _map(ref, create):
+  flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0)
+  fd = os.open(ref.path, flags, 0600)
+  try:
+    # can't map zero bytes, so empty arrays get one
+    size = max(ref.nbytes, 1)
+    if create:
+      os.ftruncate(fd, size)
+    buf = mmap.mmap(fd, size)
+  finally:
+    os.close(fd)
+  return np.frombuffer(buf, dtype = ref.dtype, count = int(np.prod(ref.shape))).reshape(ref.shape)
+
+def empty(shape, dtype):
+  """
+  Uninitialized array in shared memory along with the
+  description other processes can map it with
+  """
+  shape = tuple(shape) if isinstance(shape, (tuple, list)) else (shape,)
+  ref = SharedArrayRef("parakeet-%d-%d" % (os.getpid(), _counter.next()), shape, dtype)
+  return _map(ref, create = True), ref
+
+def copy(array):
+  result, ref = empty(array.shape, array.dtype)
+  result[...] = array
+  return result, ref
+
+def attach(ref):
+  """
+  Map a shared array created by another process
+  """
+  return _map(ref, create = False)
+
+def release(ref):
+  """
+  Remove the shared array's name once no other process needs to attach
+  to it, the memory itself stays around while anyone still maps it
+  """
+  try:
+    os.unlink(ref.path)
+  except OSError:
+    pass
@@ -0,0 +1,86 @@
+"""
+How the parent process starts workers and talks to them. A transport starts
+a worker process running a given function on its end of a connection, both
+ends of which can send and receive picklable Python objects.
+
+Any object with a start method and a shared_memory flag can be used as
+config.transport, e.g. to launch workers on other hosts.
+"""
+
+import multiprocessing
+import os
+from multiprocessing.connection import Listener, Client
+
+class Worker(object):
+  def __init__(self, connection, process):
+    self.connection = connection
+    self.process = process
+    # compiled modules this worker has already been sent
+    self.modules = set([])
+
+  def send(self, msg):
+    self.connection.send(msg)
+
+  def recv(self):
+    return self.connection.recv()
+
+  def close(self):
+    try:
+      self.connection.send(None)
+      self.connection.close()
+    except (IOError, EOFError):
+      pass
+    if self.process is not None:
+      self.process.join(1.0)
+
+class Transport(object):
+  # can workers map arrays in this machine's shared memory and load
+  # compiled modules from its file system? If not then arrays and
+  # modules get sent along with the work
+  shared_memory = True
+
+  def start(self, serve):
+    """
+    Start a worker process which calls serve(connection), returns a Worker
+    """
+    raise NotImplementedError
+
+class PipeTransport(Transport):
+  """
+  Worker processes forked from this one, connected through pipes
+  """
+  shared_memory = True
+
+  def start(self, serve):
+    parent_end, child_end = multiprocessing.Pipe()
+    process = multiprocessing.Process(target = serve, args = (child_end,))
+    process.daemon = True
+    process.start()
+    child_end.close()
+    return Worker(parent_end, process)
+
+def _connect(address, authkey, serve):
+  serve(Client(address, authkey = authkey))
+
+class SocketTransport(Transport):
+  """
+  Workers which connect back to this process over TCP and share nothing
+  with it, a stand-in for running workers on other hosts
+  """
+  shared_memory = False
+
+  def __init__(self, host = '127.0.0.1'):
+    self.host = host
+
+  def start(self, serve):
+    authkey = os.urandom(16)
+    listener = Listener((self.host, 0), authkey = authkey)
+    try:
+      process = multiprocessing.Process(target = _connect,
+                                        args = (listener.address, authkey, serve))
+      process.daemon = True
+      process.start()
+      connection = listener.accept()
+    finally:
+      listener.close()
+    return Worker(connection, process)
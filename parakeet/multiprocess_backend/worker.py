@@ -0,0 +1,137 @@
+"""
+Worker processes and the pool which hands them work.
+
+Each piece of work names a compiled module (the same one the parent runs),
+the function to call in it and its arguments. Arguments are plain values
+except for arrays in shared memory, which are passed as descriptions the
+worker maps. Outputs which aren't in shared memory get sent back.
+"""
+
+import atexit
+import imp
+import os
+import tempfile
+import traceback
+
+import numpy as np
+
+import shared_memory
+from shared_memory import SharedArrayRef
+
+class Task(object):
+  def __init__(self, module_path, fn_name, args, send_back = (), rows = None):
+    self.module_path = module_path
+    self.fn_name = fn_name
+    self.args = args
+    # positions of arguments whose rows get sent back afterward
+    self.send_back = send_back
+    self.rows = rows
+    # contents of the compiled module, if the worker can't load it from disk
+    self.module_bytes = None
+
+def unpack(value):
+  if isinstance(value, SharedArrayRef):
+    return shared_memory.attach(value)
+  elif isinstance(value, tuple):
+    return tuple(unpack(v) for v in value)
+  return value
+
+def load_fn(modules, task):
+  key = task.module_path, task.fn_name
+  if key not in modules:
+    path = task.module_path
+    if task.module_bytes is not None:
+      fd, path = tempfile.mkstemp(suffix = os.path.splitext(path)[1])
+      with os.fdopen(fd, 'wb') as f:
+        f.write(task.module_bytes)
+    modules[key] = getattr(imp.load_dynamic(task.fn_name, path), task.fn_name)
+  return modules[key]
+
+def serve(connection):
+  """
+  Main loop of a worker process, runs tasks until told to stop
+  """
+  modules = {}
+  while True:
+    try:
+      task = connection.recv()
+    except (EOFError, IOError):
+      break
+    if task is None:
+      break
+    try:
+      fn = load_fn(modules, task)
+      args = unpack(task.args)
+      result = fn(*args)
+      if task.send_back:
+        start, stop = task.rows
+        rows = [np.asarray(args[i][start:stop]) for i in task.send_back]
+      else:
+        rows = []
+      reply = ('ok', result, rows)
+    except Exception:
+      reply = ('error', traceback.format_exc(), None)
+    # drop mappings of shared arrays before the parent unlinks them
+    args = None
+    connection.send(reply)
+
+class WorkerError(Exception):
+  pass
+
+class WorkerPool(object):
+  def __init__(self, transport, n_workers):
+    self.transport = transport
+    self.workers = [transport.start(serve) for _ in xrange(n_workers)]
+
+  def submit(self, tasks):
+    """
+    Start running the tasks, one per worker
+    """
+    assert len(tasks) <= len(self.workers), \
+      "Can't run %d tasks on %d workers" % (len(tasks), len(self.workers))
+    for (worker, task) in zip(self.workers, tasks):
+      if not self.transport.shared_memory and task.module_path not in worker.modules:
+        with open(task.module_path, 'rb') as f:
+          task.module_bytes = f.read()
+        worker.modules.add(task.module_path)
+      worker.send(task)
+      task.module_bytes = None
+
+  def results(self, n_tasks):
+    """
+    Wait for the tasks given to the first n workers, returns their
+    results along with the rows of outputs they sent back
+    """
+    replies = [worker.recv() for worker in self.workers[:n_tasks]]
+    for (status, value, _) in replies:
+      if status != 'ok':
+        raise WorkerError("Worker process failed:\n%s" % value)
+    return [(value, rows) for (_, value, rows) in replies]
+
+  def close(self):
+    for worker in self.workers:
+      worker.close()
+    self.workers = []
+
+_pools = {}
+
+def get_pool(transport, n_workers):
+  key = id(transport), n_workers
+  if key not in _pools:
+    _pools[key] = WorkerPool(transport, n_workers)
+  return _pools[key]
+
+def discard_pool(pool):
+  """
+  Stop a pool whose workers are in an unknown state (e.g. after an error)
+  """
+  for (key, p) in _pools.items():
+    if p is pool:
+      del _pools[key]
+  pool.close()
+
+@atexit.register
+def shutdown():
+  for pool in _pools.values():
+    pool.close()
+  _pools.clear()
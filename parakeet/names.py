@@ -46,6 +46,18 @@ def original(unique_name):
   else:
     return original_name 
   
+def sort_key(unique_name):
+  """
+  Order names by their root and then by when they were created, which 
+  unlike the names themselves doesn't depend on what else was created 
+  earlier in the same process 
+  """
+  root = original(unique_name)
+  suffix = unique_name[len(root)+1:]
+  if unique_name == root or not suffix.isdigit():
+    return (root, 1, suffix)
+  return (root, int(suffix), "")
+  
 def refresh(unique_name):
   """Given an existing unique name, create another versioned name with the same root"""
   try:
@@ -0,0 +1,863 @@
+"""
+Interpreter for the adverb-level IR which runs adverbs as whole-array
+NumPy operations instead of walking them one element at a time.
+
+When the function of a Map, OuterMap, IndexMap or reduction is straight-line
+scalar code (primitives, casts, selects, indexing into arrays it closes over
+and calls to other such functions), it gets evaluated once with NumPy arrays
+of every element's inputs in place of scalars: primitives are ufuncs, so the
+same code computes all the elements at once. Reductions and scans whose
+combining function is a single primitive turn into that ufunc's reduce or
+accumulate. Anything else falls back to calling the function per element.
+
+Nothing gets compiled, which makes this a fallback for code which isn't
+worth compiling (cold or tiny calls) and for hosts without a C compiler.
+"""
+
+import numpy as np
+
+from ndtypes import ScalarT, ArrayT, TupleT, NoneT
+from syntax import (Expr, Var, Const, Tuple, TupleProj, Index, PrimCall, Cast, Select,
+                    Call, Closure, ClosureElt, TypedFn, Map, Return, Assign, If, While, ForLoop,
+                    ParFor, ExprStmt, Comment)
+from syntax.helpers import get_fn, get_closure_args
+
+class ReturnValue(Exception):
+  def __init__(self, value):
+    self.value = value
+
+class ClosureVal(object):
+  def __init__(self, fn, fixed_args):
+    self.fn = fn
+    self.fixed_args = tuple(fixed_args)
+
+def rankof(x):
+  return x.ndim if hasattr(x, 'ndim') else 0
+
+def fn_value(fn, args):
+  return ClosureVal(fn.fn, fn.fixed_args + tuple(args)) \
+         if isinstance(fn, ClosureVal) else ClosureVal(fn, args)
+
+def untyped_fn(fn):
+  return fn.fn if isinstance(fn, ClosureVal) else fn
+
+def eval_fn(fn, args):
+  if isinstance(fn, ClosureVal):
+    args = fn.fixed_args + tuple(args)
+    fn = fn.fn
+  if isinstance(fn, np.dtype):
+    return fn.type(*args)
+  assert isinstance(fn, TypedFn), "Expected typed function, got %s" % (fn,)
+  assert len(fn.arg_names) == len(args), \
+    "Wrong number of args, expected %s but given %s" % (fn.arg_names, args)
+  return Evaluator(fn, dict(zip(fn.arg_names, args))).run()
+
+def to_type(value, t):
+  """
+  Convert a value computed with NumPy's type promotion to the Parakeet type
+  the IR says it has
+  """
+  if isinstance(t, ScalarT):
+    if isinstance(value, np.ndarray):
+      return value.astype(t.dtype) if value.dtype != t.dtype else value
+    return t.dtype.type(value)
+  elif isinstance(t, ArrayT):
+    value = np.asarray(value)
+    if value.dtype != t.elt_type.dtype:
+      value = value.astype(t.elt_type.dtype)
+    return value
+  elif isinstance(t, TupleT) and isinstance(value, tuple):
+    return tuple(to_type(v, elt_t) for (v, elt_t) in zip(value, t.elt_types))
+  elif isinstance(t, NoneT):
+    return None
+  return value
+
+#############################################
+#
+#  Which functions can run on whole arrays
+#
+#############################################
+
+def is_scalar_type(t):
+  return isinstance(t, ScalarT) or \
+         (isinstance(t, TupleT) and all(isinstance(elt_t, ScalarT) for elt_t in t.elt_types))
+
+_vectorizable = {}
+def vectorizable(fn):
+  """
+  Can the function be evaluated with arrays in place of its scalar arguments?
+  Only straight-line code whose every intermediate value is a scalar
+  (or tuple of scalars) qualifies, anything which branches on a value or
+  builds arrays of its own has to run per element.
+  """
+  key = fn.cache_key, fn.input_types
+  if key in _vectorizable:
+    return _vectorizable[key]
+  # recursive functions branch, so assume the worst while checking
+  _vectorizable[key] = False
+  result = is_scalar_type(fn.return_type) and _vectorizable_block(fn.body)
+  _vectorizable[key] = result
+  return result
+
+def _vectorizable_block(stmts, guarded = False):
+  """
+  Both branches of an If run on every element (and get merged with np.where),
+  so the code they guard must be safe to run where the condition is false:
+  no indexing, which might go out of bounds, and no returning early
+  """
+  for stmt in stmts:
+    if stmt.__class__ is Assign:
+      if stmt.lhs.__class__ is not Var or not _vectorizable_expr(stmt.rhs, guarded):
+        return False
+    elif stmt.__class__ is Return and not guarded:
+      if not _vectorizable_expr(stmt.value):
+        return False
+    elif stmt.__class__ is If:
+      if not _vectorizable_expr(stmt.cond, guarded) or \
+         not _vectorizable_block(stmt.true, True) or \
+         not _vectorizable_block(stmt.false, True) or \
+         not all(_vectorizable_expr(e, True) for exprs in stmt.merge.itervalues() for e in exprs):
+        return False
+    elif stmt.__class__ is not Comment:
+      return False
+  return True
+
+def _vectorizable_expr(expr, guarded = False):
+  c = expr.__class__
+  if c in (Var, ClosureElt):
+    # array-valued variables can only be closure arguments,
+    # every input which gets replaced by an array is a scalar
+    return True
+  elif c is Const:
+    return True
+  if not is_scalar_type(expr.type):
+    return False
+  if c is PrimCall:
+    return isinstance(expr.prim.fn, np.ufunc) and \
+           all(_vectorizable_expr(arg, guarded) for arg in expr.args)
+  elif c is Cast:
+    return is_scalar_type(expr.value.type) and _vectorizable_expr(expr.value, guarded)
+  elif c is Select:
+    return _vectorizable_expr(expr.cond, guarded) and \
+           _vectorizable_expr(expr.true_value, guarded) and \
+           _vectorizable_expr(expr.false_value, guarded)
+  elif c is Tuple:
+    return all(_vectorizable_expr(elt, guarded) for elt in expr.elts)
+  elif c is TupleProj:
+    return _vectorizable_expr(expr.tuple, guarded)
+  elif guarded:
+    return False
+  elif c is Index:
+    return _vectorizable_expr(expr.value) and _vectorizable_expr(expr.index)
+  elif c is Call:
+    return all(_vectorizable_expr(arg) for arg in expr.args) and \
+           all(_vectorizable_expr(arg) for arg in get_closure_args(expr.fn)) and \
+           vectorizable(get_fn(expr.fn))
+  return False
+
+def elementwise_fn(fn_value, n_elt_args):
+  """
+  Whether the function (or closure) value can take arrays of its last
+  n_elt_args arguments, which are all scalars
+  """
+  fn = untyped_fn(fn_value)
+  if not isinstance(fn, TypedFn):
+    return False
+  elt_types = fn.input_types[len(fn.input_types) - n_elt_args:]
+  return isinstance(fn.return_type, ScalarT) and \
+         all(is_scalar_type(t) for t in elt_types) and vectorizable(fn)
+
+commutative_ufuncs = set([np.add, np.multiply, np.maximum, np.minimum, np.logical_and,
+                          np.logical_or, np.logical_xor, np.bitwise_and, np.bitwise_or,
+                          np.bitwise_xor])
+
+_combine_prims = {}
+def combine_prim(fn_value):
+  """
+  The primitive (if any) which a combining function applies
+  to its two arguments, e.g. add for lambda acc, x: acc + x
+  """
+  if not isinstance(fn_value, ClosureVal) or fn_value.fixed_args:
+    return None
+  fn = fn_value.fn
+  if not isinstance(fn, TypedFn) or len(fn.arg_names) != 2:
+    return None
+  key = fn.cache_key
+  if key in _combine_prims:
+    return _combine_prims[key]
+  # guard against recursive combining functions
+  _combine_prims[key] = None
+  result = None
+  body = [stmt for stmt in fn.body if stmt.__class__ is not Comment]
+  value = body[-1].value if body and body[-1].__class__ is Return else None
+  if len(body) == 2 and body[0].__class__ is Assign and body[0].lhs.__class__ is Var and \
+     value.__class__ is Var and value.name == body[0].lhs.name:
+    value = body[0].rhs
+  elif len(body) != 1:
+    value = None
+  if value.__class__ is PrimCall and isinstance(value.prim.fn, np.ufunc) and \
+     value.prim.fn.nin == 2:
+    ufunc = value.prim.fn
+  elif value.__class__ is Map and value.fn.__class__ is TypedFn and \
+       const_axis(value.axis) in (None, 0):
+    # combining whole arrays elementwise, as in reductions along an axis
+    ufunc = combine_prim(ClosureVal(value.fn, ()))
+  else:
+    ufunc = None
+  if ufunc is not None and len(value.args) == 2 and \
+     all(arg.__class__ is Var and arg.type == fn.return_type for arg in value.args):
+    arg_names = [arg.name for arg in value.args]
+    if arg_names == list(fn.arg_names) or \
+       (arg_names == list(reversed(fn.arg_names)) and ufunc in commutative_ufuncs):
+      result = ufunc
+  _combine_prims[key] = result
+  return result
+
+def const_axis(axis):
+  if axis.__class__ is Const:
+    return axis.value
+  elif axis.__class__ is Tuple and all(elt.__class__ is Const for elt in axis.elts):
+    return tuple(elt.value for elt in axis.elts)
+  return axis
+
+def is_identity(fn_value):
+  if not isinstance(fn_value, ClosureVal) or fn_value.fixed_args:
+    return False
+  fn = fn_value.fn
+  return isinstance(fn, TypedFn) and len(fn.arg_names) == 1 and len(fn.body) == 1 and \
+         fn.body[0].__class__ is Return and fn.body[0].value.__class__ is Var and \
+         fn.body[0].value.name == fn.arg_names[0]
+
+#############################################
+#
+#  Adverbs
+#
+#############################################
+
+def normalize_axes(axis, args):
+  if isinstance(axis, tuple):
+    assert len(axis) == len(args), "Expected %d axes, got %s" % (len(args), axis)
+    return axis
+  return (axis,) * len(args)
+
+def slice_along_axis(arg, axis, i):
+  return arg[(slice(None),) * axis + (i,)]
+
+def broadcast_into(value, shape, dtype):
+  result = np.empty(shape, dtype = dtype)
+  result[...] = value
+  return result
+
+def elt_dtype(t):
+  return t.elt_type.dtype if isinstance(t, ArrayT) else t.dtype
+
+def stack(values, iter_shape, result_t):
+  """
+  Array of the given type holding the per-element results
+  of an adverb, in C order of its iteration space
+  """
+  dtype = elt_dtype(result_t)
+  if len(values) == 0:
+    extra_dims = (0,) * (result_t.rank - len(iter_shape)) if isinstance(result_t, ArrayT) else ()
+    return np.empty(tuple(iter_shape) + extra_dims, dtype = dtype)
+  result = np.empty(tuple(iter_shape) + np.shape(values[0]), dtype = dtype)
+  flat = result.reshape((len(values),) + np.shape(values[0]))
+  for (i, v) in enumerate(values):
+    flat[i] = v
+  return result
+
+def map_elts(args, axes, idx):
+  """
+  Inputs of one element of an elementwise Map, the same slices
+  as the ones IndexifyAdverbs gives the compiled backends
+  """
+  elts = []
+  for (arg, axis) in zip(args, axes):
+    r = rankof(arg)
+    if axis is None and r <= 1:
+      axis = 0
+    if axis is None:
+      elts.append(arg[idx[-r:]])
+    elif r > axis:
+      elts.append(slice_along_axis(arg, axis, idx[0]))
+    else:
+      elts.append(arg)
+  return elts
+
+def highest_rank(args, axes):
+  """
+  The argument with the most dimensions (which determines how many
+  elements an adverb has) along with its axis
+  """
+  ranks = [rankof(arg) for arg in args]
+  i = ranks.index(max(ranks))
+  return args[i], axes[i]
+
+def map_shape(args, axes):
+  best, axis = highest_rank(args, axes)
+  if all(axis is None for axis in axes):
+    return best.shape
+  return (best.shape[axis],)
+
+def pad_rank(value, n_dims):
+  """
+  Insert leading dimensions so the value has the given rank,
+  which keeps it lined up with the same trailing dimensions
+  """
+  shape = np.shape(value)
+  return np.reshape(value, (1,) * (n_dims - len(shape)) + shape)
+
+def nested_map(fn):
+  """
+  If the function just maps another function over its arguments,
+  returns that inner Map
+  """
+  fn = untyped_fn(fn)
+  if not isinstance(fn, TypedFn):
+    return None
+  body = [stmt for stmt in fn.body if stmt.__class__ is not Comment]
+  if len(body) != 1 or body[0].__class__ is not Return or body[0].value.__class__ is not Map:
+    return None
+  inner = body[0].value
+  closure_args = inner.fn.args if inner.fn.__class__ is Closure else []
+  inner_fn = inner.fn.fn if inner.fn.__class__ is Closure else inner.fn
+  if inner_fn.__class__ is not TypedFn or \
+     not all(arg.__class__ is Var and arg.name in fn.arg_names
+             for arg in tuple(inner.args) + tuple(closure_args)):
+    return None
+  return inner
+
+def lift_map(fn, args, axes):
+  """
+  Find the elementwise function which a Map (perhaps through Maps nested in
+  its function) applies to scalars, and reshape the arguments so they
+  broadcast against each other the way the Map lines up their elements.
+  Returns the function, the reshaped arguments and the iteration space,
+  or None if the Map can't be run on whole arrays.
+  """
+  iter_shape = map_shape(args, axes)
+  n_dims = len(iter_shape)
+  if elementwise_fn(fn, len(args)):
+    lifted = []
+    for (arg, axis) in zip(args, axes):
+      r = rankof(arg)
+      if r == 0:
+        lifted.append(arg)
+      elif (axis is None or axis == 0) and r == 1:
+        # like the compiled loops, ignore anything past the iteration space
+        arg = arg[:iter_shape[0]]
+        lifted.append(arg.reshape(arg.shape + (1,) * (n_dims - 1)))
+      elif axis is None:
+        lifted.append(arg)
+      else:
+        return None
+    return fn, lifted, iter_shape
+  inner = nested_map(fn)
+  if inner is None or n_dims != 1 or iter_shape[0] == 0:
+    return None
+  # work out how the inner Map lines up the elements of its first
+  # iteration and then add the outer Map's dimension in front
+  outer_fn = untyped_fn(fn)
+  env = dict(zip(outer_fn.arg_names, list(fn.fixed_args) + map_elts(args, axes, (0,))))
+  inner_args = [env[arg.name] for arg in inner.args]
+  if inner.fn.__class__ is Closure:
+    inner_fn = ClosureVal(inner.fn.fn, [env[arg.name] for arg in inner.fn.args])
+  else:
+    inner_fn = ClosureVal(inner.fn, ())
+  result = lift_map(inner_fn, inner_args,
+                    normalize_axes(const_axis(inner.axis), inner_args))
+  if result is None:
+    return None
+  elt_fn, lifted_elts, inner_shape = result
+  n_inner = len(inner_shape)
+  sources = dict(zip(outer_fn.arg_names[len(fn.fixed_args):], zip(args, axes)))
+  lifted = []
+  for (inner_arg, lifted_elt) in zip(inner.args, lifted_elts):
+    arg, axis = sources.get(inner_arg.name, (None, None))
+    if arg is not None and rankof(arg) > (axis or 0):
+      if axis:
+        arg = np.rollaxis(arg, axis)
+      arg = arg[:iter_shape[0]]
+      elt_shape = pad_rank(lifted_elt, n_inner).shape
+      lifted.append(arg.reshape(iter_shape + elt_shape))
+    elif rankof(lifted_elt) == 0:
+      lifted.append(lifted_elt)
+    else:
+      # arguments which aren't sliced are the same in every iteration
+      lifted.append(pad_rank(lifted_elt, n_inner + 1))
+  return elt_fn, lifted, iter_shape + inner_shape
+
+def eval_map(fn, args, axes, result_t):
+  if all(rankof(arg) == 0 for arg in args):
+    return eval_fn(fn, args)
+  lifted = lift_map(fn, args, axes)
+  if lifted is not None:
+    elt_fn, lifted_args, iter_shape = lifted
+    return broadcast_into(eval_fn(elt_fn, lifted_args), iter_shape, elt_dtype(result_t))
+  iter_shape = map_shape(args, axes)
+  values = [eval_fn(fn, map_elts(args, axes, idx)) for idx in np.ndindex(*iter_shape)]
+  return stack(values, iter_shape, result_t)
+
+def eval_outer_map(fn, args, axes, result_t):
+  """
+  Cartesian product of the arguments' elements, each argument
+  gets its own block of dimensions in the result
+  """
+  blocks = []
+  for (arg, axis) in zip(args, axes):
+    r = rankof(arg)
+    if r == 0:
+      blocks.append(())
+    elif axis is None and r > 1:
+      blocks.append(arg.shape)
+    else:
+      blocks.append((arg.shape[0 if axis is None else axis],))
+  iter_shape = sum(blocks, ())
+  n_dims = len(iter_shape)
+  if elementwise_fn(fn, len(args)) and \
+     all(axis is None or rankof(arg) <= 1 for (arg, axis) in zip(args, axes)):
+    lifted = []
+    start = 0
+    for (arg, block) in zip(args, blocks):
+      if rankof(arg) == 0:
+        lifted.append(arg)
+      else:
+        lifted.append(arg.reshape((1,) * start + block + (1,) * (n_dims - start - len(block))))
+      start += len(block)
+    return broadcast_into(eval_fn(fn, lifted), iter_shape, elt_dtype(result_t))
+  values = []
+  for idx in np.ndindex(*iter_shape):
+    elts = []
+    start = 0
+    for (arg, axis, block) in zip(args, axes, blocks):
+      arg_idx = idx[start:start + len(block)]
+      start += len(block)
+      if len(block) == 0:
+        elts.append(arg)
+      elif axis is None or rankof(arg) == 1:
+        elts.append(arg[arg_idx])
+      else:
+        elts.append(slice_along_axis(arg, axis, arg_idx[0]))
+    values.append(eval_fn(fn, elts))
+  return stack(values, iter_shape, result_t)
+
+def reduce_args(args, axes):
+  """
+  Reductions along axis None run over the flattened arguments
+  """
+  new_args = []
+  new_axes = []
+  for (arg, axis) in zip(args, axes):
+    if axis is None:
+      new_args.append(np.ravel(arg))
+      new_axes.append(0)
+    else:
+      new_args.append(arg)
+      new_axes.append(axis)
+  return new_args, new_axes
+
+def mapped_values(fn, args, axes):
+  """
+  The results of a reduction's function on each of its elements, as one
+  array (whose leading dimension runs over elements) whenever possible
+  """
+  best, axis = highest_rank(args, axes)
+  n = best.shape[axis] if rankof(best) > axis else 1
+  if len(args) == 1 and is_identity(fn):
+    if rankof(args[0]) > axis:
+      return np.rollaxis(args[0], axis)
+    return [args[0]] * n
+  if elementwise_fn(fn, len(args)) and all(rankof(arg) <= 1 for arg in args):
+    result = eval_fn(fn, args)
+    return broadcast_into(result, (n,), np.result_type(result))
+  return [eval_fn(fn, [slice_along_axis(arg, axis, i) if rankof(arg) > axis else arg
+                       for (arg, axis) in zip(args, axes)])
+          for i in xrange(n)]
+
+def fold(combine, values, init, result_t):
+  ufunc = combine_prim(combine)
+  if ufunc is not None and len(values) > 0:
+    values = np.asarray(values)
+    result = ufunc.reduce(values, axis = 0, dtype = elt_dtype(result_t))
+    if init is not None:
+      result = ufunc(init, result)
+    return result
+  if init is None:
+    acc = values[0]
+    values = values[1:]
+  else:
+    acc = init
+  for v in values:
+    acc = eval_fn(combine, [acc, v])
+  return acc
+
+def scan(combine, emit, values, init, result_t):
+  ufunc = combine_prim(combine)
+  if ufunc is not None and is_identity(emit) and len(values) > 0:
+    values = np.asarray(values)
+    if init is not None:
+      values = np.concatenate([np.asarray(init, dtype = values.dtype)[np.newaxis], values])
+    result = ufunc.accumulate(values, axis = 0, dtype = elt_dtype(result_t))
+    return result[1:] if init is not None else result
+  accs = []
+  acc = init
+  for v in values:
+    acc = v if acc is None else eval_fn(combine, [acc, v])
+    accs.append(eval_fn(emit, [acc]))
+  return stack(accs, (len(accs),), result_t)
+
+def index_shape(shape):
+  return tuple(shape) if isinstance(shape, tuple) else (shape,)
+
+def index_args(fn, idx):
+  """
+  Index functions either take a tuple of indices or one argument per index
+  """
+  fn = untyped_fn(fn)
+  if isinstance(fn, TypedFn) and isinstance(fn.input_types[-1], TupleT):
+    return [tuple(idx)]
+  return list(idx)
+
+def lifted_indices(shape, start = None):
+  n_dims = len(shape)
+  indices = []
+  for (k, n) in enumerate(shape):
+    idx = np.arange(n).reshape((1,) * k + (n,) + (1,) * (n_dims - k - 1))
+    if start is not None:
+      idx = idx + (start[k] if isinstance(start, tuple) else start)
+    indices.append(idx)
+  return indices
+
+def index_values(fn, shape, start = None):
+  """
+  The function's value at every index of the shape, as an array of the
+  shape if the function can take arrays of indices, otherwise as a list
+  """
+  fn_t = untyped_fn(fn)
+  n_elt_args = 1 if isinstance(fn_t, TypedFn) and isinstance(fn_t.input_types[-1], TupleT) \
+               else len(shape)
+  if elementwise_fn(fn, n_elt_args):
+    result = eval_fn(fn, index_args(fn, lifted_indices(shape, start)))
+    return broadcast_into(result, shape, np.result_type(result))
+  values = []
+  for idx in np.ndindex(*shape):
+    if start is not None:
+      offsets = start if isinstance(start, tuple) else (start,) * len(idx)
+      idx = tuple(i + o for (i, o) in zip(idx, offsets))
+    values.append(eval_fn(fn, index_args(fn, idx)))
+  return values
+
+#############################################
+#
+#  Function bodies
+#
+#############################################
+
+class Evaluator(object):
+  def __init__(self, fn, env):
+    self.fn = fn
+    self.env = env
+
+  def run(self):
+    try:
+      self.eval_block(self.fn.body)
+    except ReturnValue as r:
+      return r.value
+    return None
+
+  def eval_expr(self, expr):
+    method = getattr(self, "expr_" + expr.__class__.__name__, None)
+    assert method is not None, "Expression %s not supported by the NumPy interpreter" % expr
+    return method(expr)
+
+  def eval_exprs(self, exprs):
+    return [self.eval_expr(e) for e in exprs]
+
+  def eval_if_expr(self, maybe_expr):
+    if isinstance(maybe_expr, Expr):
+      return self.eval_expr(maybe_expr)
+    return maybe_expr
+
+  def eval_axis(self, axis):
+    axis = self.eval_if_expr(axis)
+    return tuple(axis) if isinstance(axis, list) else axis
+
+  def expr_Var(self, expr):
+    return self.env[expr.name]
+
+  def expr_Const(self, expr):
+    return expr.value
+
+  def expr_TypeValue(self, expr):
+    return expr.type_value.dtype
+
+  def expr_Tuple(self, expr):
+    return tuple(self.eval_exprs(expr.elts))
+
+  def expr_TupleProj(self, expr):
+    return self.eval_expr(expr.tuple)[expr.index]
+
+  def expr_Closure(self, expr):
+    return fn_value(self.eval_if_expr(expr.fn), self.eval_exprs(expr.args))
+
+  def expr_ClosureElt(self, expr):
+    return self.eval_expr(expr.closure).fixed_args[expr.index]
+
+  def expr_TypedFn(self, expr):
+    return ClosureVal(expr, ())
+
+  def expr_UntypedFn(self, expr):
+    return ClosureVal(expr, ())
+
+  def expr_Call(self, expr):
+    return eval_fn(self.eval_expr(expr.fn), self.eval_exprs(expr.args))
+
+  def expr_PrimCall(self, expr):
+    return expr.prim.fn(*self.eval_exprs(expr.args))
+
+  def expr_Cast(self, expr):
+    return to_type(self.eval_expr(expr.value), expr.type)
+
+  def expr_Select(self, expr):
+    cond = self.eval_expr(expr.cond)
+    if isinstance(cond, np.ndarray):
+      return np.where(cond, self.eval_expr(expr.true_value), self.eval_expr(expr.false_value))
+    return self.eval_expr(expr.true_value) if cond else self.eval_expr(expr.false_value)
+
+  def expr_Index(self, expr):
+    return self.eval_expr(expr.value)[self.eval_expr(expr.index)]
+
+  def expr_Slice(self, expr):
+    return slice(self.eval_expr(expr.start), self.eval_expr(expr.stop),
+                 self.eval_expr(expr.step))
+
+  def expr_Attribute(self, expr):
+    value = self.eval_expr(expr.value)
+    name = expr.name
+    if isinstance(value, tuple):
+      return value[int(name[3:]) if name.startswith('elt') else int(name)]
+    elif name == 'strides':
+      return tuple(s / value.dtype.itemsize for s in value.strides)
+    elif name == 'offset':
+      if value.base is None:
+        return 0
+      return (value.ctypes.data - value.base.ctypes.data) / value.dtype.itemsize
+    elif name == 'data':
+      return np.ravel(value)
+    elif name == 'step' and getattr(value, 'step', None) is None:
+      return 1
+    assert hasattr(value, name), "Missing attribute %s from value %s" % (name, value)
+    return getattr(value, name)
+
+  def expr_Len(self, expr):
+    return len(self.eval_expr(expr.value))
+
+  def expr_Shape(self, expr):
+    return np.shape(self.eval_expr(expr.array))
+
+  def expr_Strides(self, expr):
+    value = self.eval_expr(expr.array)
+    return tuple(s / value.dtype.itemsize for s in value.strides)
+
+  def expr_Array(self, expr):
+    return np.array(self.eval_exprs(expr.elts), dtype = expr.type.elt_type.dtype)
+
+  def expr_AllocArray(self, expr):
+    return np.empty(index_shape(self.eval_expr(expr.shape)), dtype = expr.elt_type.dtype)
+
+  def expr_Alloc(self, expr):
+    return np.empty((self.eval_expr(expr.count),), dtype = expr.elt_type.dtype)
+
+  def expr_ArrayView(self, expr):
+    data = self.eval_expr(expr.data)
+    itemsize = expr.type.elt_type.dtype.itemsize
+    return np.ndarray(shape = index_shape(self.eval_expr(expr.shape)),
+                      buffer = data.data if isinstance(data, np.ndarray) else data,
+                      offset = self.eval_expr(expr.offset) * itemsize,
+                      strides = tuple(s * itemsize for s in index_shape(self.eval_expr(expr.strides))),
+                      dtype = expr.type.elt_type.dtype)
+
+  def expr_ConstArray(self, expr):
+    return broadcast_into(self.eval_expr(expr.value), index_shape(self.eval_expr(expr.shape)),
+                          expr.type.elt_type.dtype)
+
+  def expr_ConstArrayLike(self, expr):
+    return broadcast_into(self.eval_expr(expr.value), np.shape(self.eval_expr(expr.array)),
+                          expr.type.elt_type.dtype)
+
+  def expr_DiagonalArray(self, expr):
+    shape = index_shape(self.eval_expr(expr.shape))
+    offset = self.eval_if_expr(expr.offset) or 0
+    return np.eye(shape[0], shape[1] if len(shape) > 1 else None, offset,
+                  dtype = expr.type.elt_type.dtype) * self.eval_expr(expr.value)
+
+  def expr_ExtractDiagonal(self, expr):
+    return np.diag(self.eval_expr(expr.array))
+
+  def expr_Range(self, expr):
+    return np.arange(self.eval_expr(expr.start), self.eval_expr(expr.stop),
+                     self.eval_expr(expr.step), dtype = expr.type.elt_type.dtype)
+
+  def expr_Ravel(self, expr):
+    return np.ravel(self.eval_expr(expr.array))
+
+  def expr_Reshape(self, expr):
+    return self.eval_expr(expr.array).reshape(index_shape(self.eval_expr(expr.shape)))
+
+  def expr_Transpose(self, expr):
+    return np.transpose(self.eval_expr(expr.array))
+
+  def expr_Tile(self, expr):
+    return np.tile(self.eval_expr(expr.array), self.eval_expr(expr.reps))
+
+  def expr_Where(self, expr):
+    return np.where(self.eval_expr(expr.array))
+
+  def expr_Compress(self, expr):
+    return np.compress(self.eval_expr(expr.condition), self.eval_expr(expr.data))
+
+  def expr_Map(self, expr):
+    args = self.eval_exprs(expr.args)
+    axes = normalize_axes(self.eval_axis(expr.axis), args)
+    return eval_map(self.eval_expr(expr.fn), args, axes, expr.type)
+
+  def expr_OuterMap(self, expr):
+    args = self.eval_exprs(expr.args)
+    axes = normalize_axes(self.eval_axis(expr.axis), args)
+    return eval_outer_map(self.eval_expr(expr.fn), args, axes, expr.type)
+
+  def expr_Reduce(self, expr):
+    args = self.eval_exprs(expr.args)
+    args, axes = reduce_args(args, normalize_axes(self.eval_axis(expr.axis), args))
+    values = mapped_values(self.eval_expr(expr.fn), args, axes)
+    return fold(self.eval_expr(expr.combine), values, self.eval_if_expr(expr.init), expr.type)
+
+  def expr_Scan(self, expr):
+    args = self.eval_exprs(expr.args)
+    args, axes = reduce_args(args, normalize_axes(self.eval_axis(expr.axis), args))
+    values = mapped_values(self.eval_expr(expr.fn), args, axes)
+    return scan(self.eval_expr(expr.combine), self.eval_expr(expr.emit), values,
+                self.eval_if_expr(expr.init), expr.type)
+
+  def expr_IndexMap(self, expr):
+    shape = index_shape(self.eval_expr(expr.shape))
+    values = index_values(self.eval_expr(expr.fn), shape, self.eval_if_expr(expr.start_index))
+    if isinstance(values, np.ndarray):
+      return to_type(values, expr.type)
+    return stack(values, shape, expr.type)
+
+  def index_reduction_values(self, expr):
+    shape = index_shape(self.eval_expr(expr.shape))
+    values = index_values(self.eval_expr(expr.fn), shape, self.eval_if_expr(expr.start_index))
+    if isinstance(values, np.ndarray):
+      return values.reshape((-1,) + values.shape[len(shape):])
+    return values
+
+  def expr_IndexReduce(self, expr):
+    return fold(self.eval_expr(expr.combine), self.index_reduction_values(expr),
+                self.eval_if_expr(expr.init), expr.type)
+
+  def expr_IndexScan(self, expr):
+    return scan(self.eval_expr(expr.combine), self.eval_expr(expr.emit),
+                self.index_reduction_values(expr), self.eval_if_expr(expr.init), expr.type)
+
+  #############################################
+  #
+  #  Statements
+  #
+  #############################################
+
+  def assign(self, lhs, value):
+    c = lhs.__class__
+    if c is Var:
+      if isinstance(lhs.type, ScalarT) and not isinstance(value, np.ndarray):
+        value = lhs.type.dtype.type(value)
+      self.env[lhs.name] = value
+    elif c is Tuple:
+      for (elt, v) in zip(lhs.elts, value):
+        self.assign(elt, v)
+    elif c is Index:
+      self.eval_expr(lhs.value)[self.eval_expr(lhs.index)] = value
+    else:
+      assert False, "Unexpected LHS %s" % lhs
+
+  def eval_merge(self, merge, side):
+    values = [(name, self.eval_expr(exprs[side])) for (name, exprs) in merge.iteritems()]
+    for (name, value) in values:
+      self.env[name] = value
+
+  def eval_lifted_if(self, stmt, cond):
+    """
+    With a condition per element, run both branches and pick
+    each element's merged values from the one it would have taken
+    """
+    env = self.env
+    merged = {}
+    for (side, block) in enumerate([stmt.true, stmt.false]):
+      self.env = dict(env)
+      self.eval_block(block)
+      for (name, exprs) in stmt.merge.iteritems():
+        merged.setdefault(name, []).append(self.eval_expr(exprs[side]))
+    self.env = env
+    for (name, (true_value, false_value)) in merged.iteritems():
+      env[name] = np.where(cond, true_value, false_value)
+
+  def eval_block(self, stmts):
+    for stmt in stmts:
+      c = stmt.__class__
+      if c is Assign:
+        self.assign(stmt.lhs, self.eval_expr(stmt.rhs))
+      elif c is Return:
+        raise ReturnValue(self.eval_expr(stmt.value))
+      elif c is ExprStmt:
+        self.eval_expr(stmt.value)
+      elif c is If:
+        cond = self.eval_expr(stmt.cond)
+        if isinstance(cond, np.ndarray):
+          self.eval_lifted_if(stmt, cond)
+        elif cond:
+          self.eval_block(stmt.true)
+          self.eval_merge(stmt.merge, 0)
+        else:
+          self.eval_block(stmt.false)
+          self.eval_merge(stmt.merge, 1)
+      elif c is While:
+        self.eval_merge(stmt.merge, 0)
+        while self.eval_expr(stmt.cond):
+          self.eval_block(stmt.body)
+          self.eval_merge(stmt.merge, 1)
+      elif c is ForLoop:
+        start = self.eval_expr(stmt.start)
+        stop = self.eval_expr(stmt.stop)
+        step = self.eval_expr(stmt.step)
+        self.eval_merge(stmt.merge, 0)
+        for i in xrange(start, stop, step):
+          self.env[stmt.var.name] = i
+          self.eval_block(stmt.body)
+          self.eval_merge(stmt.merge, 1)
+      elif c is ParFor:
+        fn = self.eval_expr(stmt.fn)
+        for idx in np.ndindex(*index_shape(self.eval_expr(stmt.bounds))):
+          eval_fn(fn, index_args(fn, idx) if len(idx) > 1 else [idx[0]])
+      elif c is not Comment:
+        assert False, "Statement %s not supported by the NumPy interpreter" % stmt
+
+_prepared = {}
+def prepare(fn):
+  """
+  Run the optimizations which precede indexification, whose output
+  (rather than loops over indices) is what this interpreter is good at
+  """
+  from tiering import compile_lock
+  from transforms.pipeline import adverb_optimizations
+  key = fn.cache_key
+  if key not in _prepared:
+    with compile_lock:
+      _prepared[key] = adverb_optimizations.apply(fn)
+  return _prepared[key]
+
+def run(fn, args):
+  prepared = prepare(fn)
+  with np.errstate(all = 'ignore'):
+    result = eval_fn(prepared, args)
+  return to_type(result, fn.return_type)
@@ -1,2 +1,5 @@
 from multicore_compiler import MulticoreCompiler
-from run_function import run 
\ No newline at end of file
+from run_function import run
+from thread_settings import (set_num_threads, get_num_threads, 
+                             set_schedule, get_schedule, thread_pool)
+from calibration import calibrate_parallel_threshold, get_parallel_threshold
@@ -0,0 +1,121 @@
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from ..c_backend import config as c_config
+import config
+
+calibration_filename = "openmp_calibration.json"
+
+def calibration_path():
+  if not c_config.cache_dir:
+    return None
+  return os.path.join(c_config.cache_dir, calibration_filename)
+
+def load_calibration():
+  """
+  Read the parallel threshold saved for this machine, returns None if there
+  isn't one or it was measured with a different number of cores
+  """
+  path = calibration_path()
+  if path is None or not os.path.exists(path):
+    return None
+  try:
+    with open(path) as f:
+      saved = json.load(f)
+  except (IOError, ValueError):
+    return None
+  if saved.get('cpu_count') != multiprocessing.cpu_count():
+    return None
+  return saved.get('parallel_threshold')
+
+def save_calibration(threshold):
+  path = calibration_path()
+  if path is None:
+    return
+  if not os.path.exists(c_config.cache_dir):
+    os.makedirs(c_config.cache_dir)
+  with open(path, 'w') as f:
+    json.dump({'cpu_count' : multiprocessing.cpu_count(),
+               'parallel_threshold' : threshold}, f)
+
+_saved_threshold = []
+def get_parallel_threshold():
+  """
+  Minimum estimated work for a loop to run in parallel, taken from
+  config.parallel_threshold if it's set, otherwise from the calibration
+  saved in the cache directory
+  """
+  if config.parallel_threshold is not None:
+    return config.parallel_threshold
+  if not _saved_threshold:
+    _saved_threshold.append(load_calibration())
+  if _saved_threshold[0] is not None:
+    return _saved_threshold[0]
+  return config.default_parallel_threshold
+
+def _add1(x):
+  return x + 1.0
+
+def _best_time(fn, x, repeat):
+  best = None
+  for _ in xrange(repeat):
+    start = time.time()
+    fn(x, _backend = 'openmp')
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def calibrate_parallel_threshold(save = True, repeat = 25, max_log_size = 22):
+  """
+  Find the smallest array for which a simple parallel map beats its
+  sequential version on this machine, and turn that into a threshold on
+  estimated work. Unless save = False, the result is stored in the cache
+  directory where later processes will find it.
+  """
+  from ..frontend import jit
+  from ..analysis import estimate_cost
+  from ..frontend import specialize
+  from ..syntax import ParFor
+  from ..syntax.helpers import get_fn
+  from ..transforms.pipeline import lower_to_adverbs
+
+  add1 = jit(_add1)
+  typed_fn, _ = specialize(add1.fn, [np.zeros(1)])
+  lowered = lower_to_adverbs.apply(typed_fn)
+  parfors = [stmt for stmt in lowered.body if stmt.__class__ is ParFor]
+  body_cost = estimate_cost(get_fn(parfors[0].fn)) if parfors else 3
+
+  old_threshold = config.parallel_threshold
+  crossover = None
+  # to avoid being fooled by timing noise, parallel execution has to
+  # win for two consecutive sizes
+  candidate = None
+  try:
+    for log_size in xrange(4, max_log_size + 1):
+      x = np.zeros(2 ** log_size)
+      config.parallel_threshold = 2 ** 62
+      sequential = _best_time(add1, x, repeat)
+      config.parallel_threshold = 0
+      parallel = _best_time(add1, x, repeat)
+      if parallel >= sequential:
+        candidate = None
+      elif candidate is None:
+        candidate = len(x)
+      else:
+        crossover = candidate
+        break
+  finally:
+    config.parallel_threshold = old_threshold
+
+  if crossover is None:
+    crossover = 2 ** max_log_size
+  threshold = crossover * body_cost
+  if save:
+    save_calibration(threshold)
+    del _saved_threshold[:]
+  return threshold
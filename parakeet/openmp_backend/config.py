@@ -1,2 +1,34 @@
 collapse_nested_loops = True
-schedule = 'static'
+
+# when a parallel loop has fewer iterations than there are threads but the 
+# parallel loops in its body have more, run it sequentially and split those 
+# across threads instead, checking the extents on every call
+plan_nested_parallelism = True
+
+# run independent parallel loops and reductions which follow each other in 
+# one parallel region, so threads don't wait at the end of each of them and 
+# reductions which would otherwise run sequentially overlap with other loops
+overlap_independent_loops = True
+
+# OpenMP loop schedule baked into generated code:
+#   'static', 'dynamic', 'guided' or 'auto' fix the schedule at compile time,
+#   'runtime' compiles once and lets the schedule below (or the _schedule
+#   keyword / thread_pool scope) choose it on every call
+schedule = 'runtime'
+
+# schedule and chunk size used for 'runtime' loops unless overridden
+# for a call, a chunk size of 0 means the OpenMP default
+runtime_schedule = 'static'
+runtime_chunk_size = 0
+
+# number of threads to use for parallel loops,
+# None means the OpenMP default (usually all cores or OMP_NUM_THREADS)
+num_threads = None
+
+# parallel loops whose estimated work (trip count times the estimated cost 
+# of their body, in units of simple scalar operations) is below this threshold 
+# run sequentially. None means use the value saved by 
+# calibrate_parallel_threshold() in the compiler's cache directory, 
+# or default_parallel_threshold if this machine was never calibrated
+parallel_threshold = None
+default_parallel_threshold = 20000
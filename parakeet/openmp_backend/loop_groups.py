@@ -0,0 +1,113 @@
+from collections import namedtuple
+
+from ..analysis.collect_vars import collect_var_names
+from ..analysis.escape_analysis import may_alias
+from ..analysis.written_args import WrittenArgs
+from ..syntax import Assign, Comment, Tuple, Var
+from ..syntax.helpers import get_closure_args, get_fn
+from ..transforms.horizontal_fusion import has_effects, stmt_var_names
+
+# a run of statements fn.body[start:stop] in which the loops don't depend on
+# each other, so they can all run in one parallel region once the other
+# statements in the run (hoisted) have been executed before it
+LoopGroup = namedtuple("LoopGroup", ("start", "stop", "hoisted", "loops"))
+
+class LoopDependences(object):
+  """
+  Which arrays and variables the parallel loops and reductions of a
+  function might read or write, taking into account which of its
+  variables might share data according to escape analysis
+  """
+  def __init__(self, fn):
+    self.alias_sets = may_alias(fn)
+
+  def aliases(self, var_names):
+    result = set([])
+    for name in var_names:
+      result.update(self.alias_sets.get(name, [name]))
+    return result
+
+  def loop_fn(self, stmt):
+    return stmt.rhs.fn if stmt.__class__ is Assign else stmt.fn
+
+  def written(self, stmt):
+    """
+    Variables whose data the loop might write
+    """
+    fn_expr = self.loop_fn(stmt)
+    fn = get_fn(fn_expr)
+    written_params = WrittenArgs().visit_fn(fn)
+    result = set([])
+    for (param, arg) in zip(fn.arg_names, get_closure_args(fn_expr)):
+      if param in written_params:
+        result.update(collect_var_names(arg))
+    return self.aliases(result)
+
+  def touched(self, stmt):
+    """
+    Variables whose data the statement might read or write
+    """
+    return self.aliases(stmt_var_names(stmt))
+
+  def results(self, stmt):
+    return set([stmt.lhs.name]) if stmt.__class__ is Assign else set([])
+
+  def independent(self, stmt, loops):
+    written = self.written(stmt)
+    touched = self.touched(stmt)
+    for other in loops:
+      if written & self.touched(other) or touched & self.written(other) or \
+         touched & self.results(other):
+        return False
+    return True
+
+  def movable(self, stmt, loops):
+    """
+    Can the statement run before all of the given loops?
+    """
+    if stmt.__class__ is Comment:
+      return True
+    if stmt.__class__ is not Assign or stmt.lhs.__class__ not in (Var, Tuple) or \
+       has_effects(stmt.rhs):
+      return False
+    touched = self.touched(stmt)
+    for loop in loops:
+      if touched & self.written(loop) or touched & self.results(loop):
+        return False
+    return True
+
+def find_loop_groups(fn, is_member):
+  """
+  Groups of at least two independent loops in the body of a function,
+  where is_member picks out the statements which the backend knows how
+  to run alongside others
+  """
+  dependences = LoopDependences(fn)
+  body = fn.body
+  groups = []
+  i = 0
+  while i < len(body):
+    if not is_member(body[i]):
+      i += 1
+      continue
+    loops = [body[i]]
+    hoisted = []
+    pending = []
+    stop = i + 1
+    for j in xrange(i + 1, len(body)):
+      stmt = body[j]
+      if is_member(stmt) and dependences.independent(stmt, loops):
+        loops.append(stmt)
+        hoisted.extend(pending)
+        pending = []
+        stop = j + 1
+      elif dependences.movable(stmt, loops):
+        pending.append(stmt)
+      else:
+        break
+    if len(loops) > 1:
+      groups.append(LoopGroup(i, stop, hoisted, loops))
+      i = stop
+    else:
+      i += 1
+  return groups
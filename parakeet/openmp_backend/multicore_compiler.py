@@ -1,10 +1,12 @@
-import multiprocessing 
-
 from .. import prims 
-from ..syntax import Expr, Tuple, Assign, Return, Var, PrimCall 
+from ..analysis import estimate_cost
+from ..syntax import Expr, Tuple, Assign, Return, Var, PrimCall, ParFor, IndexReduce, Closure, TypedFn 
 from ..syntax.helpers import get_fn, return_type
 from ..ndtypes import ScalarT, TupleT, ArrayT
 from ..c_backend import PyModuleCompiler
+from ..c_backend.allocation import current_allocation
+from loop_groups import find_loop_groups
+from parallel_planner import largest_nested_extent
 
 import config 
 
@@ -13,21 +15,116 @@ class MulticoreCompiler(PyModuleCompiler):
   def __init__(self, depth = 0, *args, **kwargs):
     self.depth = depth
     self.seen_parfor = None 
+    self.loop_groups = {}
     PyModuleCompiler.__init__(self, *args, **kwargs)
   
-  @property 
+  @property
   def cache_key(self):
-    return self.__class__, self.depth > 0
-  
+    # the schedule and loop collapsing are baked into the generated pragmas,
+    # whereas the thread count and runtime schedule are chosen per call
+    return self.__class__, self.depth > 0, config.schedule, config.collapse_nested_loops, \
+      config.plan_nested_parallelism, config.overlap_independent_loops, current_allocation()
+
+  num_threads_var = "parakeet_num_threads"
+  num_threads_decl = "static __thread int %s = 1" % num_threads_var
+  threshold_var = "parakeet_parallel_threshold"
+  threshold_decl = "static __thread int64_t %s = 0" % threshold_var
+
   _loop_var_names = ["i","j","k","l","a","b","c","ii","jj","kk","ll","aa","bb","cc"] 
-  def loop_vars(self, count, init_value = "0"):
+  def loop_vars(self, count, init_value = "0", index_types = None):
+    """
+    Declare the counters of a loop nest, which are 64-bit integers 
+    unless the loop body takes indices of some other type 
+    """
     assert count <= len(self._loop_var_names)
-    return [self.fresh_var("int64_t", self._loop_var_names[i], init_value) 
+    if index_types is None:
+      ctypes = ["int64_t"] * count
+    else:
+      ctypes = [self.to_ctype(t) for t in index_types]
+    return [self.fresh_var(ctypes[i], self._loop_var_names[i], init_value) 
             for i in xrange(count)]
+  
+  def index_types(self, fn_expr, count):
+    """
+    Types of the indices a loop body takes, or None if it takes a tuple
+    """
+    input_types = get_fn(fn_expr).input_types
+    if len(input_types) < count or isinstance(input_types[-1], TupleT):
+      return None
+    return input_types[-count:]
        
   def visit_NumCores(self, expr):
-    # by default we're running sequentially 
-    return "%d" % multiprocessing.cpu_count()
+    # the thread count is chosen when the module entry gets called,
+    # inside a parallel region ask OpenMP since our variable is thread-local
+    self.add_decl(self.num_threads_decl)
+    return "(omp_in_parallel() ? omp_get_num_threads() : %s)" % self.num_threads_var
+
+  def enter_module_body(self):
+    """
+    Read the thread count and runtime schedule which openmp_backend.run
+    appends after the function's own arguments, fall back on OpenMP's
+    defaults when they're missing
+    """
+    self.add_header("omp.h")
+    self.add_compile_flag("-fopenmp")
+    self.add_link_flag("-fopenmp")
+    self.add_decl(self.num_threads_decl)
+    self.add_decl(self.threshold_decl)
+    args = self.entry_args_var
+    n = self.n_entry_args
+    var = self.num_threads_var
+    self.comment("Number of threads and loop schedule are chosen per call")
+    self.append("%s = omp_get_max_threads();" % var)
+    self.append("""
+      if (PyTuple_GET_SIZE(%(args)s) > %(n)d) {
+        long requested_threads = PyInt_AsLong(PyTuple_GET_ITEM(%(args)s, %(n)d));
+        if (requested_threads > 0) { %(var)s = (int) requested_threads; }
+      }""" % locals())
+    if config.schedule == 'runtime':
+      kind = n + 1
+      chunk = n + 2
+      self.append("""
+      if (PyTuple_GET_SIZE(%(args)s) > %(chunk)d) {
+        omp_set_schedule((omp_sched_t) PyInt_AsLong(PyTuple_GET_ITEM(%(args)s, %(kind)d)),
+                         (int) PyInt_AsLong(PyTuple_GET_ITEM(%(args)s, %(chunk)d)));
+      }""" % locals())
+    threshold = n + 3
+    threshold_var = self.threshold_var
+    self.append("""
+      if (PyTuple_GET_SIZE(%(args)s) > %(threshold)d) {
+        %(threshold_var)s = PyInt_AsLong(PyTuple_GET_ITEM(%(args)s, %(threshold)d));
+      }""" % locals())
+  
+  page_size = 4096
+  
+  def alloc_array(self, array_t, shape_expr, storage = None):
+    """
+    Outside of parallel loops, touch the pages of large new arrays with a 
+    schedule(static) loop so that each thread writes first to the part of 
+    the array a schedule(static) ParFor over its elements would give it
+    """
+    result = PyModuleCompiler.alloc_array(self, array_t, shape_expr, storage = storage)
+    first_touch_min_bytes = current_allocation()[2]
+    if first_touch_min_bytes is None or self.depth > 0 or storage is not None:
+      return result
+    self.add_compile_flag("-fopenmp")
+    self.add_link_flag("-fopenmp")
+    self.add_decl(self.num_threads_decl)
+    nbytes = "(%s.size * %d)" % (result, array_t.elt_type.dtype.itemsize)
+    page = self.fresh_name("page")
+    self.append("""
+      if (%(nbytes)s >= %(min_bytes)dLL) {
+        char* first_touch_ptr = (char*) %(result)s.data.raw_ptr;
+        int64_t n_pages = (%(nbytes)s + %(page_size)d - 1) / %(page_size)d;
+        int64_t %(page)s;
+        #pragma omp parallel for schedule(static) num_threads(%(num_threads)s)
+        for (%(page)s = 0; %(page)s < n_pages; ++%(page)s) { 
+          first_touch_ptr[%(page)s * %(page_size)d] = 0; 
+        }
+      }""" % dict(nbytes = nbytes, min_bytes = first_touch_min_bytes, 
+                  result = result, page = page, page_size = self.page_size, 
+                  num_threads = self.num_threads_var))
+    return result 
   
   def tuple_to_var_list(self, expr):
     assert isinstance(expr, Expr)
@@ -100,20 +197,41 @@ class MulticoreCompiler(PyModuleCompiler):
       self.seen_parfor = True 
       self.add_compile_flag("-fopenmp")
       self.add_link_flag("-fopenmp")
-    
+      self.add_decl(self.num_threads_decl)
+      self.add_decl(self.threshold_decl)
+
   def exit_parfor(self):
     self.depth -= 1
 
-  def omp_pragma(self, n_loops, private_vars, reduce_op = None, reduce_vars = None):
-    if config.collapse_nested_loops:
-      omp = "#pragma omp parallel for private(%s) schedule(%s)" % \
-        (", ".join(private_vars), config.schedule)
-      if n_loops > 1:
-        omp += " collapse(%d)" % n_loops
-    else:
-      omp = "#pragma omp parallel for private(%s) schedule(%s)" % \
-          (private_vars[0], config.schedule)
-    
+  def estimated_work(self, bounds, fns):
+    """
+    C expression for the estimated work of a loop nest: its trip count times
+    the static cost estimate of the functions called in its body
+    """
+    body_cost = sum(estimate_cost(get_fn(fn)) for fn in fns)
+    return " * ".join(["((int64_t) %s)" % bound for bound in bounds] + ["%dLL" % body_cost])
+
+  def omp_for_clauses(self, n_loops, private_vars, collapse = None):
+    """
+    Work-sharing clauses of a parallel loop nest, the counters of inner 
+    loops which don't get collapsed are declared outside of it so they 
+    need to be private as well 
+    """
+    if collapse is None:
+      collapse = config.collapse_nested_loops
+    clauses = "private(%s) schedule(%s)" % (", ".join(private_vars), config.schedule)
+    if collapse and n_loops > 1:
+      clauses += " collapse(%d)" % n_loops
+    return clauses 
+  
+  def omp_pragma(self, n_loops, private_vars, reduce_op = None, reduce_vars = None, work = None, 
+                 collapse = None):
+    omp = "#pragma omp parallel for " + self.omp_for_clauses(n_loops, private_vars, collapse)
+    omp += " num_threads(%s)" % self.num_threads_var
+    if work is not None:
+      # small loops aren't worth waking up the other threads
+      omp += " if(%s >= %s)" % (work, self.threshold_var)
+
     if reduce_op:
       omp += " reduction (%s:%s)" % (reduce_op, ", ".join(reduce_vars))
     return omp 
@@ -121,7 +239,8 @@ class MulticoreCompiler(PyModuleCompiler):
   def visit_ParFor(self, stmt):
     bounds = self.tuple_to_var_list(stmt.bounds)
     n_vars = len(bounds)
-    loop_vars = self.loop_vars(n_vars)
+    # narrow_indices gives loops which fit in 32 bits a body taking int32 indices 
+    loop_vars = self.loop_vars(n_vars, index_types = self.index_types(stmt.fn, n_vars))
     
     self.enter_parfor()
     body, private_vars = self.build_loop_body(stmt.fn, loop_vars)
@@ -129,14 +248,151 @@ class MulticoreCompiler(PyModuleCompiler):
     self.exit_parfor()
     
     if self.depth == 0:  
-      release_gil = "\nPy_BEGIN_ALLOW_THREADS\n"
-      acquire_gil = "\nPy_END_ALLOW_THREADS\n" 
-      omp = self.omp_pragma(len(loop_vars), private_vars)
-      return release_gil + omp + loops + acquire_gil    
+      return self.plan_parfor(stmt, bounds, loop_vars, private_vars, loops)
     else:
       return loops 
-     
   
+  def plan_parfor(self, stmt, bounds, loop_vars, private_vars, loops):
+    """
+    Choose on every call which loop level of a parallel loop nest to split 
+    across threads. By default that's the outermost ParFor (collapsed with 
+    the indices after its first one if its first extent is smaller than the 
+    thread count), but when it has fewer iterations than there are threads 
+    and the parallel loops in its body have more (as far as shape inference 
+    can tell from the closure arguments), the outer loop runs sequentially 
+    and each of those inner loops gets its own parallel region instead  
+    """
+    release_gil = "\nPy_BEGIN_ALLOW_THREADS\n"
+    acquire_gil = "\nPy_END_ALLOW_THREADS\n" 
+    n_threads = self.num_threads_var
+    work = self.estimated_work(bounds, [stmt.fn])
+    omp = self.omp_pragma(len(loop_vars), private_vars, work = work)
+    parallel = release_gil + omp + loops + acquire_gil
+    if len(loop_vars) > 1 and not config.collapse_nested_loops:
+      collapsed = self.omp_pragma(len(loop_vars), private_vars, work = work, collapse = True)
+      parallel = """
+        if (%s >= %s) {%s
+        } else {%s
+        }""" % (bounds[0], n_threads, parallel, release_gil + collapsed + loops + acquire_gil)
+    
+    if not config.plan_nested_parallelism:
+      return parallel 
+    closure_args = self.get_closure_args(stmt.fn)
+    inner_extent = largest_nested_extent(get_fn(stmt.fn), closure_args)
+    if inner_extent is None:
+      return parallel 
+    # compiling the body outside of a parallel region lets its own loops use threads 
+    body, _ = self.build_loop_body(stmt.fn, loop_vars)
+    sequential = self.build_loops(loop_vars, bounds, body)
+    outer_extent = " * ".join("((int64_t) %s)" % bound for bound in bounds)
+    return """
+      if (%(outer_extent)s < %(n_threads)s && %(inner_extent)s > %(outer_extent)s) {%(sequential)s
+      } else {%(parallel)s
+      }""" % locals()
+  
+  def loop_group_member(self, stmt):
+    """
+    Parallel loops and reductions which can share a parallel region with 
+    other loops: the ones with an OpenMP reduction operator and the ones 
+    which would otherwise run sequentially
+    """
+    if stmt.__class__ is ParFor:
+      return stmt.fn.__class__ in (Closure, TypedFn)
+    elif stmt.__class__ is Assign and stmt.lhs.__class__ is Var and \
+         stmt.rhs.__class__ is IndexReduce:
+      expr = stmt.rhs 
+      return expr.init is not None and getattr(expr, 'output', None) is None and \
+        (self.omp_reduce_op(expr) is not None or not self.per_thread_combine(expr))
+    return False 
+  
+  def visit_fn(self, fn):
+    if config.overlap_independent_loops:
+      for group in find_loop_groups(fn, self.loop_group_member):
+        self.loop_groups[id(fn.body[group.start])] = group
+    return PyModuleCompiler.visit_fn(self, fn)
+  
+  def visit_block(self, stmts, push = True):
+    if len(self.loop_groups) == 0:
+      return PyModuleCompiler.visit_block(self, stmts, push)
+    if push: self.push()
+    i = 0
+    while i < len(stmts):
+      group = self.loop_groups.get(id(stmts[i]))
+      if group is None:
+        self.append(self.visit_stmt(stmts[i]))
+        i += 1
+      else:
+        self.visit_loop_group(group)
+        i += group.stop - group.start 
+    self.append("\n")
+    return self.pop()
+  
+  def visit_loop_group(self, group):
+    """
+    Run independent loops in a single parallel region, where threads which 
+    are done with their share of one loop move on to the next one without
+    waiting for the others (nowait) and reductions whose combine function 
+    isn't an OpenMP operator run on one thread alongside the other loops
+    """
+    for stmt in group.hoisted:
+      self.append(self.visit_stmt(stmt))
+    single_parts = []
+    shared_parts = []
+    works = []
+    results = []
+    for stmt in group.loops:
+      if stmt.__class__ is ParFor:
+        bounds = self.tuple_to_var_list(stmt.bounds)
+        n_vars = len(bounds)
+        loop_vars = self.loop_vars(n_vars, index_types = self.index_types(stmt.fn, n_vars))
+        self.enter_parfor()
+        body, private_vars = self.build_loop_body(stmt.fn, loop_vars)
+        loops = self.build_loops(loop_vars, bounds, body)
+        self.exit_parfor()
+        clauses = self.omp_for_clauses(n_vars, private_vars)
+        shared_parts.append("#pragma omp for %s nowait%s" % (clauses, loops))
+        works.append(self.estimated_work(bounds, [stmt.fn]))
+        continue 
+      expr = stmt.rhs
+      bounds = self.tuple_to_var_list(expr.shape)
+      n_vars = len(bounds)
+      acc = self.fresh_var(expr.type, "acc", self.visit_expr(expr.init))
+      loop_vars = self.loop_vars(n_vars)
+      elt = self.fresh_var(return_type(expr.fn), "elt")
+      omp_reduce_op = self.omp_reduce_op(expr)
+      self.enter_parfor()
+      body, private_vars = self.build_loop_body(expr.fn, loop_vars, target_name = elt)
+      if omp_reduce_op:
+        body += "\n%s = %s %s %s;" % (acc, acc, omp_reduce_op, elt)
+      else:
+        combine_name, combine_closure_args, _ = self.get_fn_info(expr.combine)
+        combine_arg_str = ", ".join(tuple(combine_closure_args) + (acc, elt))
+        body += "\n%s = %s(%s);\n" % (acc, combine_name, combine_arg_str)
+      loops = self.build_loops(loop_vars, bounds, body)
+      self.exit_parfor()
+      if omp_reduce_op:
+        clauses = self.omp_for_clauses(n_vars, private_vars + [elt])
+        shared_parts.append("#pragma omp for %s reduction (%s:%s) nowait%s" % \
+                            (clauses, omp_reduce_op, acc, loops))
+      else:
+        single_parts.append("#pragma omp single nowait\n{%s\n}" % loops)
+      works.append(self.estimated_work(bounds, [expr.fn, expr.combine]))
+      results.append((stmt.lhs, acc))
+    # start the sequential reductions first so the other threads can pick up 
+    # the slack in the loops after them 
+    parts = "\n".join(single_parts + shared_parts)
+    n_threads = self.num_threads_var
+    work = " + ".join("(%s)" % w for w in works)
+    threshold = self.threshold_var
+    self.append("""
+      Py_BEGIN_ALLOW_THREADS
+      #pragma omp parallel num_threads(%(n_threads)s) if(%(work)s >= %(threshold)s)
+      {
+        %(parts)s
+      }
+      Py_END_ALLOW_THREADS""" % locals())
+    for (lhs, acc) in results:
+      self.append("%s %s = %s;" % (self.to_ctype(lhs.type), self.visit_expr(lhs), acc))
   
   def get_binop_prim(self, fn):
     """
@@ -198,31 +454,107 @@ class MulticoreCompiler(PyModuleCompiler):
        
     
       
-  def visit_IndexReduce(self, expr):
+  def scalar_fields(self, t):
     """
-    For now, just use a sequential implementation for reductions
+    Is the type a scalar or a tuple of them, i.e. safe to copy 
+    around inside a parallel region?
+    """
+    if isinstance(t, ScalarT):
+      return True 
+    return isinstance(t, TupleT) and all(self.scalar_fields(elt_t) for elt_t in t.elt_types)
+  
+  def per_thread_reduction(self, expr, acc, bounds):
+    """
+    Parallel reduction for combine functions OpenMP doesn't know about: each
+    thread reduces its own contiguous block of iterations starting from its
+    first element, then the partial results get combined into the 
+    accumulator in thread order, which only requires combine to be 
+    associative 
     """
-    bounds = self.tuple_to_var_list(expr.shape)
     n_vars = len(bounds)
-    acc = self.fresh_var(expr.type, "acc", self.visit_expr(expr.init))
-    # try to get a simple primitive to use as the OpenMP combiner
-    # if this isn't possible then run the loops sequentially
-    #
-    # TODO: instead of falling back on sequential execution 
-    # use complex combiners by generating one 
-    # accumulator value per thread and then combining those
+    loop_vars = self.loop_vars(n_vars)
+    elt = self.fresh_var(expr.type, "elt")
+    partial = self.fresh_var(expr.type, "partial")
+    has_partial = self.fresh_var("int", "has_partial", "0")
+    self.enter_parfor()
+    body, private_vars = self.build_loop_body(expr.fn, loop_vars, target_name = elt)
+    combine_name, combine_closure_args, _ = self.get_fn_info(expr.combine)
+    combine_call = "%s(%s)" % (combine_name, ", ".join(tuple(combine_closure_args) + (partial, elt)))
+    body += """
+      if (%(has_partial)s) { %(partial)s = %(combine_call)s; }
+      else { %(partial)s = %(elt)s; %(has_partial)s = 1; }""" % locals()
+    loops = self.build_loops(loop_vars, bounds, body)
+    self.exit_parfor()
+    
+    c_acc_t = self.to_ctype(expr.type)
+    partials = self.fresh_name("partials")
+    partial_counts = self.fresh_name("has_partials")
+    t = self.fresh_name("thread_id")
+    n_threads = self.num_threads_var
+    private = ", ".join(private_vars + [elt, partial, has_partial])
+    collapse = " collapse(%d)" % n_vars if config.collapse_nested_loops and n_vars > 1 else ""
+    work = self.estimated_work(bounds, [expr.fn, expr.combine])
+    threshold = self.threshold_var
+    final_combine = "%s(%s)" % (combine_name, ", ".join(tuple(combine_closure_args) + 
+                                                         (acc, "%s[%s]" % (partials, t))))
+    self.append("""
+    {
+      %(c_acc_t)s %(partials)s[%(n_threads)s];
+      int %(partial_counts)s[%(n_threads)s];
+      int %(t)s;
+      for (%(t)s = 0; %(t)s < %(n_threads)s; ++%(t)s) { %(partial_counts)s[%(t)s] = 0; }
+      Py_BEGIN_ALLOW_THREADS
+      #pragma omp parallel private(%(private)s) num_threads(%(n_threads)s) if(%(work)s >= %(threshold)s)
+      {
+        %(has_partial)s = 0;
+        #pragma omp for schedule(static)%(collapse)s
+        %(loops)s
+        if (%(has_partial)s) {
+          %(partials)s[omp_get_thread_num()] = %(partial)s;
+          %(partial_counts)s[omp_get_thread_num()] = 1;
+        }
+      }
+      Py_END_ALLOW_THREADS
+      for (%(t)s = 0; %(t)s < %(n_threads)s; ++%(t)s) {
+        if (%(partial_counts)s[%(t)s]) { %(acc)s = %(final_combine)s; }
+      }
+    }""" % locals())
+    return acc 
+      
+  def omp_reduce_op(self, expr):
+    """
+    The OpenMP reduction operator for a reduction's combine function, 
+    if it's a simple enough primitive
+    """
     combine_prim = self.get_binop_prim(expr.combine)
     if combine_prim is prims.add:
-      omp_reduce_op = "+"
+      return "+"
     elif combine_prim is prims.multiply:
-      omp_reduce_op = "*"
+      return "*"
     elif combine_prim is prims.logical_and:
-      omp_reduce_op = "&&"
+      return "&&"
     elif combine_prim is prims.logical_or:
-      omp_reduce_op = "||"
+      return "||"
     else:
-      omp_reduce_op = None 
- 
+      return None 
+  
+  def per_thread_combine(self, expr):
+    return self.scalar_fields(expr.type) and return_type(expr.fn) == expr.type
+  
+  def visit_IndexReduce(self, expr):
+    """
+    Reductions whose combine function is a simple operator use an OpenMP
+    reduction clause, other ones over scalars (or tuples of them) get one 
+    partial result per thread, and the rest run sequentially 
+    """
+    bounds = self.tuple_to_var_list(expr.shape)
+    n_vars = len(bounds)
+    acc = self.fresh_var(expr.type, "acc", self.visit_expr(expr.init))
+    omp_reduce_op = self.omp_reduce_op(expr)
+    
+    if omp_reduce_op is None and self.depth == 0 and self.per_thread_combine(expr):
+      return self.per_thread_reduction(expr, acc, bounds)
+    
     loop_vars = self.loop_vars(n_vars)
     assert expr.init is not None, "Accumulator required but not given"
     elt = self.fresh_var(return_type(expr.fn), "elt")
@@ -243,7 +575,8 @@ class MulticoreCompiler(PyModuleCompiler):
       acquire_gil = "\nPy_END_ALLOW_THREADS\n" 
       omp = self.omp_pragma(len(loop_vars), private_vars, 
                             reduce_op = omp_reduce_op, 
-                            reduce_vars = [acc])
+                            reduce_vars = [acc], 
+                            work = self.estimated_work(bounds, [expr.fn, expr.combine]))
       loops = release_gil + omp + loops + acquire_gil    
     self.append(loops)
     return acc 
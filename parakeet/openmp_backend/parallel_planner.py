@@ -0,0 +1,109 @@
+from ..analysis.syntax_visitor import SyntaxVisitor
+from ..ndtypes import ArrayT, IntT
+from ..shape_inference import shape, shape_env, shapes_from_types
+from ..syntax import Const, Var
+
+class NestedSpaces(SyntaxVisitor):
+  """
+  Iteration spaces of the parallel loops and reductions in the body
+  of a parallel loop, which would run on every thread if it got
+  called outside of a parallel region
+  """
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.spaces = []
+
+  def visit_ParFor(self, stmt):
+    self.spaces.append(stmt.bounds)
+
+  def visit_IndexReduce(self, expr):
+    self.spaces.append(expr.shape)
+
+def symbolic_extent(expr, env):
+  """
+  Number of iterations of a loop with the given bounds in terms of the
+  inputs of the function it's in, according to shape inference
+  """
+  if expr.__class__ is Const:
+    value = shape.const(expr.value)
+  elif expr.__class__ is Var:
+    value = env.get(expr.name, shape.any_scalar)
+  else:
+    return shape.any_scalar
+  if isinstance(value, (shape.Tuple, shape.Shape)):
+    elts = value.elts if isinstance(value, shape.Tuple) else value.dims
+    if len(elts) == 0:
+      return shape.any_scalar
+    result = elts[0]
+    for elt in elts[1:]:
+      result = shape.Mult(result, elt)
+    return result
+  return value
+
+def nested_extents(fn):
+  """
+  Symbolic trip counts of the parallel loops and reductions directly
+  inside a loop body (not the ones in functions it calls)
+  """
+  spaces = NestedSpaces()
+  spaces.visit_fn(fn)
+  if len(spaces.spaces) == 0:
+    return []
+  env = shape_env(fn)
+  return [symbolic_extent(space, env) for space in spaces.spaces]
+
+def input_dims(input_types, c_args):
+  """
+  Map from the symbolic variables shape inference uses for the inputs of
+  a function to C expressions for their values, for each argument which
+  is an integer or an array
+  """
+  result = {}
+  for (t, value, c_arg) in zip(input_types, shapes_from_types(input_types), c_args):
+    if isinstance(t, IntT) and value.__class__ is shape.Var:
+      result[value] = c_arg
+    elif isinstance(t, ArrayT) and value.__class__ is shape.Shape:
+      for (i, d) in enumerate(value.dims):
+        result[d] = "%s.shape[%d]" % (c_arg, i)
+  return result
+
+_binop_symbols = {shape.Add : '+', shape.Sub : '-', shape.Mult : '*'}
+
+def extent_to_c(value, dims):
+  """
+  C expression for a symbolic value, or None if it depends on something
+  besides the given dimensions
+  """
+  c = value.__class__
+  if c is shape.Const and isinstance(value.value, (int, long)):
+    return "%dLL" % value.value
+  elif c is shape.Var:
+    return "((int64_t) %s)" % dims[value] if value in dims else None
+  elif c in _binop_symbols:
+    x = extent_to_c(value.x, dims)
+    y = extent_to_c(value.y, dims)
+    if x is None or y is None:
+      return None
+    return "(%s %s %s)" % (x, _binop_symbols[c], y)
+  return None
+
+def largest_nested_extent(fn, closure_args):
+  """
+  C expression for the largest trip count of the parallel loops in the body
+  of a parallel loop, computed from its closure arguments before the loop
+  starts, or None if there are no such loops or none of their trip counts
+  are known without running the body
+  """
+  n_closure_args = len(closure_args)
+  dims = input_dims(fn.input_types[:n_closure_args], closure_args)
+  extents = []
+  for extent in nested_extents(fn):
+    c_extent = extent_to_c(extent, dims)
+    if c_extent is not None and c_extent not in extents:
+      extents.append(c_extent)
+  if len(extents) == 0:
+    return None
+  result = extents[0]
+  for extent in extents[1:]:
+    result = "(%s > %s ? %s : %s)" % (result, extent, result, extent)
+  return result
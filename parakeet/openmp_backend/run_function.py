@@ -1,24 +1,78 @@
 from .. import config 
 
+from ..c_backend.allocation import current_allocation
+from ..c_backend.multiversion import compile_multiversion
 from ..c_backend.prepare_args import prepare_args  
+from ..c_backend.run_function import multiversioned 
+from ..retention import release_after_compile, snapshot_ir_caches
+from ..settings_caches import register_backend_caches
+from ..tiering import compile_lock
 from ..transforms.pipeline import lower_to_adverbs  
-from ..value_specialization import specialize
+from ..value_specialization import specialization_values, specialize_abstract_values
 
 
 from multicore_compiler import MulticoreCompiler 
+from thread_settings import runtime_args 
+import config as openmp_config 
 
 _cache = {}
-def run(fn, args):
+
+# compiled functions keyed by the typed function they were compiled from,
+# so that later calls skip lowering (whose results may have been released)
+_entry_cache = {}
+register_backend_caches('openmp', __name__)
+
+def entry_key(fn, args):
+  """
+  Key of the code compiled for the typed function and these arguments,
+  along with the arguments to call it with
+  """
   args = prepare_args(args, fn.input_types)
-  fn = lower_to_adverbs.apply(fn)
-  if config.value_specialization:
-    fn = specialize(fn, python_values = args)
-  key = fn.cache_key 
-  if key in _cache:
-    return _cache[key](*args)
+  multiversion = multiversioned()
+  if config.value_specialization and not multiversion:
+    abstract_values = specialization_values(fn, args)
   else:
-    compiled_fn = MulticoreCompiler().compile_entry(fn)
-    c_fn = compiled_fn.c_fn 
-    _cache[key] = c_fn 
-    return c_fn(*args)
-  
\ No newline at end of file
+    abstract_values = None
+  # thread count and runtime schedule get passed as trailing arguments, 
+  # so only settings which change the generated code need to be in the key
+  settings = multiversion, openmp_config.schedule, \
+    openmp_config.collapse_nested_loops, openmp_config.plan_nested_parallelism, \
+    openmp_config.overlap_independent_loops, current_allocation()
+  return (fn.cache_key, abstract_values) + settings, args + runtime_args()
+
+def compiled_entry(fn, args):
+  """
+  Compiled code for the typed function along with the arguments to call it with
+  """
+  compiled_key, args = entry_key(fn, args)
+  if compiled_key in _entry_cache:
+    return _entry_cache[compiled_key], args
+  # lowering reads the compiler's settings and caches, which the compiler
+  # of a hot function on another thread might be changing
+  with compile_lock:
+    snapshot = snapshot_ir_caches()
+    abstract_values = compiled_key[1]
+    settings = compiled_key[2:]
+    multiversion = settings[0]
+
+    lowered = lower_to_adverbs.apply(fn)
+    if abstract_values is not None:
+      lowered = specialize_abstract_values(lowered, abstract_values)
+    key = (lowered.cache_key,) + settings
+    if key in _cache:
+      c_fn = _cache[key]
+    elif multiversion:
+      c_fn = compile_multiversion(MulticoreCompiler(), lowered)
+      _cache[key] = c_fn
+    else:
+      compiled_fn = MulticoreCompiler().compile_entry(lowered)
+      c_fn = compiled_fn.c_fn
+      _cache[key] = c_fn
+    _entry_cache[compiled_key] = c_fn
+    release_after_compile(fn, snapshot)
+    return c_fn, args
+
+def run(fn, args):
+  c_fn, c_args = compiled_entry(fn, args)
+  return c_fn(*c_args)
+
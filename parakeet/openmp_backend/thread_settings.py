@@ -0,0 +1,107 @@
+import threading
+
+import config
+from calibration import get_parallel_threshold
+
+# values of OpenMP's omp_sched_t enum
+schedule_kinds = {
+  'static' : 1,
+  'dynamic' : 2,
+  'guided' : 3,
+  'auto' : 4,
+}
+
+class _ScopeStack(threading.local):
+  """
+  Each Python thread keeps its own stack of thread_pool scopes
+  so that concurrent callers can partition cores differently
+  """
+  def __init__(self):
+    self.scopes = []
+
+_local = _ScopeStack()
+
+def _check_num_threads(num_threads):
+  assert num_threads is None or (isinstance(num_threads, (int, long)) and num_threads > 0), \
+    "Expected positive number of threads, got %s" % (num_threads,)
+
+def _check_schedule(kind, chunk_size):
+  assert kind is None or kind in schedule_kinds, \
+    "Unknown OpenMP schedule '%s', expected one of %s" % (kind, ", ".join(sorted(schedule_kinds)))
+  assert chunk_size is None or (isinstance(chunk_size, (int, long)) and chunk_size >= 0), \
+    "Expected non-negative chunk size, got %s" % (chunk_size,)
+
+def set_num_threads(num_threads):
+  """
+  Set the number of threads used by parallel loops in every later call,
+  None restores the OpenMP default
+  """
+  _check_num_threads(num_threads)
+  config.num_threads = num_threads
+
+def get_num_threads():
+  """
+  Number of threads the next call will use from this Python thread,
+  None means the OpenMP default
+  """
+  for scope in reversed(_local.scopes):
+    if scope.num_threads is not None:
+      return scope.num_threads
+  return config.num_threads
+
+def set_schedule(kind, chunk_size = None):
+  """
+  Choose how iterations of 'schedule(runtime)' loops get divided among threads,
+  without recompiling anything
+  """
+  _check_schedule(kind, chunk_size)
+  config.runtime_schedule = kind
+  config.runtime_chunk_size = chunk_size if chunk_size is not None else 0
+
+def get_schedule():
+  kind = config.runtime_schedule
+  chunk_size = config.runtime_chunk_size
+  for scope in reversed(_local.scopes):
+    if scope.schedule is not None:
+      kind = scope.schedule
+      if scope.chunk_size is not None:
+        chunk_size = scope.chunk_size
+      break
+  return kind, chunk_size
+
+class thread_pool(object):
+  """
+  Scope which overrides the number of threads and loop schedule
+  for all Parakeet calls made inside it by the current Python thread:
+
+    with parakeet.thread_pool(4, schedule = 'dynamic'):
+      f(x)
+  """
+  def __init__(self, num_threads = None, schedule = None, chunk_size = None):
+    _check_num_threads(num_threads)
+    _check_schedule(schedule, chunk_size)
+    self.num_threads = num_threads
+    self.schedule = schedule
+    self.chunk_size = chunk_size
+
+  def __enter__(self):
+    _local.scopes.append(self)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    popped = _local.scopes.pop()
+    assert popped is self, "thread_pool scopes exited out of order"
+    return False
+
+def runtime_args():
+  """
+  Extra trailing arguments passed to every compiled OpenMP entry point:
+    - number of threads (0 for the OpenMP default)
+    - omp_sched_t kind of the schedule used by 'schedule(runtime)' loops
+    - chunk size (0 for the OpenMP default)
+    - minimum estimated work for a loop to run in parallel
+  """
+  num_threads = get_num_threads()
+  kind, chunk_size = get_schedule()
+  return (num_threads if num_threads else 0, schedule_kinds[kind], chunk_size, 
+          get_parallel_threshold())
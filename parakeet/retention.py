@@ -0,0 +1,114 @@
+"""
+Once a specialization has been compiled to native code, the versions of it
+made by every optimization phase (along with the analyses of those versions)
+are dead weight: later calls get dispatched straight to the compiled code.
+Modules which cache intermediate IR register those caches here so they
+can be released after compilation.
+"""
+
+import gc
+import sys
+
+import config
+import names
+
+# (module name, attribute) of every module-level cache of intermediate IR,
+# looked up when needed since autotuning swaps in its own dictionaries.
+# Each cache is keyed by a function's cache_key or by a tuple starting with it
+_ir_caches = []
+
+def register_ir_cache(module_name, attr = '_cache'):
+  _ir_caches.append((module_name, attr))
+
+def ir_caches():
+  """
+  List of (description, cache dictionary) for every cache of intermediate IR
+  """
+  from transforms.phase import memoized_phases
+  result = []
+  for (module_name, attr) in _ir_caches:
+    result.append(("%s.%s" % (module_name, attr),
+                   getattr(sys.modules[module_name], attr)))
+  for phase in memoized_phases():
+    result.append(("phase %s" % phase, phase.cache))
+  return result
+
+def cached_fn_name(key):
+  """
+  Name of the function whose cache_key is (or starts) the given cache key
+  """
+  if isinstance(key[0], tuple):
+    key = key[0]
+  return key[0]
+
+def release_intermediate_ir():
+  for (_, cache) in ir_caches():
+    cache.clear()
+
+def snapshot_ir_caches():
+  """
+  Keys of every IR cache before compiling a specialization, so that the
+  entries made while compiling it can be told apart afterward
+  """
+  if not config.release_intermediate_ir:
+    return None
+  return dict((id(cache), set(cache)) for (_, cache) in ir_caches())
+
+def release_after_compile(fn, snapshot):
+  """
+  Drop the entries for versions of the compiled function made since the
+  snapshot, keeping those of its callees, which later specializations
+  are likely to share
+  """
+  if snapshot is None:
+    return
+  root = names.original_names.get(fn.name, fn.name)
+  def released(key, old_keys):
+    name = cached_fn_name(key)
+    return key not in old_keys and names.original_names.get(name, name) == root
+  for (_, cache) in ir_caches():
+    old_keys = snapshot.get(id(cache), ())
+    if any(released(key, old_keys) for key in cache):
+      # transform histories keep growing after they're used as keys, so
+      # entries can't be deleted one at a time; entries which lookups can
+      # no longer reach get dropped along the way
+      kept = [(key, cache[key]) for key in cache.keys()
+              if key in cache and not released(key, old_keys)]
+      cache.clear()
+      cache.update(kept)
+
+def memory_footprint():
+  """
+  Dictionary describing how much compiler state is alive: the number of
+  entries in each kind of IR cache, the number and size (in bytes) of
+  syntax nodes, and how many names have been generated
+  """
+  from syntax import Expr, Stmt
+  caches = {}
+  for (description, cache) in ir_caches():
+    caches[description] = caches.get(description, 0) + len(cache)
+  gc.collect()
+  n_nodes = 0
+  n_bytes = 0
+  for obj in gc.get_objects():
+    if isinstance(obj, (Expr, Stmt)):
+      n_nodes += 1
+      n_bytes += sys.getsizeof(obj)
+      d = getattr(obj, '__dict__', None)
+      if d is not None:
+        n_bytes += sys.getsizeof(d)
+  return {'ir_caches' : caches,
+          'cached_entries' : sum(caches.itervalues()),
+          'syntax_nodes' : n_nodes,
+          'syntax_bytes' : n_bytes,
+          'names' : len(names.original_names)}
+
+def print_memory_footprint():
+  footprint = memory_footprint()
+  print "Syntax nodes: %d (%0.1fKB)" % (footprint['syntax_nodes'],
+                                       footprint['syntax_bytes'] / 1024.0)
+  print "Generated names: %d" % footprint['names']
+  print "Cached intermediate functions/analyses: %d" % footprint['cached_entries']
+  items = [(k, n) for (k, n) in footprint['ir_caches'].iteritems() if n > 0]
+  for (description, n) in sorted(items, key = lambda (_, n): -n):
+    print "  %-60s %6d" % (description[:60], n)
@@ -0,0 +1,34 @@
+"""
+Caches whose contents depend on the compiler's settings. Functions compiled
+with different settings still end up with the same cache keys, so scopes
+which change the settings (autotuning variants, compilation tiers) give
+each group of settings its own copy of every cache registered here.
+"""
+
+import sys
+
+# (owner, attribute) of every cache which depends on the settings, where the
+# owner is either an object or the name of a module (looked up when needed)
+_settings_caches = []
+
+# backends whose compiled code is only found through registered caches,
+# so that each group of settings really compiles its own code
+_tunable_backends = set([])
+
+def register_settings_cache(owner, attr = '_cache'):
+  _settings_caches.append((owner, attr))
+
+def register_backend_caches(backend, module_name, attrs = ('_cache', '_entry_cache')):
+  for attr in attrs:
+    register_settings_cache(module_name, attr)
+  _tunable_backends.add(backend)
+
+def settings_caches():
+  """
+  List of (object, attribute) for every cache which depends on the settings
+  """
+  return [(sys.modules[owner] if isinstance(owner, str) else owner, attr)
+          for (owner, attr) in _settings_caches]
+
+def tunable_backends():
+  return set(_tunable_backends)
@@ -2,6 +2,7 @@
 from .. import syntax, prims 
 from ..analysis import OffsetAnalysis, SyntaxVisitor
 from ..ndtypes import  ArrayT, ScalarT, SliceT, TupleT, NoneT
+from ..retention import register_ir_cache
 from ..syntax import unwrap_constant, Expr  
 
 import shape
@@ -804,6 +805,8 @@ class ShapeInference(SyntaxVisitor):
     
     
 _shape_env_cache = {}
+register_ir_cache(__name__, '_shape_env_cache')
+
 def shape_env(typed_fn):
   key = typed_fn.cache_key
   
@@ -817,6 +820,8 @@ def shape_env(typed_fn):
   return env
 
 _shape_cache = {}
+register_ir_cache(__name__, '_shape_cache')
+
 def call_shape_expr(typed_fn):
   key = typed_fn.cache_key
   if key in _shape_cache:
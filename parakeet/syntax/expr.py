@@ -3,10 +3,40 @@ from dsltools import Node
 from .. ndtypes import NoneT
 
 class Expr(object):
+  __slots__ = []
+  
   # _members = ['type', 'source_info']
   
+  @classmethod
+  def slot_names(cls):
+    """
+    Names of all the slots declared by this class and its bases 
+    """
+    if '_slot_names' in cls.__dict__:
+      return cls._slot_names
+    names = []
+    for c in reversed(cls.__mro__):
+      for name in c.__dict__.get('__slots__', ()):
+        if name not in names:
+          names.append(name)
+    cls._slot_names = tuple(names)
+    return cls._slot_names
+
+  def fields(self):
+    """
+    Iterate over (name, value) of every field set on this node, whether it
+    lives in a slot or (for subclasses which don't declare slots) in __dict__
+    """
+    for name in self.slot_names():
+      if hasattr(self, name):
+        yield (name, getattr(self, name))
+    d = getattr(self, '__dict__', None)
+    if d:
+      for item in d.iteritems():
+        yield item
+
   def __str__(self):
-    fields = ["%s = %s" % (k,v) for (k,v) in self.__dict__.iteritems()]
+    fields = ["%s = %s" % (k,v) for (k,v) in self.fields()]
     return "%s(%s)" % (self.__class__.__name__, ", ".join(fields))
   
   def __repr__(self):
@@ -41,6 +71,8 @@ class Expr(object):
     return hash(elts)
    
 class Const(Expr):
+  __slots__ = ['value', 'type', 'source_info']
+  
   def __init__(self, value, type = None, source_info = None):
     self.value = value 
     self.type = type 
@@ -75,6 +107,8 @@ class Const(Expr):
            self.type != other.type
 
 class Var(Expr):
+  __slots__ = ['name', 'type', 'source_info']
+  
   def __init__(self, name, type = None, source_info = None):
     assert name is not None 
     self.name = name
@@ -119,6 +153,8 @@ class Var(Expr):
     return ()
 
 class Attribute(Expr):
+  __slots__ = ['value', 'name', 'type', 'source_info']
+  
   def __init__(self, value, name, type = None, source_info = None):
     self.value = value 
     self.name = name 
@@ -142,6 +178,8 @@ class Attribute(Expr):
 
 class Closure(Expr):
   """Create a closure which points to a global fn with a list of partial args"""
+  __slots__ = ['fn', 'args', 'type', 'source_info']
+  
   def __init__(self, fn, args, type = None, source_info = None):
     self.fn = fn 
     self.args = args 
@@ -168,6 +206,8 @@ class Closure(Expr):
     return hash((self.fn, tuple(self.args)))
 
 class Call(Expr):
+  __slots__ = ['fn', 'args', 'type', 'source_info']
+  
   def __init__(self, fn, args, type = None, source_info = None):
     self.fn = fn 
     self.args = args 
@@ -201,6 +241,8 @@ class PrimCall(Expr):
   """
   Call a primitive function, the "prim" field should be a prims.Prim object
   """
+  __slots__ = ['prim', 'args', 'type', 'source_info']
+  
   def __init__(self, prim, args, type = None, source_info = None):
     self.prim = prim 
     self.args = args 
@@ -266,6 +308,8 @@ class PrimCall(Expr):
 
 
 class ClosureElt(Expr):
+  __slots__ = ['closure', 'index', 'type', 'source_info']
+  
   def __init__(self, closure, index, type = None, source_info = None):
     self.closure = closure 
     self.index = index 
@@ -282,6 +326,8 @@ class ClosureElt(Expr):
     return hash((self.closure, self.index))
 
 class Cast(Expr):
+  __slots__ = ['value', 'type', 'source_info']
+  
   def __init__(self, value, type, source_info = None):
     self.value = value 
     self.type = type 
@@ -297,6 +343,8 @@ class Cast(Expr):
     return "Cast(%s : %s)" % (self.value, self.type) 
 
 class Select(Expr):
+  __slots__ = ['cond', 'true_value', 'false_value', 'type', 'source_info']
+  
   def __init__(self, cond, true_value, false_value, type = None, source_info = None):
     self.cond = cond 
     self.true_value = true_value 
@@ -7,6 +7,8 @@ class Struct(Expr):
   syntax node, signifying explicit struct allocation
   """
 
+  __slots__ = ['args', 'type', 'source_info']
+  
   def __init__(self, args, type = None, source_info = None):
     self.args = tuple(args)
     self.type = type 
@@ -26,6 +28,8 @@ class Struct(Expr):
 class Alloc(Expr):
   """Allocates a block of data, returns a pointer"""
   
+  __slots__ = ['elt_type', 'count', 'type', 'source_info']
+  
   def __init__(self, elt_type, count, type = None, source_info = None):
     self.elt_type = elt_type 
     self.count = count 
@@ -43,6 +47,8 @@ class Alloc(Expr):
 
 class Free(Expr):
   """Free a manually allocated block of memory"""
+  __slots__ = ['value', 'type', 'source_info']
+  
   def __init__(self, value, type = None, source_info = None):
     self.value = value 
     self.type = type 
@@ -66,6 +72,8 @@ class NumCores(Expr):
   to executing threads/thread blocks/etc..
   """
   
+  __slots__ = ['type', 'source_info']
+  
   def __str__(self):
     return "NUM_CORES"
   
@@ -88,6 +96,8 @@ class SourceExpr(Expr):
   should only be used from within a backend that knows what
   the target code should look like 
   """
+  __slots__ = ['text', 'type', 'source_info']
+  
   def __init__(self, text, type = None, source_info = None):
     self.text = text 
     self.type = type 
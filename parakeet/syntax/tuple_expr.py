@@ -4,6 +4,8 @@ from expr import Const
 from seq_expr import SeqExpr
 
 class Tuple(SeqExpr):
+  __slots__ = ['elts']
+  
   def __init__(self, elts, type = None, source_info = None):
     self.elts = tuple(elts)
     self.type = type 
@@ -35,6 +37,8 @@ class Tuple(SeqExpr):
 
 
 class TupleProj(SeqExpr):
+  __slots__ = ['tuple', 'index']
+  
   def __init__(self, tuple, index, type = None, source_info = None):
     self.tuple = tuple 
     self.index = index 
@@ -6,6 +6,8 @@ class TypeValue(Expr):
   """
   Value materialization of a type 
   """
+  __slots__ = ['type_value', 'type', 'source_info']
+  
   def __init__(self, type_value, type = None, source_info = None):
     self.type_value = type_value
      
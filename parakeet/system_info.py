@@ -14,4 +14,13 @@ def check_openmp_available():
   code = p.returncode
   return code == 0
 
-openmp_available = check_openmp_available()
\ No newline at end of file
+openmp_available = check_openmp_available()
+
+def check_llvmlite_available():
+  try:
+    import llvmlite.binding
+    return True
+  except ImportError:
+    return False
+
+llvmlite_available = check_llvmlite_available()
@@ -2,6 +2,7 @@ import sys
 import time 
 import numpy as np
 
+from contextlib import contextmanager
 from nose.tools import nottest
 
 from dsltools.testing_helpers import eq, expect_eq, run_local_tests
@@ -9,8 +10,10 @@ from dsltools.testing_helpers import eq, expect_eq, run_local_tests
 from . import (
   type_conv, type_inference, config, 
   translate_function_value, find_broken_transform,
-  run_untyped_fn, openmp_available
+  run_python_fn, openmp_available, llvmlite_available
 )
+from .frontend import closure_values
+from .openmp_backend import config as openmp_config
 
 
 
@@ -33,11 +36,11 @@ def expect(fn, args, expected, msg = None, valid_types = None):
   if hasattr(expected, 'dtype') and expected.dtype == 'float16':
     expected = expected.astype('float32')
 
-  untyped_fn = translate_function_value(fn)
-  
-  available_backends = ['interp', 'c']
+  available_backends = ['interp', 'numpy', 'c']
   if openmp_available:
     available_backends.append('openmp')
+  if llvmlite_available:
+    available_backends.append('llvm')
     
   #import cuda_backend 
   #if cuda_backend.device_info.has_gpu():
@@ -46,7 +49,7 @@ def expect(fn, args, expected, msg = None, valid_types = None):
 
   for backend in available_backends: #available_backends:
     try: 
-      result = run_untyped_fn(untyped_fn, _copy_list(args), backend = backend)
+      result = run_python_fn(fn, _copy_list(args), backend = backend)
       
     except: 
       if config.testing_find_broken_transform: 
@@ -84,7 +87,7 @@ def expect_allpairs(parakeet_fn, python_fn, inputs):
 
 def return_type(fn, input_types):
   untyped_fundef = translate_function_value(fn)
-  closure_args = untyped_fundef.python_nonlocals()
+  closure_args = closure_values(fn)
   closure_arg_types = map(type_conv.typeof, closure_args)
   return type_inference.infer_return_type(untyped_fundef,
                                           closure_arg_types + input_types)
@@ -135,3 +138,36 @@ def timed_test(parakeet_fn, parakeet_args, python_fn,
   if min_speedup is not None:
     assert py_time / parakeet_time_no_comp > min_speedup, \
         "Parakeet too slow: %.2f slowdown" % (parakeet_time_no_comp/py_time)
+
+def _openmp_add1(x):
+  return x + 1
+
+_openmp_backend_works = []
+def openmp_backend_works():
+  """
+  Can this machine compile and run code with the OpenMP backend? Unlike
+  openmp_available, which probes for clang, this tries the compiler the
+  backend actually uses
+  """
+  if len(_openmp_backend_works) == 0:
+    try:
+      works = run_python_fn(_openmp_add1, [np.arange(3.0)], backend = 'openmp')[2] == 3.0
+    except:
+      works = False
+    _openmp_backend_works.append(works)
+  return _openmp_backend_works[0]
+
+@contextmanager
+def openmp_settings(**settings):
+  """
+  Change settings of the OpenMP backend (e.g. num_threads = 4) and
+  restore their old values when the block exits
+  """
+  old_values = dict((name, getattr(openmp_config, name)) for name in settings)
+  for (name, value) in settings.iteritems():
+    setattr(openmp_config, name, value)
+  try:
+    yield
+  finally:
+    for (name, value) in old_values.iteritems():
+      setattr(openmp_config, name, value)
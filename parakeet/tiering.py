@@ -0,0 +1,169 @@
+"""
+Tiered compilation: the first calls of a specialization run code which was
+compiled without any optimizations (tier 0), while calls are counted and
+timed. Once a specialization gets hot it's recompiled with every
+optimization turned on (tier 1), usually on a background thread, and later
+calls get dispatched to the optimized code once it's ready.
+
+The compiler's settings, caches and name counter are global, so everything
+which reads or changes them holds compile_lock: translation and type
+inference, lowering and compiling in every backend, and the config scopes
+which swap in each tier's settings and its own copy of the caches. Calls
+of already compiled code only look up entries by their keys and don't take
+the lock; a key computed while another thread has swapped in different
+settings can only miss or find code which is also valid for the arguments.
+"""
+
+import sys
+import threading
+import time
+
+import config
+
+compile_lock = threading.RLock()
+
+# inlining and specializing functions on their constant arguments get rid 
+# of functions which can't be compiled on their own, so tier 0 keeps them 
+tier0_required_opts = ['opt_inline', 'opt_specialize_fn_args']
+
+def tier0_overrides():
+  from c_backend import config as c_config
+  overrides = [(config, name, False)
+               for name in dir(config) 
+               if name.startswith('opt_') and name not in tier0_required_opts]
+  overrides.extend([(config, 'value_specialization', False),
+                    (config, 'multiversioning', False),
+                    (config, 'small_shape_specialization', False),
+                    (c_config, 'opt_level', c_config.tier0_opt_level)])
+  return overrides
+
+def tier1_overrides():
+  from c_backend import config as c_config
+  return [(config, 'opt_loop_unrolling', True),
+          (c_config, 'opt_level', c_config.tier1_opt_level)]
+
+def tier_scope(tier):
+  from frontend.autotune import config_scope
+  if tier == 0:
+    return config_scope(tier0_overrides(), ('tier', 0))
+  else:
+    return config_scope(tier1_overrides(), ('tier', 1))
+
+def backend_module(backend):
+  if backend == 'c':
+    import c_backend
+    return sys.modules['parakeet.c_backend.run_function']
+  else:
+    assert backend == 'openmp', "Tiered compilation not supported for backend %s" % backend
+    import openmp_backend
+    return sys.modules['parakeet.openmp_backend.run_function']
+
+class TieredFn(object):
+  """
+  Call counts, running time and compiled code of one specialization
+  """
+  def __init__(self, fn, backend):
+    self.fn = fn
+    self.backend = backend
+    self.module = backend_module(backend)
+    self.calls = 0
+    self.seconds = 0.0
+    # unoptimized code for each allocation policy it was called with 
+    self.tier0_fns = {}
+    # optimized code for each key its backend's compiled_entry would use 
+    # (allocation policy, and argument values it was specialized on) 
+    self.tier1_fns = {}
+    # 0 while only the unoptimized code exists, 1 once the optimized code is ready
+    self.tier = 0
+    self.compiling = False
+    # if recompiling failed then keep running the unoptimized code
+    self.error = None
+
+  def run_tier0(self, args):
+    if config.tier0_backend in ('numpy', 'interp'):
+      from frontend.run_function import run_typed_fn
+      with tier_scope(0):
+        return run_typed_fn(self.fn, args, config.tier0_backend)
+    from c_backend.allocation import current_allocation
+    from c_backend.prepare_args import prepare_args
+    allocation = current_allocation()
+    tier0_fn = self.tier0_fns.get(allocation)
+    if tier0_fn is None:
+      with tier_scope(0):
+        tier0_fn = backend_module('c').compiled_entry(self.fn, args)[0]
+      self.tier0_fns[allocation] = tier0_fn
+    return tier0_fn(*prepare_args(args, self.fn.input_types))
+
+  def compile_tier1(self, args):
+    with compile_lock:
+      # the key has to be computed without any other thread's settings
+      key = self.module.entry_key(self.fn, args)[0]
+      with tier_scope(1):
+        c_fn, _ = self.module.compiled_entry(self.fn, args)
+    self.tier1_fns[key] = c_fn
+    return c_fn
+
+  def recompile(self, args):
+    try:
+      self.compile_tier1(args)
+      self.tier = 1
+    except Exception:
+      self.error = sys.exc_info()[1]
+    self.compiling = False
+
+  def tier_up(self, args):
+    self.compiling = True
+    if config.tier_up_in_background:
+      thread = threading.Thread(target = self.recompile, args = (args,))
+      thread.daemon = True
+      thread.start()
+      _recompile_threads.append(thread)
+    else:
+      self.recompile(args)
+
+  def __call__(self, args):
+    if self.tier == 1:
+      key, c_args = self.module.entry_key(self.fn, args)
+      c_fn = self.tier1_fns.get(key)
+      # the optimized code might still need to be compiled for new argument
+      # values, don't wait for the compiler if it's busy with another function
+      if c_fn is None and compile_lock.acquire(False):
+        try:
+          c_fn = self.compile_tier1(args)
+        finally:
+          compile_lock.release()
+      if c_fn is not None:
+        return c_fn(*c_args)
+    start = time.time()
+    result = self.run_tier0(args)
+    self.seconds += time.time() - start
+    self.calls += 1
+    if self.tier == 0 and not self.compiling and self.error is None and \
+       (self.calls >= config.tier_up_calls or self.seconds >= config.tier_up_seconds):
+      self.tier_up(args)
+    return result
+
+# TieredFn for each typed function and backend
+_tiered_fns = {}
+
+_recompile_threads = []
+
+def run(fn, args, backend):
+  key = fn.name, backend
+  tiered_fn = _tiered_fns.get(key)
+  if tiered_fn is None:
+    tiered_fn = _tiered_fns.setdefault(key, TieredFn(fn, backend))
+  return tiered_fn(args)
+
+def wait_for_recompilation():
+  """
+  Block until every hot function being recompiled in the background is ready
+  """
+  while _recompile_threads:
+    _recompile_threads.pop().join()
+
+def tier_of(fn, backend = None):
+  if backend is None:
+    backend = config.backend
+  tiered_fn = _tiered_fns.get((fn.name, backend))
+  return None if tiered_fn is None else tiered_fn.tier
@@ -99,7 +99,7 @@ class CloneFunction(Transform):
      
     else:
       args = {}  
-      for k,v in expr.__dict__.iteritems():
+      for k,v in expr.fields():
         args[k] = self.transform_if_expr(v)
       if c is DelayUntilTyped and 'type' in args:
         del args['type']
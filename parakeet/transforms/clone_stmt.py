@@ -58,6 +58,14 @@ class CloneStmt(CloneFunction):
 
   def transform_Var(self, expr):
     return self.rename_dict.get(expr.name, expr)
+  
+  def _transform_expr(self, expr):
+    # CloneFunction copies variables directly, 
+    # skipping the renaming in transform_Var 
+    if expr.__class__ is Var:
+      new_var = self.transform_Var(expr)
+      return Var(new_var.name, type = new_var.type)
+    return CloneFunction._transform_expr(self, expr)
 
   def transform_ForLoop(self, stmt):
     new_var = self.rename_var(stmt.var)
@@ -1,15 +1,98 @@
 from .. ndtypes import ScalarT, ArrayT
 
-from .. analysis.collect_vars import collect_var_names
-from .. analysis import escape_analysis
+from .. analysis.collect_vars import collect_var_names, SetCollector
+from .. analysis.escape_analysis import EscapeAnalysis
 from .. analysis.find_local_arrays import FindLocalArrays
+from .. analysis.syntax_visitor import SyntaxVisitor
 from .. analysis.usedef import UseDefAnalysis
-from .. syntax import AllocArray, ArrayView, Index, Struct, Var
+from .. syntax import AllocArray, Assign, Closure, Index, ParFor, Tuple, TypedFn, Var
 
-from .. syntax import Adverb
 from transform import Transform
 
+class VarUses(SyntaxVisitor):
+  """
+  Count the reads of every variable, including the initial values of
+  loop-carried variables, and collect the names which get bound
+  """
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.counts = {}
+    self.bound = set([])
+
+  def visit_Var(self, expr):
+    self.counts[expr.name] = self.counts.get(expr.name, 0) + 1
+
+  def visit_lhs_Var(self, lhs):
+    self.bound.add(lhs.name)
+
+  def visit_merge(self, phi_nodes):
+    self.bound.update(phi_nodes.iterkeys())
+    SyntaxVisitor.visit_merge(self, phi_nodes)
+
+  def visit_merge_loop_start(self, phi_nodes):
+    self.bound.update(phi_nodes.iterkeys())
+    for (_, (l, _)) in phi_nodes.iteritems():
+      self.visit_expr(l)
+
+def var_uses(stmts):
+  uses = VarUses()
+  uses.visit_block(stmts)
+  return uses
+
+class ElementwiseAccess(SyntaxVisitor):
+  """
+  Does the body of a parallel loop only touch the given arrays one element
+  at a time, always at the element indexed by the loop's own indices?
+  """
+  def __init__(self, array_names, index_names):
+    SyntaxVisitor.__init__(self)
+    self.array_names = array_names
+    self.index_names = index_names
+    self.ok = True
+
+  def is_loop_index(self, index):
+    if index.__class__ is Var:
+      return [index.name] == self.index_names
+    elif index.__class__ is Tuple:
+      return [elt.name if elt.__class__ is Var else None
+              for elt in index.elts] == self.index_names
+    return False
+
+  def visit_Index(self, expr):
+    if expr.value.__class__ is Var and expr.value.name in self.array_names:
+      if not isinstance(expr.type, ScalarT) or not self.is_loop_index(expr.index):
+        self.ok = False
+      self.visit_expr(expr.index)
+    else:
+      SyntaxVisitor.visit_Index(self, expr)
+
+  def visit_Var(self, expr):
+    if expr.name in self.array_names:
+      self.ok = False
+
+def elementwise_access(fn, array_names, index_names):
+  visitor = ElementwiseAccess(array_names, index_names)
+  visitor.visit_fn(fn)
+  return visitor.ok
+
 class CopyElimination(Transform):
+  """
+  Write the result of an array expression straight into the
+  array slice it gets assigned to, replacing
+    a = AllocArray(...)
+    ParFor(... fills in a ...)
+    b[idx] = a
+  with
+    a = b[idx]
+    ParFor(... fills in a ...)
+
+  This is only safe if nothing between the allocation and the assignment
+  reads or writes b's data, since those reads used to see b's old values.
+  The one exception is a parallel loop whose iterations read the element
+  of b which they also write (as in x[1:-1] = x[1:-1] * 2). Otherwise,
+  or whenever two arrays might alias, the temporary stays.
+  """
+
   def apply(self, fn):
     if all(isinstance(t, ScalarT) for t in fn.type_env.itervalues()):
       return fn
@@ -19,23 +102,38 @@ class CopyElimination(Transform):
   def pre_apply(self, fn):
     local_array_analysis = FindLocalArrays()
     local_array_analysis.visit_fn(fn)
-
-
-    self.local_alloc = local_array_analysis.local_allocs
     self.local_arrays = local_array_analysis.local_arrays
 
-    escape_info = escape_analysis(fn)
-    self.may_escape = escape_info.may_escape
+    # not using the cached escape_analysis since earlier
+    # transforms may have rewritten the function in place
+    escape_info = EscapeAnalysis()
+    escape_info.visit_fn(fn)
     self.may_alias = escape_info.may_alias
+    self.may_escape = escape_info.may_escape
     self.may_return = escape_info.may_return
-    
+
     self.usedef = UseDefAnalysis()
     self.usedef.visit_fn(fn)
 
-    
-    self.pointers_by_size = {}
-    self.arrays_by_size = {}
-    
+    self.use_counts = var_uses(fn.body).counts
+
+    # views of other arrays, e.g. v = b[1:n], so that a loop reading
+    # a view of the destination can be matched against the slice written
+    self.views = {}
+    for stmt in self.all_assignments(fn.body):
+      if stmt.lhs.__class__ is Var and stmt.rhs.__class__ is Index and \
+         stmt.rhs.value.__class__ is Var and stmt.rhs.type.__class__ is ArrayT:
+        self.views[stmt.lhs.name] = stmt.rhs
+
+  def all_assignments(self, stmts):
+    for stmt in stmts:
+      if stmt.__class__ is Assign:
+        yield stmt
+      for block_name in ('true', 'false', 'body'):
+        block = getattr(stmt, block_name, None)
+        if isinstance(block, list):
+          for nested in self.all_assignments(block):
+            yield nested
 
   def no_array_aliases(self, array_name):
     alias_set = self.may_alias.get(array_name, [])
@@ -47,59 +145,110 @@ class CopyElimination(Transform):
     # if we ever have mutable compound objects in arrays
     return len(array_aliases) <= 1
 
-  def is_array_alloc(self, expr):
-    return expr.__class__ in [ArrayView, Struct, AllocArray] or isinstance(expr, Adverb)
-    
-  def transform_Assign(self, stmt):
-    # pattern match only on statements of the form
-    # dest[complex_indexing] = src
-    # when:
-    #   1) dest hasn't been used before as a value
-    #   2) src doesn't escape
-    #   3) src was locally allocated
-    # ...then transform the code so instead of allocating src
-
-    if stmt.lhs.__class__ is not Index or stmt.lhs.value.__class__ is not Var:
-      return stmt 
-    
-    lhs_name = stmt.lhs.value.name
-
-    # why assign to an array if it never gets used?
-    if lhs_name not in self.usedef.first_use and \
-       lhs_name not in self.may_escape and \
-       self.no_array_aliases(lhs_name):
-      return None
-    
-    # only match statements like array[idx] = some_rhs_var
-    if stmt.lhs.type.__class__ is not ArrayT or stmt.rhs.__class__ is not Var:
-      return stmt 
-    
-    curr_path = self.usedef.stmt_paths[id(stmt)]
-    rhs_name = stmt.rhs.name
-
-    
-    if lhs_name in self.usedef.first_use and self.usedef.first_use[lhs_name] <= curr_path:
-      return stmt 
-    
-    if self.usedef.last_use[rhs_name] != curr_path:
-      return stmt
-    
-    if rhs_name in self.may_return:
-      return stmt  
-    
-    if rhs_name not in self.local_arrays:
-      return stmt 
-            
-    array_stmt = self.local_arrays[rhs_name]
-    prev_path = self.usedef.stmt_paths[id(array_stmt)]
-    if not self.is_array_alloc(array_stmt.rhs):
-      return stmt 
-    
-    for lhs_depends_on in collect_var_names(stmt.lhs):
-      created_on = self.usedef.created_on.get(lhs_depends_on)
-      if created_on is None or created_on >= prev_path:
-        return stmt 
-             
-    array_stmt.rhs = stmt.lhs
+  def find_alloc(self, stmts, j, name):
+    for k in xrange(j - 1, -1, -1):
+      stmt = stmts[k]
+      if stmt.__class__ is Assign and stmt.lhs.__class__ is Var and \
+         stmt.lhs.name == name:
+        return k
     return None
-    
\ No newline at end of file
+
+  def reads_destination(self, stmt, dest_name, dest_index, dest_aliases, array_name):
+    """
+    Could this statement read or write any part of the destination
+    other than the element being produced for the same position?
+    """
+    collector = SetCollector()
+    collector.visit_stmt(stmt)
+    names = collector.var_names
+    overlapping = [name for name in names if name in dest_aliases]
+    if len(overlapping) == 0:
+      return False
+    if stmt.__class__ is not ParFor or stmt.fn.__class__ is not Closure or \
+       stmt.fn.fn.__class__ is not TypedFn:
+      return True
+    # every array sharing data with the destination has to be
+    # the very slice being written, e.g. x[1:-1] = x[1:-1] * 2
+    for name in overlapping:
+      view = self.views.get(name)
+      if view is None or view.value.name != dest_name or view.index != dest_index:
+        return True
+    closure_args = stmt.fn.args
+    fn = stmt.fn.fn
+    tracked = set([])
+    for (param, arg) in zip(fn.arg_names, closure_args):
+      if arg.__class__ is not Var:
+        if any(name in dest_aliases or name == array_name
+               for name in collect_var_names(arg)):
+          return True
+      elif arg.name in overlapping or arg.name == array_name:
+        tracked.add(param)
+    index_names = list(fn.arg_names[len(closure_args):])
+    return not elementwise_access(fn, tracked, index_names)
+
+  def eliminate_copy(self, stmts, j):
+    """
+    If stmts[j] copies a temporary into a slice of another array which
+    the temporary could have been written into directly, returns the
+    position of the temporary's allocation
+    """
+    stmt = stmts[j]
+    if stmt.__class__ is not Assign or stmt.lhs.__class__ is not Index or \
+       stmt.lhs.value.__class__ is not Var or stmt.rhs.__class__ is not Var:
+      return None
+    dest_name = stmt.lhs.value.name
+    array_name = stmt.rhs.name
+    array_type = self.type_env[array_name]
+    # no broadcasting or casting along the way
+    if array_type.__class__ is not ArrayT or stmt.lhs.type != array_type:
+      return None
+    k = self.find_alloc(stmts, j, array_name)
+    if k is None or stmts[k].rhs.__class__ is not AllocArray:
+      return None
+    # the temporary can't be seen by anyone else or be used afterward
+    if self.may_alias.get(array_name, set([array_name])) != set([array_name]) or \
+       array_name in self.may_return:
+      return None
+    between = stmts[k+1:j]
+    uses = var_uses(between + [stmt])
+    if uses.counts.get(array_name, 0) != self.use_counts.get(array_name, 0):
+      return None
+    # the slice has to be computable where the temporary was allocated
+    if any(name in uses.bound for name in collect_var_names(stmt.lhs)):
+      return None
+    dest_aliases = self.may_alias.get(dest_name, set([dest_name]))
+    if array_name in dest_aliases:
+      return None
+    for other in between:
+      if self.reads_destination(other, dest_name, stmt.lhs.index, dest_aliases, array_name):
+        return None
+    return k
+
+  def transform_block(self, stmts):
+    stmts = list(stmts)
+    for j in xrange(len(stmts)):
+      k = self.eliminate_copy(stmts, j)
+      if k is not None:
+        dest = stmts[j].lhs
+        array_name = stmts[j].rhs.name
+        stmts[k] = Assign(stmts[k].lhs, dest, source_info = stmts[k].source_info)
+        stmts[j] = None
+        # from now on the former temporary shares data with the destination
+        combined = self.may_alias.get(dest.value.name, set([dest.value.name]))
+        combined.add(array_name)
+        for name in combined:
+          self.may_alias[name] = combined
+        self.views[array_name] = dest
+    return Transform.transform_block(self, [s for s in stmts if s is not None])
+
+  def transform_Assign(self, stmt):
+    # drop writes into locally allocated arrays which never get read
+    if stmt.lhs.__class__ is Index and stmt.lhs.value.__class__ is Var:
+      lhs_name = stmt.lhs.value.name
+      if lhs_name in self.local_arrays and \
+         lhs_name not in self.usedef.first_use and \
+         lhs_name not in self.may_escape and \
+         lhs_name not in self.may_return and \
+         self.no_array_aliases(lhs_name):
+        return None
+    return Transform.transform_Assign(self, stmt)
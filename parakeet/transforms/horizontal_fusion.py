@@ -0,0 +1,303 @@
+from .. import names
+from .. analysis.collect_vars import collect_var_names, SetCollector
+from .. analysis.contains import ContainsAdverbs, ContainsCalls, Yes
+from .. analysis.escape_analysis import EscapeAnalysis
+from .. analysis.written_args import WrittenArgs
+from .. builder import build_fn
+from .. ndtypes import NoneType, make_tuple_type
+from .. syntax import (Assign, Closure, Comment, Const, IndexReduce, ParFor,
+                       Tuple, TupleProj, TypedFn, Var)
+from .. syntax.helpers import none
+
+from transform import Transform
+
+def stmt_var_names(stmt):
+  collector = SetCollector()
+  collector.visit_stmt(stmt)
+  return collector.var_names
+
+def has_effects(expr):
+  try:
+    ContainsCalls().visit_expr(expr)
+    ContainsAdverbs().visit_expr(expr)
+    return False
+  except Yes:
+    return True
+
+class HorizontalFusion(Transform):
+  """
+  Merge independent sibling loops over the same iteration space into a
+  single traversal, the counterpart of Fusion which only merges a producer
+  with its consumer. Parallel loops with the same bounds get one body which
+  runs both of theirs, e.g.
+    ParFor(f, n)
+    ParFor(g, n)
+  becomes
+    ParFor(f_g, n)
+  and reductions with the same shape, such as the min and max of
+  an array, become one reduction with a tuple accumulator:
+    a = IndexReduce(f, combine = c1, init = i1, shape = n)
+    b = IndexReduce(g, combine = c2, init = i2, shape = n)
+  becomes
+    acc = IndexReduce(f_g, combine = c1_c2, init = (i1, i2), shape = n)
+    a = acc[0]
+    b = acc[1]
+
+  The merged statement takes the place of the last loop in its group, so
+  the statements in between may only compute scalars, shapes and other
+  side-effect free values which don't use the results of the earlier loops.
+  """
+
+  def pre_apply(self, fn):
+    escape_info = EscapeAnalysis()
+    escape_info.visit_fn(fn)
+    self.may_alias = escape_info.may_alias
+    # side-effect free definitions of variables, used to recognize
+    # iteration spaces which got computed twice
+    self.definitions = {}
+    for stmt in fn.body:
+      if stmt.__class__ is Assign and stmt.lhs.__class__ is Var and \
+         not has_effects(stmt.rhs):
+        self.definitions[stmt.lhs.name] = stmt.rhs
+
+  def same_value(self, x, y):
+    if x == y:
+      return True
+    if x is None or y is None:
+      return False
+    if x.__class__ is Var and x.name in self.definitions:
+      return self.same_value(self.definitions[x.name], y)
+    if y.__class__ is Var and y.name in self.definitions:
+      return self.same_value(x, self.definitions[y.name])
+    # constants and variables without a known definition are only
+    # the same value if they're equal
+    if x.__class__ is not y.__class__ or x.__class__ in (Const, Var) or \
+       x.type != y.type:
+      return False
+    x_children = list(x.children())
+    y_children = list(y.children())
+    return len(x_children) == len(y_children) and \
+      all(self.same_value(xc, yc) for (xc, yc) in zip(x_children, y_children))
+
+  def aliases(self, var_names):
+    result = set([])
+    for name in var_names:
+      result.update(self.may_alias.get(name, [name]))
+    return result
+
+  def loop_kind(self, stmt):
+    """
+    Returns the kind of loop a statement is (if it's one which could be
+    merged with others) along with its iteration space
+    """
+    if stmt.__class__ is ParFor:
+      if isinstance(stmt.fn, (Closure, TypedFn)):
+        return ("ParFor", (stmt.bounds,))
+    elif stmt.__class__ is Assign and stmt.lhs.__class__ is Var and \
+         stmt.rhs.__class__ is IndexReduce:
+      expr = stmt.rhs
+      if expr.init is not None and \
+         getattr(expr, 'output', None) is None and \
+         isinstance(expr.fn, (Closure, TypedFn)) and \
+         isinstance(expr.combine, (Closure, TypedFn)):
+        return ("IndexReduce", (expr.shape, expr.start_index))
+    return None
+
+  def loop_fn(self, stmt):
+    return stmt.fn if stmt.__class__ is ParFor else stmt.rhs.fn
+
+  def written(self, stmt):
+    """
+    Variables whose data the loop might write
+    """
+    fn_expr = self.loop_fn(stmt)
+    fn = self.get_fn(fn_expr)
+    written_params = WrittenArgs().visit_fn(fn)
+    result = set([])
+    for (param, arg) in zip(fn.arg_names, self.closure_elts(fn_expr)):
+      if param in written_params:
+        result.update(collect_var_names(arg))
+    return self.aliases(result)
+
+  def touched(self, stmt):
+    """
+    Variables whose data the loop might read or write
+    """
+    return self.aliases(stmt_var_names(stmt))
+
+  def results(self, stmt):
+    return set([stmt.lhs.name]) if stmt.__class__ is Assign else set([])
+
+  def pure(self, stmt):
+    """
+    Can the statement be moved past a loop?
+    """
+    if stmt.__class__ is Comment:
+      return True
+    if stmt.__class__ is not Assign or stmt.lhs.__class__ not in (Var, Tuple):
+      return False
+    return not has_effects(stmt.rhs)
+
+  def can_join(self, stmts, members, j):
+    """
+    Can the loop at position j be merged with the loops at the
+    given positions, with the merged loop taking its place?
+    """
+    stmt = stmts[j]
+    written = self.written(stmt)
+    touched = self.touched(stmt)
+    member_results = set([])
+    member_written = set([])
+    for i in members:
+      other = stmts[i]
+      if written.intersection(self.touched(other)) or \
+         touched.intersection(self.written(other)):
+        return False
+      member_results.update(self.results(other))
+      member_written.update(self.written(other))
+    if stmt_var_names(stmt).intersection(member_results):
+      return False
+    for i in xrange(members[0] + 1, j):
+      if i in members:
+        continue
+      between = stmts[i]
+      if not self.pure(between):
+        return False
+      used = stmt_var_names(between)
+      if used.intersection(member_results) or \
+         self.aliases(used).intersection(member_written):
+        return False
+    return True
+
+  def merge_closure_args(self, fn_exprs):
+    """
+    Closure arguments of all the given functions, passing each variable
+    only once, along with where each function's arguments ended up
+    """
+    args = []
+    positions = []
+    for fn_expr in fn_exprs:
+      fn_positions = []
+      for arg in self.closure_elts(fn_expr):
+        same = [i for (i, other) in enumerate(args)
+                if arg.__class__ is Var and other.__class__ is Var and
+                   other.name == arg.name]
+        if same:
+          fn_positions.append(same[0])
+        else:
+          fn_positions.append(len(args))
+          args.append(arg)
+      positions.append(fn_positions)
+    return args, positions
+
+  def fused_fn(self, fn_exprs, extra_types, return_type):
+    """
+    Empty function taking the merged closure arguments of the given
+    functions followed by arguments of the given types
+    """
+    fns = [self.get_fn(fn_expr) for fn_expr in fn_exprs]
+    closure_args, positions = self.merge_closure_args(fn_exprs)
+    input_types = [arg.type for arg in closure_args] + list(extra_types)
+    name = "_".join(names.original(fn.name) for fn in fns)
+    fused, builder, input_vars = build_fn(input_types, return_type, name)
+    fn_args = [[input_vars[i] for i in fn_positions] for fn_positions in positions]
+    extra_vars = input_vars[len(closure_args):]
+    return fused, builder, fns, fn_args, extra_vars, closure_args
+
+  def fuse_parfors(self, loops):
+    first_fn = self.get_fn(loops[0].fn)
+    index_types = first_fn.input_types[len(self.closure_elts(loops[0].fn)):]
+    fused, builder, fns, fn_args, indices, closure_args = \
+      self.fused_fn([stmt.fn for stmt in loops], index_types, NoneType)
+    for (fn, args) in zip(fns, fn_args):
+      builder.call(fn, list(args) + list(indices))
+    builder.return_(none)
+    return [ParFor(fn = self.closure(fused, closure_args),
+                   bounds = loops[0].bounds,
+                   read_only = None,
+                   write_only = None)]
+
+  def fuse_combines(self, combines):
+    acc_t = make_tuple_type([self.get_fn(c).input_types[-2] for c in combines])
+    elt_t = make_tuple_type([self.get_fn(c).input_types[-1] for c in combines])
+    return_t = make_tuple_type([self.get_fn(c).return_type for c in combines])
+    fused, builder, fns, fn_args, (acc, elt), closure_args = \
+      self.fused_fn(combines, [acc_t, elt_t], return_t)
+    results = []
+    for (i, (fn, args)) in enumerate(zip(fns, fn_args)):
+      acc_i = builder.tuple_proj(acc, i)
+      elt_i = builder.tuple_proj(elt, i)
+      results.append(builder.call(fn, list(args) + [acc_i, elt_i], name = "combined"))
+    builder.return_(builder.tuple(results))
+    return self.closure(fused, closure_args)
+
+  def fuse_reductions(self, stmts):
+    exprs = [stmt.rhs for stmt in stmts]
+    first_fn = self.get_fn(exprs[0].fn)
+    index_types = first_fn.input_types[len(self.closure_elts(exprs[0].fn)):]
+    elt_t = make_tuple_type([self.get_fn(expr.fn).return_type for expr in exprs])
+    fused, builder, fns, fn_args, indices, closure_args = \
+      self.fused_fn([expr.fn for expr in exprs], index_types, elt_t)
+    elts = [builder.call(fn, list(args) + list(indices), name = "elt")
+            for (fn, args) in zip(fns, fn_args)]
+    builder.return_(builder.tuple(elts))
+
+    acc_t = make_tuple_type([expr.type for expr in exprs])
+    init = self.fresh_var_in_env(acc_t, "init")
+    acc = self.fresh_var_in_env(acc_t, "acc")
+    first = exprs[0]
+    new_stmts = [
+      Assign(init, Tuple(tuple(expr.init for expr in exprs), type = acc_t)),
+      Assign(acc, IndexReduce(fn = self.closure(fused, closure_args),
+                              combine = self.fuse_combines([e.combine for e in exprs]),
+                              shape = first.shape,
+                              start_index = first.start_index,
+                              init = init,
+                              type = acc_t,
+                              source_info = first.source_info)),
+    ]
+    for (i, stmt) in enumerate(stmts):
+      new_stmts.append(Assign(stmt.lhs, TupleProj(acc, i, type = stmt.lhs.type)))
+    return new_stmts
+
+  def fresh_var_in_env(self, t, prefix):
+    name = names.fresh(prefix)
+    self.type_env[name] = t
+    return Var(name, type = t)
+
+  def transform_block(self, stmts):
+    stmts = list(stmts)
+    groups = []
+    for (j, stmt) in enumerate(stmts):
+      kind = self.loop_kind(stmt)
+      if kind is None:
+        continue
+      loop_type, space = kind
+      for (other_type, other_space, members) in groups:
+        if other_type == loop_type and \
+           all(self.same_value(x, y) for (x, y) in zip(space, other_space)) and \
+           self.can_join(stmts, members, j):
+          members.append(j)
+          break
+      else:
+        groups.append((loop_type, space, [j]))
+
+    fused = {}
+    skip = set([])
+    for (loop_type, _, members) in groups:
+      if len(members) < 2:
+        continue
+      loops = [stmts[i] for i in members]
+      if loop_type == "ParFor":
+        fused[members[-1]] = self.fuse_parfors(loops)
+      else:
+        fused[members[-1]] = self.fuse_reductions(loops)
+      skip.update(members[:-1])
+
+    new_stmts = []
+    for (i, stmt) in enumerate(stmts):
+      if i in fused:
+        new_stmts.extend(fused[i])
+      elif i not in skip:
+        new_stmts.append(stmt)
+    return Transform.transform_block(self, new_stmts)
@@ -6,7 +6,7 @@ from .. analysis.escape_analysis import may_alias
 from .. analysis.syntax_visitor import SyntaxVisitor
 
 from .. ndtypes import ImmutableT, ArrayT, PtrT 
-from .. syntax import Var, Assign, Return, While, If, Index, Alloc, AllocArray  
+from .. syntax import Attribute, Var, Assign, Return, While, If, Index, Alloc, AllocArray  
 from .. syntax import Array, ArrayView, Slice, Struct 
 
 from transform import Transform
@@ -121,7 +121,8 @@ class Find_LICM_Candidates(SyntaxVisitor):
 
     if any(x in self.volatile_vars for x in rhs_names):
       self.volatile_vars.update(lhs_names)
-    elif self.is_mutable_alloc(stmt.rhs):
+    # a pointer into an array stays the same when its elements get written 
+    elif self.is_mutable_alloc(stmt.rhs) and stmt.rhs.__class__ is not Attribute:
       if len(lhs_names) == 1 and \
          len(self.may_alias.get(lhs_names[0], [])) <= 1:
         pass
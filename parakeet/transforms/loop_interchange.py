@@ -0,0 +1,114 @@
+from .. import names
+from .. analysis.collect_vars import collect_var_names
+from .. analysis.syntax_visitor import SyntaxVisitor
+from .. ndtypes import ArrayT
+from .. syntax import Closure, ParFor, Tuple, TypedFn, Var
+from .. value_specialization.abstract_value import Array, one, unknown, zero
+from .. value_specialization.abstract_value import Tuple as AbstractTuple
+from .. value_specialization.find_constant_values import symbolic_call
+from .. value_specialization.value_specialization import contiguous_values
+
+from clone_function import CloneFunction
+from transform import Transform
+
+class AccessStrides(SyntaxVisitor):
+  """
+  Count how many of the array elements touched by a loop body lie along a
+  unit-stride dimension of their array for each loop index, and how many
+  lie along a dimension with some other stride
+  """
+  def __init__(self, index_names, env):
+    SyntaxVisitor.__init__(self)
+    self.env = env
+    self.unit = dict((name, 0) for name in index_names)
+    self.strided = dict((name, 0) for name in index_names)
+
+  def dim_strides(self, array):
+    rank = array.type.rank
+    value = self.env.get(array.name, unknown)
+    if value.__class__ is Array and value.strides.__class__ is AbstractTuple and \
+       len(value.strides.elts) == rank:
+      return value.strides.elts
+    # without anything better to go on assume arrays are in C order
+    return (unknown,) * (rank - 1) + (one,)
+
+  def visit_Index(self, expr):
+    if expr.value.__class__ is Var and isinstance(expr.value.type, ArrayT):
+      index = expr.index
+      elts = index.elts if index.__class__ is Tuple else (index,)
+      for (elt, stride) in zip(elts, self.dim_strides(expr.value)):
+        used = [name for name in collect_var_names(elt) if name in self.unit]
+        if len(used) != 1 or stride == zero:
+          continue
+        if stride == one:
+          self.unit[used[0]] += 1
+        else:
+          self.strided[used[0]] += 1
+    SyntaxVisitor.visit_Index(self, expr)
+
+class LoopInterchange(Transform):
+  """
+  Reorder the indices of a multidimensional parallel loop so that
+  its innermost index steps through the arrays it touches one element
+  at a time. For example, a loop which reads x[j, i] for a C-ordered x
+  goes over j in its outer loop and i in its inner one, and the outer
+  loop (the one which gets split across threads) has the large strides.
+
+  Strides come from the same symbolic evaluation value specialization
+  uses, starting from inputs with contiguous rows, so transposed views and
+  Fortran-ordered allocations are recognized. Since the iterations of a
+  ParFor are independent, any order of its indices gives the same result.
+  """
+
+  def pre_apply(self, fn):
+    self.env, _ = symbolic_call(fn, contiguous_values(fn.input_types))
+
+  def loop_order(self, stmt):
+    """
+    Positions of the loop's indices from outermost to innermost,
+    or None if the current order is at least as good
+    """
+    fn = self.get_fn(stmt.fn)
+    closure_args = self.closure_elts(stmt.fn)
+    index_names = fn.arg_names[len(closure_args):]
+    if len(index_names) < 2:
+      return None
+    arg_values = [self.env.get(arg.name, unknown) if arg.__class__ is Var else unknown
+                  for arg in closure_args]
+    env, _ = symbolic_call(fn, tuple(arg_values) + (unknown,) * len(index_names))
+    counts = AccessStrides(index_names, env)
+    counts.visit_fn(fn)
+    scores = [counts.unit[name] - counts.strided[name] for name in index_names]
+    # sorting is stable, so indices which are equally good keep their order
+    order = sorted(range(len(index_names)), key = lambda k: scores[k])
+    if order == range(len(index_names)):
+      return None
+    return order
+
+  def permute_indices(self, fn, n_closure_args, order):
+    cloned = CloneFunction().apply(fn)
+    index_names = fn.arg_names[n_closure_args:]
+    index_types = fn.input_types[n_closure_args:]
+    return TypedFn(name = names.refresh(fn.name),
+                   arg_names = list(fn.arg_names[:n_closure_args]) +
+                               [index_names[k] for k in order],
+                   body = cloned.body,
+                   input_types = tuple(fn.input_types[:n_closure_args]) +
+                                 tuple(index_types[k] for k in order),
+                   return_type = fn.return_type,
+                   type_env = cloned.type_env,
+                   source_info = fn.source_info)
+
+  def transform_ParFor(self, stmt):
+    if stmt.fn.__class__ not in (Closure, TypedFn):
+      return stmt
+    order = self.loop_order(stmt)
+    if order is None:
+      return stmt
+    closure_args = self.closure_elts(stmt.fn)
+    new_fn = self.permute_indices(self.get_fn(stmt.fn), len(closure_args), order)
+    bounds = self.tuple_elts(stmt.bounds)
+    return ParFor(fn = self.closure(new_fn, closure_args),
+                  bounds = self.tuple([bounds[k] for k in order], "bounds"),
+                  read_only = stmt.read_only,
+                  write_only = stmt.write_only)
@@ -1,10 +1,60 @@
 
 from ..analysis.collect_vars import collect_binding_names, collect_var_names
-from ..analysis.escape_analysis import may_alias
-
+from ..analysis.escape_analysis import EscapeAnalysis
+from ..analysis.syntax_visitor import SyntaxVisitor
+from ..ndtypes import ScalarT
 from ..syntax import Return, While, ForLoop, If, Assign, Var, Index, ExprStmt
 from transform import Transform
 
+class MemoryAccesses(SyntaxVisitor):
+  """
+  Reads and writes of single elements, directly on either side of an 
+  assignment, along with every other use of a variable (such as an array 
+  passed to a call) and the names which get bound
+  """
+  def __init__(self):
+    SyntaxVisitor.__init__(self)
+    self.reads = []
+    self.writes = []
+    self.other_uses = set([])
+    self.bound = set([])
+
+  def is_element(self, expr):
+    return expr.__class__ is Index and \
+           expr.value.__class__ is Var and \
+           isinstance(expr.type, ScalarT)
+
+  def visit_Assign(self, stmt):
+    if self.is_element(stmt.lhs):
+      self.writes.append(stmt.lhs)
+      self.visit_expr(stmt.lhs.index)
+    else:
+      self.visit_lhs(stmt.lhs)
+    if self.is_element(stmt.rhs):
+      self.reads.append(stmt.rhs)
+      self.visit_expr(stmt.rhs.index)
+    else:
+      self.visit_expr(stmt.rhs)
+
+  def visit_Var(self, expr):
+    self.other_uses.add(expr.name)
+
+  def visit_lhs_Var(self, lhs):
+    self.bound.add(lhs.name)
+
+  def visit_lhs_Tuple(self, lhs):
+    for elt in lhs.elts:
+      self.visit_lhs(elt)
+
+  def visit_merge_if(self, phi_nodes):
+    self.bound.update(phi_nodes.iterkeys())
+    self.visit_merge(phi_nodes)
+
+  def visit_merge_loop_start(self, phi_nodes):
+    self.bound.update(phi_nodes.iterkeys())
+    for (_, (l, _)) in phi_nodes.iteritems():
+      self.visit_expr(l)
+
 class LoopTransform(Transform):
   def is_simple_block(self, stmts, allow_branches = True):
     for stmt in stmts:
@@ -18,7 +68,21 @@ class LoopTransform(Transform):
     return True
 
   def pre_apply(self, fn):
-    self.may_alias = may_alias(fn)
+    # not using the cached escape analysis since earlier 
+    # transforms may have rewritten the function in place
+    escape_info = EscapeAnalysis()
+    escape_info.visit_fn(fn)
+    self.may_alias = escape_info.may_alias
+
+  def aliases(self, name):
+    result = set(self.may_alias.get(name, []))
+    result.add(name)
+    return result
+
+  def memory_accesses(self, stmts):
+    accesses = MemoryAccesses()
+    accesses.visit_block(stmts)
+    return accesses
 
   def collect_loop_vars(self, loop_vars, loop_body):
     """Gather the variables whose values change between loop iterations"""
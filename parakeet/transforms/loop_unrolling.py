@@ -1,4 +1,4 @@
-from .. import syntax
+from .. import config, syntax
 from .. syntax import Const, ForLoop, Var
 from .. syntax.helpers import const_int
 from ..transforms import CloneStmt 
@@ -10,10 +10,12 @@ def safediv(m,n):
   return (m+n-1)/n
 
 class LoopUnrolling(LoopTransform):
-  def __init__(self, unroll_factor = 4,
+  def __init__(self, unroll_factor = None,
                       max_static_unrolling = 8,
                       max_block_size = 50):
     LoopTransform.__init__(self)
+    if unroll_factor is None:
+      unroll_factor = config.loop_unrolling_factor
     self.unroll_factor = unroll_factor
     if max_static_unrolling is not None:
     # should we unroll static loops more than ones with unknown iters?
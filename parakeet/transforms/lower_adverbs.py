@@ -89,6 +89,8 @@ class LowerAdverbs(Transform):
         starts = self.tuple_elts(expr.start_index)
       else:
         starts = [expr.start_index]
+      # like IndexMap, the shape counts indices from the start
+      bounds = [self.add(start, bound) for (start, bound) in zip(starts, bounds)]
     else:
       starts = [self.int(0)] * len(bounds)
       
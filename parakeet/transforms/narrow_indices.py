@@ -0,0 +1,445 @@
+from .. import names, prims
+from .. analysis.collect_vars import collect_var_names, SetCollector
+from .. analysis.value_range_analysis import (Interval, TupleOfIntervals, ValueRangeAnalyis,
+                                              mk_tuple)
+from .. ndtypes import ArrayT, Int32, Int64, IntT, get_rank
+from .. syntax import (Alloc, AllocArray, ArrayView, Assign, Attribute, Cast, Closure,
+                       Const, ForLoop, If, Index, ParFor, PrimCall, TupleProj, TypedFn,
+                       Var, While)
+
+from clone_function import CloneFunction
+from transform import Transform
+
+# the narrow version of a function only runs when no array argument has more
+# elements than this or spans more than this many elements of memory, which
+# leaves room for loop counters to step past their bounds without overflowing
+max_elements = 2 ** 30
+
+int32_min = -2 ** 31
+int32_max = 2 ** 31 - 1
+
+def fits_int32(value):
+  return value.__class__ is Interval and \
+    value.lower >= int32_min and value.upper <= int32_max
+
+# ranges of the fields of an array which passed the runtime check
+small_count = Interval(0, max_elements)
+small_stride = Interval(-max_elements, max_elements)
+
+arithmetic_prims = (prims.add, prims.subtract, prims.multiply, prims.negative)
+
+class IndexRanges(ValueRangeAnalyis):
+  """
+  Value ranges of a function's variables given the ranges of some of its
+  inputs and a set of arrays known to be no bigger than max_elements
+  """
+  def __init__(self, small_arrays, input_ranges):
+    ValueRangeAnalyis.__init__(self)
+    self.small_arrays = small_arrays
+    self.ranges.update(input_ranges)
+
+  def get(self, expr):
+    if expr.__class__ is Attribute and expr.value.__class__ is Var and \
+       expr.value.name in self.small_arrays:
+      rank = get_rank(expr.value.type)
+      if expr.name == 'shape':
+        return mk_tuple([small_count] * rank)
+      elif expr.name == 'strides':
+        return mk_tuple([small_stride] * rank)
+      elif expr.name in ('offset', 'size'):
+        return small_count
+    return ValueRangeAnalyis.get(self, expr)
+
+class NarrowIndices(Transform):
+  """
+  Use 32-bit integers for loop counters and array offsets whenever the
+  value ranges of the function prove they fit, assuming that its array
+  arguments passed the runtime check on their size (see max_elements).
+  Smaller index types let gathers and other indexed loads use twice as
+  many vector lanes and need half as many registers.
+
+  Two kinds of values get narrowed:
+    - loop counters and sums, differences and products of narrow values
+      whose ranges fit in 32 bits
+    - offsets into the data of the checked arrays (or into allocations
+      whose size fits), built from strides, narrow values and indices
+      loaded from memory, which can't exceed the size of the array unless
+      the program indexes past its end
+
+  Anywhere else a narrowed variable is cast back to a 64-bit integer.
+  Parallel loops whose bounds fit also get a copy of their body
+  taking 32-bit indices.
+  """
+
+  def __init__(self, small_arrays = None, input_ranges = {}):
+    Transform.__init__(self)
+    self.small_arrays = small_arrays
+    self.input_ranges = input_ranges
+    self.changed = False
+
+  def pre_apply(self, fn):
+    if self.small_arrays is None:
+      self.small_arrays = set(name for (name, t) in zip(fn.arg_names, fn.input_types)
+                              if isinstance(t, ArrayT))
+    self.range_analysis = IndexRanges(self.small_arrays, self.input_ranges)
+    self.range_analysis.visit_fn(fn)
+    self.definitions = {}
+    self.loops = {}
+    self.uses = {}
+    self.find_uses(fn.body)
+    self.small_arrays = self.local_small_arrays()
+    self.small_pointers = set(name for (name, rhs) in self.definitions.iteritems()
+                              if self.is_small_pointer(rhs))
+    self.narrowed = self.find_narrowed(fn)
+    if len(self.narrowed) > 0:
+      self.changed = True
+    for name in self.narrowed:
+      self.type_env[name] = Int32
+
+  def range(self, expr):
+    return self.range_analysis.get(expr)
+
+  def record_uses(self, expr, context):
+    for name in collect_var_names(expr):
+      self.uses.setdefault(name, []).append(context)
+
+  def record_index(self, expr):
+    self.record_uses(expr.value, "other")
+    if expr.index.__class__ is Var and expr.value.__class__ is Var:
+      self.record_uses(expr.index, ("index", expr.value.name))
+    else:
+      self.record_uses(expr.index, "other")
+
+  def find_uses(self, stmts):
+    """
+    Remember the definition of every variable along with the contexts
+    each variable gets used in: as an operand of the value assigned to
+    another variable, as an index into a pointer, or anything else
+    """
+    for stmt in stmts:
+      c = stmt.__class__
+      if c is Assign:
+        lhs, rhs = stmt.lhs, stmt.rhs
+        if lhs.__class__ is Var:
+          self.definitions[lhs.name] = rhs
+        if lhs.__class__ is Var and rhs.__class__ is PrimCall:
+          for arg in rhs.args:
+            self.record_uses(arg, ("operand", lhs.name))
+        elif lhs.__class__ is Var and rhs.__class__ is Var:
+          self.record_uses(rhs, ("operand", lhs.name))
+        elif rhs.__class__ is Index:
+          self.record_index(rhs)
+        else:
+          self.record_uses(rhs, "other")
+        if lhs.__class__ is Index:
+          self.record_index(lhs)
+        elif lhs.__class__ is not Var:
+          self.record_uses(lhs, "other")
+      elif c is ForLoop:
+        self.loops[stmt.var.name] = stmt
+        for bound in (stmt.start, stmt.stop, stmt.step):
+          self.record_uses(bound, ("operand", stmt.var.name))
+        self.find_uses(stmt.body)
+        self.record_merge(stmt.merge)
+      elif c is If:
+        self.record_uses(stmt.cond, "other")
+        self.find_uses(stmt.true)
+        self.find_uses(stmt.false)
+        self.record_merge(stmt.merge)
+      elif c is While:
+        self.record_uses(stmt.cond, "other")
+        self.find_uses(stmt.body)
+        self.record_merge(stmt.merge)
+      else:
+        collector = SetCollector()
+        collector.visit_stmt(stmt)
+        for name in collector.var_names:
+          self.uses.setdefault(name, []).append("other")
+
+  def record_merge(self, merge):
+    for (left, right) in merge.itervalues():
+      self.record_uses(left, "other")
+      if right is not None:
+        self.record_uses(right, "other")
+
+  def shape_dims(self, expr):
+    """
+    Returns the (array, dimension) pairs whose product is the given
+    value, or None if it's not a product of dimensions of small arrays
+    """
+    c = expr.__class__
+    if c is Var and expr.name in self.definitions:
+      return self.shape_dims(self.definitions[expr.name])
+    elif c is TupleProj and expr.tuple.__class__ is Var:
+      shape = self.definitions.get(expr.tuple.name)
+      if shape.__class__ is Attribute and shape.name == 'shape' and \
+         shape.value.__class__ is Var and shape.value.name in self.small_arrays:
+        return [(shape.value.name, expr.index)]
+    elif c is PrimCall and expr.prim == prims.multiply:
+      left = self.shape_dims(expr.args[0])
+      right = self.shape_dims(expr.args[1])
+      if left is not None and right is not None:
+        return left + right
+    return None
+
+  def small_count(self, count):
+    """
+    Is the number of elements no bigger than that of a small array?
+    """
+    if fits_int32(self.range(count)):
+      return True
+    dims = self.shape_dims(count)
+    # distinct dimensions of the same array can't multiply to more than its size
+    return dims is not None and len(dims) > 0 and \
+      len(set(array for (array, _) in dims)) == 1 and len(set(dims)) == len(dims)
+
+  def small_shape(self, shape):
+    if shape.__class__ is Var and shape.name in self.definitions:
+      defn = self.definitions[shape.name]
+      if defn.__class__ is Attribute and defn.name == 'shape' and \
+         defn.value.__class__ is Var and defn.value.name in self.small_arrays:
+        return True
+    value = self.range(shape)
+    if value.__class__ is TupleOfIntervals and \
+       all(elt.__class__ is Interval for elt in value.elts):
+      return fits_int32(Interval(0, reduce(lambda x, y: x * y,
+                                           [elt.upper for elt in value.elts], 1)))
+    return fits_int32(value)
+
+  def local_small_arrays(self):
+    """
+    Checked arrays along with views of their data and allocations whose
+    size fits in an int32
+    """
+    small = set(self.small_arrays)
+    for (name, rhs) in self.definitions.iteritems():
+      if rhs.__class__ is AllocArray and self.small_shape(rhs.shape):
+        small.add(name)
+    changed = True
+    while changed:
+      changed = False
+      for (name, rhs) in self.definitions.iteritems():
+        if name in small:
+          continue
+        if (rhs.__class__ is ArrayView and rhs.data.__class__ is Var and
+            self.data_of(rhs.data.name) in small) or \
+           (rhs.__class__ is Var and rhs.name in small):
+          small.add(name)
+          changed = True
+    return small
+
+  def data_of(self, pointer_name):
+    rhs = self.definitions.get(pointer_name)
+    if rhs.__class__ is Attribute and rhs.name == 'data' and rhs.value.__class__ is Var:
+      return rhs.value.name
+    return None
+
+  def is_small_pointer(self, rhs):
+    if rhs.__class__ is Alloc:
+      return self.small_count(rhs.count)
+    return rhs.__class__ is Attribute and rhs.name == 'data' and \
+      rhs.value.__class__ is Var and rhs.value.name in self.small_arrays
+
+  def array_field(self, expr):
+    """
+    Which field of a small array the value was read from, if any
+    """
+    c = expr.__class__
+    if c is Var and expr.name in self.definitions:
+      return self.array_field(self.definitions[expr.name])
+    elif c is Attribute and expr.value.__class__ is Var and \
+         expr.value.name in self.small_arrays:
+      return expr.name
+    elif c is TupleProj and expr.tuple.__class__ is Var and \
+         expr.tuple.name in self.definitions:
+      return self.array_field(self.definitions[expr.tuple.name])
+    return None
+
+  def is_stride(self, expr):
+    # arrays allocated with the shape of another array
+    # use its dimensions as their strides
+    return self.array_field(expr) in ('shape', 'strides')
+
+  def fits(self, expr, narrowed):
+    if expr.__class__ is Var and expr.name in narrowed:
+      return True
+    return isinstance(expr.type, IntT) and fits_int32(self.range(expr))
+
+  def is_loaded_index(self, expr):
+    return expr.__class__ is Var and \
+      self.definitions.get(expr.name).__class__ is Index
+
+  def is_offset_term(self, expr, narrowed):
+    return self.fits(expr, narrowed) or self.is_loaded_index(expr) or \
+      self.array_field(expr) == 'offset'
+
+  def is_offset(self, name, narrowed):
+    """
+    Is the variable part of an offset into small arrays, and
+    nothing else?
+    """
+    rhs = self.definitions[name]
+    if rhs.prim == prims.multiply:
+      x, y = rhs.args
+      if not ((self.is_stride(x) and self.is_offset_term(y, narrowed)) or
+              (self.is_stride(y) and self.is_offset_term(x, narrowed))):
+        return False
+    elif rhs.prim in (prims.add, prims.subtract):
+      if not all(self.is_offset_term(arg, narrowed) or
+                 (arg.__class__ is Var and arg.name in narrowed) for arg in rhs.args):
+        return False
+    else:
+      return False
+    uses = self.uses.get(name, [])
+    for context in uses:
+      if context == "other":
+        return False
+      kind, other = context
+      if kind == "index" and other not in self.small_pointers:
+        return False
+      if kind == "operand" and other not in narrowed:
+        return False
+    return len(uses) > 0
+
+  def can_narrow(self, name, narrowed):
+    if name in self.loops:
+      stmt = self.loops[name]
+      value = self.range(stmt.var)
+      if stmt.step.__class__ is not Const or value.__class__ is not Interval:
+        return False
+      step = abs(stmt.step.value)
+      return fits_int32(Interval(value.lower - step, value.upper + step)) and \
+        all(self.fits(bound, narrowed) for bound in (stmt.start, stmt.stop))
+    rhs = self.definitions[name]
+    if rhs.__class__ is not PrimCall or rhs.prim not in arithmetic_prims or \
+       not all(isinstance(arg.type, IntT) for arg in rhs.args):
+      return False
+    if fits_int32(self.range_analysis.ranges.get(name)) and \
+       all(self.fits(arg, narrowed) for arg in rhs.args):
+      return True
+    return self.is_offset(name, narrowed)
+
+  def find_narrowed(self, fn):
+    input_names = set(fn.arg_names)
+    candidates = [name for name in self.loops.keys() + self.definitions.keys()
+                  if name not in input_names and self.type_env.get(name) == Int64]
+    # start by assuming everything can be narrowed and drop
+    # variables until the rest only depend on each other
+    narrowed = set(candidates).union(self.input_ranges.keys())
+    changed = True
+    while changed:
+      changed = False
+      for name in candidates:
+        if name in narrowed and not self.can_narrow(name, narrowed):
+          narrowed.remove(name)
+          changed = True
+    return narrowed
+
+  def narrow_var(self, expr):
+    return Var(expr.name, type = Int32)
+
+  def narrow_operand(self, expr):
+    if expr.__class__ is Var and expr.name in self.narrowed:
+      return self.narrow_var(expr)
+    elif expr.__class__ is Const:
+      return Const(expr.value, type = Int32)
+    return Cast(self.transform_expr(expr), type = Int32)
+
+  def transform_Var(self, expr):
+    if expr.name in self.narrowed:
+      return Cast(self.narrow_var(expr), type = Int64)
+    return expr
+
+  def transform_Index(self, expr):
+    expr.value = self.transform_expr(expr.value)
+    if expr.index.__class__ is Var and expr.index.name in self.narrowed:
+      expr.index = self.narrow_var(expr.index)
+    else:
+      expr.index = self.transform_expr(expr.index)
+    return expr
+
+  def transform_Assign(self, stmt):
+    if stmt.lhs.__class__ is Var and stmt.lhs.name in self.narrowed:
+      rhs = stmt.rhs
+      if rhs.__class__ is PrimCall:
+        stmt.rhs = PrimCall(rhs.prim, [self.narrow_operand(arg) for arg in rhs.args],
+                            type = Int32)
+      else:
+        stmt.rhs = self.narrow_operand(rhs)
+      stmt.lhs = self.narrow_var(stmt.lhs)
+      return stmt
+    return Transform.transform_Assign(self, stmt)
+
+  def transform_ForLoop(self, stmt):
+    if stmt.var.name not in self.narrowed:
+      return Transform.transform_ForLoop(self, stmt)
+    stmt.var = self.narrow_var(stmt.var)
+    stmt.start = self.narrow_operand(stmt.start)
+    stmt.stop = self.narrow_operand(stmt.stop)
+    stmt.step = self.narrow_operand(stmt.step)
+    stmt.body = self.transform_block(stmt.body)
+    stmt.merge = self.transform_merge_after_loop(stmt.merge)
+    return stmt
+
+  def narrow_loop_body(self, stmt):
+    """
+    Copy of a parallel loop's body which takes 32-bit indices, or None
+    if its bounds might not fit
+    """
+    if stmt.fn.__class__ not in (Closure, TypedFn):
+      return None
+    fn = self.get_fn(stmt.fn)
+    closure_args = self.closure_elts(stmt.fn)
+    bounds = self.range(stmt.bounds)
+    if bounds.__class__ is not TupleOfIntervals:
+      bounds = mk_tuple([bounds])
+    if bounds.__class__ is not TupleOfIntervals:
+      return None
+    index_names = fn.arg_names[len(closure_args):]
+    index_types = fn.input_types[len(closure_args):]
+    if len(index_names) != len(bounds.elts) or \
+       any(t != Int64 for t in index_types) or \
+       not all(b.__class__ is Interval and fits_int32(Interval(0, b.upper + 1))
+               for b in bounds.elts):
+      return None
+    small_args = set(param for (param, arg) in zip(fn.arg_names, closure_args)
+                     if arg.__class__ is Var and arg.name in self.small_arrays)
+    index_ranges = dict((name, Interval(0, b.upper))
+                        for (name, b) in zip(index_names, bounds.elts))
+    cloned = CloneFunction().apply(fn)
+    for name in index_names:
+      cloned.type_env[name] = Int32
+    narrow_fn = TypedFn(name = names.refresh(fn.name),
+                        arg_names = fn.arg_names,
+                        body = cloned.body,
+                        input_types = tuple(fn.input_types[:len(closure_args)]) +
+                                      (Int32,) * len(index_names),
+                        return_type = fn.return_type,
+                        type_env = cloned.type_env,
+                        source_info = fn.source_info)
+    return NarrowIndices(small_args, index_ranges).apply(narrow_fn)
+
+  def transform_ParFor(self, stmt):
+    narrow_fn = self.narrow_loop_body(stmt)
+    if narrow_fn is None:
+      return Transform.transform_ParFor(self, stmt)
+    self.changed = True
+    closure_args = self.closure_elts(stmt.fn)
+    return ParFor(fn = self.closure(narrow_fn, closure_args),
+                  bounds = self.transform_expr(stmt.bounds),
+                  read_only = stmt.read_only,
+                  write_only = stmt.write_only)
+
+def narrow_indices(fn):
+  """
+  Version of a function with 32-bit loop counters and offsets wherever
+  they fit when its arrays are small, or the function itself if
+  nothing could be narrowed
+  """
+  if not any(isinstance(t, ArrayT) for t in fn.input_types):
+    return fn
+  transform = NarrowIndices()
+  narrow_fn = transform.apply(CloneFunction(rename = True).apply(fn))
+  if not transform.changed:
+    return fn
+  return narrow_fn
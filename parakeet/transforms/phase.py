@@ -1,3 +1,4 @@
+import weakref 
 from itertools import izip 
 
 from .. import config
@@ -41,6 +42,13 @@ def apply_transforms(fn, transforms,
   if phase_name: name_stack.pop()
   return fn
 
+# every phase which memoizes its results, so that their 
+# caches can be found and released after compilation 
+_memoized_phases = weakref.WeakValueDictionary()
+
+def memoized_phases():
+  return _memoized_phases.values()
+
 name_stack = []
 class Phase(object):
   def __init__(self,
@@ -82,6 +90,8 @@ class Phase(object):
     self.name = name
     self.recursive = recursive 
     self._hash = hash(str(self))
+    if memoize:
+      _memoized_phases[id(self)] = self
 
   def __str__(self):
     if self.name:
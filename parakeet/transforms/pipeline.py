@@ -1,4 +1,5 @@
 from .. import config 
+from ..settings_caches import register_settings_cache
 from ..analysis import (contains_adverbs, contains_calls, contains_loops, 
                         contains_structs, contains_array_operators)
 
@@ -8,6 +9,7 @@ from dead_code_elim import DCE
 
 from flattening import Flatten
 from fusion import Fusion
+from horizontal_fusion import HorizontalFusion
 from imap_elim import IndexMapElimination
 from index_elimination import IndexElim
 from indexify_adverbs import IndexifyAdverbs
@@ -19,6 +21,7 @@ from lower_adverbs import LowerAdverbs
 from lower_array_operators import LowerArrayOperators
 from lower_indexing import LowerIndexing
 from lower_slices import LowerSlices
+from loop_interchange import LoopInterchange
 from lower_structs import LowerStructs
 from negative_index_elim import NegativeIndexElim
 from offset_propagation import OffsetPropagation
@@ -144,6 +147,14 @@ copy_elim = Phase(CopyElimination,
                   config_param = 'opt_copy_elimination', 
                   memoize = False)
 
+horizontal_fusion = Phase(HorizontalFusion, 
+                          config_param = 'opt_horizontal_fusion', 
+                          memoize = False)
+
+loop_interchange = Phase(LoopInterchange, 
+                         config_param = 'opt_loop_interchange', 
+                         memoize = False)
+
 
 def print_indexified(fn):
   if config.print_indexified_function:
@@ -165,10 +176,10 @@ indexify = Phase([
                  memoize = True, 
                  post_apply = print_indexified) 
 
-optimize_indexified_code = Phase([copy_elim, Simplify, DCE, 
+optimize_indexified_code = Phase([copy_elim, Simplify, DCE, horizontal_fusion, 
                         LowerSlices, 
                         inline_opt, Simplify, DCE, 
-                        IndexMapElimination], 
+                        IndexMapElimination, loop_interchange], 
                        name = "AfterIndexify", 
                        depends_on = indexify, 
                        copy = True, 
@@ -208,11 +219,8 @@ index_elim = Phase([NegativeIndexElim, IndexElim], config_param = 'opt_index_eli
 lower_adverbs = Phase([LowerAdverbs, LowerSlices], run_if = contains_adverbs)
 
 
-# Currently incorrect in the presence of function calls
-# TODO: Make this mark an slices that are call arguments as read & written to
 load_elim = Phase(RedundantLoadElimination,
-                  config_param = 'opt_redundant_load_elimination', 
-                  run_if = lambda fn: not contains_calls(fn))
+                  config_param = 'opt_redundant_load_elimination')
 
 
 
@@ -293,4 +301,10 @@ lower_to_adverbs = Phase([lowering, final_optimizations],
                          copy = True, 
                          recursive = True, 
                          memoize = True, 
-                         depends_on = optimize_indexified_code,)
\ No newline at end of file
+                         depends_on = optimize_indexified_code,)
+
+# every phase above memoizes functions which were optimized with the 
+# current settings, so each group of settings needs its own caches
+for _phase in vars().values():
+  if isinstance(_phase, Phase):
+    register_settings_cache(_phase, 'cache')
@@ -4,15 +4,18 @@ from loop_transform import LoopTransform
 
 class RedundantLoadElimination(LoopTransform):
   def transform_block(self, stmts):
-    stmts = LoopTransform.transform_block(self, stmts) 
+    stmts = LoopTransform.transform_block(self, stmts)
     if self.is_simple_block(stmts, allow_branches = False):
-      reads, writes = self.collect_memory_accesses(stmts)
+      accesses = self.memory_accesses(stmts)
+      writes = set(expr.value.name for expr in accesses.writes)
       safe_arrays = set([])
-      for name in reads:
-        # if any alias of this array gets written to, consider it unsafe 
-        aliases = self.may_alias.get(name, set([]))
-        aliases.add(name)
-        unsafe = any(alias in writes for alias in aliases) 
+      for expr in accesses.reads:
+        name = expr.value.name
+        # if any alias of this array gets written to or might be
+        # changed some other way (e.g. by a call), consider it unsafe
+        aliases = self.aliases(name)
+        unsafe = any(alias in writes or alias in accesses.other_uses
+                     for alias in aliases)
         if not unsafe:
           safe_arrays.add(name)
       available_expressions = {}
@@ -32,9 +35,9 @@ class RedundantLoadElimination(LoopTransform):
               new_stmts.append(Assign(temp, stmt.rhs))
               stmt.rhs = temp
               available_expressions[key] = temp
-          new_stmts.append(stmt)
+        new_stmts.append(stmt)
       return new_stmts
     else:
       return stmts
-        
-        
\ No newline at end of file
+
+
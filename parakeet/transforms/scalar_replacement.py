@@ -1,121 +1,229 @@
-from .. syntax import Assign, Index, Var
+from .. analysis.collect_vars import collect_var_names
+from .. ndtypes import BoolT, FloatT, IntT
+from .. syntax import Assign, Attribute, Const, If, Index, PrimCall, TupleProj, Var
+from .. syntax.helpers import zero
 
-from loop_transform import LoopTransform 
+from loop_transform import LoopTransform
 
 
 class ScalarReplacement(LoopTransform):
   """
-  When a loop reads and writes to a non-varying memory location, 
-  we can keep the value of that location in a register and write 
-  it to the heap after the loop completes. 
-  
+  When a loop reads and writes to a non-varying memory location,
+  we can keep the value of that location in a register and write
+  it to the heap after the loop completes.
+
   Transform code like this:
-      for i in low .. high: 
+      for i in low .. high:
         z = x[const]
         q = z ** 2
-        x[const] = q + i 
-  into 
-      z_in = x[const]
+        x[const] = q + i
+  into
+      if low < high:
+        z_in = x[const]
       for i in low .. high:
         (header)
           z_loop = phi(z_in, z_out)
-        (body) 
+        (body)
           q = z_loop ** 2
-          z_out = q + i 
-      x[const] = z_loop   
+          z_out = q + i
+      if low < high:
+        x[const] = z_loop
+
+  A location only gets a register if every access to the arrays which might
+  share data with it (according to the escape analysis) is to that same
+  element, and none of those arrays get used any other way in the loop
+  (e.g. passed to a call). The loads and stores are skipped when the loop
+  doesn't run, since the element might not exist then.
   """
-  
-  
-  
-  def preload_reads(self, reads):
-    scalar_vars = {}
-    for (array_name, index_set) in reads.iteritems():
-      t = self.type_env[array_name]
-      for index_expr in index_set:
-        scalar = self.index(Var(array_name, type = t), index_expr, 
-                            temp = True, name = "scalar_repl_input")
-       
-        scalar_vars[(array_name, index_expr)] = scalar
-    return scalar_vars
-
-  def replace_indexing(self, loop_body, loop_scalars):
+
+  def pre_apply(self, fn):
+    LoopTransform.pre_apply(self, fn)
+    # pointers pulled out of the same array and offsets computed the same
+    # way (but maybe not yet merged by Simplify) are the same location
+    self.definitions = {}
+    for stmt in self.all_assignments(fn.body):
+      if stmt.lhs.__class__ is Var and \
+         stmt.rhs.__class__ in (Attribute, Const, PrimCall, TupleProj, Var):
+        self.definitions[stmt.lhs.name] = stmt.rhs
+
+  def all_assignments(self, stmts):
+    for stmt in stmts:
+      if stmt.__class__ is Assign:
+        yield stmt
+      for block_name in ('true', 'false', 'body'):
+        block = getattr(stmt, block_name, None)
+        if isinstance(block, list):
+          for nested in self.all_assignments(block):
+            yield nested
+
+  def canonical(self, expr):
+    c = expr.__class__
+    if c is Var:
+      if expr.name in self.definitions:
+        return self.canonical(self.definitions[expr.name])
+      return expr.name
+    elif c is Attribute:
+      return ("attr", self.canonical(expr.value), expr.name)
+    elif c is TupleProj:
+      return ("proj", self.canonical(expr.tuple), expr.index)
+    elif c is PrimCall:
+      return ("prim", expr.prim.name, tuple(self.canonical(arg) for arg in expr.args))
+    elif c is Const:
+      return ("const", expr.value)
+    return expr
+
+  def location(self, expr):
+    return self.canonical(expr.value), self.canonical(expr.index)
+
+  def hoist_fields(self, stmts, varying):
     """
-    Given a map from (array_name, index_expr) pairs to 
-    scalar variables, replace reads/writes with scalars
+    Move fields of loop-invariant values (e.g. an array's data pointer)
+    out of the loop so that the locations they point to can be loaded
+    before the loop starts
     """
-    final_scalars = loop_scalars.copy()
-    for stmt in loop_body:
-      if stmt.__class__ is not Assign: 
-        continue 
-      if stmt.rhs.__class__ is Index:
-        key = stmt.rhs.value.name, stmt.rhs.index
-        if key in final_scalars:
-          stmt.rhs = final_scalars[key]  
-      if stmt.lhs.__class__ is Index:
-        key = stmt.lhs.value.name, stmt.lhs.index
-        if key in final_scalars:
-          new_var = self.fresh_var(stmt.lhs.type, "scalar_repl_out")
-          stmt.lhs = new_var
-          final_scalars[key] = new_var  
-    return final_scalars
-  
-  
-  def transform_ForLoop(self, stmt):
-    
-    if self.is_simple_block(stmt.body):
-      loop_vars = set([stmt.var.name])
-      loop_vars.update(stmt.merge.keys())
-      # gather all the variables whose values change between loop iters
-      self.collect_loop_vars(loop_vars, stmt.body)
-      # full set of array reads & writes 
-      reads, writes = self.collect_memory_accesses(stmt.body)
-      
-      # which arrays are written to at loop-dependent locations? 
-      unsafe = set([])
-      for (name, write_indices) in writes.iteritems():
-        if self.any_loop_vars(loop_vars, write_indices):
-          unsafe.add(name)
-      safe_writes = dict([(k,v) for (k,v) in writes.items() 
-                          if k not in unsafe])
-      
-      safe_reads = dict([(k,v) for (k,v) in reads.items() 
-                         if k not in unsafe and not self.any_loop_vars(loop_vars, v)])
-
-      
-      safe_locations = {}
-      all_keys = set(safe_writes.keys()).union(set(safe_reads.keys()))
-      for name in all_keys:
-        index_set = safe_reads.get(name, set([])).union(safe_writes.get(name, set([])))
-        safe_locations[name] = index_set 
-      # move all safe/loop-invariant reads into registers at the top of the loop
-      # I'm also including the writes (by passing safe_locations instead of safe_reads)
-      # so that they become loop-carried accumulator values, otherwise where else would
-      # they get their initial values?
-      input_scalars = self.preload_reads(safe_locations)
-
-      
-      # need to rename the scalars so they have an SSA variable for the beginning of the loop
-      loop_scalars = {}
-      for ( (name,index_expr), input_var) in input_scalars.iteritems():
-        loop_var = self.fresh_var(input_var.type, "scalar_repl_acc")
-        loop_scalars[(name, index_expr)] = loop_var
-      
-      
-      # propagate register names for all writes 
-      final_scalars = self.replace_indexing(stmt.body, loop_scalars)
-      
-      for (key, final_var) in final_scalars.iteritems():
-        loop_var = loop_scalars[key]
-        input_var = input_scalars[key]
-        stmt.merge[loop_var.name] = (input_var, final_var)
-      
-      self.blocks.append(stmt)
-      # write out the results back to memeory 
-      for ( (array_name, index_expr), loop_var) in loop_scalars.iteritems():
-        array_type = self.type_env[array_name]
-        lhs = self.index(Var(array_name, type = array_type), index_expr, temp = False)
-        self.assign(lhs, loop_var) 
+    remaining = []
+    for stmt in stmts:
+      if stmt.__class__ is Assign and stmt.lhs.__class__ is Var and \
+         stmt.rhs.__class__ in (Attribute, TupleProj) and \
+         not any(name in varying for name in collect_var_names(stmt.rhs)):
+        self.blocks.append(stmt)
+        varying.discard(stmt.lhs.name)
+      else:
+        if stmt.__class__ is If:
+          stmt.true = self.hoist_fields(stmt.true, varying)
+          stmt.false = self.hoist_fields(stmt.false, varying)
+        remaining.append(stmt)
+    return remaining
+
+  def nonempty(self, stmt):
+    """
+    Returns True if the loop certainly runs, the condition for it
+    to run, or None if we can't tell which way it goes
+    """
+    if stmt.step.__class__ is not Const:
       return None
-    else:     
-      stmt.body = self.transform_block(stmt.body)
-      return stmt 
\ No newline at end of file
+    if stmt.start.__class__ is Const and stmt.stop.__class__ is Const:
+      if stmt.step.value > 0 and stmt.start.value < stmt.stop.value:
+        return True
+      if stmt.step.value < 0 and stmt.start.value > stmt.stop.value:
+        return True
+    if stmt.step.value > 0:
+      return self.lt(stmt.start, stmt.stop, "nonempty")
+    elif stmt.step.value < 0:
+      return self.gt(stmt.start, stmt.stop, "nonempty")
+    return None
+
+  def safe_locations(self, stmt, varying):
+    """
+    Returns a map from each location which could live in a register to
+    one of its accesses and whether the loop writes to it
+    """
+    accesses = self.memory_accesses(stmt.body)
+    for (_, (_, r)) in stmt.merge.iteritems():
+      accesses.visit_expr(r)
+
+    all_accesses = accesses.reads + accesses.writes
+    written = set(self.location(expr) for expr in accesses.writes)
+    locations = {}
+    for expr in all_accesses:
+      key = self.location(expr)
+      if key in locations:
+        continue
+      t = expr.type
+      if not isinstance(t, (FloatT, IntT, BoolT)):
+        continue
+      aliases = self.aliases(expr.value.name)
+      if aliases.intersection(accesses.other_uses):
+        continue
+      if any(name in varying for name in collect_var_names(expr.index)):
+        continue
+      shared = [other for other in all_accesses
+                if other.value.name in aliases or
+                   expr.value.name in self.aliases(other.value.name)]
+      if any(self.location(other) != key or other.type != t or
+             other.value.name in varying for other in shared):
+        continue
+      locations[key] = (expr, key in written)
+    return locations
+
+  def replace_accesses(self, stmts, current):
+    """
+    Given a map from locations to the variables holding their current
+    values, replace reads and writes with those variables, and return
+    the map of values at the end of the block
+    """
+    for stmt in stmts:
+      if stmt.__class__ is Assign:
+        if stmt.rhs.__class__ is Index and stmt.rhs.value.__class__ is Var:
+          key = self.location(stmt.rhs)
+          if key in current:
+            stmt.rhs = current[key]
+        if stmt.lhs.__class__ is Index and stmt.lhs.value.__class__ is Var:
+          key = self.location(stmt.lhs)
+          if key in current:
+            new_var = self.fresh_var(stmt.lhs.type, "scalar_repl_out")
+            stmt.lhs = new_var
+            current[key] = new_var
+      elif stmt.__class__ is If:
+        true_values = self.replace_accesses(stmt.true, current.copy())
+        false_values = self.replace_accesses(stmt.false, current.copy())
+        for key in current:
+          left = true_values[key]
+          right = false_values[key]
+          if left is not right:
+            merged = self.fresh_var(left.type, "scalar_repl_merge")
+            stmt.merge[merged.name] = (left, right)
+            current[key] = merged
+    return current
+
+  def transform_ForLoop(self, stmt):
+    stmt.body = self.transform_block(stmt.body)
+    if not self.is_simple_block(stmt.body):
+      return stmt
+
+    # gather all the variables whose values change between loop iters
+    varying = set([stmt.var.name])
+    varying.update(stmt.merge.iterkeys())
+    varying.update(self.memory_accesses(stmt.body).bound)
+    stmt.body = self.hoist_fields(stmt.body, varying)
+
+    locations = self.safe_locations(stmt, varying)
+    if len(locations) == 0:
+      return stmt
+    nonempty = self.nonempty(stmt)
+    if nonempty is None:
+      return stmt
+
+    loop_scalars = {}
+    for (key, (expr, _)) in locations.iteritems():
+      t = expr.type
+      load = Index(expr.value, expr.index, type = t)
+      input_var = self.fresh_var(t, "scalar_repl_input")
+      if nonempty is True:
+        self.assign(input_var, load)
+      else:
+        loaded = self.fresh_var(t, "scalar_repl_load")
+        self.blocks.append(If(nonempty, [Assign(loaded, load)], [],
+                              {input_var.name : (loaded, zero(t))}))
+      loop_var = self.fresh_var(t, "scalar_repl_acc")
+      stmt.merge[loop_var.name] = (input_var, None)
+      loop_scalars[key] = loop_var
+
+    # propagate register names for all writes
+    final_scalars = self.replace_accesses(stmt.body, loop_scalars.copy())
+    for (key, loop_var) in loop_scalars.iteritems():
+      input_var, _ = stmt.merge[loop_var.name]
+      stmt.merge[loop_var.name] = (input_var, final_scalars[key])
+    self.blocks.append(stmt)
+
+    # write the results back to memory
+    for (key, (expr, written)) in locations.iteritems():
+      if not written:
+        continue
+      store = Assign(Index(expr.value, expr.index, type = expr.type),
+                     loop_scalars[key])
+      if nonempty is True:
+        self.blocks.append(store)
+      else:
+        self.blocks.append(If(nonempty, [store], [], {}))
+    return None
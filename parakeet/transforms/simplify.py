@@ -1,7 +1,7 @@
 
 from dsltools import ScopedDict
 
-from .. import prims, syntax 
+from .. import names, prims, syntax 
 from .. analysis.collect_vars import collect_var_names
 from .. analysis.mutability_analysis import TypeBasedMutabilityAnalysis
 from .. analysis.use_analysis import use_count
@@ -714,7 +714,8 @@ class Simplify(Transform):
     self.bindings.pop()
     stmt.cond = self.transform_simple_expr(stmt.cond, "cond")
     if len(stmt.true) == 0 and len(stmt.false) == 0 and len(stmt.merge) <= 2:
-      for (lhs_name, (true_expr, false_expr)) in stmt.merge.items():
+      for lhs_name in sorted(stmt.merge, key = names.sort_key):
+        true_expr, false_expr = stmt.merge[lhs_name]
         lhs_type = self.lookup_type(lhs_name)
         lhs_var = Var(name = lhs_name, type = lhs_type)
         assert true_expr.type == false_expr.type, \
@@ -23,6 +23,23 @@ if config.print_transform_timings:
             (k.__name__, t*1000, count, (t/count)*1000)
   atexit.register(print_timings)
 
+
+# maps each transform class to a dictionary from (method prefix, syntax class) 
+# to the unbound function which handles that syntax class, or None 
+_dispatch_tables = {}
+
+def transform_method(transform_class, prefix, expr_class):
+  table = _dispatch_tables.get(transform_class)
+  if table is None:
+    table = _dispatch_tables[transform_class] = {}
+  key = (prefix, expr_class)
+  if key in table:
+    return table[key]
+  method = getattr(transform_class, prefix + expr_class.__name__, None)
+  fn = getattr(method, 'im_func', method)
+  table[key] = fn
+  return fn
+
 class Transform(Builder):
   def __init__(self, verify=config.opt_verify,
                      reverse=False,
@@ -71,11 +88,11 @@ class Transform(Builder):
 
   def find_method(self, expr, prefix = "transform_"):
     assert expr, "Expected expression but got %s" % expr 
-    method_name = prefix + expr.__class__.__name__
-    if hasattr(self, method_name):
-      return getattr(self, method_name)
-    else:
+    fn = transform_method(self.__class__, prefix, expr.__class__)
+    if fn is None:
       return None
+    else:
+      return fn.__get__(self, self.__class__)
 
   """
   Common cases for expression transforms: we don't need to create a method for
@@ -307,9 +324,9 @@ class Transform(Builder):
     elif expr_class is Len:
       result = self.transform_Len(expr)
     else:
-      method = self.find_method(expr, "transform_")
-      if method:
-        result = method(expr)
+      fn = transform_method(self.__class__, "transform_", expr_class)
+      if fn:
+        result = fn(self, expr)
 
       else:
         assert False, "Unsupported expr %s" % (expr,)
@@ -350,13 +367,11 @@ class Transform(Builder):
     elif lhs_class is Attribute:
       return self.transform_lhs_Attribute(lhs)
 
-    lhs_method = self.find_method(lhs, prefix = "transform_lhs_")
-    if lhs_method:
-      return lhs_method(lhs)
-
-    method = self.find_method(lhs, prefix = "transform_")
-    assert method, "Unknown expression of type %s" % lhs_class
-    return method(lhs)
+    fn = transform_method(self.__class__, "transform_lhs_", lhs_class)
+    if fn is None:
+      fn = transform_method(self.__class__, "transform_", lhs_class)
+    assert fn, "Unknown expression of type %s" % lhs_class
+    return fn(self, lhs)
 
   def transform_expr_list(self, exprs):
     return [self.transform_expr(e) for e in exprs]
@@ -1,6 +1,7 @@
 from itertools import izip 
 
 from .. import config, names,  prims, syntax
+from ..tiering import compile_lock
 
 from ..builder import mk_prim_fn 
 from ..ndtypes import (Type, 
@@ -507,28 +508,33 @@ def specialize(fn, arg_types, return_type = None):
   if key in closure_t.specializations:
     return closure_t.specializations[key]
 
-  if config.print_before_specialization:
-    if return_type:
-      print "==== Specializing", fn, "for input types", arg_types, "and return type", return_type
-    else:  
-      print "=== Specializing", fn, "for types", arg_types 
+  # type inference creates fresh names, so it can't run while a hot 
+  # function is being recompiled on another thread 
+  with compile_lock:
+    if key in closure_t.specializations:
+      return closure_t.specializations[key]
+    if config.print_before_specialization:
+      if return_type:
+        print "==== Specializing", fn, "for input types", arg_types, "and return type", return_type
+      else:  
+        print "=== Specializing", fn, "for types", arg_types 
   
-  full_arg_types = arg_types.prepend_positional(closure_t.arg_types)
-  fundef = _get_fundef(closure_t.fn)
-  typed =  _specialize(fundef, full_arg_types, return_type)
-  closure_t.specializations[key] = typed
-
-  if config.print_specialized_function:
-    if return_type:
-      print "=== Specialized %s for input types %s and return type %s ==="  % \
-          (fundef.name, full_arg_types, return_type)
-    else:
-      print "=== Specialized %s for input types %s ==="  % \
-          (fundef.name, full_arg_types)
+    full_arg_types = arg_types.prepend_positional(closure_t.arg_types)
+    fundef = _get_fundef(closure_t.fn)
+    typed =  _specialize(fundef, full_arg_types, return_type)
+    closure_t.specializations[key] = typed
+
+    if config.print_specialized_function:
+      if return_type:
+        print "=== Specialized %s for input types %s and return type %s ==="  % \
+            (fundef.name, full_arg_types, return_type)
+      else:
+        print "=== Specialized %s for input types %s ==="  % \
+            (fundef.name, full_arg_types)
     
-    print
-    print repr(typed)
-    print
+      print
+      print repr(typed)
+      print
 
   return typed
 
@@ -1 +1,2 @@
-from value_specialization import specialize
\ No newline at end of file
+from value_specialization import (specialize, specialize_abstract_values, 
+                                  specialization_values, specialize_contiguous)
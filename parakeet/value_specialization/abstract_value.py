@@ -56,14 +56,18 @@ class Array(AbstractValue):
     self._hash = hash(self.shape) + hash(self.offset) + hash(self.strides.elts) + 1
   
   def __str__(self):
-    return "Array(strides = %s)" % self.strides
+    # the name of a specialization phase includes this string, so it 
+    # needs to tell apart everything that makes arrays specialize differently 
+    return "Array(strides = %s, shape = %s, offset = %s)" % (self.strides, self.shape, self.offset)
   
   def __hash__(self):
     return self._hash 
   
   def __eq__(self, other):
     return other.__class__ is Array and \
-      self.strides == other.strides
+      self.strides == other.strides and \
+      self.shape == other.shape and \
+      self.offset == other.offset
 
 
 class Struct(AbstractValue):
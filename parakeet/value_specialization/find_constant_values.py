@@ -4,6 +4,7 @@ import numpy as np
 from .. ndtypes import ArrayT, TupleT   
 from .. syntax import TypedFn, Var
 from ..analysis import SyntaxVisitor
+from ..retention import register_ir_cache
 from abstract_value import one, zero, Const, unknown, Tuple, Array, Struct, abstract_tuple, abstract_array  
 
 
@@ -18,6 +19,8 @@ def bind_list(arg_names, abstract_values):
   return env 
 
 _cache = {}
+register_ir_cache(__name__)
+
 def symbolic_call(fn, symbolic_inputs):
   key = fn.cache_key, tuple(symbolic_inputs)
   if key in _cache:
@@ -1,9 +1,16 @@
 import numpy as np 
 from numpy import ndarray 
 
-from .. import syntax 
+from .. import config, syntax 
+from ..ndtypes import ArrayT 
+from ..retention import register_ir_cache
+from ..settings_caches import register_settings_cache
 from .. syntax.helpers import const 
 from ..transforms  import Transform, Simplify, Phase, DCE 
+from ..transforms.loop_transform import LoopTransform
+from ..transforms.loop_unrolling import LoopUnrolling, safediv
+from ..transforms.redundant_load_elim import RedundantLoadElimination
+from ..transforms.scalar_replacement import ScalarReplacement
 
 
 from find_constant_values import symbolic_call
@@ -73,6 +80,45 @@ class ValueSpecializer(Transform):
   def transform_lhs(self, lhs):
     return lhs
   
+class FullUnrolling(LoopUnrolling):
+  """
+  Only unroll loops with constant bounds, and then completely
+  """
+  def __init__(self):
+    LoopUnrolling.__init__(self, 
+                           max_static_unrolling = config.small_shape_max_dim, 
+                           max_block_size = 4 * config.small_shape_max_dim)
+  
+  def is_simple_block(self, stmts, allow_branches = True):
+    # unrolling inner loops leaves comments behind, which 
+    # shouldn't stop us from unrolling the loops around them 
+    stmts = [stmt for stmt in stmts if stmt.__class__ is not syntax.Comment]
+    return LoopUnrolling.is_simple_block(self, stmts, allow_branches)
+  
+  def transform_ForLoop(self, stmt):
+    start, stop, step = stmt.start, stmt.stop, stmt.step 
+    if start.__class__ is syntax.Const and \
+       stop.__class__ is syntax.Const and \
+       step.__class__ is syntax.Const and \
+       step.value > 0 and \
+       safediv(stop.value - start.value, step.value) <= self.max_static_unrolling:
+      return LoopUnrolling.transform_ForLoop(self, stmt)
+    return LoopTransform.transform_ForLoop(self, stmt)
+
+def has_const_shape(abstract_value):
+  """
+  Does an abstract value contain any array dimension 
+  which small shape specialization turned into a constant?
+  """
+  c = abstract_value.__class__
+  if c is Array:
+    return abstract_value.shape.__class__ is Tuple and \
+      any(d.__class__ is Const and d.value > 1 for d in abstract_value.shape.elts)
+  elif c is Tuple:
+    return any(has_const_shape(elt) for elt in abstract_value.elts)
+  else:
+    return False 
+
 def has_small_const(abstract_value):
   c = abstract_value.__class__
   
@@ -91,7 +137,12 @@ def has_small_const(abstract_value):
     return False
 
 
-def from_python(python_value):
+def shape_const(dim, small_shapes = False):
+  if small_shapes and dim <= config.small_shape_max_dim:
+    return Const(dim)
+  return specialization_const(dim)
+
+def from_python(python_value, small_shapes = False):
   t = type(python_value)
   if t is ndarray:
     elt_size = python_value.dtype.itemsize 
@@ -99,10 +150,10 @@ def from_python(python_value):
     for s in python_value.strides:
       strides.append(specialization_const(s/elt_size))
     strides = abstract_tuple(strides)
-    shape = abstract_tuple([specialization_const(dim) for dim in python_value.shape])
+    shape = abstract_tuple([shape_const(dim, small_shapes) for dim in python_value.shape])
     return Array(strides, shape)
   elif t is tuple:
-    return abstract_tuple(from_python_list(python_value))
+    return abstract_tuple(from_python_list(python_value, small_shapes))
   elif python_value == 0:
     return zero 
   elif python_value == 1:
@@ -111,15 +162,31 @@ def from_python(python_value):
     return unknown 
     
   
-def from_python_list(python_values):
-  return tuple([from_python(v) for v in python_values]) 
+def from_python_list(python_values, small_shapes = False):
+  return tuple([from_python(v, small_shapes) for v in python_values]) 
 
 _cache = {}
+register_ir_cache(__name__)
+register_settings_cache(__name__)
+
 def specialize_abstract_values(fn, abstract_values):
   key = (fn.cache_key, abstract_values)
   if key in _cache:
     return _cache[key]
-  if any(has_small_const(v) for v in abstract_values):
+  if any(has_const_shape(v) for v in abstract_values):
+    # loops over the constant dimensions become straight-line code 
+    # in which the tiny arrays they index can live in scalars 
+    specializer = ValueSpecializer(abstract_values)
+    transforms = Phase([specializer, Simplify, DCE, 
+                        FullUnrolling, Simplify, 
+                        RedundantLoadElimination, ScalarReplacement],
+                        memoize = False, 
+                        copy = True, 
+                        cleanup = [Simplify, DCE],
+                        name = "ShapeSpecialization for %s" % (abstract_values,), 
+                        recursive = False)
+    new_fn = transforms.apply(fn)
+  elif any(has_small_const(v) for v in abstract_values):
     specializer = ValueSpecializer(abstract_values)
     transforms = Phase([specializer, Simplify, DCE],
                         memoize = False, 
@@ -133,6 +200,57 @@ def specialize_abstract_values(fn, abstract_values):
   return new_fn
 
 
+# specialization keys of the constant shape variants of each function 
+_shape_variants = {}
+def small_shape_values(fn, python_values):
+  """
+  Abstract values with small dimensions treated as constants, unless 
+  that would make a new variant of a function which already has too many 
+  """
+  abstract_values = from_python_list(python_values, small_shapes = True)
+  if not any(has_const_shape(v) for v in abstract_values):
+    return abstract_values
+  variants = _shape_variants.setdefault(fn.cache_key, set([]))
+  if abstract_values not in variants:
+    if len(variants) >= config.small_shape_max_variants:
+      return from_python_list(python_values)
+    variants.add(abstract_values)
+  return abstract_values
+
+def specialization_values(fn, python_values):
+  """
+  Abstract values of the given arguments which pick 
+  the version of a function to use for them 
+  """
+  if config.small_shape_specialization:
+    return small_shape_values(fn, python_values)
+  else:
+    return from_python_list(python_values)
+
 def specialize(fn, python_values):
-  return specialize_abstract_values(fn,  from_python_list(python_values))
-  
\ No newline at end of file
+  """
+  Pick the version of a function compiled for the 
+  constant strides and shapes of the given values
+  """
+  return specialize_abstract_values(fn, specialization_values(fn, python_values))
+  
+
+def contiguous_values(input_types):
+  """
+  Abstract values of arguments whose arrays all have unit innermost strides
+  """
+  values = []
+  for t in input_types:
+    if isinstance(t, ArrayT) and t.rank > 0:
+      values.append(abstract_array((unknown,) * (t.rank - 1) + (one,)))
+    else:
+      values.append(unknown)
+  return tuple(values)
+
+def specialize_contiguous(fn):
+  """
+  Version of a function which assumes the innermost dimension of 
+  all its array arguments is contiguous, or the function itself 
+  if it has no array arguments 
+  """
+  return specialize_abstract_values(fn, contiguous_values(fn.input_types))
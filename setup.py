@@ -42,5 +42,5 @@ setup(
       'dsltools',
       'appdirs',
       # LLVM is optional as long as you use the C backend 
-      # 'llvmpy',
+      # 'llvmlite',
     ])
@@ -0,0 +1,42 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.frontend import specialize
+from parakeet.openmp_backend import MulticoreCompiler
+from parakeet.transforms.pipeline import lower_to_adverbs
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+@jit
+def add1(x):
+  return parakeet.map(lambda xi: xi + 1, x)
+
+def test_aligned_output():
+  x = np.arange(1000.0)
+  for alignment in [64, 4096]:
+    y = add1(x, _backend = 'c', _alloc = parakeet.allocation_policy(alignment = alignment))
+    expect_eq(y, x + 1)
+    assert y.ctypes.data % alignment == 0, \
+      "Expected data aligned to %d bytes, got address %d" % (alignment, y.ctypes.data)
+
+def test_malloc_output():
+  x = np.arange(10.0)
+  with parakeet.allocation_policy(alignment = 0):
+    expect_eq(add1(x, _backend = 'c'), x + 1)
+
+def test_first_touch_codegen():
+  typed_fn, _ = specialize(add1.fn, [np.arange(10.0)])
+  fn = lower_to_adverbs.apply(typed_fn)
+  with parakeet.allocation_policy(first_touch = True, huge_pages = True):
+    compiler = MulticoreCompiler()
+    _, _, src = compiler.visit_fn(fn)
+  assert "schedule(static)" in src, src
+  helpers = list(compiler.extra_functions.values())
+  # helpers shared between modules get compiled into objects next to their source
+  for object_name in compiler.extra_objects:
+    with open(object_name[:-len(".o")] + ".c") as f:
+      helpers.append(f.read())
+  helpers = "\n".join(helpers)
+  assert "MADV_HUGEPAGE" in helpers, helpers
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,111 @@
+import shutil
+import tempfile
+
+import numpy as np
+import parakeet
+from parakeet import jit, llvmlite_available
+from parakeet.c_backend import config as c_config, run_function as c_run_function
+from parakeet.frontend import autotune
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+@jit
+def dot(x, y):
+  total = 0.0
+  for i in xrange(len(x)):
+    total = total + x[i] * y[i]
+  return total
+
+def test_settings_scope_restores_config():
+  old_unrolling = parakeet.config.opt_loop_unrolling
+  old_opt_level = c_config.opt_level
+  with autotune.settings_scope({'opt_loop_unrolling' : not old_unrolling,
+                                'opt_level' : '-O1'}):
+    assert parakeet.config.opt_loop_unrolling == (not old_unrolling)
+    assert c_config.opt_level == '-O1'
+  assert parakeet.config.opt_loop_unrolling == old_unrolling
+  assert c_config.opt_level == old_opt_level
+
+def test_autotune_saves_winner():
+  old_cache_dir = c_config.cache_dir
+  tmp_dir = tempfile.mkdtemp()
+  c_config.cache_dir = tmp_dir
+  del autotune._saved_settings[:]
+  try:
+    x = np.random.randn(1000)
+    y = np.random.randn(1000)
+    settings = dot.autotune(x, y, budget_seconds = 2.0, _backend = 'c')
+    assert 'opt_loop_unrolling' in settings, settings
+    # forget what's in memory and reload the winner from the cache directory
+    del autotune._saved_settings[:]
+    input_types = (parakeet.typeof(x), parakeet.typeof(y))
+    assert autotune.tuned_settings(dot.fn, input_types, 'c') == settings
+    expect_eq(dot(x, y, _backend = 'c'), np.dot(x, y))
+  finally:
+    c_config.cache_dir = old_cache_dir
+    del autotune._saved_settings[:]
+    shutil.rmtree(tmp_dir)
+
+def count_calls(obj, attr):
+  calls = []
+  fn = getattr(obj, attr)
+  def counted(*args, **kwargs):
+    # variants which fail to compile get skipped, so only count calls which return
+    result = fn(*args, **kwargs)
+    calls.append(args)
+    return result
+  setattr(obj, attr, counted)
+  return calls
+
+@jit
+def scaled_sum(x, alpha):
+  total = 0.0
+  for i in xrange(len(x)):
+    total = total + alpha * x[i]
+  return total
+
+def distinct_settings(time_variant_calls):
+  # the greedy search can come back to settings it already tried
+  return set(tuple(sorted(settings.items())) for (_, settings) in time_variant_calls)
+
+def test_each_variant_compiles_its_own_code():
+  x = np.random.randn(100)
+  old_time_variant = autotune.time_variant
+  old_lower_to_loops = c_run_function.lower_to_loops
+  try:
+    variants = count_calls(autotune, 'time_variant')
+    lowered = count_calls(c_run_function, 'lower_to_loops')
+    scaled_sum.autotune(x, 2.0, budget_seconds = 30.0, save = False, _backend = 'c')
+  finally:
+    autotune.time_variant = old_time_variant
+    c_run_function.lower_to_loops = old_lower_to_loops
+  assert len(variants) > 1
+  expect_eq(len(lowered), len(distinct_settings(variants)))
+
+def test_llvm_variants():
+  if not llvmlite_available:
+    return
+  from parakeet.llvm_backend import run_function as llvm_run_function
+  x = np.random.randn(100)
+  old_time_variant = autotune.time_variant
+  old_compile_entry = llvm_run_function.compile_entry
+  try:
+    variants = count_calls(autotune, 'time_variant')
+    compiled = count_calls(llvm_run_function, 'compile_entry')
+    settings = scaled_sum.autotune(x, 3.0, budget_seconds = 30.0, save = False, _backend = 'llvm')
+  finally:
+    autotune.time_variant = old_time_variant
+    llvm_run_function.compile_entry = old_compile_entry
+  assert 'small_shape_specialization' not in settings, settings
+  assert len(variants) > 1
+  expect_eq(len(compiled), len(distinct_settings(variants)))
+
+def test_untunable_backend():
+  x = np.random.randn(10)
+  try:
+    dot.autotune(x, x, save = False, _backend = 'interp')
+  except AssertionError:
+    return
+  assert False, "Expected autotuning the interpreter to fail"
+
+if __name__ == '__main__':
+  run_local_tests()
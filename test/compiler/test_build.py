@@ -0,0 +1,42 @@
+import glob
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import parakeet
+from parakeet.c_backend import config as c_config
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def add1(x):
+  return parakeet.map(lambda xi: xi + 1, x)
+
+def build_add1(single_command, x):
+  """
+  Build add1 in a fresh cache directory and return the names of the 
+  files left in its build subdirectory, each test needs its own input 
+  type to avoid reusing a module compiled earlier in this process
+  """
+  cache_dir = tempfile.mkdtemp()
+  old_values = c_config.cache_dir, c_config.single_command_build
+  c_config.cache_dir = cache_dir
+  c_config.single_command_build = single_command
+  try:
+    with parakeet.allocation_policy(alignment = 32):
+      expect_eq(parakeet.jit(add1)(x, _backend = 'c'), x + 1)
+    return [os.path.basename(f) for f in glob.glob(os.path.join(cache_dir, "build", "*"))]
+  finally:
+    c_config.cache_dir, c_config.single_command_build = old_values
+    shutil.rmtree(cache_dir)
+
+def test_single_command_build():
+  files = build_add1(True, np.arange(10.0))
+  assert any(f.endswith(".h.gch") for f in files), files
+  assert any(f.startswith("parakeet_alloc_32_") and f.endswith(".o") for f in files), files
+
+def test_separate_build():
+  files = build_add1(False, np.arange(10))
+  assert not any(f.endswith(".gch") for f in files), files
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,40 @@
+import numpy as np
+import parakeet
+from parakeet.c_backend import run_function as c_run_function
+from parakeet.frontend import translate_function_value
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def scaled(alpha):
+  return lambda xi: xi * alpha
+
+def make_adder(a):
+  def add(xi):
+    return xi + a
+  return add
+
+x = np.arange(10.0)
+
+def test_lambda_reuses_translation():
+  fns = [scaled(alpha) for alpha in (1.0, 2.0, 3.0)]
+  untyped = translate_function_value(fns[0])
+  for (alpha, f) in zip((1.0, 2.0, 3.0), fns):
+    assert translate_function_value(f) is untyped
+    expect_eq(parakeet.map(f, x, _backend = 'c'), x * alpha)
+
+def test_nested_fn_reuses_compiled_code():
+  expect_eq(parakeet.map(make_adder(1.0), x, _backend = 'c'), x + 1.0)
+  n_compiled = len(c_run_function._entry_cache)
+  for a in (2.0, 3.0, 4.0):
+    expect_eq(parakeet.map(make_adder(a), x, _backend = 'c'), x + a)
+    expect_eq(parakeet.jit(make_adder(a))(1.0, _backend = 'c'), 1.0 + a)
+  # one more specialization for calling the function through jit 
+  assert len(c_run_function._entry_cache) == n_compiled + 1
+
+def test_closure_cell_types():
+  # cells of a different type get a different specialization 
+  expect_eq(parakeet.map(make_adder(1), np.arange(10), _backend = 'interp'), np.arange(10) + 1)
+  expect_eq(parakeet.map(make_adder(True), x, _backend = 'interp'), x + 1)
+  expect_eq(parakeet.map(make_adder(0.5), x, _backend = 'interp'), x + 0.5)
+
+if __name__ == '__main__':
+  run_local_tests()
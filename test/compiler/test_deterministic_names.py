@@ -0,0 +1,66 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import parakeet
+from parakeet.testing_helpers import run_local_tests
+
+# compiles the same kernel in a fresh interpreter, optionally after compiling
+# some unrelated functions, and prints the module it got from the disk cache
+script = """
+import sys
+import numpy as np
+import parakeet
+from parakeet.c_backend import config as c_config, PyModuleCompiler
+from parakeet.frontend import specialize
+from parakeet.transforms.pipeline import lower_to_loops
+
+c_config.cache_dir = sys.argv[1]
+
+def other(x, y):
+  return parakeet.map(lambda xi: xi * 2 + y, x).sum()
+
+def kernel(x, alpha):
+  total = 0.0
+  for i in range(x.shape[0]):
+    if x[i] > alpha:
+      total = total + x[i]
+  return parakeet.map(lambda xi, yi: xi * alpha + yi, x, x) + total
+
+if sys.argv[2] == 'warm':
+  parakeet.jit(other)(np.arange(5.0), 3.0, _backend = 'c')
+  parakeet.jit(other)(np.arange(5), 3, _backend = 'c')
+typed_fn, _ = specialize(kernel, [np.arange(10.0), 2.0])
+compiled = PyModuleCompiler().compile_entry(lower_to_loops(typed_fn))
+print compiled.shared_filename
+"""
+
+def compiled_filename(script_name, cache_dir, mode):
+  env = dict(os.environ)
+  package_root = os.path.dirname(os.path.dirname(os.path.abspath(parakeet.__file__)))
+  env['PYTHONPATH'] = os.pathsep.join([package_root, env.get('PYTHONPATH', '')])
+  output = subprocess.check_output([sys.executable, script_name, cache_dir, mode], env = env)
+  return output.strip().splitlines()[-1]
+
+def test_cache_hit_across_processes():
+  cache_dir = tempfile.mkdtemp()
+  try:
+    # Parakeet needs the source of the functions it compiles so 
+    # the script has to live in a file rather than a "-c" argument 
+    script_name = os.path.join(cache_dir, "compile_kernel.py")
+    with open(script_name, "w") as f:
+      f.write(script)
+    first = compiled_filename(script_name, cache_dir, 'cold')
+    assert os.path.exists(first), first
+    mtime = os.path.getmtime(first)
+    second = compiled_filename(script_name, cache_dir, 'warm')
+    assert first == second, \
+      "Expected same cached module in both processes, got %s and %s" % (first, second)
+    assert os.path.getmtime(second) == mtime, "Expected cached module to be reused"
+  finally:
+    shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,65 @@
+import numpy as np
+import parakeet
+from parakeet.transforms.pipeline import optimize_indexified_code
+from parakeet.testing_helpers import expect, expect_eq, run_local_tests, openmp_backend_works, \
+  openmp_settings
+
+def optimized(fn, args):
+  return str(optimize_indexified_code.apply(parakeet.typed_repr(fn, args)))
+
+def min_max(x):
+  return np.min(x), np.max(x)
+
+def test_fuse_reductions():
+  x = np.array([3.0, -1.0, 7.0, 2.0, 0.5])
+  expect(min_max, [x], min_max(x))
+  fn = optimized(min_max, [x])
+  assert fn.count("IndexReduce(") == 1, \
+      "Expected min and max to share one reduction, got:\n%s" % fn
+
+def row_min_max(x):
+  return np.min(x, axis = 1), np.max(x, axis = 1)
+
+def test_fuse_nested_reductions():
+  x = np.arange(12.0).reshape(3, 4) % 5
+  expect(row_min_max, [x], row_min_max(x))
+
+def two_maps(x):
+  return x + 1, x * 2
+
+def test_fuse_maps():
+  x = np.arange(6.0)
+  expect(two_maps, [x], two_maps(x))
+  fn = optimized(two_maps, [x])
+  assert fn.count("ParFor(") == 1, \
+      "Expected both maps to run in one loop, got:\n%s" % fn
+
+def different_shapes():
+  return np.zeros((3, 3, 3)), np.ones((3, 3, 2))
+
+def test_different_shapes():
+  expect(different_shapes, [], different_shapes())
+  fn = optimized(different_shapes, [])
+  assert fn.count("ParFor(") == 2, \
+      "Loops over different shapes shouldn't be merged, got:\n%s" % fn
+
+def mean_var(x):
+  m = np.mean(x)
+  return m, np.mean((x - m) ** 2)
+
+def test_dependent_reductions():
+  x = np.arange(10.0)
+  expect(mean_var, [x], mean_var(x))
+  fn = optimized(mean_var, [x])
+  assert fn.count("IndexReduce(") == 2, \
+      "Variance can't be computed in the same pass as the mean, got:\n%s" % fn
+
+def test_threaded_reduction():
+  if not openmp_backend_works():
+    return
+  x = np.random.randn(10007)
+  with openmp_settings(num_threads = 4, parallel_threshold = 0):
+    expect_eq(parakeet.jit(min_max)(x, _backend = 'openmp'), min_max(x))
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,100 @@
+import numpy as np
+from parakeet import jit, lazy, force, LazyArray
+from parakeet.lazy_arrays import _graph_cache, GraphTranslation
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+@jit
+def scale(x, a):
+  return x * a
+
+@jit
+def center(x):
+  return x - x.mean()
+
+def test_arithmetic_and_ufuncs():
+  x = np.random.randn(100)
+  y = np.sqrt(lazy(x) * lazy(x) + 1.0)
+  assert isinstance(y, LazyArray), y
+  expect_eq(force(y), np.sqrt(x * x + 1.0))
+  expect_eq(np.asarray(-abs(lazy(x)) < 0.5), -abs(x) < 0.5)
+  y = np.round(x)
+  expect_eq(force(lazy(y) == lazy(x)), y == x)
+  expect_eq(force(lazy(y) != x), y != x)
+
+def test_calls_across_jit_functions():
+  x = np.random.randn(100)
+  y = np.random.randn(100)
+  z = center(scale(lazy(x), 2.0)) + y
+  assert isinstance(z, LazyArray), z
+  assert np.allclose(force(z), (2 * x - (2 * x).mean()) + y)
+  # telling a function which backend to use runs it right away
+  expect_eq(scale(lazy(x), 3.0, _backend = 'c'), x * 3.0)
+
+def test_slices_and_reductions():
+  x = np.random.randn(100)
+  m = np.random.randn(20, 30)
+  assert np.allclose(force((lazy(x)[10:50:2] ** 2).sum()), (x[10:50:2] ** 2).sum())
+  expect_eq(force(lazy(m).T[::2, 3:].max(axis = 0)), m.T[::2, 3:].max(axis = 0))
+  assert np.allclose(force(np.sum(lazy(m), axis = 1)), m.sum(axis = 1))
+
+def test_negative_indices():
+  x = np.arange(10.0)
+  m = np.random.randn(3, 4)
+  expect_eq(force(lazy(x)[-1]), 9.0)
+  expect_eq(force(lazy(x)[-3:]), x[-3:])
+  expect_eq(force(lazy(x)[:-2:3]), x[:-2:3])
+  expect_eq(force(lazy(m)[-1, 1:-1]), m[-1, 1:-1])
+
+def test_long_chain():
+  x = np.random.randn(10)
+  v = lazy(x)
+  for _ in xrange(2000):
+    v = v + 1.0
+  translation = GraphTranslation()
+  translation.node(v)
+  assert len(translation.stmts) == 2000
+  assert len(translation.inputs) == 2, translation.inputs
+  w = lazy(x)
+  for _ in xrange(20):
+    w = w * 0.5 + 1.0
+  expected = x
+  for _ in xrange(20):
+    expected = expected * 0.5 + 1.0
+  assert np.allclose(force(w), expected)
+
+def test_same_structure_reuses_graph():
+  def expr(x):
+    return force(np.exp(lazy(x) - 1.0) * 2.0)
+  x = np.random.randn(50)
+  expect_eq(expr(x), np.exp(x - 1.0) * 2.0)
+  n_graphs = len(_graph_cache)
+  y = np.random.randn(70)
+  expect_eq(expr(y), np.exp(y - 1.0) * 2.0)
+  assert len(_graph_cache) == n_graphs
+
+def test_fresh_lambdas_share_graph():
+  x = np.random.randn(30)
+  def expr():
+    add_one = jit(lambda xi: xi + 1.0)
+    return force(add_one(lazy(x)) * 2.0)
+  expect_eq(expr(), (x + 1.0) * 2.0)
+  n_graphs = len(_graph_cache)
+  for _ in xrange(3):
+    expect_eq(expr(), (x + 1.0) * 2.0)
+  assert len(_graph_cache) == n_graphs, \
+    "Expected %d cached graphs but got %d" % (n_graphs, len(_graph_cache))
+
+def test_truth_value():
+  x = np.arange(5.0)
+  try:
+    bool(lazy(x) == lazy(x))
+  except ValueError:
+    pass
+  else:
+    assert False, "Expected truth value of a lazy array to be ambiguous"
+  assert lazy(x)[2:3] == 2.0
+  assert not (lazy(x)[2:3] != 2.0)
+  assert not (lazy(x)[3] == 2.0)
+
+if __name__ == '__main__':
+  run_local_tests()
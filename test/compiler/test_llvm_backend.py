@@ -0,0 +1,65 @@
+import time
+import numpy as np
+import parakeet
+from parakeet import jit, llvmlite_available
+from parakeet.frontend import specialize
+from parakeet.openmp_backend import config as openmp_config
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def scale_rows(x, alpha):
+  return parakeet.map(lambda row: parakeet.map(lambda xi: xi * alpha + 1, row), x)
+
+def run_parallel(x, alpha, num_threads):
+  from parakeet.llvm_backend import llvm_config
+  old_values = openmp_config.parallel_threshold, llvm_config.parallel
+  openmp_config.parallel_threshold = 0
+  llvm_config.parallel = True
+  try:
+    with parakeet.thread_pool(num_threads):
+      return jit(scale_rows)(x, alpha, _backend = 'llvm')
+  finally:
+    openmp_config.parallel_threshold, llvm_config.parallel = old_values
+
+def test_parallel_loop():
+  if not llvmlite_available:
+    return
+  from parakeet.llvm_backend.llvm_context import global_context
+  x = np.arange(20000.0).reshape(200, 100)
+  expect_eq(run_parallel(x, 2.0, 4), x * 2.0 + 1)
+  assert global_context().pool_size() >= 3, \
+    "Expected thread pool to have grown, got %d threads" % global_context().pool_size()
+  # one thread means never going through the pool
+  expect_eq(run_parallel(x, 3.0, 1), x * 3.0 + 1)
+
+def test_sequential():
+  if not llvmlite_available:
+    return
+  from parakeet.llvm_backend import llvm_config
+  llvm_config.parallel = False
+  try:
+    x = np.arange(12, dtype = 'int32').reshape(3, 4)
+    expect_eq(jit(scale_rows)(x, 3, _backend = 'llvm'), x * 3 + 1)
+  finally:
+    llvm_config.parallel = True
+
+def test_compile_latency():
+  if not llvmlite_available:
+    return
+  from parakeet.llvm_backend import compiled_entry
+  def clamp_sum(x, lo, hi):
+    total = 0.0
+    for i in xrange(len(x)):
+      total += max(lo, min(hi, x[i]))
+    return total
+  x = np.arange(10.0)
+  typed_fn, args = specialize(clamp_sum, [x, 2.0, 7.0])
+  # warm up the JIT engine and thread pool
+  compiled_entry(*specialize(lambda y: y + 1, [1.0]))
+  start = time.time()
+  entry, entry_args = compiled_entry(typed_fn, args)
+  elapsed = time.time() - start
+  expect_eq(entry(*entry_args), np.sum(np.clip(x, 2.0, 7.0)))
+  assert elapsed < 1.0, "Expected compilation without a C compiler to be fast, took %.2fs" % elapsed
+
+if __name__ == '__main__':
+  run_local_tests()
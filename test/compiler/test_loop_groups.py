@@ -0,0 +1,54 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.frontend import specialize
+from parakeet.openmp_backend.loop_groups import find_loop_groups
+from parakeet.syntax import ParFor
+from parakeet.testing_helpers import run_local_tests, expect_eq, openmp_backend_works, \
+  openmp_settings
+from parakeet.transforms.pipeline import lower_to_adverbs
+
+def scale_and_sqrt(x, y):
+  return x * 2, np.sqrt(y)
+
+def scale_then_reverse(x):
+  a = x * 2
+  return a[::-1] + 1.0
+
+def sums(x, y):
+  return x.sum() + (y * y).sum()
+
+def column_sums_and_scale(X, y):
+  return parakeet.reduce(lambda a, b: a + b, X, axis = 0), y * 2
+
+def parfor_groups(fn, *args):
+  typed, _ = specialize(fn, args)
+  return find_loop_groups(lower_to_adverbs(typed), lambda stmt: stmt.__class__ is ParFor)
+
+def test_independent_maps():
+  groups = parfor_groups(scale_and_sqrt, np.random.randn(10), np.random.randn(7, 3))
+  assert len(groups) == 1, groups
+  assert len(groups[0].loops) == 2, groups[0]
+
+def test_dependent_maps():
+  groups = parfor_groups(scale_then_reverse, np.random.randn(10))
+  assert len(groups) == 0, groups
+
+def test_overlapped_loops():
+  if not openmp_backend_works():
+    return
+  with openmp_settings(num_threads = 4, parallel_threshold = 0):
+    x = np.random.randn(1000)
+    X = np.random.randn(200, 30)
+    y = np.random.rand(70, 3)
+    a, b = jit(scale_and_sqrt)(x, y, _backend = 'openmp')
+    expect_eq(a, x * 2)
+    expect_eq(b, np.sqrt(y))
+    expect_eq(jit(scale_then_reverse)(x, _backend = 'openmp'), scale_then_reverse(x))
+    assert np.allclose(jit(sums)(x, y[:, 0], _backend = 'openmp'), sums(x, y[:, 0]))
+    col_sums, scaled = jit(column_sums_and_scale)(X, x, _backend = 'openmp')
+    assert np.allclose(col_sums, X.sum(axis = 0))
+    expect_eq(scaled, x * 2)
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,45 @@
+import numpy as np
+import parakeet
+from parakeet.syntax import Index, ParFor
+from parakeet.transforms.pipeline import optimize_indexified_code
+from parakeet.testing_helpers import expect, run_local_tests
+
+def innermost_subscripts(fn):
+  """
+  The innermost index of the function's parallel loop along with the
+  last subscript of every array element its body reads
+  """
+  [parfor] = [stmt for stmt in fn.body if stmt.__class__ is ParFor]
+  body_fn = parfor.fn.fn
+  subscripts = [stmt.rhs.index.elts[-1].name for stmt in body_fn.body
+                if getattr(stmt, "rhs", None).__class__ is Index]
+  return body_fn.arg_names[-1], subscripts
+
+def swapped_sum(x, y):
+  return parakeet.imap(lambda idx: x[idx[1], idx[0]] + y[idx[1], idx[0]],
+                       (x.shape[1], x.shape[0]))
+
+def test_interchange():
+  x = np.arange(12.0).reshape(3, 4)
+  y = x * 2
+  expect(swapped_sum, [x, y], (x + y).T)
+  fn = optimize_indexified_code.apply(parakeet.typed_repr(swapped_sum, [x, y]))
+  innermost, subscripts = innermost_subscripts(fn)
+  assert all(name == innermost for name in subscripts), \
+      "Expected the innermost loop to run along the rows of x and y, got:\n%s" % fn
+
+def transpose_add(x, y):
+  return x.T + y
+
+def test_keep_order():
+  # only one of the three arrays is transposed, so rows stay innermost
+  x = np.arange(12.0).reshape(3, 4)
+  y = np.ones((4, 3))
+  expect(transpose_add, [x, y], x.T + y)
+  fn = optimize_indexified_code.apply(parakeet.typed_repr(transpose_add, [x, y]))
+  innermost, subscripts = innermost_subscripts(fn)
+  assert subscripts == [innermost, innermost], \
+      "Expected loop order to stay the same, got:\n%s" % fn
+
+if __name__ == "__main__":
+  run_local_tests()
@@ -0,0 +1,55 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.frontend import specialize
+from parakeet.multiprocess_backend import config, partition
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def run_split(fn, args, transport):
+  old_values = config.num_processes, config.transport, config.min_iterations_per_process
+  config.num_processes = 3
+  config.transport = transport
+  config.min_iterations_per_process = 1
+  try:
+    return jit(fn)(*args, _backend = 'multiprocess')
+  finally:
+    config.num_processes, config.transport, config.min_iterations_per_process = old_values
+
+def scale_rows(x, alpha):
+  return parakeet.map(lambda row: parakeet.map(lambda xi: xi * alpha + 1, row), x)
+
+def test_map():
+  x = np.arange(200.0).reshape(50, 4)
+  for transport in ('pipe', 'socket'):
+    expect_eq(run_split(scale_rows, (x, 2.0), transport), x * 2.0 + 1)
+
+def sum_of_squares(x):
+  return np.sum(x * x)
+
+def test_reduction():
+  x = np.arange(100)
+  for transport in ('pipe', 'socket'):
+    expect_eq(run_split(sum_of_squares, (x,), transport), np.sum(x * x))
+
+def centered_total(x):
+  y = x - 1.0
+  return np.sum(y) + y[0]
+
+def test_finish():
+  x = np.arange(30.0)
+  expect_eq(run_split(centered_total, (x,), 'pipe'), np.sum(x - 1.0) + x[0] - 1.0)
+
+def loop_sum(x):
+  total = 0.0
+  for i in xrange(len(x)):
+    total += x[i]
+  return total
+
+def test_loops_not_partitioned():
+  x = np.arange(10.0)
+  typed_fn, _ = specialize(loop_sum, [x])
+  assert partition(typed_fn) is None, "Didn't expect a sequential loop to be partitioned"
+  expect_eq(run_split(loop_sum, (x,), 'pipe'), np.sum(x))
+
+if __name__ == '__main__':
+  run_local_tests()
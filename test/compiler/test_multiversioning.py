@@ -0,0 +1,35 @@
+import numpy as np
+import parakeet
+from parakeet import jit, config
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def add(x, y):
+  return x + y
+
+def count_calls(label_prefix):
+  counts = parakeet.path_counts()
+  total = {'contiguous' : 0, 'strided' : 0, 'narrow_index' : 0}
+  for (label, label_counts) in counts.iteritems():
+    if label.startswith(label_prefix):
+      for (k,v) in label_counts.iteritems():
+        total[k] += v
+  return total
+
+def test_one_module_for_all_strides():
+  old_value = config.multiversioning
+  config.multiversioning = True
+  try:
+    add_fn = jit(add)
+    x = np.random.randn(20, 30)
+    before = count_calls("add(array2(float64), array2(float64)) with PyModuleCompiler")
+    expect_eq(add_fn(x, x, _backend = 'c'), x + x)
+    expect_eq(add_fn(x.T, x.T, _backend = 'c'), x.T + x.T)
+    expect_eq(add_fn(x[:, ::2], x[:, 1::2], _backend = 'c'), x[:, ::2] + x[:, 1::2])
+    after = count_calls("add(array2(float64), array2(float64)) with PyModuleCompiler")
+    assert after['contiguous'] - before['contiguous'] == 1, (before, after)
+    assert after['strided'] - before['strided'] == 2, (before, after)
+  finally:
+    config.multiversioning = old_value
+
+if __name__ == '__main__':
+  run_local_tests()
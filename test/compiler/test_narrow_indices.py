@@ -0,0 +1,67 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.frontend import specialize
+from parakeet.ndtypes import Int32, Int64
+from parakeet.syntax import ForLoop
+from parakeet.testing_helpers import run_local_tests, expect_eq
+from parakeet.transforms.narrow_indices import narrow_indices
+from parakeet.transforms.pipeline import lower_to_loops
+from parakeet.value_specialization import specialize_contiguous
+
+def gather(x, idx):
+  return x[idx]
+
+def count_to(x, n):
+  total = 0
+  for i in range(n):
+    total += i
+  return total + x[0]
+
+def narrowed(fn, *args):
+  typed, _ = specialize(fn, args)
+  return narrow_indices(specialize_contiguous(lower_to_loops(typed)))
+
+def loop_var_types(fn):
+  return [stmt.var.type for stmt in fn.body if stmt.__class__ is ForLoop]
+
+def narrow_calls(label_prefix):
+  total = 0
+  for (label, counts) in parakeet.path_counts().iteritems():
+    if label.startswith(label_prefix):
+      total += counts['narrow_index']
+  return total
+
+def test_narrow_gather_loop():
+  x = np.arange(10.0)
+  idx = np.array([3, 1, 4])
+  fn = narrowed(gather, x, idx)
+  assert loop_var_types(fn) == [Int32], fn
+
+def test_unknown_loop_bound():
+  fn = narrowed(count_to, np.arange(10), 10)
+  assert loop_var_types(fn) == [Int64], fn
+
+def test_gather_runs_narrow_version():
+  x = np.random.randn(100)
+  idx = np.array([99, 0, 50, 50, 7])
+  label = "gather(array1(float64), array1(int64)) with PyModuleCompiler"
+  before = narrow_calls(label)
+  expect_eq(jit(gather)(x, idx, _backend = 'c'), x[idx])
+  assert narrow_calls(label) - before == 1
+
+def test_openmp_gather():
+  x = np.random.randn(100)
+  idx = np.arange(100)[::-1]
+  expect_eq(jit(gather)(x, idx, _backend = 'openmp'), x[idx])
+
+def test_strided_transpose():
+  def add_transpose(x, y):
+    return x + y.T
+  x = np.random.randn(30, 40)
+  y = np.random.randn(40, 30)
+  expect_eq(jit(add_transpose)(x, y, _backend = 'c'), x + y.T)
+  expect_eq(jit(add_transpose)(x, y, _backend = 'openmp'), x + y.T)
+
+if __name__ == '__main__':
+  run_local_tests()
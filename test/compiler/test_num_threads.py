@@ -0,0 +1,48 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.openmp_backend import MulticoreCompiler
+from parakeet.frontend import specialize
+from parakeet.transforms.pipeline import lower_to_adverbs
+from parakeet.testing_helpers import run_local_tests, expect_eq, openmp_backend_works
+
+@jit
+def add1(x):
+  return parakeet.map(lambda xi: xi + 1, x)
+
+def test_thread_pool_scopes():
+  parakeet.set_num_threads(None)
+  parakeet.set_schedule('static')
+  expect_eq(parakeet.get_num_threads(), None)
+  with parakeet.thread_pool(4, schedule = 'dynamic', chunk_size = 8):
+    expect_eq(parakeet.get_num_threads(), 4)
+    assert parakeet.get_schedule() == ('dynamic', 8)
+    with parakeet.thread_pool(2):
+      expect_eq(parakeet.get_num_threads(), 2)
+      assert parakeet.get_schedule() == ('dynamic', 8)
+    expect_eq(parakeet.get_num_threads(), 4)
+  expect_eq(parakeet.get_num_threads(), None)
+  assert parakeet.get_schedule() == ('static', 0)
+
+def test_runtime_schedule_codegen():
+  x = np.arange(100.0)
+  typed_fn, args = specialize(add1.fn, [x])
+  fn = lower_to_adverbs.apply(typed_fn)
+  compiler = MulticoreCompiler()
+  _, _, src = compiler.visit_fn(fn)
+  full_src = src + "\n".join(compiler.extra_functions.values())
+  assert "schedule(runtime)" in full_src, full_src
+  assert "num_threads(parakeet_num_threads)" in full_src, full_src
+  assert "omp_set_schedule" in src, src
+
+def test_threads_keyword():
+  if not openmp_backend_works():
+    return
+  x = np.arange(1000.0)
+  expect_eq(add1(x, _backend = 'openmp', _threads = 1), x + 1)
+  expect_eq(add1(x, _backend = 'openmp', _threads = 2, _schedule = 'guided'), x + 1)
+  with parakeet.thread_pool(3, schedule = 'dynamic'):
+    expect_eq(add1(x, _backend = 'openmp'), x + 1)
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,98 @@
+import numpy as np
+import parakeet
+from parakeet import jit, numpy_interp
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def count_evaluations(fn, *args):
+  """
+  Run a function with the NumPy interpreter and count how many
+  function bodies it had to evaluate along the way
+  """
+  calls = [0]
+  old_init = numpy_interp.Evaluator.__init__
+  def counting_init(self, fn, env):
+    calls[0] += 1
+    old_init(self, fn, env)
+  numpy_interp.Evaluator.__init__ = counting_init
+  try:
+    result = jit(fn)(*args, _backend = 'numpy')
+  finally:
+    numpy_interp.Evaluator.__init__ = old_init
+  return result, calls[0]
+
+def scale_rows(x, alpha):
+  return parakeet.map(lambda row: parakeet.map(lambda xi: xi * alpha + 1, row), x)
+
+def test_nested_map_runs_on_whole_array():
+  x = np.arange(2000.0).reshape(200, 10)
+  result, calls = count_evaluations(scale_rows, x, 2.0)
+  expect_eq(result, x * 2.0 + 1)
+  assert calls <= 3, "Expected the Map to run on whole arrays, evaluated %d functions" % calls
+
+def clipped(x):
+  def clip(xi):
+    if xi > 10:
+      xi = 10
+    return xi
+  return parakeet.map(clip, x)
+
+def test_branches_run_on_whole_array():
+  x = np.arange(20)
+  result, calls = count_evaluations(clipped, x)
+  expect_eq(result, np.minimum(x, 10))
+  assert calls <= 3, "Expected the branch to run on whole arrays, evaluated %d functions" % calls
+
+def outer_diff(x, y):
+  return parakeet.outer_map(lambda xi, yi: xi - yi, x, y)
+
+def test_outer_map():
+  x = np.arange(5.0)
+  y = np.arange(3.0)
+  result, calls = count_evaluations(outer_diff, x, y)
+  expect_eq(result, np.subtract.outer(x, y))
+  assert calls <= 3, "Expected OuterMap to run on whole arrays, evaluated %d functions" % calls
+
+def column_sums(x):
+  return parakeet.reduce(lambda acc, row: acc + row, x, axis = 0)
+
+def test_reduce_along_axis():
+  x = np.arange(300).reshape(100, 3)
+  result, calls = count_evaluations(column_sums, x)
+  expect_eq(result, np.sum(x, axis = 0))
+  assert calls <= 4, "Expected Reduce to use a ufunc, evaluated %d functions" % calls
+
+def running_max(x):
+  return parakeet.scan(np.maximum, x)
+
+def test_scan():
+  x = np.array([3, 1, 4, 1, 5, 9, 2, 6])
+  expect_eq(jit(running_max)(x, _backend = 'numpy'), np.maximum.accumulate(x))
+
+def distances(n):
+  return parakeet.imap(lambda (i, j): abs(i - j), (n, n))
+
+def test_index_map():
+  result, calls = count_evaluations(distances, 50)
+  idx = np.arange(50)
+  expect_eq(result, np.abs(idx[:, np.newaxis] - idx))
+  assert calls <= 3, "Expected IndexMap to run on whole arrays, evaluated %d functions" % calls
+
+def collatz_steps(x):
+  def steps(n):
+    count = 0
+    while n > 1:
+      if n % 2 == 0:
+        n = n / 2
+      else:
+        n = 3 * n + 1
+      count += 1
+    return count
+  return parakeet.map(steps, x)
+
+def test_loops_run_per_element():
+  x = np.arange(1, 10)
+  expected = np.array([0, 1, 7, 2, 5, 8, 16, 3, 19])
+  expect_eq(jit(collatz_steps)(x, _backend = 'numpy'), expected)
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -2,7 +2,8 @@ import numpy as np
 
 import parakeet
 from parakeet import config, each, syntax
-from parakeet.transforms.pipeline import lowering, high_level_optimizations
+from parakeet.transforms.pipeline import lowering, high_level_optimizations, \
+                                       optimize_indexified_code
 from parakeet.syntax import OuterMap, Return
 from parakeet.analysis.syntax_visitor import SyntaxVisitor
 from parakeet.testing_helpers import expect, run_local_tests
@@ -147,6 +148,48 @@ def test_copy_elimination():
   assert n_loops <= n_expected, \
       "Too many loops generated! Expected at most 2, got %d" % n_loops
 
+def count_parfors(fn):
+  return str(fn).count("ParFor(")
+
+def double_interior(x):
+  x[1:-1] = x[1:-1] * 2
+  return x
+
+def test_copy_elimination_in_place():
+  x = np.arange(6.0)
+  expected = double_interior(x.copy())
+  expect(double_interior, [x.copy()], expected)
+  typed_fn = parakeet.typed_repr(double_interior, [x])
+  fn = optimize_indexified_code.apply(typed_fn)
+  assert count_parfors(fn) == 1, \
+      "Expected result to be written in place, got:\n%s" % fn
+
+def smooth_interior(x):
+  x[1:-1] = x[:-2] + x[2:]
+  return x
+
+def test_copy_elimination_overlap():
+  x = np.arange(6.0)
+  expected = smooth_interior(x.copy())
+  expect(smooth_interior, [x.copy()], expected)
+  typed_fn = parakeet.typed_repr(smooth_interior, [x])
+  fn = optimize_indexified_code.apply(typed_fn)
+  assert count_parfors(fn) == 2, \
+      "Expected a temporary since reads overlap the written slice, got:\n%s" % fn
+
+def laplacian(x):
+  y = np.zeros_like(x)
+  y[1:-1, 1:-1] = x[2:, 1:-1] + x[:-2, 1:-1] - 4 * x[1:-1, 1:-1]
+  return y
+
+def test_copy_elimination_local_destination():
+  x = np.arange(30.0).reshape(5, 6)
+  expect(laplacian, [x], laplacian(x))
+  typed_fn = parakeet.typed_repr(laplacian, [x])
+  fn = optimize_indexified_code.apply(typed_fn)
+  assert "setidx" not in str(fn), \
+      "Expected result to be written straight into y, got:\n%s" % fn
+
 def allpairs_dist(x):
   return np.array([[np.sqrt(np.sum( (x1-x2)**2)) for x2 in x] for x1 in x])
   
@@ -0,0 +1,37 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.frontend import specialize
+from parakeet.openmp_backend.parallel_planner import largest_nested_extent, nested_extents
+from parakeet.syntax import ParFor
+from parakeet.syntax.helpers import get_fn
+from parakeet.testing_helpers import run_local_tests, expect_eq, openmp_backend_works, \
+  openmp_settings
+from parakeet.transforms.pipeline import lower_to_adverbs
+
+def center(X):
+  return parakeet.each(lambda x: x - np.mean(x), X)
+
+def outer_loop(fn, *args):
+  typed, _ = specialize(fn, args)
+  loops = [stmt for stmt in lower_to_adverbs(typed).body if stmt.__class__ is ParFor]
+  assert len(loops) == 1, loops
+  return loops[0]
+
+def test_nested_extent_of_rows():
+  loop = outer_loop(center, np.random.randn(3, 100))
+  closure_args = ["arg%d" % i for i in range(len(loop.fn.args))]
+  assert len(nested_extents(get_fn(loop.fn))) > 0
+  extent = largest_nested_extent(get_fn(loop.fn), closure_args)
+  assert extent is not None and ".shape[1]" in extent, extent
+
+def test_few_long_rows():
+  if not openmp_backend_works():
+    return
+  with openmp_settings(num_threads = 4, parallel_threshold = 0):
+    for shape in [(3, 100000), (50, 10)]:
+      X = np.random.randn(*shape)
+      expect_eq(jit(center)(X, _backend = 'openmp'), X - X.mean(axis = 1)[:, np.newaxis])
+
+if __name__ == '__main__':
+  run_local_tests()
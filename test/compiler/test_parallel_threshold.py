@@ -0,0 +1,46 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.analysis import estimate_cost
+from parakeet.frontend import specialize
+from parakeet.openmp_backend import MulticoreCompiler
+from parakeet.testing_helpers import run_local_tests, expect_eq, openmp_backend_works, \
+  openmp_settings
+
+def loop_sum(x):
+  total = 0.0
+  for i in xrange(10):
+    total = total + x[i] * 2.0
+  return total
+
+def test_loop_cost():
+  typed_fn, _ = specialize(loop_sum, [np.arange(10.0)])
+  cost = estimate_cost(typed_fn)
+  assert cost >= 30, "Expected cost of ten iterations, got %d" % cost
+
+def expensive(x):
+  return parakeet.map(lambda xi: np.exp(np.sqrt(xi)), x)
+
+def cheap(x):
+  return parakeet.map(lambda xi: xi + 1, x)
+
+def test_guarded_pragma():
+  typed_fn, _ = specialize(cheap, [np.arange(10.0)])
+  from parakeet.transforms.pipeline import lower_to_adverbs
+  compiler = MulticoreCompiler()
+  _, _, src = compiler.visit_fn(lower_to_adverbs.apply(typed_fn))
+  full_src = src + "\n".join(compiler.extra_functions.values())
+  assert ">= parakeet_parallel_threshold)" in full_src, full_src
+
+def test_small_and_large_inputs():
+  if not openmp_backend_works():
+    return
+  for threshold in [0, 10 ** 9]:
+    with openmp_settings(parallel_threshold = threshold):
+      for n in [3, 1000]:
+        x = np.arange(n, dtype = 'float64')
+        expect_eq(jit(expensive)(x, _backend = 'openmp'), np.exp(np.sqrt(x)))
+        expect_eq(jit(cheap)(x, _backend = 'openmp'), x + 1)
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,80 @@
+import numpy as np
+import parakeet
+from parakeet import jit, config, names
+from parakeet.retention import cached_fn_name, ir_caches
+from parakeet.testing_helpers import run_local_tests, expect_eq
+from parakeet.transforms.phase import memoized_phases
+
+def add1(xi):
+  return xi + 1
+
+def map_add1(x):
+  return parakeet.map(add1, x)
+
+def sum_add1(x):
+  return parakeet.reduce(lambda a, b: a + b, parakeet.map(add1, x))
+
+def add2(xi):
+  return xi + 2
+
+def map_add2(x):
+  return parakeet.map(add2, x)
+
+def sum_add2(x):
+  return parakeet.reduce(lambda a, b: a + b, parakeet.map(add2, x))
+
+def cached_versions(fn_name, caches):
+  count = 0
+  for cache in caches:
+    for key in cache:
+      name = cached_fn_name(key)
+      if names.original_names.get(name, name) == fn_name:
+        count += 1
+  return count
+
+def all_caches():
+  return [cache for (_, cache) in ir_caches()]
+
+def phase_caches():
+  return [phase.cache for phase in memoized_phases()]
+
+def test_release_after_compile():
+  x = np.arange(10.0)
+  old_value = config.release_intermediate_ir
+  config.release_intermediate_ir = False
+  try:
+    expect_eq(jit(map_add1)(x, _backend = 'c'), x + 1)
+    assert cached_versions('map_add1', all_caches()) > 0
+    config.release_intermediate_ir = True
+    # shares the function add1 with the code compiled above
+    expect_eq(jit(sum_add1)(x, _backend = 'c'), np.sum(x + 1))
+    assert cached_versions('sum_add1', all_caches()) == 0
+    assert cached_versions('add1', all_caches()) > 0
+    # later calls dispatch straight to the compiled code
+    expect_eq(jit(sum_add1)(x, _backend = 'c'), np.sum(x + 1))
+    # only the entries made while compiling a specialization get released
+    n_cached = cached_versions('map_add1', all_caches())
+    expect_eq(jit(map_add1)(x[::2], _backend = 'openmp'), x[::2] + 1)
+    assert cached_versions('map_add1', all_caches()) == n_cached
+  finally:
+    config.release_intermediate_ir = old_value
+
+def test_shared_callee_keeps_its_phases():
+  x = np.arange(10.0)
+  old_value = config.release_intermediate_ir
+  config.release_intermediate_ir = True
+  try:
+    expect_eq(jit(sum_add2)(x, _backend = 'c'), np.sum(x + 2))
+    n_cached = cached_versions('add2', phase_caches())
+    n_versions = names.versions['add2']
+    assert n_cached > 0
+    expect_eq(jit(map_add2)(x, _backend = 'c'), x + 2)
+    assert cached_versions('map_add2', all_caches()) == 0
+    # the phases applied to add2 while compiling sum_add2 don't run again
+    assert cached_versions('add2', phase_caches()) == n_cached
+    assert names.versions['add2'] == n_versions
+  finally:
+    config.release_intermediate_ir = old_value
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,56 @@
+import numpy as np
+import parakeet
+from parakeet.transforms.pipeline import lower_to_loops
+from parakeet.testing_helpers import expect, run_local_tests
+
+def lowered(fn, args):
+  return str(lower_to_loops.apply(parakeet.typed_repr(fn, args)))
+
+def row_sums(x, out):
+  for i in xrange(x.shape[0]):
+    for j in xrange(x.shape[1]):
+      out[i] += x[i, j]
+  return out
+
+def test_accumulator():
+  x = np.arange(12.0).reshape(3, 4)
+  expect(row_sums, [x, np.zeros(3)], x.sum(axis = 1))
+  fn = lowered(row_sums, [x, np.zeros(3)])
+  assert "scalar_repl_acc" in fn, \
+      "Expected out[i] to stay in a register, got:\n%s" % fn
+
+def test_empty_loop():
+  # out[i] gets neither loaded nor stored when there's nothing to add
+  x = np.zeros((3, 0))
+  expect(row_sums, [x, np.ones(3)], np.ones(3))
+
+def running_max(x, out):
+  for i in xrange(len(x)):
+    if x[i] > out[0]:
+      out[0] = x[i]
+  return out
+
+def test_conditional_write():
+  x = np.array([2, -1, 5, 3])
+  expect(running_max, [x, np.zeros(1)], np.array([5.0]))
+  fn = lowered(running_max, [x, np.zeros(1)])
+  assert "scalar_repl_merge" in fn, \
+      "Expected out[0] to stay in a register, got:\n%s" % fn
+
+def shift_add(x, y):
+  for i in xrange(len(y)):
+    x[0] += y[i]
+  return x
+
+def test_aliased_arrays():
+  # y might be x itself, so x[0] has to be written through every iteration
+  x = np.arange(4.0)
+  expect(shift_add, [x.copy(), x.copy()], shift_add(x.copy(), x.copy()))
+  z = np.arange(4.0)
+  parakeet.jit(shift_add)(z, z)
+  w = np.arange(4.0)
+  shift_add(w, w)
+  assert np.all(z == w), "Expected %s but got %s" % (w, z)
+
+if __name__ == "__main__":
+  run_local_tests()
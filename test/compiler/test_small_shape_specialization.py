@@ -0,0 +1,73 @@
+import numpy as np
+import parakeet
+from parakeet import jit, config
+from parakeet.c_backend.prepare_args import prepare_args
+from parakeet.frontend import specialize
+from parakeet.syntax import ForLoop
+from parakeet.transforms.pipeline import lower_to_loops
+from parakeet.value_specialization import value_specialization
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def conv(img, k):
+  m = img.shape[0] - k.shape[0] + 1
+  n = img.shape[1] - k.shape[1] + 1
+  out = np.zeros((m, n))
+  for i in xrange(m):
+    for j in xrange(n):
+      total = 0.0
+      for di in xrange(k.shape[0]):
+        for dj in xrange(k.shape[1]):
+          total = total + img[i+di, j+dj] * k[di, dj]
+      out[i,j] = total
+  return out
+
+def python_conv(img, k):
+  m = img.shape[0] - k.shape[0] + 1
+  n = img.shape[1] - k.shape[1] + 1
+  out = np.zeros((m, n))
+  for i in xrange(m):
+    for j in xrange(n):
+      out[i,j] = (img[i:i+k.shape[0], j:j+k.shape[1]] * k).sum()
+  return out
+
+def count_loops(stmts):
+  total = 0
+  for stmt in stmts:
+    if stmt.__class__ is ForLoop:
+      total += 1 + count_loops(stmt.body)
+  return total
+
+def test_loops_over_small_dims_unrolled():
+  img = np.random.randn(20, 20)
+  k = np.random.randn(3, 3)
+  typed_fn, _ = specialize(conv, [img, k])
+  fn = lower_to_loops(typed_fn)
+  args = prepare_args((img, k), fn.input_types)
+  old_value = config.small_shape_specialization
+  config.small_shape_specialization = True
+  try:
+    specialized = value_specialization.specialize(fn, args)
+  finally:
+    config.small_shape_specialization = old_value
+  assert count_loops(specialized.body) < count_loops(fn.body), \
+    "Expected loops over the 3x3 kernel to be unrolled in %s" % specialized
+
+def test_bounded_variants():
+  old_value = config.small_shape_specialization
+  old_max_variants = config.small_shape_max_variants
+  config.small_shape_specialization = True
+  config.small_shape_max_variants = 2
+  try:
+    img = np.random.randn(30, 25)
+    jit_conv = jit(conv)
+    for shape in [(3,3), (5,2), (2,4), (3,3)]:
+      k = np.random.randn(*shape)
+      expect_eq(jit_conv(img, k, _backend = 'c'), python_conv(img, k))
+    for variants in value_specialization._shape_variants.itervalues():
+      assert len(variants) <= 2, "Too many variants: %s" % (variants,)
+  finally:
+    config.small_shape_specialization = old_value
+    config.small_shape_max_variants = old_max_variants
+
+if __name__ == '__main__':
+  run_local_tests()
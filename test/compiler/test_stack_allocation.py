@@ -0,0 +1,50 @@
+import numpy as np
+import parakeet
+from parakeet import jit
+from parakeet.c_backend import PyModuleCompiler
+from parakeet.frontend import specialize
+from parakeet.transforms.pipeline import lower_to_loops
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def weighted_sums(x):
+  def f(xi):
+    v = np.zeros(3)
+    v[0] = xi
+    v[1] = xi * 2
+    v[2] = xi * 3
+    return v[0] + v[1] * v[2]
+  return parakeet.map(f, x)
+
+def small_output(x):
+  v = np.zeros(3)
+  v[0] = x
+  return v
+
+def generated_source(python_fn, arg):
+  typed_fn, _ = specialize(python_fn, [arg])
+  compiler = PyModuleCompiler()
+  _, _, src = compiler.visit_fn(lower_to_loops.apply(typed_fn))
+  return src + "\n".join(compiler.extra_functions.values())
+
+def test_local_array_on_stack():
+  x = np.arange(10.0)
+  src = generated_source(weighted_sums, x)
+  assert "stack_data" in src, src
+  old_value = parakeet.config.opt_stack_allocation
+  parakeet.config.opt_stack_allocation = False
+  try:
+    src = generated_source(weighted_sums, x)
+    assert "stack_data" not in src, src
+  finally:
+    parakeet.config.opt_stack_allocation = old_value
+  expected = x + 2 * x * 3 * x
+  expect_eq(jit(weighted_sums)(x, _backend = 'c'), expected)
+  expect_eq(jit(weighted_sums)(x, _backend = 'openmp'), expected)
+
+def test_returned_array_on_heap():
+  src = generated_source(small_output, 1.0)
+  assert "stack_data" not in src, src
+  expect_eq(jit(small_output)(1.0, _backend = 'c'), np.array([1.0, 0.0, 0.0]))
+
+if __name__ == '__main__':
+  run_local_tests()
@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+import parakeet
+from parakeet import config, jit, tiering
+from parakeet.frontend import specialize
+from parakeet.testing_helpers import run_local_tests, expect_eq
+
+def sum_squares(x):
+  return parakeet.reduce(lambda a, b: a + b, parakeet.map(lambda xi: xi * xi, x))
+
+def run_tiered(backend, in_background):
+  old_values = config.tiered_compilation, config.tier_up_calls, config.tier_up_in_background
+  config.tiered_compilation = True
+  config.tier_up_calls = 3
+  config.tier_up_in_background = in_background
+  try:
+    f = jit(sum_squares)
+    x = np.arange(100.0)
+    typed_fn, _ = f.specialize((x,), {})
+    tiers = []
+    for _ in xrange(5):
+      expect_eq(f(x, _backend = backend), np.sum(x * x))
+      tiering.wait_for_recompilation()
+      tiers.append(tiering.tier_of(typed_fn, backend))
+    return tiers
+  finally:
+    config.tiered_compilation, config.tier_up_calls, config.tier_up_in_background = old_values
+
+def test_tier_up_c():
+  expect_eq(run_tiered('c', False), [0, 0, 1, 1, 1])
+
+def test_tier_up_in_background():
+  expect_eq(run_tiered('openmp', True), [0, 0, 1, 1, 1])
+
+def test_tier1_calls_skip_compile_lock():
+  old_values = config.tiered_compilation, config.tier_up_calls, config.tier_up_in_background
+  config.tiered_compilation = True
+  config.tier_up_calls = 1
+  config.tier_up_in_background = False
+  locked = threading.Event()
+  done = threading.Event()
+  def hold_lock():
+    with tiering.compile_lock:
+      locked.set()
+      done.wait()
+  try:
+    f = jit(sum_squares)
+    x = np.arange(10.0)
+    typed_fn, _ = f.specialize((x,), {})
+    f(x, _backend = 'c')
+    assert tiering.tier_of(typed_fn, 'c') == 1
+    tiered_fn = tiering._tiered_fns[(typed_fn.name, 'c')]
+    calls = tiered_fn.calls
+    thread = threading.Thread(target = hold_lock)
+    thread.start()
+    locked.wait()
+    try:
+      for _ in xrange(3):
+        expect_eq(f(x, _backend = 'c'), np.sum(x * x))
+    finally:
+      done.set()
+      thread.join()
+    # none of those calls fell back on the unoptimized code
+    assert tiered_fn.calls == calls, (tiered_fn.calls, calls)
+  finally:
+    config.tiered_compilation, config.tier_up_calls, config.tier_up_in_background = old_values
+
+def cube(x):
+  return x * x * x
+
+def test_compiling_waits_for_compile_lock():
+  locked = threading.Event()
+  done = threading.Event()
+  def hold_lock():
+    # swapping in a tier's settings and caches holds the lock too
+    with tiering.tier_scope(1):
+      locked.set()
+      done.wait()
+  results = []
+  def compile_cube():
+    results.append(specialize(cube, [np.arange(3.0)]))
+  thread = threading.Thread(target = hold_lock)
+  thread.start()
+  locked.wait()
+  try:
+    assert not tiering.compile_lock.acquire(False)
+    compiler_thread = threading.Thread(target = compile_cube)
+    compiler_thread.start()
+    compiler_thread.join(0.2)
+    assert results == [], "Specialized while another thread held the compile lock"
+  finally:
+    done.set()
+    thread.join()
+  compiler_thread.join()
+  assert len(results) == 1
+
+if __name__ == '__main__':
+  run_local_tests()